@@ -0,0 +1,35 @@
+"""Add soft delete columns to sessions
+
+Revision ID: 3f9a1c2b7d41
+Revises: 71e277e658f9
+Create Date: 2025-08-04 10:12:45.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a1c2b7d41'
+down_revision = '71e277e658f9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('sessions', sa.Column('is_deleted', sa.Boolean(), server_default=sa.text('false'), nullable=False))
+    op.add_column('sessions', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    # Dashboard KPI queries filter live sessions by date range
+    op.create_index(
+        'ix_sessions_live_session_date',
+        'sessions',
+        ['session_date'],
+        unique=False,
+        postgresql_where=sa.text('is_deleted = false')
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_sessions_live_session_date', table_name='sessions')
+    op.drop_column('sessions', 'deleted_at')
+    op.drop_column('sessions', 'is_deleted')
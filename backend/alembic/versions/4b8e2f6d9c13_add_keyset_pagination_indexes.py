@@ -0,0 +1,49 @@
+"""Add keyset pagination indexes
+
+Revision ID: 4b8e2f6d9c13
+Revises: f3a9c6e1b857
+Create Date: 2025-08-13 10:42:07.318265
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b8e2f6d9c13'
+down_revision = 'f3a9c6e1b857'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # List endpoints page by (created_at, id) descending over live rows
+    op.create_index(
+        'ix_transcription_tasks_live_created_id',
+        'transcription_tasks',
+        ['created_at', 'id'],
+        unique=False,
+        postgresql_where=sa.text("is_deleted = false")
+    )
+    op.create_index(
+        'ix_analysis_tasks_live_created_id',
+        'analysis_tasks',
+        ['created_at', 'id'],
+        unique=False,
+        postgresql_where=sa.text("is_deleted = false")
+    )
+    op.create_index(
+        'ix_recordings_live_created_id',
+        'recordings',
+        ['created_at', 'id'],
+        unique=False,
+        postgresql_where=sa.text("is_deleted = false")
+    )
+    op.create_index('ix_sessions_created_id', 'sessions', ['created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_sessions_created_id', table_name='sessions')
+    op.drop_index('ix_recordings_live_created_id', table_name='recordings')
+    op.drop_index('ix_analysis_tasks_live_created_id', table_name='analysis_tasks')
+    op.drop_index('ix_transcription_tasks_live_created_id', table_name='transcription_tasks')
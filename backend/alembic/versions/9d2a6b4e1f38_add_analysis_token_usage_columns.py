@@ -0,0 +1,32 @@
+"""Add analysis token usage columns
+
+Revision ID: 9d2a6b4e1f38
+Revises: 4b8e2f6d9c13
+Create Date: 2025-08-14 16:27:51.604118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d2a6b4e1f38'
+down_revision = '4b8e2f6d9c13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('analysis_tasks', sa.Column('openai_prompt_tokens', sa.Integer(), nullable=True))
+    op.add_column('analysis_tasks', sa.Column('openai_completion_tokens', sa.Integer(), nullable=True))
+    op.add_column('analysis_tasks', sa.Column('openai_cached_tokens', sa.Integer(), nullable=True))
+    op.add_column('analysis_tasks', sa.Column('openai_model', sa.String(length=50), nullable=True))
+    op.add_column('analysis_tasks', sa.Column('token_budget_action', sa.String(length=50), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('analysis_tasks', 'token_budget_action')
+    op.drop_column('analysis_tasks', 'openai_model')
+    op.drop_column('analysis_tasks', 'openai_cached_tokens')
+    op.drop_column('analysis_tasks', 'openai_completion_tokens')
+    op.drop_column('analysis_tasks', 'openai_prompt_tokens')
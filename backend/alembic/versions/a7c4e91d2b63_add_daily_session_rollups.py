@@ -0,0 +1,129 @@
+"""Add daily session rollups
+
+Revision ID: a7c4e91d2b63
+Revises: 3f9a1c2b7d41
+Create Date: 2025-08-06 09:41:27.604118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from app.core.config import settings
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c4e91d2b63'
+down_revision = '3f9a1c2b7d41'
+branch_labels = None
+depends_on = None
+
+
+# Rebuild every rollup row from the raw sessions/analysis_tasks
+# (same aggregation as RollupService, kept inline so the migration
+# does not depend on later model changes)
+BACKFILL_SQL = """
+INSERT INTO daily_session_rollups (
+    id, day, clinic_id, counselor_id,
+    session_count, completed_count, scored_count, high_score_count, satisfied_count, score_sum,
+    questioning_score_sum, questioning_count, anxiety_score_sum, anxiety_count,
+    closing_score_sum, closing_count, flow_score_sum, flow_count,
+    analysis_count, tokens_used, cost, analysis_duration_sum, refreshed_at
+)
+SELECT
+    gen_random_uuid(),
+    s.day, s.clinic_id, s.counselor_id,
+    count(*),
+    count(*) FILTER (WHERE s.status = 'COMPLETED'),
+    count(s.score),
+    count(*) FILTER (WHERE s.score >= 8.0),
+    count(*) FILTER (WHERE s.score >= 7.0),
+    coalesce(sum(s.score), 0),
+    coalesce(sum(s.questioning), 0), count(s.questioning),
+    coalesce(sum(s.anxiety), 0), count(s.anxiety),
+    coalesce(sum(s.closing), 0), count(s.closing),
+    coalesce(sum(s.flow), 0), count(s.flow),
+    coalesce(sum(t.analysis_count), 0),
+    coalesce(sum(t.tokens_used), 0),
+    coalesce(sum(t.cost), 0),
+    coalesce(sum(t.analysis_duration_sum), 0),
+    timezone('UTC', now())
+FROM (
+    SELECT
+        sessions.id,
+        sessions.status,
+        sessions.counselor_id,
+        customers.clinic_id,
+        timezone(:tz, timezone('UTC', sessions.session_date))::date AS day,
+        (sessions.analysis_result ->> 'overall_score')::float AS score,
+        (sessions.analysis_result -> 'questioning' ->> 'score')::float AS questioning,
+        (sessions.analysis_result -> 'anxiety_handling' ->> 'score')::float AS anxiety,
+        (sessions.analysis_result -> 'closing' ->> 'score')::float AS closing,
+        (sessions.analysis_result -> 'flow' ->> 'score')::float AS flow
+    FROM sessions
+    JOIN customers ON customers.id = sessions.customer_id
+    WHERE sessions.is_deleted = false
+) s
+LEFT JOIN (
+    SELECT
+        session_id,
+        count(*) AS analysis_count,
+        coalesce(sum(openai_tokens_used), 0) AS tokens_used,
+        coalesce(sum(openai_cost), 0) AS cost,
+        coalesce(sum(actual_duration), 0) AS analysis_duration_sum
+    FROM analysis_tasks
+    WHERE status = 'completed' AND is_deleted = false AND session_id IS NOT NULL
+    GROUP BY session_id
+) t ON t.session_id = s.id
+GROUP BY s.day, s.clinic_id, s.counselor_id
+"""
+
+
+def upgrade() -> None:
+    op.create_table(
+        'daily_session_rollups',
+        sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('clinic_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('counselor_id', postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column('session_count', sa.Integer(), nullable=False),
+        sa.Column('completed_count', sa.Integer(), nullable=False),
+        sa.Column('scored_count', sa.Integer(), nullable=False),
+        sa.Column('high_score_count', sa.Integer(), nullable=False),
+        sa.Column('satisfied_count', sa.Integer(), nullable=False),
+        sa.Column('score_sum', sa.Float(), nullable=False),
+        sa.Column('questioning_score_sum', sa.Float(), nullable=False),
+        sa.Column('questioning_count', sa.Integer(), nullable=False),
+        sa.Column('anxiety_score_sum', sa.Float(), nullable=False),
+        sa.Column('anxiety_count', sa.Integer(), nullable=False),
+        sa.Column('closing_score_sum', sa.Float(), nullable=False),
+        sa.Column('closing_count', sa.Integer(), nullable=False),
+        sa.Column('flow_score_sum', sa.Float(), nullable=False),
+        sa.Column('flow_count', sa.Integer(), nullable=False),
+        sa.Column('analysis_count', sa.Integer(), nullable=False),
+        sa.Column('tokens_used', sa.BigInteger(), nullable=False),
+        sa.Column('cost', sa.Float(), nullable=False),
+        sa.Column('analysis_duration_sum', sa.Integer(), nullable=False),
+        sa.Column('refreshed_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['clinic_id'], ['clinics.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['counselor_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    # Sessions without a counselor share one row per clinic and day
+    op.create_index(
+        'uq_daily_session_rollups_key',
+        'daily_session_rollups',
+        ['day', 'clinic_id', sa.text("coalesce(counselor_id, '00000000-0000-0000-0000-000000000000'::uuid)")],
+        unique=True
+    )
+    op.create_index('ix_daily_session_rollups_clinic_day', 'daily_session_rollups', ['clinic_id', 'day'], unique=False)
+    op.create_index('ix_daily_session_rollups_counselor_day', 'daily_session_rollups', ['counselor_id', 'day'], unique=False)
+
+    op.execute(sa.text(BACKFILL_SQL).bindparams(tz=settings.ROLLUP_TIME_ZONE))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_daily_session_rollups_counselor_day', table_name='daily_session_rollups')
+    op.drop_index('ix_daily_session_rollups_clinic_day', table_name='daily_session_rollups')
+    op.drop_index('uq_daily_session_rollups_key', table_name='daily_session_rollups')
+    op.drop_table('daily_session_rollups')
@@ -0,0 +1,101 @@
+"""Promote analysis scores out of JSONB
+
+Revision ID: c52e8d7f1a90
+Revises: a7c4e91d2b63
+Create Date: 2025-08-07 14:03:52.117460
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c52e8d7f1a90'
+down_revision = 'a7c4e91d2b63'
+branch_labels = None
+depends_on = None
+
+
+CATEGORY_SCORE_COLUMNS = {
+    'questioning': 'questioning_score',
+    'anxiety_handling': 'anxiety_score',
+    'closing': 'closing_score',
+    'flow': 'flow_score',
+}
+
+COMPLETED_TASKS = sa.text("status = 'completed' AND is_deleted = false")
+LIVE_SESSIONS = sa.text('is_deleted = false')
+
+
+def _numeric(path: str) -> str:
+    """JSONB value as float, NULL when it is missing or not a number"""
+    return f"CASE WHEN jsonb_typeof({path}) = 'number' THEN ({path})::text::float END"
+
+
+def upgrade() -> None:
+    for column in CATEGORY_SCORE_COLUMNS.values():
+        op.add_column('analysis_tasks', sa.Column(column, sa.Float(), nullable=True))
+    op.add_column('sessions', sa.Column('overall_score', sa.Float(), nullable=True))
+
+    # Backfill from the stored analysis results
+    assignments = ', '.join(
+        f"{column} = " + _numeric(f"full_analysis_result -> '{category}' -> 'score'")
+        for category, column in CATEGORY_SCORE_COLUMNS.items()
+    )
+    op.execute(f"UPDATE analysis_tasks SET {assignments} WHERE full_analysis_result IS NOT NULL")
+    op.execute(
+        "UPDATE sessions SET overall_score = " + _numeric("analysis_result -> 'overall_score'")
+        + " WHERE analysis_result IS NOT NULL"
+    )
+
+    op.create_index(
+        'ix_analysis_tasks_completed_session_scores',
+        'analysis_tasks',
+        ['session_id'],
+        unique=False,
+        postgresql_include=['overall_score', 'questioning_score', 'anxiety_score', 'closing_score', 'flow_score', 'completed_at'],
+        postgresql_where=COMPLETED_TASKS
+    )
+    op.create_index(
+        'ix_analysis_tasks_completed_created_score',
+        'analysis_tasks',
+        ['created_at', 'overall_score'],
+        unique=False,
+        postgresql_include=['questioning_score', 'anxiety_score', 'closing_score', 'flow_score'],
+        postgresql_where=COMPLETED_TASKS
+    )
+
+    # Supersedes ix_sessions_live_session_date
+    op.create_index(
+        'ix_sessions_live_session_date_score',
+        'sessions',
+        ['session_date', 'overall_score'],
+        unique=False,
+        postgresql_where=LIVE_SESSIONS
+    )
+    op.create_index(
+        'ix_sessions_live_counselor_date_score',
+        'sessions',
+        ['counselor_id', 'session_date', 'overall_score'],
+        unique=False,
+        postgresql_where=LIVE_SESSIONS
+    )
+    op.drop_index('ix_sessions_live_session_date', table_name='sessions')
+
+
+def downgrade() -> None:
+    op.create_index(
+        'ix_sessions_live_session_date',
+        'sessions',
+        ['session_date'],
+        unique=False,
+        postgresql_where=LIVE_SESSIONS
+    )
+    op.drop_index('ix_sessions_live_counselor_date_score', table_name='sessions')
+    op.drop_index('ix_sessions_live_session_date_score', table_name='sessions')
+    op.drop_index('ix_analysis_tasks_completed_created_score', table_name='analysis_tasks')
+    op.drop_index('ix_analysis_tasks_completed_session_scores', table_name='analysis_tasks')
+
+    op.drop_column('sessions', 'overall_score')
+    for column in CATEGORY_SCORE_COLUMNS.values():
+        op.drop_column('analysis_tasks', column)
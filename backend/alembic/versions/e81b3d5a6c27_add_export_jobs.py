@@ -0,0 +1,49 @@
+"""Add export jobs
+
+Revision ID: e81b3d5a6c27
+Revises: c52e8d7f1a90
+Create Date: 2025-08-08 10:22:14.538201
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'e81b3d5a6c27'
+down_revision = 'c52e8d7f1a90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'export_jobs',
+        sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('user_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('dataset', sa.String(length=20), nullable=False),
+        sa.Column('file_format', sa.String(length=20), nullable=False),
+        sa.Column('filters', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+        sa.Column('status', sa.String(length=20), server_default='pending', nullable=False),
+        sa.Column('total_rows', sa.Integer(), nullable=True),
+        sa.Column('rows_exported', sa.Integer(), nullable=False),
+        sa.Column('bytes_written', sa.BigInteger(), nullable=False),
+        sa.Column('parts_uploaded', sa.Integer(), nullable=False),
+        sa.Column('file_path', sa.String(length=500), nullable=True),
+        sa.Column('upload_id', sa.String(length=255), nullable=True),
+        sa.Column('error_message', sa.Text(), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('completed_at', sa.DateTime(), nullable=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_export_jobs_user_created', 'export_jobs', ['user_id', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_export_jobs_user_created', table_name='export_jobs')
+    op.drop_table('export_jobs')
@@ -0,0 +1,59 @@
+"""Add analysis scheduling columns
+
+Revision ID: f3a9c6e1b857
+Revises: e81b3d5a6c27
+Create Date: 2025-08-11 09:15:38.902744
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9c6e1b857'
+down_revision = 'e81b3d5a6c27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('analysis_tasks', sa.Column('lane', sa.String(length=20), server_default='interactive', nullable=False))
+    op.add_column('analysis_tasks', sa.Column('batch_id', sa.String(length=100), nullable=True))
+    op.add_column('analysis_tasks', sa.Column('clinic_id', postgresql.UUID(as_uuid=True), nullable=True))
+    op.add_column('analysis_tasks', sa.Column('dispatched_at', sa.DateTime(), nullable=True))
+    op.add_column('analysis_tasks', sa.Column('bypass_cache', sa.Boolean(), server_default='false', nullable=False))
+    op.create_foreign_key(
+        'analysis_tasks_clinic_id_fkey', 'analysis_tasks', 'clinics',
+        ['clinic_id'], ['id'], ondelete='SET NULL'
+    )
+
+    # Existing tasks were all enqueued directly
+    op.execute("UPDATE analysis_tasks SET dispatched_at = created_at")
+    op.execute("""
+        UPDATE analysis_tasks
+        SET clinic_id = customers.clinic_id
+        FROM sessions
+        JOIN customers ON customers.id = sessions.customer_id
+        WHERE sessions.id = analysis_tasks.session_id
+    """)
+
+    op.create_index(op.f('ix_analysis_tasks_batch_id'), 'analysis_tasks', ['batch_id'], unique=False)
+    op.create_index(
+        'ix_analysis_tasks_batch_queued',
+        'analysis_tasks',
+        ['clinic_id', 'created_at'],
+        unique=False,
+        postgresql_where=sa.text("lane = 'batch' AND dispatched_at IS NULL AND status = 'pending' AND is_deleted = false")
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_analysis_tasks_batch_queued', table_name='analysis_tasks')
+    op.drop_index(op.f('ix_analysis_tasks_batch_id'), table_name='analysis_tasks')
+    op.drop_constraint('analysis_tasks_clinic_id_fkey', 'analysis_tasks', type_='foreignkey')
+    op.drop_column('analysis_tasks', 'bypass_cache')
+    op.drop_column('analysis_tasks', 'dispatched_at')
+    op.drop_column('analysis_tasks', 'clinic_id')
+    op.drop_column('analysis_tasks', 'batch_id')
+    op.drop_column('analysis_tasks', 'lane')
@@ -1,46 +1,69 @@
 """
 AI Analysis API endpoints
 """
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from typing import List, Optional
 import uuid
 import logging
 from datetime import datetime, timedelta
 
-from app.api.deps import get_db, get_current_user
+from app.api.deps import get_db, get_current_user, get_clinic_scope
+from app.core.config import settings
+from app.core.database import get_background_session
+from app.core.pagination import InvalidCursorError, paginate
+from app.core.job_queue import LANE_INTERACTIVE, LANE_BATCH, get_job_queue, is_retryable_error, job_handler
 from app.schemas.analysis import (
     AnalysisRequest, AnalysisResponse, AnalysisStatusResponse,
-    BatchAnalysisRequest, BatchAnalysisResponse, AnalysisList, AnalysisStats
+    BatchAnalysisRequest, BatchAnalysisResponse, BatchQueueStatus, AnalysisList, AnalysisStats
 )
 from app.schemas.user import User
 from app.models.analysis import AnalysisTask
 from app.models.transcription import TranscriptionTask
 from app.models.session import Session as SessionModel, SessionStatus
 from app.models.customer import Customer
+from app.services.access_scope import ClinicScope
 from app.services.analysis_service import AnalysisService
+from app.services.batch_scheduler import BatchScheduler, BatchQueueFullError
+from app.services.llm_cache import get_llm_cache
+from app.services.rollup_service import RollupService
+from app.services.token_budget import TokenBudgetExceededError
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+async def analysis_attempts_exhausted(task_id: str, **kwargs):
+    """再試行上限に達したジョブのタスクを失敗として記録"""
+    db = get_background_session()
+    
+    try:
+        analysis_task = db.query(AnalysisTask).filter(
+            AnalysisTask.task_id == task_id
+        ).first()
+        
+        if analysis_task and not analysis_task.is_completed and not analysis_task.is_failed:
+            message = "Job attempts exhausted"
+            if analysis_task.error_message:
+                message = f"{message}: {analysis_task.error_message}"
+            analysis_task.fail_processing(message, "JOB_ATTEMPTS_EXHAUSTED")
+            db.commit()
+    finally:
+        db.close()
+
+@job_handler("analysis", on_exhausted=analysis_attempts_exhausted)
 async def analysis_background_task(
     task_id: str,
     transcription_task_id: str,
-    transcription_text: str,
     analysis_type: str,
+    transcription_text: Optional[str] = None,
     focus_areas: List[str] = None,
     custom_prompts: dict = None,
-    db_url: str = None
+    bypass_cache: bool = False
 ):
     """バックグラウンドAI分析タスク"""
-    # 新しいデータベースセッションを作成
-    from sqlalchemy import create_engine
-    from sqlalchemy.orm import sessionmaker
-    
-    engine = create_engine(db_url)
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    db = SessionLocal()
+    # 共有プールからデータベースセッションを取得
+    db = get_background_session()
     
     try:
         # タスク取得
@@ -52,12 +75,26 @@ async def analysis_background_task(
             logger.error(f"Analysis task not found: {task_id}")
             return
         
+        # 再配信されたジョブは完了済みならスキップ
+        if analysis_task.is_completed:
+            logger.info(f"Analysis task already completed: {task_id}")
+            return
+        
         # 処理開始
         analysis_task.start_processing("preprocessing")
+        
+        # セッションを分析中へ（再分析・再配信ではすでに分析中以降）
+        session = None
+        if analysis_task.session_id:
+            session = db.query(SessionModel).filter(
+                SessionModel.id == analysis_task.session_id
+            ).first()
+            if session and session.status == SessionStatus.TRANSCRIBED:
+                session.update_status(SessionStatus.ANALYZING)
         db.commit()
         
         # AI分析実行
-        service = AnalysisService()
+        service = AnalysisService(use_cache=not bypass_cache)
         
         # 前処理段階
         analysis_task.update_progress(20, "preprocessing")
@@ -67,12 +104,25 @@ async def analysis_background_task(
         analysis_task.update_progress(30, "analyzing")
         db.commit()
         
+        # 長文分割用のセグメント（タイムスタンプ）
+        transcription_task = db.query(TranscriptionTask).filter(
+            TranscriptionTask.id == transcription_task_id
+        ).first()
+        segments = None
+        if transcription_task and transcription_task.transcription_result:
+            segments = transcription_task.transcription_result.get("segments")
+        
+        # バッチのジョブは本文を持たないのでここで読み込む
+        if transcription_text is None:
+            transcription_text = (transcription_task.transcription_text if transcription_task else None) or ""
+        
         from app.schemas.analysis import AnalysisType
         analysis_result, tokens_used, cost = await service.analyze_counseling(
             transcription_text=transcription_text,
             analysis_type=AnalysisType(analysis_type),
             focus_areas=focus_areas,
-            custom_prompts=custom_prompts
+            custom_prompts=custom_prompts,
+            segments=segments
         )
         
         # 改善提案生成段階
@@ -84,17 +134,18 @@ async def analysis_background_task(
             analysis_result=analysis_result.model_dump(),
             suggestions=None,  # TODO: 改善提案生成機能と統合
             tokens_used=tokens_used,
-            cost=cost
+            cost=cost,
+            usage=service.usage
         )
         
         # セッションのステータス更新
-        if analysis_task.session_id:
-            session = db.query(SessionModel).filter(
-                SessionModel.id == analysis_task.session_id
-            ).first()
-            if session:
-                session.analysis_result = analysis_result.model_dump()
+        if session:
+            session.analysis_result = analysis_result.model_dump()
+            if session.status == SessionStatus.ANALYZING:
                 session.update_status(SessionStatus.ANALYZED)
+            
+            # ダッシュボード用の日次ロールアップを更新（再分析でもスコアが変わる）
+            RollupService(db).refresh_sessions(session)
         
         db.commit()
         logger.info(f"Analysis task completed: {task_id}")
@@ -102,13 +153,24 @@ async def analysis_background_task(
     except Exception as e:
         logger.error(f"Analysis task failed: {task_id} - {e}")
         
+        # 途中まで反映した結果を保存しない
+        db.rollback()
+        
         # エラーを記録
         analysis_task = db.query(AnalysisTask).filter(
             AnalysisTask.task_id == task_id
         ).first()
         
+        # 一時的なエラーはジョブキューで再試行（上限到達時は on_exhausted で失敗にする）
+        if is_retryable_error(e):
+            if analysis_task:
+                analysis_task.wait_for_retry(str(e), "ANALYSIS_RETRYING")
+                db.commit()
+            raise
+        
         if analysis_task:
-            analysis_task.fail_processing(str(e), "ANALYSIS_ERROR")
+            error_code = "TOKEN_BUDGET_EXCEEDED" if isinstance(e, TokenBudgetExceededError) else "ANALYSIS_ERROR"
+            analysis_task.fail_processing(str(e), error_code)
             db.commit()
     
     finally:
@@ -117,9 +179,8 @@ async def analysis_background_task(
 @router.post("/", response_model=AnalysisResponse)
 async def start_analysis(
     request: AnalysisRequest,
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    scope: ClinicScope = Depends(get_clinic_scope)
 ):
     """AI分析開始"""
     try:
@@ -137,12 +198,7 @@ async def start_analysis(
             raise HTTPException(status_code=400, detail="Transcription not completed yet")
         
         # 権限チェック
-        if transcription_task.session_id:
-            session = db.query(SessionModel).filter(SessionModel.id == transcription_task.session_id).first()
-            if session:
-                customer = db.query(Customer).filter(Customer.id == session.customer_id).first()
-                if current_user.role == "counselor" and customer.clinic_id != current_user.clinic_id:
-                    raise HTTPException(status_code=403, detail="Access denied")
+        clinic_id = scope.require_one("transcription", transcription_task.id)
         
         # 既存の進行中分析タスクチェック
         existing_task = db.query(AnalysisTask).filter(
@@ -164,6 +220,8 @@ async def start_analysis(
         estimated_duration = 180  # 3分と仮定
         if request.analysis_type.value == "quick":
             estimated_duration = 60
+        elif request.analysis_type.value == "combined":
+            estimated_duration = 90
         elif request.analysis_type.value == "specific":
             estimated_duration = 120
         
@@ -175,6 +233,10 @@ async def start_analysis(
             analysis_type=request.analysis_type.value,
             focus_areas=request.focus_areas,
             custom_prompts=request.custom_prompts,
+            bypass_cache=request.bypass_cache,
+            lane=LANE_INTERACTIVE,
+            clinic_id=clinic_id,
+            dispatched_at=datetime.utcnow(),
             estimated_duration=estimated_duration,
             estimated_completion=datetime.utcnow() + timedelta(seconds=estimated_duration)
         )
@@ -182,17 +244,17 @@ async def start_analysis(
         db.add(analysis_task)
         db.commit()
         
-        # バックグラウンドタスク開始
-        from app.core.config import settings
-        background_tasks.add_task(
+        # ジョブキューに投入（interactive レーンはバッチより先に処理される）
+        await get_job_queue().add_task(
             analysis_background_task,
+            lane=LANE_INTERACTIVE,
             task_id=task_id,
             transcription_task_id=str(request.transcription_id),
             transcription_text=transcription_task.transcription_text or "",
             analysis_type=request.analysis_type.value,
             focus_areas=request.focus_areas,
             custom_prompts=request.custom_prompts,
-            db_url=str(settings.DATABASE_URL)
+            bypass_cache=request.bypass_cache
         )
         
         logger.info(f"Started analysis task: {task_id}")
@@ -214,7 +276,7 @@ async def start_analysis(
 async def get_analysis_status(
     task_id: str,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    scope: ClinicScope = Depends(get_clinic_scope)
 ):
     """AI分析状況取得"""
     try:
@@ -228,12 +290,7 @@ async def get_analysis_status(
             raise HTTPException(status_code=404, detail="Analysis task not found")
         
         # 権限チェック
-        if analysis_task.session_id:
-            session = db.query(SessionModel).filter(SessionModel.id == analysis_task.session_id).first()
-            if session:
-                customer = db.query(Customer).filter(Customer.id == session.customer_id).first()
-                if current_user.role == "counselor" and customer.clinic_id != current_user.clinic_id:
-                    raise HTTPException(status_code=403, detail="Access denied")
+        scope.require_one("analysis", analysis_task.id)
         
         # 結果作成
         result = None
@@ -264,7 +321,7 @@ async def get_analysis_status(
 async def get_analysis_result(
     analysis_id: str,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    scope: ClinicScope = Depends(get_clinic_scope)
 ):
     """AI分析結果取得"""
     try:
@@ -282,12 +339,7 @@ async def get_analysis_result(
             raise HTTPException(status_code=400, detail="Analysis not completed yet")
         
         # 権限チェック
-        if analysis_task.session_id:
-            session = db.query(SessionModel).filter(SessionModel.id == analysis_task.session_id).first()
-            if session:
-                customer = db.query(Customer).filter(Customer.id == session.customer_id).first()
-                if current_user.role == "counselor" and customer.clinic_id != current_user.clinic_id:
-                    raise HTTPException(status_code=403, detail="Access denied")
+        scope.require_one("analysis", analysis_task.id)
         
         return {
             "analysis_id": str(analysis_task.id),
@@ -308,81 +360,100 @@ async def get_analysis_result(
 @router.post("/batch", response_model=BatchAnalysisResponse)
 async def start_batch_analysis(
     request: BatchAnalysisRequest,
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    scope: ClinicScope = Depends(get_clinic_scope)
 ):
-    """バッチAI分析開始"""
+    """バッチAI分析開始
+
+    タスクは順番待ちとして登録するだけで、BatchDispatcher が同時実行数の上限まで
+    クリニックごとに公平にジョブキューへ投入する。順番待ちが上限を超える場合は 429。
+    """
     try:
         # 管理者またはマネージャーのみ
         if current_user.role not in ["admin", "manager"]:
             raise HTTPException(status_code=403, detail="Permission denied")
         
+        if len(request.transcription_ids) > settings.BATCH_QUEUE_MAX_PER_CLINIC:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Batch size exceeds limit of {settings.BATCH_QUEUE_MAX_PER_CLINIC}"
+            )
+        
         # 文字起こしタスク存在チェック
-        transcription_tasks = db.query(TranscriptionTask).filter(
+        rows = db.query(TranscriptionTask.id, TranscriptionTask.session_id).filter(
             TranscriptionTask.id.in_(request.transcription_ids),
-            TranscriptionTask.is_completed == True,
+            TranscriptionTask.status == "completed",
             TranscriptionTask.is_deleted == False
         ).all()
         
-        if len(transcription_tasks) != len(request.transcription_ids):
+        if len(rows) != len(set(request.transcription_ids)):
             raise HTTPException(status_code=400, detail="Some transcription tasks not found or not completed")
         
-        # 権限チェック（マネージャーは自分のクリニックのみ）
-        if current_user.role == "manager":
-            for task in transcription_tasks:
-                if task.session_id:
-                    session = db.query(SessionModel).filter(SessionModel.id == task.session_id).first()
-                    if session:
-                        customer = db.query(Customer).filter(Customer.id == session.customer_id).first()
-                        if customer.clinic_id != current_user.clinic_id:
-                            raise HTTPException(status_code=403, detail="Access denied to some sessions")
+        # 権限チェック（マネージャーは自分のクリニックのみ、件数に関係なく1クエリ）
+        clinics = scope.require(
+            "transcription", [row.id for row in rows], roles=("manager",), detail="Access denied to some sessions"
+        )
+        
+        # バックプレッシャー：順番待ちが溢れるなら受け付けない
+        counts = {}
+        for clinic_id in clinics.values():
+            counts[clinic_id] = counts.get(clinic_id, 0) + 1
+        scheduler = BatchScheduler(db)
+        try:
+            snapshot = scheduler.admit(counts)
+        except BatchQueueFullError as e:
+            raise HTTPException(
+                status_code=429,
+                detail=str(e),
+                headers={"Retry-After": str(e.retry_after)}
+            )
         
         batch_id = str(uuid.uuid4())
         task_ids = []
+        added = {}
+        now = datetime.utcnow()
+        estimated_duration = int(snapshot["average_duration"])
+        total_eta = 0
         
-        # 各文字起こしに対して分析タスクを作成
-        for transcription_task in transcription_tasks:
+        # 各文字起こしに対して順番待ちの分析タスクを作成
+        for row in rows:
             task_id = str(uuid.uuid4())
             task_ids.append(task_id)
             
-            estimated_duration = 180
-            if request.analysis_type.value == "quick":
-                estimated_duration = 60
+            # ラウンドロビンでの順番から完了時刻を推定
+            clinic_id = clinics[row.id]
+            added[clinic_id] = added.get(clinic_id, 0) + 1
+            position = scheduler.queue_position(snapshot, clinic_id, added[clinic_id])
+            eta = scheduler.estimate_seconds(snapshot, position)
+            total_eta = max(total_eta, eta)
             
             analysis_task = AnalysisTask(
-                transcription_task_id=transcription_task.id,
-                session_id=transcription_task.session_id,
+                transcription_task_id=row.id,
+                session_id=row.session_id,
                 task_id=task_id,
                 analysis_type=request.analysis_type.value,
+                bypass_cache=request.bypass_cache,
+                lane=LANE_BATCH,
+                batch_id=batch_id,
+                clinic_id=clinic_id,
                 estimated_duration=estimated_duration,
-                estimated_completion=datetime.utcnow() + timedelta(seconds=estimated_duration)
+                estimated_completion=now + timedelta(seconds=eta)
             )
             
             db.add(analysis_task)
-            
-            # バックグラウンドタスク開始
-            from app.core.config import settings
-            background_tasks.add_task(
-                analysis_background_task,
-                task_id=task_id,
-                transcription_task_id=str(transcription_task.id),
-                transcription_text=transcription_task.transcription_text or "",
-                analysis_type=request.analysis_type.value,
-                focus_areas=None,
-                custom_prompts=None,
-                db_url=str(settings.DATABASE_URL)
-            )
         
         db.commit()
         
-        logger.info(f"Started batch analysis: {batch_id} with {len(task_ids)} tasks")
+        logger.info(f"Queued batch analysis: {batch_id} with {len(task_ids)} tasks (eta {total_eta}s)")
         
         return BatchAnalysisResponse(
             batch_id=batch_id,
             task_ids=task_ids,
             total_count=len(task_ids),
-            estimated_total_duration=len(task_ids) * 180
+            estimated_total_duration=total_eta,
+            queue_depth=snapshot["queued"] + len(task_ids),
+            estimated_completion=now + timedelta(seconds=total_eta)
         )
         
     except HTTPException:
@@ -391,12 +462,48 @@ async def start_batch_analysis(
         logger.error(f"Failed to start batch analysis: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@router.get("/batch/queue", response_model=BatchQueueStatus)
+async def get_batch_queue_status(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """バッチ分析キューの状況"""
+    try:
+        if current_user.role not in ["admin", "manager"]:
+            raise HTTPException(status_code=403, detail="Permission denied")
+        
+        snapshot = BatchScheduler(db).snapshot()
+        
+        # マネージャーには自分のクリニックの順番待ちが空くまでの時間を返す
+        queued = snapshot["queued"]
+        position = queued
+        if current_user.role == "manager":
+            queued = snapshot["queued_by_clinic"].get(current_user.clinic_id, 0)
+            position = BatchScheduler.queue_position(snapshot, current_user.clinic_id, 0) if queued else 0
+        
+        return BatchQueueStatus(
+            queued=queued,
+            in_flight=snapshot["in_flight"],
+            max_in_flight=snapshot["max_in_flight"],
+            average_duration=snapshot["average_duration"],
+            throughput_per_minute=snapshot["throughput_per_second"] * 60,
+            estimated_drain_seconds=BatchScheduler.estimate_seconds(snapshot, position) if position else 0
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to get batch queue status: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 @router.get("/", response_model=AnalysisList)
 async def list_analysis_tasks(
     transcription_id: Optional[str] = Query(None, description="Filter by transcription ID"),
     status: Optional[str] = Query(None, description="Filter by status"),
     page: int = Query(1, ge=1, description="Page number"),
     per_page: int = Query(10, ge=1, le=100, description="Items per page"),
+    cursor: Optional[str] = Query(None, description="Cursor from next_cursor (overrides page)"),
+    include_total: bool = Query(False, description="Estimate the total when paging by cursor"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
@@ -423,16 +530,18 @@ async def list_analysis_tasks(
                         .join(Customer, SessionModel.customer_id == Customer.id)\
                         .filter(Customer.clinic_id == current_user.clinic_id)
         
-        # 総数取得
-        total = query.count()
-        
-        # ページング
-        offset = (page - 1) * per_page
-        analysis_tasks = query.order_by(AnalysisTask.created_at.desc()).offset(offset).limit(per_page).all()
+        # ページング（カーソル指定時はキーセット）
+        try:
+            result_page = paginate(
+                query, AnalysisTask, per_page,
+                page=page, cursor=cursor, include_total=include_total
+            )
+        except InvalidCursorError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
         
         # レスポンス変換
         analysis_list = []
-        for task in analysis_tasks:
+        for task in result_page.items:
             result = None
             if task.is_completed and task.full_analysis_result:
                 from app.schemas.analysis import AnalysisResult
@@ -453,11 +562,15 @@ async def list_analysis_tasks(
         
         return AnalysisList(
             analyses=analysis_list,
-            total=total,
-            page=page,
-            per_page=per_page
+            total=result_page.total,
+            total_is_estimate=result_page.total_is_estimate,
+            page=None if cursor else page,
+            per_page=per_page,
+            next_cursor=result_page.next_cursor
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Failed to list analysis tasks: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -481,6 +594,9 @@ async def get_analysis_stats(
                         .join(Customer, SessionModel.customer_id == Customer.id)\
                         .filter(Customer.clinic_id == current_user.clinic_id)
         
+        # LLMキャッシュはクリニック横断の累計のため管理者のみ
+        llm_cache = await get_llm_cache().get_statistics() if current_user.role == "admin" else None
+        
         # 統計計算
         all_tasks = query.all()
         total_analyses = len(all_tasks)
@@ -494,7 +610,8 @@ async def get_analysis_stats(
                 processing_analyses=0,
                 average_processing_time=0.0,
                 average_overall_score=0.0,
-                success_rate=0.0
+                success_rate=0.0,
+                llm_cache=llm_cache
             )
         
         completed_analyses = len([t for t in all_tasks if t.status == "completed"])
@@ -521,7 +638,8 @@ async def get_analysis_stats(
             processing_analyses=processing_analyses,
             average_processing_time=average_processing_time,
             average_overall_score=average_overall_score,
-            success_rate=success_rate
+            success_rate=success_rate,
+            llm_cache=llm_cache
         )
         
     except Exception as e:
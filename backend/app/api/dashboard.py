@@ -1,7 +1,7 @@
 """
 Dashboard and analytics API endpoints
 """
-from fastapi import APIRouter, Depends, HTTPException, Query, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from typing import List, Optional, Union, Dict
 import logging
@@ -9,8 +9,10 @@ from datetime import datetime, timedelta
 import uuid
 
 from app.api.deps import get_db, get_current_user
+from app.core.database import SessionLocal, get_background_session
+from app.core.job_queue import get_job_queue, is_retryable_error, job_handler
 from app.schemas.dashboard import (
-    ExecutiveDashboard, CounselorDashboard, OperationDashboard,
+    ExecutiveDashboard, CounselorDashboard, TeamDashboard, OperationDashboard,
     DashboardFilters, PerformanceReportFilters, PerformanceReport,
     CustomReportRequest, CustomReportResponse, TrendAnalysisRequest, TrendAnalysisResponse,
     ExportRequest, ExportResponse
@@ -18,17 +20,39 @@ from app.schemas.dashboard import (
 from app.schemas.user import User
 from app.models.user import User as UserModel
 from app.models.clinic import Clinic
+from app.models.export import ExportJob
 from app.services.analytics_service import AnalyticsService
+from app.services.dashboard_cache import get_dashboard_cache
+from app.services.export_service import ExportService
+from app.services.storage_service import get_storage_service
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+
+def _default_end_date() -> datetime:
+    """デフォルト期間の終端（分単位に切り上げ、同じ分のリクエストでキャッシュキーを揃える）"""
+    return datetime.utcnow().replace(second=0, microsecond=0) + timedelta(minutes=1)
+
+
+def _cached_compute(build):
+    """キャッシュミス・裏の再計算用の集計（リクエストとは別のDBセッションを使う）"""
+    async def compute():
+        db = SessionLocal()
+        try:
+            return await build(AnalyticsService(db))
+        finally:
+            db.close()
+    return compute
+
+
 @router.get("/executive", response_model=ExecutiveDashboard)
 async def get_executive_dashboard(
     start_date: Optional[datetime] = Query(None),
     end_date: Optional[datetime] = Query(None),
     clinic_id: Optional[str] = Query(None),
+    granularity: str = Query(default="daily", pattern="^(hourly|daily|weekly|monthly)$"),
     time_zone: str = Query(default="Asia/Tokyo"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
@@ -41,7 +65,7 @@ async def get_executive_dashboard(
         
         # デフォルト期間設定（過去30日）
         if not end_date:
-            end_date = datetime.utcnow()
+            end_date = _default_end_date()
         if not start_date:
             start_date = end_date - timedelta(days=30)
         
@@ -51,16 +75,27 @@ async def get_executive_dashboard(
             effective_clinic_id = current_user.clinic_id
         
         # フィルター設定
-        filters = DashboardFilters(
-            start_date=start_date,
-            end_date=end_date,
-            clinic_id=effective_clinic_id
+        try:
+            filters = DashboardFilters(
+                start_date=start_date,
+                end_date=end_date,
+                clinic_id=effective_clinic_id,
+                granularity=granularity,
+                time_zone=time_zone
+            )
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid time zone: {time_zone}")
+        
+        # 分析サービス（キャッシュ経由）
+        dashboard_data = await get_dashboard_cache().get_or_compute(
+            "executive",
+            current_user.role,
+            effective_clinic_id,
+            filters.model_dump(mode="json"),
+            _cached_compute(lambda service: service.get_executive_dashboard(filters)),
+            ExecutiveDashboard
         )
         
-        # 分析サービス
-        analytics_service = AnalyticsService(db)
-        dashboard_data = await analytics_service.get_executive_dashboard(filters)
-        
         logger.info(f"Executive dashboard requested by user {current_user.id}")
         return dashboard_data
         
@@ -102,7 +137,7 @@ async def get_counselor_dashboard(
         
         # デフォルト期間設定（過去30日）
         if not end_date:
-            end_date = datetime.utcnow()
+            end_date = _default_end_date()
         if not start_date:
             start_date = end_date - timedelta(days=30)
         
@@ -113,9 +148,15 @@ async def get_counselor_dashboard(
             counselor_id=counselor_id
         )
         
-        # 分析サービス
-        analytics_service = AnalyticsService(db)
-        dashboard_data = await analytics_service.get_counselor_dashboard(counselor_id, filters)
+        # 分析サービス（キャッシュ経由）
+        dashboard_data = await get_dashboard_cache().get_or_compute(
+            "counselor",
+            current_user.role,
+            counselor.clinic_id,
+            {**filters.model_dump(mode="json"), "comparison_period": comparison_period},
+            _cached_compute(lambda service: service.get_counselor_dashboard(counselor_id, filters)),
+            CounselorDashboard
+        )
         
         logger.info(f"Counselor dashboard requested for {counselor_id} by user {current_user.id}")
         return dashboard_data
@@ -126,6 +167,55 @@ async def get_counselor_dashboard(
         logger.error(f"Failed to get counselor dashboard: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@router.get("/team", response_model=TeamDashboard)
+async def get_team_dashboard(
+    clinic_id: Optional[str] = Query(None),
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """チームダッシュボード取得（クリニック内の全カウンセラーを1リクエストで）"""
+    try:
+        # 管理者またはマネージャーのみアクセス可能
+        if current_user.role not in ["admin", "manager"]:
+            raise HTTPException(status_code=403, detail="Access denied")
+        
+        # マネージャーは自分のクリニックのみ
+        effective_clinic_id = clinic_id or current_user.clinic_id
+        if current_user.role == "manager" and str(effective_clinic_id) != str(current_user.clinic_id):
+            raise HTTPException(status_code=403, detail="Access denied")
+        if not effective_clinic_id:
+            raise HTTPException(status_code=400, detail="clinic_id is required")
+        
+        # デフォルト期間設定（過去30日）
+        if not end_date:
+            end_date = _default_end_date()
+        if not start_date:
+            start_date = end_date - timedelta(days=30)
+        
+        # 個別ダッシュボードと同じ集計条件（カウンセラー単位、クリニックでは絞らない）
+        filters = DashboardFilters(start_date=start_date, end_date=end_date)
+        
+        # 分析サービス（キャッシュ経由）
+        dashboard_data = await get_dashboard_cache().get_or_compute(
+            "team",
+            current_user.role,
+            effective_clinic_id,
+            filters.model_dump(mode="json"),
+            _cached_compute(lambda service: service.get_team_dashboard(str(effective_clinic_id), filters)),
+            TeamDashboard
+        )
+        
+        logger.info(f"Team dashboard requested for clinic {effective_clinic_id} by user {current_user.id}")
+        return dashboard_data
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to get team dashboard: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 @router.get("/operations", response_model=OperationDashboard)
 async def get_operations_dashboard(
     db: Session = Depends(get_db),
@@ -137,9 +227,15 @@ async def get_operations_dashboard(
         if current_user.role != "admin":
             raise HTTPException(status_code=403, detail="Access denied")
         
-        # 分析サービス
-        analytics_service = AnalyticsService(db)
-        dashboard_data = await analytics_service.get_operation_dashboard()
+        # 分析サービス（キャッシュ経由）
+        dashboard_data = await get_dashboard_cache().get_or_compute(
+            "operations",
+            current_user.role,
+            None,
+            {},
+            _cached_compute(lambda service: service.get_operation_dashboard()),
+            OperationDashboard
+        )
         
         logger.info(f"Operations dashboard requested by user {current_user.id}")
         return dashboard_data
@@ -150,6 +246,15 @@ async def get_operations_dashboard(
         logger.error(f"Failed to get operations dashboard: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@router.get("/cache-stats")
+async def get_dashboard_cache_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """ダッシュボードキャッシュのエンドポイント別ヒット率"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Access denied")
+    return get_dashboard_cache().get_statistics()
+
 @router.get("/performance-report", response_model=PerformanceReport)
 async def get_performance_report(
     report_type: str = Query(..., pattern="^(counselor|clinic|customer)$"),
@@ -320,7 +425,6 @@ async def get_trend_analysis(
 @router.post("/export", response_model=ExportResponse)
 async def export_dashboard_data(
     request: ExportRequest,
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
@@ -329,26 +433,33 @@ async def export_dashboard_data(
         # 権限チェック
         if current_user.role == "counselor":
             raise HTTPException(status_code=403, detail="Access denied")
-        
-        # エクスポートID生成
-        export_id = str(uuid.uuid4())
-        
-        # バックグラウンドでエクスポート処理を開始
-        background_tasks.add_task(
-            _process_export,
-            export_id=export_id,
-            request=request,
-            user_id=str(current_user.id)
+        elif current_user.role == "manager":
+            # マネージャーは自分のクリニックのみ
+            if request.filters.clinic_ids and str(current_user.clinic_id) not in request.filters.clinic_ids:
+                raise HTTPException(status_code=403, detail="Access denied")
+            request.filters.clinic_ids = [str(current_user.clinic_id)]
+        
+        # エクスポートジョブ作成
+        export_job = ExportJob(
+            user_id=current_user.id,
+            dataset=request.data_source,
+            file_format=request.export_type,
+            filters=request.filters.model_dump(mode="json")
         )
+        db.add(export_job)
+        db.commit()
+        db.refresh(export_job)
+        
+        # ジョブキューでエクスポート処理を開始
+        await get_job_queue().add_task(export_background_task, export_id=str(export_job.id))
         
         response = ExportResponse(
-            export_id=export_id,
+            export_id=str(export_job.id),
             status="pending",
-            generated_at=datetime.utcnow(),
-            expires_at=datetime.utcnow() + timedelta(hours=24)
+            generated_at=export_job.created_at
         )
         
-        logger.info(f"Export requested: {export_id} by user {current_user.id}")
+        logger.info(f"Export requested: {export_job.id} by user {current_user.id}")
         return response
         
     except HTTPException:
@@ -357,23 +468,46 @@ async def export_dashboard_data(
         logger.error(f"Failed to initiate export: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
-@router.get("/export/{export_id}/status")
+@router.get("/export/{export_id}/status", response_model=ExportResponse)
 async def get_export_status(
     export_id: str,
+    db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """エクスポート状況確認"""
     try:
-        # 実際の実装では、エクスポートタスクの状況をデータベースから取得
-        # ここでは簡易的なレスポンスを返す
-        return {
-            "export_id": export_id,
-            "status": "completed",
-            "file_url": f"/api/v1/exports/{export_id}/download",
-            "file_size_mb": 2.5,
-            "expires_at": datetime.utcnow() + timedelta(hours=20)
-        }
+        try:
+            export_uuid = uuid.UUID(export_id)
+        except ValueError:
+            raise HTTPException(status_code=404, detail="Export not found")
+        
+        export_job = db.query(ExportJob).filter(ExportJob.id == export_uuid).first()
+        
+        # 本人（と管理者）のみ参照可能
+        if not export_job or (export_job.user_id != current_user.id and current_user.role != "admin"):
+            raise HTTPException(status_code=404, detail="Export not found")
+        
+        # 保持期間内の完了済みエクスポートはダウンロードURLを発行
+        file_url = None
+        if export_job.status == "completed" and export_job.expires_at and export_job.expires_at > datetime.utcnow():
+            download = await get_storage_service().generate_presigned_download_url(export_job.file_path)
+            file_url = download["download_url"]
+        
+        return ExportResponse(
+            export_id=str(export_job.id),
+            file_url=file_url,
+            file_size_mb=round(export_job.bytes_written / (1024 * 1024), 2) if export_job.status == "completed" else None,
+            status=export_job.status,
+            progress=export_job.progress,
+            rows_exported=export_job.rows_exported,
+            total_rows=export_job.total_rows,
+            error_message=export_job.error_message,
+            generated_at=export_job.completed_at or export_job.created_at,
+            expires_at=export_job.expires_at
+        )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Failed to get export status: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -471,19 +605,62 @@ async def _analyze_trends(db: Session, request: TrendAnalysisRequest) -> Dict:
         ]
     }
 
-async def _process_export(export_id: str, request: ExportRequest, user_id: str):
+async def export_attempts_exhausted(export_id: str, **kwargs):
+    """再試行上限に達したエクスポートを失敗として記録"""
+    db = get_background_session()
+    
+    try:
+        export_job = db.query(ExportJob).filter(ExportJob.id == export_id).first()
+        if export_job and export_job.status not in ("completed", "failed"):
+            export_job.status = "failed"
+            export_job.error_message = (
+                f"Job attempts exhausted: {export_job.error_message}"
+                if export_job.error_message else "Job attempts exhausted"
+            )
+            db.commit()
+    finally:
+        db.close()
+
+@job_handler("export", on_exhausted=export_attempts_exhausted)
+async def export_background_task(export_id: str):
     """エクスポート処理（バックグラウンド）"""
+    # 共有プールからデータベースセッションを取得
+    db = get_background_session()
+    
     try:
-        # 実際の実装では、データの取得、フォーマット変換、ファイル生成を行う
-        logger.info(f"Processing export {export_id} for user {user_id}")
+        export_job = db.query(ExportJob).filter(ExportJob.id == export_id).first()
         
-        # ファイル生成のシミュレーション
-        import time
-        time.sleep(2)  # 処理時間のシミュレーション
+        if not export_job:
+            logger.error(f"Export job not found: {export_id}")
+            return
         
-        # 実際の実装では、生成されたファイルのURLやステータスをデータベースに保存
-        logger.info(f"Export {export_id} completed")
+        # 再配信されたジョブは完了済みならスキップ
+        if export_job.status == "completed":
+            logger.info(f"Export already completed: {export_id}")
+            return
+        
+        logger.info(f"Processing export {export_id} for user {export_job.user_id}")
+        await ExportService(db).run(export_job)
         
     except Exception as e:
         logger.error(f"Export {export_id} failed: {e}")
-        # エラー状況をデータベースに記録
\ No newline at end of file
+        
+        # エラーを記録
+        db.rollback()
+        export_job = db.query(ExportJob).filter(ExportJob.id == export_id).first()
+        
+        # 一時的なエラーはジョブキューで再試行（上限到達時は on_exhausted で失敗にする）
+        if is_retryable_error(e):
+            if export_job:
+                export_job.status = "pending"
+                export_job.error_message = str(e)
+                db.commit()
+            raise
+        
+        if export_job:
+            export_job.status = "failed"
+            export_job.error_message = str(e)
+            db.commit()
+    
+    finally:
+        db.close()
@@ -10,6 +10,7 @@ from app.core.config import settings
 from app.core.database import SessionLocal
 from app.models.user import User
 from app.schemas.user import TokenPayload
+from app.services.access_scope import ClinicScope
 
 
 reusable_oauth2 = HTTPBearer()
@@ -27,9 +28,14 @@ def get_current_user(
     db: Session = Depends(get_db),
     token: HTTPAuthorizationCredentials = Depends(reusable_oauth2)
 ) -> User:
+    return get_user_from_token(db, token.credentials)
+
+
+def get_user_from_token(db: Session, token: str) -> User:
+    """Resolve a user from a raw JWT (WebSocket connections pass it as a query parameter)"""
     try:
         payload = jwt.decode(
-            token.credentials, settings.SECRET_KEY, algorithms=[settings.JWT_ALGORITHM]
+            token, settings.SECRET_KEY, algorithms=[settings.JWT_ALGORITHM]
         )
         token_data = TokenPayload(**payload)
     except (JWTError, ValidationError):
@@ -71,4 +77,12 @@ def get_current_manager_or_admin_user(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not enough permissions"
         )
-    return current_user
\ No newline at end of file
+    return current_user
+
+
+def get_clinic_scope(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+) -> ClinicScope:
+    """Per-request clinic scope (FastAPI caches dependencies, so one resolver is shared per request)"""
+    return ClinicScope(db, current_user)
@@ -6,17 +6,18 @@ from sqlalchemy.orm import Session
 from typing import List, Optional
 import logging
 
-from app.api.deps import get_db, get_current_user
+from app.api.deps import get_db, get_current_user, get_clinic_scope
 from app.schemas.improvement import (
     SuggestionRequest, SuggestionResponse, ScriptGenerationRequest, ScriptGenerationResponse,
     SuccessPatternRequest, SuccessPatternResponse, FeedbackRequest, FeedbackResponse,
-    PerformanceTrendRequest, PerformanceTrendResponse, SuggestionCategory, SuggestionPriority
+    PerformanceTrendRequest, PerformanceTrendResponse, TeamPerformanceTrendResponse,
+    SuggestionCategory, SuggestionPriority
 )
 from app.schemas.user import User
 from app.schemas.analysis import AnalysisResult
 from app.models.analysis import AnalysisTask, AnalysisFeedback
-from app.models.session import Session as SessionModel
 from app.models.customer import Customer
+from app.services.access_scope import ClinicScope
 from app.services.improvement_service import ImprovementSuggestionService
 from app.services.script_optimization_service import ScriptOptimizationService
 
@@ -31,7 +32,7 @@ async def get_improvement_suggestions(
     focus_categories: Optional[List[SuggestionCategory]] = Query(default=None),
     max_suggestions: int = Query(default=10, ge=1, le=20),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    scope: ClinicScope = Depends(get_clinic_scope)
 ):
     """改善提案の取得"""
     try:
@@ -49,12 +50,7 @@ async def get_improvement_suggestions(
             raise HTTPException(status_code=400, detail="Analysis not completed yet")
         
         # 権限チェック
-        if analysis_task.session_id:
-            session = db.query(SessionModel).filter(SessionModel.id == analysis_task.session_id).first()
-            if session:
-                customer = db.query(Customer).filter(Customer.id == session.customer_id).first()
-                if current_user.role == "counselor" and customer.clinic_id != current_user.clinic_id:
-                    raise HTTPException(status_code=403, detail="Access denied")
+        clinic_id = scope.require_one("analysis", analysis_task.id)
         
         # 分析結果の取得
         if not analysis_task.full_analysis_result:
@@ -89,7 +85,7 @@ async def get_improvement_suggestions(
         
         # 成功パターンの取得
         success_patterns = improvement_service.get_success_patterns(
-            clinic_id=customer.clinic_id if analysis_task.session_id else None,
+            clinic_id=clinic_id,
             days=30
         )
         
@@ -110,35 +106,30 @@ async def get_improvement_suggestions(
 async def generate_optimized_script(
     request: ScriptGenerationRequest,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    scope: ClinicScope = Depends(get_clinic_scope)
 ):
     """最適化スクリプトの生成"""
     try:
-        # 顧客IDが指定されている場合の権限チェック
+        # 顧客IDが指定されている場合の権限チェック（成功パターンはその顧客のクリニックから取得）
+        clinic_id = None
         if request.customer_id:
-            customer = db.query(Customer).filter(
+            customer_exists = db.query(Customer.id).filter(
                 Customer.id == request.customer_id,
                 Customer.is_deleted == False
             ).first()
             
-            if not customer:
+            if not customer_exists:
                 raise HTTPException(status_code=404, detail="Customer not found")
             
-            if current_user.role == "counselor" and customer.clinic_id != current_user.clinic_id:
-                raise HTTPException(status_code=403, detail="Access denied")
+            clinic_id = scope.require_one("customer", request.customer_id)
+        elif current_user.role in ["counselor", "manager"]:
+            clinic_id = current_user.clinic_id
         
         # スクリプト最適化サービス
         script_service = ScriptOptimizationService(db)
         improvement_service = ImprovementSuggestionService(db)
         
-        # 成功パターンの取得
-        clinic_id = None
-        if request.customer_id:
-            customer = db.query(Customer).filter(Customer.id == request.customer_id).first()
-            clinic_id = customer.clinic_id if customer else None
-        elif current_user.role in ["counselor", "manager"]:
-            clinic_id = current_user.clinic_id
-        
         success_patterns = improvement_service.get_success_patterns(
             clinic_id=clinic_id,
             days=30
@@ -249,7 +240,8 @@ async def get_success_patterns(
 async def submit_improvement_feedback(
     request: FeedbackRequest,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    scope: ClinicScope = Depends(get_clinic_scope)
 ):
     """改善提案フィードバックの送信"""
     try:
@@ -263,12 +255,7 @@ async def submit_improvement_feedback(
             raise HTTPException(status_code=404, detail="Analysis not found")
         
         # 権限チェック
-        if analysis_task.session_id:
-            session = db.query(SessionModel).filter(SessionModel.id == analysis_task.session_id).first()
-            if session:
-                customer = db.query(Customer).filter(Customer.id == session.customer_id).first()
-                if current_user.role == "counselor" and customer.clinic_id != current_user.clinic_id:
-                    raise HTTPException(status_code=403, detail="Access denied")
+        scope.require_one("analysis", analysis_task.id)
         
         # フィードバックの保存
         feedback = AnalysisFeedback(
@@ -302,6 +289,37 @@ async def submit_improvement_feedback(
         logger.error(f"Failed to submit feedback: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@router.get("/performance-trends", response_model=TeamPerformanceTrendResponse)
+async def get_team_performance_trends(
+    clinic_id: Optional[str] = Query(None),
+    days: int = Query(default=30, ge=7, le=365),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """クリニック内の全カウンセラーのパフォーマンストレンドを一括取得"""
+    try:
+        # 権限チェック（マネージャーは自分のクリニックのみ）
+        if current_user.role == "counselor":
+            raise HTTPException(status_code=403, detail="Access denied")
+        if current_user.role == "manager" and clinic_id and clinic_id != str(current_user.clinic_id):
+            raise HTTPException(status_code=403, detail="Access denied")
+        
+        target_clinic_id = clinic_id or current_user.clinic_id
+        if not target_clinic_id:
+            raise HTTPException(status_code=400, detail="clinic_id is required")
+        
+        improvement_service = ImprovementSuggestionService(db)
+        return improvement_service.generate_team_performance_trends(
+            clinic_id=str(target_clinic_id),
+            days=days
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to get team performance trends: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 @router.get("/performance-trends/{counselor_id}", response_model=PerformanceTrendResponse)
 async def get_performance_trends(
     counselor_id: str,
@@ -332,13 +350,15 @@ async def get_performance_trends(
             days=days
         )
         
-        # 改善軌跡データ（簡易版）
+        # 改善軌跡データ（予測は総合スコアの傾きを30日分延長）
         improvement_trajectory = None
         if include_predictions:
+            weekly_change = trend_data.score_slope or 0.0
+            predicted = trend_data.current_average + weekly_change * 30 / 7
             improvement_trajectory = [
                 {"period": "過去30日", "score": trend_data.previous_average},
                 {"period": "現在", "score": trend_data.current_average},
-                {"period": "予測（30日後）", "score": min(10.0, trend_data.current_average + 0.5)}
+                {"period": "予測（30日後）", "score": max(0.0, min(10.0, predicted))}
             ]
         
         # 推奨事項の生成
@@ -7,7 +7,7 @@ from typing import Optional
 from datetime import datetime
 import logging
 
-from app.api.deps import get_db, get_current_user
+from app.api.deps import get_db, get_current_user, get_clinic_scope
 from app.schemas.recording import (
     RecordingCreate, RecordingResponse, RecordingInfo, RecordingDownload,
     RecordingList
@@ -16,7 +16,9 @@ from app.schemas.user import User
 from app.models.recording import Recording
 from app.models.customer import Customer
 from app.models.session import Session as SessionModel
-from app.services.storage_service import S3StorageService
+from app.services.access_scope import ClinicScope
+from app.services.storage_service import get_storage_service
+from app.core.pagination import InvalidCursorError, paginate
 
 logger = logging.getLogger(__name__)
 
@@ -27,7 +29,8 @@ router = APIRouter()
 async def create_recording_upload_url(
     request: RecordingCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    scope: ClinicScope = Depends(get_clinic_scope)
 ):
     """録音ファイルアップロード用URLを生成"""
     try:
@@ -39,12 +42,11 @@ async def create_recording_upload_url(
             raise HTTPException(status_code=404, detail="Customer not found")
 
         # 権限チェック（カウンセラーは自分のクリニックの顧客のみ）
-        if (current_user.role == "counselor" and
-                customer.clinic_id != current_user.clinic_id):
+        if not scope.can_access(customer.clinic_id):
             raise HTTPException(status_code=403, detail="Access denied")
 
         # ファイルタイプ検証
-        storage_service = S3StorageService()
+        storage_service = get_storage_service()
         if not storage_service.validate_file_type(request.content_type):
             raise HTTPException(status_code=400, detail="Unsupported file type")
 
@@ -114,7 +116,7 @@ async def create_recording_upload_url(
 async def get_recording_download_url(
     recording_id: str,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    scope: ClinicScope = Depends(get_clinic_scope)
 ):
     """録音ファイルダウンロードURL取得"""
     try:
@@ -128,18 +130,13 @@ async def get_recording_download_url(
             raise HTTPException(status_code=404, detail="Recording not found")
 
         # 権限チェック
-        customer = db.query(Customer).filter(
-            Customer.id == recording.customer_id
-        ).first()
-        if (current_user.role == "counselor" and
-                customer.clinic_id != current_user.clinic_id):
-            raise HTTPException(status_code=403, detail="Access denied")
+        scope.require_one("recording", recording.id)
 
         # アップロード完了チェック
         if recording.upload_status != "completed":
             raise HTTPException(status_code=400, detail="Recording not uploaded yet")
 
-        storage_service = S3StorageService()
+        storage_service = get_storage_service()
         
         # ファイル存在チェック
         if not await storage_service.file_exists(recording.file_path):
@@ -171,7 +168,8 @@ async def get_recording_download_url(
 async def delete_recording(
     recording_id: str,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    scope: ClinicScope = Depends(get_clinic_scope)
 ):
     """録音ファイル削除"""
     try:
@@ -189,14 +187,9 @@ async def delete_recording(
             raise HTTPException(status_code=403, detail="Permission denied")
 
         # マネージャーは自分のクリニックのみ
-        if current_user.role == "manager":
-            customer = db.query(Customer).filter(
-                Customer.id == recording.customer_id
-            ).first()
-            if customer.clinic_id != current_user.clinic_id:
-                raise HTTPException(status_code=403, detail="Access denied")
-
-        storage_service = S3StorageService()
+        scope.require_one("recording", recording.id, roles=("manager",))
+
+        storage_service = get_storage_service()
         
         # S3からファイル削除
         if await storage_service.file_exists(recording.file_path):
@@ -223,6 +216,8 @@ async def list_recordings(
     customer_id: Optional[str] = Query(None, description="Filter by customer ID"),
     page: int = Query(1, ge=1, description="Page number"),
     per_page: int = Query(10, ge=1, le=100, description="Items per page"),
+    cursor: Optional[str] = Query(None, description="Cursor from next_cursor (overrides page)"),
+    include_total: bool = Query(False, description="Estimate the total when paging by cursor"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
@@ -246,16 +241,18 @@ async def list_recordings(
                 Customer.clinic_id == current_user.clinic_id
             )
 
-        # 総数取得
-        total = query.count()
-
-        # ページング
-        offset = (page - 1) * per_page
-        recordings = query.offset(offset).limit(per_page).all()
+        # ページング（カーソル指定時はキーセット）
+        try:
+            result_page = paginate(
+                query, Recording, per_page,
+                page=page, cursor=cursor, include_total=include_total
+            )
+        except InvalidCursorError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
 
         # レスポンス変換
         recording_info = []
-        for recording in recordings:
+        for recording in result_page.items:
             recording_info.append(RecordingInfo(
                 recording_id=str(recording.id),
                 customer_id=str(recording.customer_id),
@@ -269,11 +266,15 @@ async def list_recordings(
 
         return RecordingList(
             recordings=recording_info,
-            total=total,
-            page=page,
-            per_page=per_page
+            total=result_page.total,
+            total_is_estimate=result_page.total_is_estimate,
+            page=None if cursor else page,
+            per_page=per_page,
+            next_cursor=result_page.next_cursor
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Failed to list recordings: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -282,7 +283,8 @@ async def list_recordings(
 async def complete_recording_upload(
     recording_id: str,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    scope: ClinicScope = Depends(get_clinic_scope)
 ):
     """録音アップロード完了通知"""
     try:
@@ -296,14 +298,9 @@ async def complete_recording_upload(
             raise HTTPException(status_code=404, detail="Recording not found")
 
         # 権限チェック
-        customer = db.query(Customer).filter(
-            Customer.id == recording.customer_id
-        ).first()
-        if (current_user.role == "counselor" and
-                customer.clinic_id != current_user.clinic_id):
-            raise HTTPException(status_code=403, detail="Access denied")
+        scope.require_one("recording", recording.id)
         
-        storage_service = S3StorageService()
+        storage_service = get_storage_service()
         
         # ファイル存在確認
         if not await storage_service.file_exists(recording.file_path):
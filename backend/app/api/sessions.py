@@ -1,13 +1,15 @@
-from typing import Any, List
+from typing import Any, List, Optional
 from uuid import uuid4
 
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, Response, status, UploadFile, File
 from sqlalchemy.orm import Session
 from sqlalchemy import and_
 
 from app.api import deps
+from app.core.pagination import InvalidCursorError, paginate
 from app.models.user import User
 from app.models.session import Session as SessionModel
+from app.services.rollup_service import RollupService
 from app.schemas.session import (
     Session as SessionSchema,
     SessionCreate,
@@ -21,13 +23,18 @@ router = APIRouter()
 
 @router.get("/", response_model=List[SessionWithRelations])
 def read_sessions(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     db: Session = Depends(deps.get_db),
     current_user: User = Depends(deps.get_current_active_user),
 ) -> Any:
     """
     Retrieve sessions based on user role and permissions
+
+    Sessions are returned newest first. Pass the X-Next-Cursor response header
+    back as `cursor` to fetch the next page without OFFSET (skip is then ignored).
     """
     query = db.query(SessionModel)
     
@@ -41,8 +48,13 @@ def read_sessions(
         )
     # Admins can see all sessions (no additional filter)
     
-    sessions = query.offset(skip).limit(limit).all()
-    return sessions
+    try:
+        page = paginate(query, SessionModel, limit, cursor=cursor, offset=skip, exact_total=False)
+    except InvalidCursorError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    if page.next_cursor:
+        response.headers["X-Next-Cursor"] = page.next_cursor
+    return page.items
 
 
 @router.post("/", response_model=SessionSchema)
@@ -77,6 +89,7 @@ def create_session(
         status="recorded"
     )
     db.add(session)
+    RollupService(db).refresh_sessions(session)
     db.commit()
     db.refresh(session)
     return session
@@ -148,6 +161,7 @@ def update_session(
         setattr(session, field, value)
     
     db.add(session)
+    RollupService(db).refresh_sessions(session)
     db.commit()
     db.refresh(session)
     return session
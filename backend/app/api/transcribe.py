@@ -1,14 +1,20 @@
 """
 Transcription API endpoints
 """
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket, status
 from sqlalchemy.orm import Session
 from typing import List, Optional
+import asyncio
+import json
+import os
 import uuid
 import logging
 from datetime import datetime, timedelta
 
-from app.api.deps import get_db, get_current_user
+from app.api.deps import get_db, get_current_user, get_clinic_scope, get_user_from_token
+from app.core.database import get_background_session
+from app.core.pagination import InvalidCursorError, paginate
+from app.core.job_queue import get_job_queue, is_retryable_error, job_handler
 from app.schemas.transcription import (
     TranscriptionRequest, TranscriptionResponse, TranscriptionStatusResponse,
     TranscriptionRetryRequest, TranscriptionList, TranscriptionStats
@@ -18,28 +24,44 @@ from app.models.transcription import TranscriptionTask
 from app.models.recording import Recording
 from app.models.session import Session as SessionModel, SessionStatus
 from app.models.customer import Customer
+from app.services.access_scope import ClinicScope
 from app.services.transcribe_service import TranscriptionService
+from app.services.storage_service import get_storage_service
+from app.services.streaming_transcription import StreamingTranscriber
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+async def transcription_attempts_exhausted(task_id: str, **kwargs):
+    """再試行上限に達したジョブのタスクを失敗として記録"""
+    db = get_background_session()
+    
+    try:
+        task = db.query(TranscriptionTask).filter(
+            TranscriptionTask.task_id == task_id
+        ).first()
+        
+        if task and not task.is_completed and not task.is_failed:
+            message = "Job attempts exhausted"
+            if task.error_message:
+                message = f"{message}: {task.error_message}"
+            task.fail_processing(message, "JOB_ATTEMPTS_EXHAUSTED")
+            db.commit()
+    finally:
+        db.close()
+
+@job_handler("transcription", on_exhausted=transcription_attempts_exhausted)
 async def transcription_background_task(
     task_id: str,
     recording_id: str,
     file_path: str,
     language: str,
-    temperature: float,
-    db_url: str
+    temperature: float
 ):
     """バックグラウンド文字起こしタスク"""
-    # 新しいデータベースセッションを作成
-    from sqlalchemy import create_engine
-    from sqlalchemy.orm import sessionmaker
-    
-    engine = create_engine(db_url)
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    db = SessionLocal()
+    # 共有プールからデータベースセッションを取得
+    db = get_background_session()
     
     try:
         # タスク取得
@@ -51,6 +73,11 @@ async def transcription_background_task(
             logger.error(f"Task not found: {task_id}")
             return
         
+        # 再配信されたジョブは完了済みならスキップ
+        if task.is_completed:
+            logger.info(f"Transcription task already completed: {task_id}")
+            return
+        
         # 処理開始
         task.start_processing()
         db.commit()
@@ -84,10 +111,18 @@ async def transcription_background_task(
         logger.error(f"Transcription task failed: {task_id} - {e}")
         
         # エラーを記録
+        db.rollback()
         task = db.query(TranscriptionTask).filter(
             TranscriptionTask.task_id == task_id
         ).first()
         
+        # 一時的なエラーはジョブキューで再試行（上限到達時は on_exhausted で失敗にする）
+        if is_retryable_error(e):
+            if task:
+                task.wait_for_retry(str(e), "TRANSCRIPTION_RETRYING")
+                db.commit()
+            raise
+        
         if task:
             task.fail_processing(str(e), "TRANSCRIPTION_ERROR")
             db.commit()
@@ -98,9 +133,9 @@ async def transcription_background_task(
 @router.post("/", response_model=TranscriptionResponse)
 async def start_transcription(
     request: TranscriptionRequest,
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    scope: ClinicScope = Depends(get_clinic_scope)
 ):
     """文字起こし開始"""
     try:
@@ -114,9 +149,7 @@ async def start_transcription(
             raise HTTPException(status_code=404, detail="Recording not found")
         
         # 権限チェック
-        customer = db.query(Customer).filter(Customer.id == recording.customer_id).first()
-        if current_user.role == "counselor" and customer.clinic_id != current_user.clinic_id:
-            raise HTTPException(status_code=403, detail="Access denied")
+        scope.require_one("recording", recording.id)
         
         # アップロード完了チェック
         if recording.upload_status != "completed":
@@ -179,16 +212,14 @@ async def start_transcription(
         db.add(task)
         db.commit()
         
-        # バックグラウンドタスク開始
-        from app.core.config import settings
-        background_tasks.add_task(
+        # ジョブキューに投入
+        await get_job_queue().add_task(
             transcription_background_task,
             task_id=task_id,
             recording_id=str(request.recording_id),
             file_path=recording.file_path,
             language=request.language,
-            temperature=request.temperature,
-            db_url=str(settings.DATABASE_URL)
+            temperature=request.temperature
         )
         
         logger.info(f"Started transcription task: {task_id}")
@@ -205,11 +236,257 @@ async def start_transcription(
         logger.error(f"Failed to start transcription: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+def _create_streaming_task(
+    token: str,
+    recording_id: str,
+    language: str,
+    temperature: float
+) -> tuple:
+    """ストリーミング文字起こし用のセッション・タスクを作成"""
+    db = get_background_session()
+    
+    try:
+        current_user = get_user_from_token(db, token)
+        
+        recording = db.query(Recording).filter(
+            Recording.id == recording_id,
+            Recording.is_deleted == False
+        ).first()
+        
+        if not recording:
+            raise HTTPException(status_code=404, detail="Recording not found")
+        
+        # 権限チェック
+        ClinicScope(db, current_user).require_one("recording", recording.id)
+        
+        if recording.upload_status == "completed":
+            raise HTTPException(status_code=400, detail="Recording already uploaded")
+        
+        session = db.query(SessionModel).filter(
+            SessionModel.customer_id == recording.customer_id,
+            SessionModel.audio_file_path == recording.file_path
+        ).first()
+        
+        if not session:
+            session = SessionModel(
+                customer_id=recording.customer_id,
+                counselor_id=current_user.id,
+                audio_file_path=recording.file_path,
+                session_date=datetime.utcnow(),
+                status=SessionStatus.TRANSCRIBING
+            )
+            db.add(session)
+            db.flush()  # IDを取得
+        else:
+            session.update_status(SessionStatus.TRANSCRIBING)
+        
+        recording.session_id = session.id
+        recording.upload_status = "uploading"
+        
+        task = TranscriptionTask(
+            recording_id=recording.id,
+            session_id=session.id,
+            task_id=str(uuid.uuid4()),
+            language=language,
+            temperature=temperature
+        )
+        task.start_processing()
+        db.add(task)
+        db.commit()
+        
+        return task.task_id, recording.file_path, recording.content_type
+        
+    finally:
+        db.close()
+
+def _save_streaming_progress(task_id: str, transcriber: StreamingTranscriber, final: bool = False) -> None:
+    """文字起こしの途中経過（確定時は完了）を保存"""
+    result = transcriber.result()
+    db = get_background_session()
+    
+    try:
+        task = db.query(TranscriptionTask).filter(
+            TranscriptionTask.task_id == task_id
+        ).first()
+        
+        if not task:
+            return
+        
+        values = dict(
+            transcription_text=result.text,
+            transcription_result={**result.model_dump(), "is_partial": not final},
+            confidence=result.confidence,
+            detected_language=result.language,
+            duration=result.duration
+        )
+        
+        if not final:
+            task.update_partial_result(**values)
+            db.commit()
+            return
+        
+        task.complete_processing(**values)
+        
+        # 録音ファイルとセッションを確定
+        recording = db.query(Recording).filter(Recording.id == task.recording_id).first()
+        if recording:
+            recording.file_size = transcriber.bytes_received
+            recording.upload_status = "completed"
+            recording.uploaded_at = datetime.utcnow()
+        
+        if task.session_id:
+            session = db.query(SessionModel).filter(
+                SessionModel.id == task.session_id
+            ).first()
+            if session:
+                session.transcription_text = result.text
+                session.update_status(SessionStatus.TRANSCRIBED)
+        
+        db.commit()
+        
+    finally:
+        db.close()
+
+def _fail_streaming_task(task_id: str, error_message: str) -> None:
+    db = get_background_session()
+    
+    try:
+        task = db.query(TranscriptionTask).filter(
+            TranscriptionTask.task_id == task_id
+        ).first()
+        
+        if task and not task.is_completed:
+            task.fail_processing(error_message, "STREAMING_ERROR")
+            db.commit()
+    finally:
+        db.close()
+
+@router.websocket("/stream/{recording_id}")
+async def stream_transcription(
+    websocket: WebSocket,
+    recording_id: str,
+    token: str = Query(...),
+    language: str = Query("ja"),
+    temperature: float = Query(0.0, ge=0.0, le=1.0)
+):
+    """録音中の音声をストリーミングで文字起こし
+    
+    プロトコル:
+        クライアント → バイナリ: MediaRecorder の音声チャンク（録音順）
+        クライアント → {"type": "stop"}: 録音終了（残りを確定）
+        サーバー → {"type": "started" | "partial" | "completed" | "error", ...}
+    
+    確定したセグメントは TranscriptionTask.transcription_result に逐次保存され、
+    録音終了時は最後のウィンドウのみ処理すればよいため数秒で完了する。
+    """
+    try:
+        task_id, file_path, content_type = await asyncio.to_thread(
+            _create_streaming_task, token, recording_id, language, temperature
+        )
+    except HTTPException as e:
+        logger.warning(f"Streaming transcription rejected for recording {recording_id}: {e.detail}")
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    except Exception as e:
+        logger.error(f"Failed to start streaming transcription: {e}")
+        await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+        return
+    
+    await websocket.accept()
+    transcriber = StreamingTranscriber(
+        task_id,
+        file_extension=os.path.splitext(file_path)[1] or ".webm",
+        language=language,
+        temperature=temperature
+    )
+    connected = True
+    
+    async def send(message: dict) -> None:
+        nonlocal connected
+        if not connected:
+            return
+        try:
+            await websocket.send_json(message)
+        except Exception:
+            connected = False
+    
+    async def process(final: bool = False) -> None:
+        segments = await transcriber.process(final=final)
+        if segments or final:
+            await asyncio.to_thread(_save_streaming_progress, task_id, transcriber, final)
+        if segments:
+            await send({
+                "type": "partial",
+                "task_id": task_id,
+                "segments": [segment.model_dump() for segment in segments],
+                "committed_until": transcriber.committed_until
+            })
+    
+    async def process_safely() -> None:
+        # 途中のウィンドウが失敗しても次のチャンク受信時に同じ位置から再試行する
+        try:
+            await process()
+        except Exception as e:
+            logger.warning(f"Streaming window failed for {task_id}: {e}")
+    
+    await send({"type": "started", "task_id": task_id})
+    pending = None
+    
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                # 切断時も受信済みの音声で確定する
+                connected = False
+                break
+            
+            if message.get("bytes"):
+                await transcriber.append(message["bytes"])
+                if pending is None or pending.done():
+                    pending = asyncio.create_task(process_safely())
+            elif message.get("text"):
+                try:
+                    command = json.loads(message["text"])
+                except ValueError:
+                    continue
+                if command.get("type") == "stop":
+                    break
+        
+        if pending:
+            await pending
+        
+        # 録音全体をストレージへ保存してから確定
+        if transcriber.bytes_received:
+            await get_storage_service().upload_file(transcriber.spool_path, file_path, content_type)
+        await process(final=True)
+        
+        result = transcriber.result()
+        await send({
+            "type": "completed",
+            "task_id": task_id,
+            "text": result.text,
+            "confidence": result.confidence,
+            "duration": result.duration
+        })
+        logger.info(f"Streaming transcription completed: {task_id}")
+        
+    except Exception as e:
+        logger.error(f"Streaming transcription failed: {task_id} - {e}")
+        await asyncio.to_thread(_fail_streaming_task, task_id, str(e))
+        await send({"type": "error", "task_id": task_id, "detail": "Streaming transcription failed"})
+    
+    finally:
+        if pending and not pending.done():
+            pending.cancel()
+        transcriber.cleanup()
+        if connected:
+            await websocket.close()
+
 @router.get("/status/{task_id}", response_model=TranscriptionStatusResponse)
 async def get_transcription_status(
     task_id: str,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    scope: ClinicScope = Depends(get_clinic_scope)
 ):
     """文字起こし状況取得"""
     try:
@@ -223,15 +500,12 @@ async def get_transcription_status(
             raise HTTPException(status_code=404, detail="Task not found")
         
         # 権限チェック
-        recording = db.query(Recording).filter(Recording.id == task.recording_id).first()
-        customer = db.query(Customer).filter(Customer.id == recording.customer_id).first()
-        
-        if current_user.role == "counselor" and customer.clinic_id != current_user.clinic_id:
-            raise HTTPException(status_code=403, detail="Access denied")
+        scope.require_one("transcription", task.id)
         
         # 結果作成
         result = None
-        if task.is_completed and task.transcription_result:
+        # ストリーミング中は途中経過を返す
+        if task.transcription_result:
             from app.schemas.transcription import TranscriptionResult
             result = TranscriptionResult(**task.transcription_result)
         
@@ -257,7 +531,7 @@ async def get_transcription_status(
 async def get_transcription_result(
     task_id: str,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    scope: ClinicScope = Depends(get_clinic_scope)
 ):
     """文字起こし結果取得"""
     try:
@@ -275,11 +549,7 @@ async def get_transcription_result(
             raise HTTPException(status_code=400, detail="Transcription not completed yet")
         
         # 権限チェック
-        recording = db.query(Recording).filter(Recording.id == task.recording_id).first()
-        customer = db.query(Customer).filter(Customer.id == recording.customer_id).first()
-        
-        if current_user.role == "counselor" and customer.clinic_id != current_user.clinic_id:
-            raise HTTPException(status_code=403, detail="Access denied")
+        scope.require_one("transcription", task.id)
         
         return {
             "task_id": task.task_id,
@@ -299,9 +569,9 @@ async def get_transcription_result(
 @router.post("/retry/{task_id}")
 async def retry_transcription(
     task_id: str,
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    scope: ClinicScope = Depends(get_clinic_scope)
 ):
     """文字起こし再試行"""
     try:
@@ -322,26 +592,21 @@ async def retry_transcription(
         if current_user.role not in ["admin", "manager"]:
             raise HTTPException(status_code=403, detail="Permission denied")
         
+        scope.require_one("transcription", task.id, roles=("manager",))
         recording = db.query(Recording).filter(Recording.id == task.recording_id).first()
-        customer = db.query(Customer).filter(Customer.id == recording.customer_id).first()
-        
-        if current_user.role == "manager" and customer.clinic_id != current_user.clinic_id:
-            raise HTTPException(status_code=403, detail="Access denied")
         
         # 再試行開始
         task.retry_processing()
         db.commit()
         
-        # バックグラウンドタスク開始
-        from app.core.config import settings
-        background_tasks.add_task(
+        # ジョブキューに投入
+        await get_job_queue().add_task(
             transcription_background_task,
             task_id=task.task_id,
             recording_id=str(task.recording_id),
             file_path=recording.file_path,
             language=task.language,
-            temperature=task.temperature,
-            db_url=str(settings.DATABASE_URL)
+            temperature=task.temperature
         )
         
         logger.info(f"Retrying transcription task: {task_id}")
@@ -360,6 +625,8 @@ async def list_transcription_tasks(
     status: Optional[str] = Query(None, description="Filter by status"),
     page: int = Query(1, ge=1, description="Page number"),
     per_page: int = Query(10, ge=1, le=100, description="Items per page"),
+    cursor: Optional[str] = Query(None, description="Cursor from next_cursor (overrides page)"),
+    include_total: bool = Query(False, description="Estimate the total when paging by cursor"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
@@ -386,17 +653,19 @@ async def list_transcription_tasks(
                 Customer.clinic_id == current_user.clinic_id
             )
         
-        # 総数取得
-        total = query.count()
-        
-        # ページング
-        offset = (page - 1) * per_page
-        tasks = query.order_by(TranscriptionTask.created_at.desc()).offset(offset).limit(per_page).all()
+        # ページング（カーソル指定時はキーセット）
+        try:
+            result_page = paginate(
+                query, TranscriptionTask, per_page,
+                page=page, cursor=cursor, include_total=include_total
+            )
+        except InvalidCursorError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
         
         # レスポンス変換
         from app.schemas.transcription import TranscriptionTask as TranscriptionTaskSchema
         task_list = []
-        for task in tasks:
+        for task in result_page.items:
             result = None
             if task.is_completed and task.transcription_result:
                 from app.schemas.transcription import TranscriptionResult
@@ -416,11 +685,15 @@ async def list_transcription_tasks(
         
         return TranscriptionList(
             tasks=task_list,
-            total=total,
-            page=page,
-            per_page=per_page
+            total=result_page.total,
+            total_is_estimate=result_page.total_is_estimate,
+            page=None if cursor else page,
+            per_page=per_page,
+            next_cursor=result_page.next_cursor
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Failed to list transcription tasks: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
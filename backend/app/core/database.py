@@ -1,26 +1,83 @@
 """
 Database configuration and session management
 """
+import threading
+import time
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
-from typing import Generator
+from sqlalchemy.pool import QueuePool
+from typing import Dict, Generator, Optional
 
 from app.core.config import settings
 
 
-# Create SQLAlchemy engine
-engine = create_engine(
-    settings.DATABASE_URL,
-    pool_pre_ping=True,
-    pool_recycle=300,
-    pool_size=10,
-    max_overflow=20
-)
+class MeteredQueuePool(QueuePool):
+    """QueuePool that records how long callers wait for a connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._metrics_lock = threading.Lock()
+        self.wait_count = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.timeouts = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            with self._metrics_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._metrics_lock:
+                self.wait_count += 1
+                self.wait_time_total += waited
+                self.wait_time_max = max(self.wait_time_max, waited)
+
+    def metrics(self) -> Dict[str, float]:
+        with self._metrics_lock:
+            return {
+                "size": self.size(),
+                "checked_out": self.checkedout(),
+                "checked_in": self.checkedin(),
+                "overflow": max(self.overflow(), 0),
+                "max_overflow": self._max_overflow,
+                "wait_count": self.wait_count,
+                "wait_time_total": round(self.wait_time_total, 6),
+                "wait_time_avg": round(self.wait_time_total / self.wait_count, 6) if self.wait_count else 0.0,
+                "wait_time_max": round(self.wait_time_max, 6),
+                "timeouts": self.timeouts,
+            }
+
+
+def _create_engine(pool_size: int, max_overflow: int) -> Engine:
+    return create_engine(
+        settings.DATABASE_URL,
+        poolclass=MeteredQueuePool,
+        pool_pre_ping=True,
+        pool_recycle=300,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=settings.DB_POOL_TIMEOUT
+    )
+
+
+# Create SQLAlchemy engine (API requests)
+engine = _create_engine(settings.DB_POOL_SIZE, settings.DB_MAX_OVERFLOW)
 
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Background jobs get their own bounded pool so a batch cannot starve API requests
+_background_engine: Optional[Engine] = None
+_background_session_factory: Optional[sessionmaker] = None
+_background_lock = threading.Lock()
+
 # Create Base class for models
 Base = declarative_base()
 
@@ -36,6 +93,56 @@ def get_db() -> Generator[Session, None, None]:
         db.close()
 
 
+def get_background_engine() -> Engine:
+    """
+    Process-wide engine for background jobs (created on first use)
+    """
+    global _background_engine, _background_session_factory
+    if _background_engine is None:
+        with _background_lock:
+            if _background_engine is None:
+                _background_engine = _create_engine(
+                    settings.DB_BACKGROUND_POOL_SIZE,
+                    settings.DB_BACKGROUND_MAX_OVERFLOW
+                )
+                _background_session_factory = sessionmaker(
+                    autocommit=False, autoflush=False, bind=_background_engine
+                )
+    return _background_engine
+
+
+def get_background_session() -> Session:
+    """
+    Session for background jobs borrowed from the shared background pool.
+    The caller must close it so the connection returns to the pool.
+    """
+    get_background_engine()
+    return _background_session_factory()
+
+
+def get_pool_metrics() -> Dict[str, Dict[str, float]]:
+    """
+    Connection pool metrics for each engine in this process
+    """
+    metrics = {"api": engine.pool.metrics()}
+    if _background_engine is not None:
+        metrics["background"] = _background_engine.pool.metrics()
+    return metrics
+
+
+def dispose_engines() -> None:
+    """
+    Close pooled connections (call at process shutdown)
+    """
+    global _background_engine, _background_session_factory
+    engine.dispose()
+    with _background_lock:
+        if _background_engine is not None:
+            _background_engine.dispose()
+            _background_engine = None
+            _background_session_factory = None
+
+
 def create_tables():
     """
     Create all tables
@@ -47,4 +154,4 @@ def drop_tables():
     """
     Drop all tables (for testing)
     """
-    Base.metadata.drop_all(bind=engine)
\ No newline at end of file
+    Base.metadata.drop_all(bind=engine)
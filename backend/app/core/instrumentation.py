@@ -0,0 +1,362 @@
+"""
+Request instrumentation
+
+Database queries (SQLAlchemy cursor events), S3 calls (botocore events) and
+LLM calls (LLMGateway) are recorded into a per-request RequestStats held in a
+context variable, and into process-wide Prometheus-style metrics. The HTTP
+middleware in app.main turns the request stats into a Server-Timing header and
+an optional slow-request log, and /metrics renders the registry.
+
+Metrics are per process; with several uvicorn workers each one is scraped
+separately. /metrics is off by default outside dev and then needs
+METRICS_ENABLED plus a METRICS_TOKEN bearer token (see app.main).
+"""
+import bisect
+import logging
+import re
+import threading
+import time
+from contextvars import ContextVar, Token
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[Tuple[str, Tuple[Tuple[str, str], ...], float]]:
+        with self._lock:
+            return [(self.name, tuple(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+
+
+class Histogram:
+    """Cumulative histogram with labels"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            counts[index] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def samples(self) -> List[Tuple[str, Tuple[Tuple[str, str], ...], float]]:
+        samples = []
+        with self._lock:
+            for key, counts in self._counts.items():
+                labels = tuple(zip(self.labelnames, key))
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    samples.append((f"{self.name}_bucket", labels + (("le", le),), cumulative))
+                samples.append((f"{self.name}_sum", labels, self._sums[key]))
+                samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """Process-wide metrics rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Callable[[], List[Tuple[str, str, Dict[str, str], float]]]] = []
+
+    def counter(self, name: str, description: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, description, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, description: str, labelnames: Sequence[str] = (), **kwargs) -> Histogram:
+        metric = Histogram(name, description, labelnames, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], List[Tuple[str, str, Dict[str, str], float]]]) -> None:
+        """Register a callback returning (name, help, labels, value) gauges computed at scrape time"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        described = set()
+        for collector in self._collectors:
+            try:
+                gauges = collector()
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+                continue
+            for name, description, labels, value in gauges:
+                if name not in described:
+                    described.add(name)
+                    lines.append(f"# HELP {name} {description}")
+                    lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name}{_format_labels(tuple(labels.items()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "http_requests_total", "HTTP requests", ("method", "route", "status")
+)
+HTTP_DURATION = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request latency", ("method", "route")
+)
+HTTP_DB_QUERIES = REGISTRY.counter(
+    "http_request_db_queries_total", "Database queries issued while serving requests", ("route",)
+)
+HTTP_DB_SECONDS = REGISTRY.counter(
+    "http_request_db_seconds_total", "Database time spent while serving requests", ("route",)
+)
+HTTP_S3_CALLS = REGISTRY.counter(
+    "http_request_s3_calls_total", "S3 calls made while serving requests", ("route",)
+)
+HTTP_S3_SECONDS = REGISTRY.counter(
+    "http_request_s3_seconds_total", "S3 time spent while serving requests", ("route",)
+)
+HTTP_LLM_CALLS = REGISTRY.counter(
+    "http_request_llm_calls_total", "LLM calls made while serving requests", ("route",)
+)
+HTTP_LLM_SECONDS = REGISTRY.counter(
+    "http_request_llm_seconds_total", "LLM time spent while serving requests", ("route",)
+)
+S3_CALLS = REGISTRY.counter("s3_calls_total", "S3 API calls", ("operation",))
+S3_SECONDS = REGISTRY.counter("s3_call_seconds_total", "Time spent in S3 API calls", ("operation",))
+S3_ERRORS = REGISTRY.counter("s3_call_errors_total", "Failed S3 API calls", ("operation",))
+LLM_CALLS = REGISTRY.counter("llm_calls_total", "LLM API calls (including retried attempts)", ("model",))
+LLM_SECONDS = REGISTRY.counter("llm_call_seconds_total", "Time spent in LLM API calls", ("model",))
+LLM_TOKENS = REGISTRY.counter("llm_tokens_total", "LLM tokens used", ("model",))
+LLM_CACHED_TOKENS = REGISTRY.counter(
+    "llm_cached_prompt_tokens_total", "Prompt tokens served from the provider's prompt cache", ("model",)
+)
+
+
+class RequestStats:
+    """Counters for a single request (shared with the threads and tasks it spawns)"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_count = 0
+        self.db_time = 0.0
+        self.s3_count = 0
+        self.s3_time = 0.0
+        self.llm_count = 0
+        self.llm_time = 0.0
+        self.llm_tokens = 0
+        self.statements: Dict[str, List[float]] = {}  # statement -> [count, seconds]
+        self._lock = threading.Lock()
+
+    def add_query(self, statement: str, seconds: float) -> None:
+        with self._lock:
+            self.db_count += 1
+            self.db_time += seconds
+            entry = self.statements.setdefault(statement, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def add_s3(self, seconds: float) -> None:
+        with self._lock:
+            self.s3_count += 1
+            self.s3_time += seconds
+
+    def add_llm(self, seconds: float) -> None:
+        with self._lock:
+            self.llm_count += 1
+            self.llm_time += seconds
+
+    def add_llm_tokens(self, tokens: int) -> None:
+        with self._lock:
+            self.llm_tokens += tokens
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def top_statements(self, limit: int) -> List[Tuple[str, int, float]]:
+        """Statements ordered by total time (statement, count, seconds)"""
+        with self._lock:
+            ranked = sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True)
+        return [(statement, int(count), seconds) for statement, (count, seconds) in ranked[:limit]]
+
+    def server_timing(self) -> str:
+        """Server-Timing header value (durations in milliseconds)"""
+        return ", ".join([
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.db_count} queries"',
+            f's3;dur={self.s3_time * 1000:.1f};desc="{self.s3_count} calls"',
+            f'llm;dur={self.llm_time * 1000:.1f};desc="{self.llm_count} calls, {self.llm_tokens} tokens"',
+            f"total;dur={self.elapsed * 1000:.1f}",
+        ])
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def start_request() -> Tuple[RequestStats, Token]:
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def finish_request(stats: RequestStats, token: Token, method: str, route: str, status_code: int) -> None:
+    """Reset the context and add the request to the process-wide metrics"""
+    _current.reset(token)
+    HTTP_REQUESTS.inc(method=method, route=route, status=status_code)
+    HTTP_DURATION.observe(stats.elapsed, method=method, route=route)
+    HTTP_DB_QUERIES.inc(stats.db_count, route=route)
+    HTTP_DB_SECONDS.inc(stats.db_time, route=route)
+    HTTP_S3_CALLS.inc(stats.s3_count, route=route)
+    HTTP_S3_SECONDS.inc(stats.s3_time, route=route)
+    HTTP_LLM_CALLS.inc(stats.llm_count, route=route)
+    HTTP_LLM_SECONDS.inc(stats.llm_time, route=route)
+
+
+def current_stats() -> Optional[RequestStats]:
+    return _current.get()
+
+
+def record_s3_call(operation: str, seconds: float, failed: bool = False) -> None:
+    S3_CALLS.inc(operation=operation)
+    S3_SECONDS.inc(seconds, operation=operation)
+    if failed:
+        S3_ERRORS.inc(operation=operation)
+    stats = _current.get()
+    if stats is not None:
+        stats.add_s3(seconds)
+
+
+def record_llm_call(model: str, seconds: float) -> None:
+    LLM_CALLS.inc(model=model)
+    LLM_SECONDS.inc(seconds, model=model)
+    stats = _current.get()
+    if stats is not None:
+        stats.add_llm(seconds)
+
+
+def record_llm_tokens(model: str, tokens: int, cached_tokens: int = 0) -> None:
+    LLM_TOKENS.inc(tokens, model=model)
+    if cached_tokens:
+        LLM_CACHED_TOKENS.inc(cached_tokens, model=model)
+    stats = _current.get()
+    if stats is not None:
+        stats.add_llm_tokens(tokens)
+
+
+def normalize_statement(statement: str, limit: int = 300) -> str:
+    """Collapse whitespace so the slow-request log stays on one line"""
+    statement = re.sub(r"\s+", " ", statement).strip()
+    return statement if len(statement) <= limit else statement[:limit] + "..."
+
+
+_hooks_installed = False
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    started = conn.info.get("query_started")
+    if stats is not None and started:
+        stats.add_query(statement, time.perf_counter() - started.pop())
+
+
+def _handle_error(exception_context):
+    started = exception_context.connection.info.get("query_started") if exception_context.connection else None
+    if started:
+        started.pop()
+
+
+def install_query_hooks() -> None:
+    """Count and time SQL statements on every engine (only inside an instrumented request)"""
+    global _hooks_installed
+    if _hooks_installed:
+        return
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(Engine, "handle_error", _handle_error)
+    _hooks_installed = True
+
+
+def _s3_before_call(model, context, **kwargs):
+    context["instrumentation"] = (model.name, time.perf_counter())
+
+
+def _s3_after_call(context, http_response=None, **kwargs):
+    started = context.pop("instrumentation", None)
+    if started is None:
+        return
+    operation, started_at = started
+    status_code = getattr(http_response, "status_code", 200)
+    record_s3_call(operation, time.perf_counter() - started_at, failed=status_code >= 400)
+
+
+def _s3_after_call_error(context, **kwargs):
+    started = context.pop("instrumentation", None)
+    if started is not None:
+        operation, started_at = started
+        record_s3_call(operation, time.perf_counter() - started_at, failed=True)
+
+
+def instrument_s3_client(client) -> None:
+    """Record every API call made through the S3 client (retries count as one call)"""
+    client.meta.events.register("before-call.s3", _s3_before_call)
+    client.meta.events.register("after-call.s3", _s3_after_call)
+    client.meta.events.register("after-call-error.s3", _s3_after_call_error)
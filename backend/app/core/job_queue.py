@@ -0,0 +1,544 @@
+"""
+Durable job queue for background processing
+
+Jobs are serialized to JSON and pushed to a broker. A worker reserves a job
+under a visibility timeout (lease); a job that is not acknowledged before its
+lease expires is handed out again, so delivery is at-least-once and job
+handlers must be idempotent.
+
+A handler that raises is released back to the queue with a growing delay
+until JOB_MAX_ATTEMPTS, then dead-lettered. Handlers re-raise transient
+errors (is_retryable_error) to get those retries and record permanent
+errors themselves before returning normally.
+
+Jobs are pushed to a lane. Workers always drain the interactive lane before
+the batch lane, so bulk work never delays a user waiting on a single job.
+
+Two brokers are provided:
+- RedisJobBroker: shared between API processes and worker processes
+- InMemoryJobBroker: in-process stand-in for development and tests
+"""
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field, asdict
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+JobHandler = Callable[..., Awaitable[None]]
+
+# Lanes in the order workers reserve from them
+LANE_INTERACTIVE = "interactive"
+LANE_BATCH = "batch"
+JOB_LANES = (LANE_INTERACTIVE, LANE_BATCH)
+
+# Registered job handlers (name -> coroutine function)
+_handlers: Dict[str, JobHandler] = {}
+# Called once a job has used up all of its delivery attempts
+_exhausted_callbacks: Dict[str, JobHandler] = {}
+
+
+def job_handler(name: str, on_exhausted: Optional[JobHandler] = None):
+    """Register a coroutine function as a job handler.
+
+    Args:
+        name: Job name stored in the queue payload
+        on_exhausted: Coroutine called with the job kwargs when the job is
+            dead-lettered after JOB_MAX_ATTEMPTS deliveries
+    """
+    def decorator(func: JobHandler) -> JobHandler:
+        _handlers[name] = func
+        if on_exhausted:
+            _exhausted_callbacks[name] = on_exhausted
+        func.job_name = name
+        return func
+    return decorator
+
+
+def get_job_handler(name: str) -> JobHandler:
+    """Look up a registered job handler"""
+    if name not in _handlers:
+        raise KeyError(f"Unknown job: {name}")
+    return _handlers[name]
+
+
+# S3 error codes that mean "try again later"
+RETRYABLE_S3_ERROR_CODES = {
+    "RequestTimeout", "SlowDown", "Throttling", "ThrottlingException",
+    "RequestLimitExceeded", "ServiceUnavailable", "InternalError",
+}
+
+
+@lru_cache(maxsize=1)
+def _transient_error_types() -> tuple:
+    """Exception classes of the client libraries that signal a transient failure"""
+    types = [ConnectionError, TimeoutError]
+    try:
+        import openai
+        types += [openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError]
+    except ImportError:
+        pass
+    try:
+        import httpx
+        types.append(httpx.TransportError)
+    except ImportError:
+        pass
+    try:
+        from botocore import exceptions as botocore_exceptions
+        types += [botocore_exceptions.ConnectionError, botocore_exceptions.HTTPClientError]
+    except ImportError:
+        pass
+    try:
+        from sqlalchemy import exc as sqlalchemy_exceptions
+        types += [sqlalchemy_exceptions.OperationalError, sqlalchemy_exceptions.DisconnectionError]
+    except ImportError:
+        pass
+    return tuple(types)
+
+
+def _is_transient(error: BaseException) -> bool:
+    if isinstance(error, _transient_error_types()):
+        return True
+    # botocore ClientError: 5xx or throttling
+    response = getattr(error, "response", None)
+    if type(error).__name__ == "ClientError" and isinstance(response, dict):
+        status = response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+        code = response.get("Error", {}).get("Code")
+        return status >= 500 or code in RETRYABLE_S3_ERROR_CODES
+    return False
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """Whether a failed job should go back to the queue instead of failing for good
+
+    Network errors, timeouts, rate limits (once the LLM gateway has given up
+    its own retries), 5xx responses and dropped DB connections are retried.
+    Everything else (validation, token budget, bad input) is permanent.
+    Services often re-raise as Exception(f"...: {e}"), so the whole
+    __cause__ / __context__ chain is inspected.
+    """
+    seen = set()
+    current = error
+    while current is not None and id(current) not in seen:
+        seen.add(id(current))
+        if _is_transient(current):
+            return True
+        current = current.__cause__ or current.__context__
+    return False
+
+
+@dataclass
+class Job:
+    """Queued unit of work"""
+    name: str
+    kwargs: Dict[str, Any]
+    job_id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    enqueued_at: float = field(default_factory=time.time)
+    lane: str = LANE_INTERACTIVE
+    attempts: int = 0
+
+    def dumps(self) -> str:
+        payload = asdict(self)
+        payload.pop("attempts")
+        return json.dumps(payload, default=str)
+
+    @classmethod
+    def loads(cls, raw: str, attempts: int = 0) -> "Job":
+        payload = json.loads(raw)
+        return cls(attempts=attempts, **payload)
+
+
+class JobBroker:
+    """Broker interface"""
+
+    async def push(self, job: Job) -> None:
+        raise NotImplementedError
+
+    async def reserve(self, timeout: float = 1.0) -> Optional[Job]:
+        """Take the next job and lease it for the visibility timeout"""
+        raise NotImplementedError
+
+    async def touch(self, job: Job) -> None:
+        """Extend the lease of a job that is still being processed"""
+        raise NotImplementedError
+
+    async def ack(self, job: Job) -> None:
+        """Remove a finished job"""
+        raise NotImplementedError
+
+    async def release(self, job: Job, delay: float = 0.0) -> None:
+        """Put a job back so it is delivered again after delay seconds"""
+        raise NotImplementedError
+
+    async def dead_letter(self, job: Job, reason: str) -> None:
+        """Move a job out of the queue after its attempts are exhausted"""
+        raise NotImplementedError
+
+    async def requeue_expired(self) -> int:
+        """Requeue jobs whose lease or retry delay has elapsed"""
+        raise NotImplementedError
+
+    async def depth(self, lane: str = None) -> int:
+        """Number of jobs waiting to be reserved (in one lane, or all lanes)"""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class InMemoryJobBroker(JobBroker):
+    """In-process broker with the same lease semantics as the Redis broker"""
+
+    def __init__(self, visibility_timeout: int = None):
+        self.visibility_timeout = visibility_timeout or settings.JOB_VISIBILITY_TIMEOUT
+        self._pending: Dict[str, Deque[str]] = {lane: deque() for lane in JOB_LANES}
+        self._lanes: Dict[str, str] = {}
+        self._payloads: Dict[str, str] = {}
+        self._attempts: Dict[str, int] = {}
+        self._leases: Dict[str, float] = {}
+        self._delayed: Dict[str, float] = {}
+        self.dead_letters: List[Dict[str, Any]] = []
+
+    async def push(self, job: Job) -> None:
+        self._payloads[job.job_id] = job.dumps()
+        self._attempts.setdefault(job.job_id, 0)
+        self._lanes[job.job_id] = job.lane
+        self._pending[job.lane].appendleft(job.job_id)
+
+    async def reserve(self, timeout: float = 1.0) -> Optional[Job]:
+        deadline = time.monotonic() + timeout
+        while True:
+            for lane in JOB_LANES:
+                if self._pending[lane]:
+                    job_id = self._pending[lane].pop()
+                    self._attempts[job_id] += 1
+                    self._leases[job_id] = time.time() + self.visibility_timeout
+                    return Job.loads(self._payloads[job_id], self._attempts[job_id])
+            if time.monotonic() >= deadline:
+                return None
+            await asyncio.sleep(0.05)
+
+    async def touch(self, job: Job) -> None:
+        if job.job_id in self._leases:
+            self._leases[job.job_id] = time.time() + self.visibility_timeout
+
+    async def ack(self, job: Job) -> None:
+        self._leases.pop(job.job_id, None)
+        self._payloads.pop(job.job_id, None)
+        self._attempts.pop(job.job_id, None)
+        self._lanes.pop(job.job_id, None)
+
+    async def release(self, job: Job, delay: float = 0.0) -> None:
+        self._leases.pop(job.job_id, None)
+        if delay > 0:
+            self._delayed[job.job_id] = time.time() + delay
+        else:
+            self._pending[job.lane].append(job.job_id)
+
+    async def dead_letter(self, job: Job, reason: str) -> None:
+        self.dead_letters.append({"job": asdict(job), "reason": reason})
+        await self.ack(job)
+
+    async def requeue_expired(self) -> int:
+        now = time.time()
+        due = [job_id for job_id, at in self._leases.items() if at <= now]
+        due += [job_id for job_id, at in self._delayed.items() if at <= now]
+        for job_id in due:
+            self._leases.pop(job_id, None)
+            self._delayed.pop(job_id, None)
+            self._pending[self._lanes.get(job_id, LANE_INTERACTIVE)].append(job_id)
+        return len(due)
+
+    async def depth(self, lane: str = None) -> int:
+        if lane:
+            return len(self._pending[lane])
+        return sum(len(pending) for pending in self._pending.values())
+
+
+class RedisJobBroker(JobBroker):
+    """Redis broker
+
+    Keys (prefix = JOB_QUEUE_NAME):
+        {prefix}:pending   LIST  interactive job ids waiting (LPUSH in, RPOP out)
+        {prefix}:pending:{lane}  LIST  job ids waiting in the other lanes
+        {prefix}:lanes     HASH  job id -> pending list of its lane (non-interactive only)
+        {prefix}:leases    ZSET  job id -> lease deadline
+        {prefix}:delayed   ZSET  job id -> time it becomes deliverable again
+        {prefix}:payloads  HASH  job id -> payload JSON
+        {prefix}:attempts  HASH  job id -> delivery count
+        {prefix}:dead      LIST  dead-lettered payloads
+    """
+
+    # RPOP (highest-priority lane first) and lease in one step so a crash
+    # cannot lose a job in between
+    _RESERVE_SCRIPT = """
+for i = 4, #KEYS do
+    local job_id = redis.call('RPOP', KEYS[i])
+    if job_id then
+        redis.call('ZADD', KEYS[1], ARGV[1], job_id)
+        local attempts = redis.call('HINCRBY', KEYS[3], job_id, 1)
+        local payload = redis.call('HGET', KEYS[2], job_id)
+        return {job_id, payload, attempts}
+    end
+end
+return nil
+"""
+
+    _REQUEUE_SCRIPT = """
+local moved = 0
+for i = 1, 2 do
+    local ids = redis.call('ZRANGEBYSCORE', KEYS[i], '-inf', ARGV[1])
+    for _, job_id in ipairs(ids) do
+        redis.call('ZREM', KEYS[i], job_id)
+        local pending = redis.call('HGET', KEYS[4], job_id) or KEYS[3]
+        redis.call('RPUSH', pending, job_id)
+        moved = moved + 1
+    end
+end
+return moved
+"""
+
+    def __init__(self, redis_url: str = None, queue_name: str = None, visibility_timeout: int = None):
+        import redis.asyncio as aioredis
+
+        self.redis = aioredis.from_url(redis_url or settings.REDIS_URL, decode_responses=True)
+        self.visibility_timeout = visibility_timeout or settings.JOB_VISIBILITY_TIMEOUT
+        prefix = queue_name or settings.JOB_QUEUE_NAME
+        self.pending_key = f"{prefix}:pending"
+        self.lane_keys = {
+            lane: self.pending_key if lane == LANE_INTERACTIVE else f"{prefix}:pending:{lane}"
+            for lane in JOB_LANES
+        }
+        self.lanes_key = f"{prefix}:lanes"
+        self.leases_key = f"{prefix}:leases"
+        self.delayed_key = f"{prefix}:delayed"
+        self.payloads_key = f"{prefix}:payloads"
+        self.attempts_key = f"{prefix}:attempts"
+        self.dead_key = f"{prefix}:dead"
+        self._reserve = self.redis.register_script(self._RESERVE_SCRIPT)
+        self._requeue = self.redis.register_script(self._REQUEUE_SCRIPT)
+        self.poll_interval = 0.2
+
+    async def push(self, job: Job) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self.payloads_key, job.job_id, job.dumps())
+            if job.lane != LANE_INTERACTIVE:
+                pipe.hset(self.lanes_key, job.job_id, self.lane_keys[job.lane])
+            pipe.lpush(self.lane_keys[job.lane], job.job_id)
+            await pipe.execute()
+
+    async def reserve(self, timeout: float = 1.0) -> Optional[Job]:
+        deadline = time.monotonic() + timeout
+        while True:
+            result = await self._reserve(
+                keys=[self.leases_key, self.payloads_key, self.attempts_key]
+                + [self.lane_keys[lane] for lane in JOB_LANES],
+                args=[time.time() + self.visibility_timeout]
+            )
+            if result:
+                job_id, payload, attempts = result
+                if payload is None:
+                    # ペイロードが消えたジョブは破棄
+                    await self.redis.zrem(self.leases_key, job_id)
+                    continue
+                return Job.loads(payload, int(attempts))
+            if time.monotonic() >= deadline:
+                return None
+            await asyncio.sleep(self.poll_interval)
+
+    async def touch(self, job: Job) -> None:
+        await self.redis.zadd(self.leases_key, {job.job_id: time.time() + self.visibility_timeout}, xx=True)
+
+    async def ack(self, job: Job) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zrem(self.leases_key, job.job_id)
+            pipe.hdel(self.payloads_key, job.job_id)
+            pipe.hdel(self.attempts_key, job.job_id)
+            pipe.hdel(self.lanes_key, job.job_id)
+            await pipe.execute()
+
+    async def release(self, job: Job, delay: float = 0.0) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zrem(self.leases_key, job.job_id)
+            if delay > 0:
+                pipe.zadd(self.delayed_key, {job.job_id: time.time() + delay})
+            else:
+                pipe.rpush(self.lane_keys[job.lane], job.job_id)
+            await pipe.execute()
+
+    async def dead_letter(self, job: Job, reason: str) -> None:
+        record = json.dumps({"job": asdict(job), "reason": reason, "failed_at": time.time()}, default=str)
+        await self.redis.lpush(self.dead_key, record)
+        await self.ack(job)
+
+    async def requeue_expired(self) -> int:
+        return int(await self._requeue(
+            keys=[self.leases_key, self.delayed_key, self.pending_key, self.lanes_key],
+            args=[time.time()]
+        ))
+
+    async def depth(self, lane: str = None) -> int:
+        if lane:
+            return int(await self.redis.llen(self.lane_keys[lane]))
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key in self.lane_keys.values():
+                pipe.llen(key)
+            return sum(int(length) for length in await pipe.execute())
+
+    async def close(self) -> None:
+        await self.redis.close()
+
+
+def create_broker(backend: str = None) -> JobBroker:
+    """Create a broker for the configured backend"""
+    backend = backend or settings.JOB_QUEUE_BACKEND
+    if backend == "redis":
+        return RedisJobBroker()
+    if backend == "memory":
+        return InMemoryJobBroker()
+    raise ValueError(f"Unsupported job queue backend: {backend}")
+
+
+class JobQueue:
+    """Enqueue API used by the routers"""
+
+    def __init__(self, broker: JobBroker):
+        self.broker = broker
+
+    async def add_task(self, func: JobHandler, *, lane: str = LANE_INTERACTIVE, **kwargs) -> str:
+        """Enqueue a registered handler (mirrors BackgroundTasks.add_task)"""
+        name = getattr(func, "job_name", None)
+        if name is None:
+            raise ValueError(f"{func.__name__} is not registered with @job_handler")
+        return await self.enqueue(name, lane=lane, **kwargs)
+
+    async def enqueue(self, name: str, *, lane: str = LANE_INTERACTIVE, **kwargs) -> str:
+        """Enqueue a job by name and return its job id"""
+        get_job_handler(name)
+        if lane not in JOB_LANES:
+            raise ValueError(f"Unknown job lane: {lane}")
+        job = Job(name=name, kwargs=kwargs, lane=lane)
+        await self.broker.push(job)
+        logger.info(f"Enqueued job {name} ({lane}): {job.job_id}")
+        return job.job_id
+
+
+class Worker:
+    """Consumes jobs with a fixed number of concurrent slots"""
+
+    def __init__(
+        self,
+        broker: JobBroker,
+        concurrency: int = None,
+        max_attempts: int = None,
+        retry_delay: float = None
+    ):
+        self.broker = broker
+        self.concurrency = concurrency or settings.WORKER_CONCURRENCY
+        self.max_attempts = max_attempts or settings.JOB_MAX_ATTEMPTS
+        self.retry_delay = retry_delay if retry_delay is not None else settings.JOB_RETRY_DELAY
+        self._stopping = asyncio.Event()
+
+    async def run(self) -> None:
+        """Run until stop() is called"""
+        logger.info(
+            f"Worker started: concurrency={self.concurrency}, "
+            f"visibility_timeout={getattr(self.broker, 'visibility_timeout', None)}s"
+        )
+        consumers = [asyncio.create_task(self._consume(slot)) for slot in range(self.concurrency)]
+        reaper = asyncio.create_task(self._reap())
+        try:
+            await self._stopping.wait()
+        finally:
+            # 処理中のジョブは完了まで待つ
+            await asyncio.gather(*consumers, return_exceptions=True)
+            reaper.cancel()
+            await asyncio.gather(reaper, return_exceptions=True)
+            logger.info("Worker stopped")
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    async def _consume(self, slot: int) -> None:
+        while not self._stopping.is_set():
+            try:
+                job = await self.broker.reserve(timeout=1.0)
+            except Exception as e:
+                logger.error(f"Worker slot {slot} failed to reserve job: {e}")
+                await asyncio.sleep(1.0)
+                continue
+            if job:
+                await self._execute(job)
+
+    async def _execute(self, job: Job) -> None:
+        if job.attempts > self.max_attempts:
+            await self._exhaust(job, f"attempts exhausted ({job.attempts - 1})")
+            return
+
+        try:
+            handler = get_job_handler(job.name)
+        except KeyError as e:
+            await self.broker.dead_letter(job, str(e))
+            return
+
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        try:
+            logger.info(f"Running job {job.name}: {job.job_id} (attempt {job.attempts})")
+            await handler(**job.kwargs)
+        except Exception as e:
+            logger.error(f"Job {job.name} failed: {job.job_id} - {e}")
+            if job.attempts >= self.max_attempts:
+                await self._exhaust(job, str(e))
+            else:
+                await self.broker.release(job, delay=self.retry_delay * job.attempts)
+        else:
+            await self.broker.ack(job)
+        finally:
+            heartbeat.cancel()
+
+    async def _exhaust(self, job: Job, reason: str) -> None:
+        logger.error(f"Job {job.name} dead-lettered: {job.job_id} - {reason}")
+        callback = _exhausted_callbacks.get(job.name)
+        if callback:
+            try:
+                await callback(**job.kwargs)
+            except Exception as e:
+                logger.error(f"Exhausted callback failed for {job.job_id}: {e}")
+        await self.broker.dead_letter(job, reason)
+
+    async def _heartbeat(self, job: Job) -> None:
+        interval = max(1.0, getattr(self.broker, "visibility_timeout", 60) / 3)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.broker.touch(job)
+            except Exception as e:
+                logger.warning(f"Failed to extend lease for {job.job_id}: {e}")
+
+    async def _reap(self) -> None:
+        while True:
+            try:
+                requeued = await self.broker.requeue_expired()
+                if requeued:
+                    logger.warning(f"Requeued {requeued} expired jobs")
+            except Exception as e:
+                logger.error(f"Failed to requeue expired jobs: {e}")
+            await asyncio.sleep(settings.JOB_REAPER_INTERVAL)
+
+
+_job_queue: Optional[JobQueue] = None
+
+
+def get_job_queue() -> JobQueue:
+    """Process-wide job queue"""
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = JobQueue(create_broker())
+    return _job_queue
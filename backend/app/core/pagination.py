@@ -0,0 +1,96 @@
+"""
+Keyset (cursor) pagination for list endpoints
+
+Rows are ordered by (created_at DESC, id DESC). A cursor is an opaque token
+holding the key of the last row on a page, and the next page continues with
+WHERE (created_at, id) < key, so deep pages cost the same as the first one
+(backed by composite (created_at, id) indexes). The page/per_page mode still
+works for existing clients (OFFSET + exact count); the cursor mode returns a
+total only on request, estimated from the planner instead of counting.
+"""
+import base64
+import json
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Query
+
+
+class InvalidCursorError(ValueError):
+    """The cursor was not produced by encode_cursor"""
+
+
+def encode_cursor(created_at: datetime, row_id) -> str:
+    payload = json.dumps({"t": created_at.isoformat(), "id": str(row_id)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(payload["t"]), uuid.UUID(payload["id"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursorError(f"Invalid cursor: {cursor}") from e
+
+
+@dataclass
+class Page:
+    items: List[Any]
+    next_cursor: Optional[str]
+    total: Optional[int]
+    total_is_estimate: bool = False
+
+
+def estimate_count(query: Query) -> int:
+    """Row estimate from the query plan (no scan, may be off for selective filters)"""
+    session = query.session
+    statement = query.order_by(None).statement
+    compiled = statement.compile(dialect=session.get_bind().dialect, compile_kwargs={"render_postcompile": True})
+    plan = session.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def paginate(
+    query: Query,
+    model,
+    per_page: int,
+    page: Optional[int] = None,
+    cursor: Optional[str] = None,
+    include_total: bool = False,
+    offset: Optional[int] = None,
+    exact_total: bool = True
+) -> Page:
+    """Fetch one page of `query` ordered by (created_at, id) descending
+
+    With a cursor the page starts after the cursor's key and the total is only
+    estimated when include_total is set. Without one, page/per_page (or a raw
+    offset) uses OFFSET and an exact count as before, unless exact_total is off.
+    """
+    ordered = query.order_by(model.created_at.desc(), model.id.desc())
+
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        rows = ordered.filter(
+            tuple_(model.created_at, model.id) < tuple_(created_at, row_id)
+        ).limit(per_page + 1).all()
+        total = estimate_count(query) if include_total else None
+        total_is_estimate = include_total
+    else:
+        total = query.order_by(None).count() if exact_total else None
+        total_is_estimate = False
+        if offset is None:
+            offset = ((page or 1) - 1) * per_page
+        rows = ordered.offset(offset).limit(per_page + 1).all()
+
+    items = rows[:per_page]
+    next_cursor = None
+    if items and len(rows) > per_page:
+        last = items[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+    return Page(items=items, next_cursor=next_cursor, total=total, total_is_estimate=total_is_estimate)
@@ -4,11 +4,24 @@ FastAPI application main module
 from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Match
+import asyncio
+import hmac
 import time
 import logging
 
 from app.core.config import settings
+from app.core.database import dispose_engines, get_pool_metrics
+from app.core.instrumentation import (
+    REGISTRY, finish_request, install_query_hooks, normalize_statement, start_request
+)
+from app.core.job_queue import Worker, get_job_queue
+from app.services.batch_scheduler import BatchDispatcher
+from app.services.dashboard_cache import get_dashboard_cache, install_invalidation_hooks
+from app.services.llm_cache import get_llm_cache
+from app.services.llm_gateway import get_llm_gateway
+from app.services.storage_service import close_storage
 from app.api import auth, sessions, recording, transcribe, ai_analysis, improvement, dashboard
 
 # Configure logging
@@ -68,6 +81,77 @@ async def log_requests(request: Request, call_next):
     
     return response
 
+# Add instrumentation middleware
+def _route_template(request: Request) -> str:
+    """Path template of the matched route (keeps metric label cardinality bounded)"""
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return getattr(route, "path", "unmatched")
+    return "unmatched"
+
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    stats, token = start_request()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        if settings.SERVER_TIMING_ENABLED:
+            response.headers["Server-Timing"] = stats.server_timing()
+        return response
+    finally:
+        route = _route_template(request)
+        finish_request(stats, token, request.method, route, status_code)
+        
+        if settings.SLOW_REQUEST_THRESHOLD and stats.elapsed >= settings.SLOW_REQUEST_THRESHOLD:
+            top = "".join(
+                f"\n  {seconds * 1000:.1f}ms x{count}: {normalize_statement(statement)}"
+                for statement, count, seconds in stats.top_statements(settings.SLOW_REQUEST_TOP_STATEMENTS)
+            )
+            logger.warning(
+                f"Slow request: {request.method} {route} {status_code} {stats.elapsed:.3f}s "
+                f"(db {stats.db_count} queries {stats.db_time:.3f}s, "
+                f"s3 {stats.s3_count} calls {stats.s3_time:.3f}s, "
+                f"llm {stats.llm_count} calls {stats.llm_tokens} tokens {stats.llm_time:.3f}s){top}"
+            )
+
+def _pool_gauges():
+    """Connection pool gauges for /metrics"""
+    gauges = []
+    for engine_name, metrics in get_pool_metrics().items():
+        for key, value in metrics.items():
+            gauges.append((f"db_pool_{key}", f"Connection pool {key.replace('_', ' ')}", {"engine": engine_name}, value))
+    return gauges
+
+REGISTRY.add_collector(_pool_gauges)
+
+def _metrics_authorized(request: Request) -> bool:
+    """Bearer token check for /metrics (no token is only accepted in dev)"""
+    if not settings.METRICS_TOKEN:
+        return settings.ENVIRONMENT == "dev"
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(token.encode(), settings.METRICS_TOKEN.encode())
+
+# Metrics endpoint
+@app.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    """Prometheus metrics
+
+    Disabled by default outside dev. To scrape it elsewhere, set
+    METRICS_ENABLED=true and METRICS_TOKEN, and give the scraper the same
+    token as a bearer token (Prometheus: authorization.credentials_file).
+    """
+    if not settings.METRICS_ENABLED:
+        return JSONResponse(status_code=status.HTTP_404_NOT_FOUND, content={"detail": "Not Found"})
+    if not _metrics_authorized(request):
+        return JSONResponse(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            content={"detail": "Not authenticated"},
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 # Health check endpoint
 @app.get("/health")
 async def health_check():
@@ -76,7 +160,8 @@ async def health_check():
         "status": "healthy",
         "timestamp": time.time(),
         "version": settings.VERSION,
-        "environment": settings.ENVIRONMENT
+        "environment": settings.ENVIRONMENT,
+        "database_pool": get_pool_metrics()
     }
 
 # Root endpoint
@@ -128,12 +213,43 @@ async def startup_event():
     logger.info(f"Starting {settings.PROJECT_NAME} v{settings.VERSION}")
     logger.info(f"Environment: {settings.ENVIRONMENT}")
     logger.info(f"Debug mode: {settings.DEBUG}")
+    
+    # Invalidate cached dashboards when sessions/analysis tasks change
+    install_invalidation_hooks()
+    
+    # Count and time SQL statements per request
+    install_query_hooks()
+    
+    # In-memory queue has no external worker, so consume jobs in-process
+    if settings.JOB_QUEUE_BACKEND == "memory":
+        worker = Worker(get_job_queue().broker)
+        app.state.job_worker = worker
+        app.state.job_worker_task = asyncio.create_task(worker.run())
+        dispatcher = BatchDispatcher(get_job_queue())
+        app.state.batch_dispatcher = dispatcher
+        app.state.batch_dispatcher_task = asyncio.create_task(dispatcher.run())
+        logger.info("Started in-process job worker")
 
 # Shutdown event
 @app.on_event("shutdown")
 async def shutdown_event():
     """Shutdown event handler"""
     logger.info("Shutting down application")
+    
+    dispatcher = getattr(app.state, "batch_dispatcher", None)
+    if dispatcher:
+        dispatcher.stop()
+        await app.state.batch_dispatcher_task
+    worker = getattr(app.state, "job_worker", None)
+    if worker:
+        worker.stop()
+        await app.state.job_worker_task
+    await get_job_queue().broker.close()
+    await get_llm_gateway().close()
+    await get_llm_cache().close()
+    await get_dashboard_cache().close()
+    close_storage()
+    dispose_engines()
 
 if __name__ == "__main__":
     import uvicorn
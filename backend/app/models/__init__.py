@@ -7,6 +7,8 @@ from .session import Session, SessionStatus
 from .recording import Recording
 from .transcription import TranscriptionTask
 from .analysis import AnalysisTask, AnalysisFeedback, SuccessPattern
+from .rollup import DailySessionRollup
+from .export import ExportJob
 
 __all__ = [
     "Base",
@@ -21,4 +23,6 @@ __all__ = [
     "AnalysisTask",
     "AnalysisFeedback",
     "SuccessPattern",
+    "DailySessionRollup",
+    "ExportJob",
 ]
\ No newline at end of file
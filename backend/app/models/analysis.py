@@ -1,7 +1,7 @@
 """
 AI Analysis database models
 """
-from sqlalchemy import Column, String, Integer, DateTime, Text, ForeignKey, Boolean, Float
+from sqlalchemy import Column, String, Integer, DateTime, Text, ForeignKey, Boolean, Float, Index, text
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -9,6 +9,28 @@ import uuid
 
 from app.models.base import Base
 
+# 分析カテゴリ → カテゴリスコア列
+CATEGORY_SCORE_COLUMNS = {
+    "questioning": "questioning_score",
+    "anxiety_handling": "anxiety_score",
+    "closing": "closing_score",
+    "flow": "flow_score",
+}
+
+
+def extract_category_score(analysis_result: dict, category: str) -> float:
+    """分析結果からカテゴリのスコアを取り出す（数値でなければNone）"""
+    if not isinstance(analysis_result, dict):
+        return None
+    category_data = analysis_result.get(category)
+    if not isinstance(category_data, dict):
+        return None
+    score = category_data.get("score")
+    if isinstance(score, bool) or not isinstance(score, (int, float)):
+        return None
+    return float(score)
+
+
 class AnalysisTask(Base):
     """AI分析タスクテーブル"""
     __tablename__ = "analysis_tasks"
@@ -30,12 +52,23 @@ class AnalysisTask(Base):
     progress = Column(Integer, nullable=False, default=0)  # 0-100
     stage = Column(String(50), nullable=True)  # 現在の処理段階
     
+    # スケジューリング
+    lane = Column(String(20), nullable=False, default="interactive", server_default="interactive")  # interactive, batch
+    batch_id = Column(String(100), nullable=True, index=True)
+    clinic_id = Column(UUID(as_uuid=True), ForeignKey("clinics.id", ondelete="SET NULL"), nullable=True)  # クリニック間の公平な割り当て用
+    dispatched_at = Column(DateTime, nullable=True)  # ジョブキューへの投入日時（バッチは順番待ちの間 NULL）
+    bypass_cache = Column(Boolean, nullable=False, default=False, server_default="false")  # LLMキャッシュを使わずに再分析
+    
     # 設定パラメータ
     focus_areas = Column(JSONB, nullable=True)  # 重点分析項目
     custom_prompts = Column(JSONB, nullable=True)  # カスタムプロンプト
     
     # 分析結果
     overall_score = Column(Float, nullable=True)
+    questioning_score = Column(Float, nullable=True)  # full_analysis_result から抽出したカテゴリスコア
+    anxiety_score = Column(Float, nullable=True)
+    closing_score = Column(Float, nullable=True)
+    flow_score = Column(Float, nullable=True)
     questioning_result = Column(JSONB, nullable=True)
     anxiety_handling_result = Column(JSONB, nullable=True)
     closing_result = Column(JSONB, nullable=True)
@@ -52,7 +85,12 @@ class AnalysisTask(Base):
     
     # API使用状況
     openai_tokens_used = Column(Integer, nullable=True)
+    openai_prompt_tokens = Column(Integer, nullable=True)
+    openai_completion_tokens = Column(Integer, nullable=True)
+    openai_cached_tokens = Column(Integer, nullable=True)  # openai_prompt_tokens の内数
     openai_cost = Column(Float, nullable=True)
+    openai_model = Column(String(50), nullable=True)
+    token_budget_action = Column(String(50), nullable=True)  # chunked, downgraded, truncated（カンマ区切り）
     
     # エラー情報
     error_message = Column(Text, nullable=True)
@@ -79,6 +117,37 @@ class AnalysisTask(Base):
     session = relationship("Session", back_populates="analysis_tasks")
     feedback_records = relationship("AnalysisFeedback", back_populates="analysis_task", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # 完了済み分析のスコア集計（セッション単位・期間単位）
+        Index(
+            "ix_analysis_tasks_completed_session_scores",
+            "session_id",
+            postgresql_include=["overall_score", "questioning_score", "anxiety_score", "closing_score", "flow_score", "completed_at"],
+            postgresql_where=text("status = 'completed' AND is_deleted = false")
+        ),
+        Index(
+            "ix_analysis_tasks_completed_created_score",
+            "created_at",
+            "overall_score",
+            postgresql_include=["questioning_score", "anxiety_score", "closing_score", "flow_score"],
+            postgresql_where=text("status = 'completed' AND is_deleted = false")
+        ),
+        # バッチスケジューラの順番待ち（クリニックごとに古い順）
+        Index(
+            "ix_analysis_tasks_batch_queued",
+            "clinic_id",
+            "created_at",
+            postgresql_where=text("lane = 'batch' AND dispatched_at IS NULL AND status = 'pending' AND is_deleted = false")
+        ),
+        # 一覧のキーセットページング（created_at, id の降順）
+        Index(
+            "ix_analysis_tasks_live_created_id",
+            "created_at",
+            "id",
+            postgresql_where=text("is_deleted = false")
+        ),
+    )
+
     def __repr__(self):
         return f"<AnalysisTask(id={self.id}, task_id='{self.task_id}', status='{self.status}')>"
 
@@ -125,7 +194,8 @@ class AnalysisTask(Base):
         analysis_result: dict,
         suggestions: list = None,
         tokens_used: int = None,
-        cost: float = None
+        cost: float = None,
+        usage: dict = None
     ) -> None:
         """処理完了"""
         self.status = "completed"
@@ -139,6 +209,8 @@ class AnalysisTask(Base):
         self.anxiety_handling_result = analysis_result.get("anxiety_handling")
         self.closing_result = analysis_result.get("closing")
         self.flow_result = analysis_result.get("flow")
+        for category, column in CATEGORY_SCORE_COLUMNS.items():
+            setattr(self, column, extract_category_score(analysis_result, category))
         self.session_summary = analysis_result.get("session_summary")
         self.key_strengths = analysis_result.get("key_strengths", [])
         self.critical_improvements = analysis_result.get("critical_improvements", [])
@@ -153,6 +225,12 @@ class AnalysisTask(Base):
             self.openai_tokens_used = tokens_used
         if cost:
             self.openai_cost = cost
+        if usage:
+            self.openai_prompt_tokens = usage.get("prompt_tokens")
+            self.openai_completion_tokens = usage.get("completion_tokens")
+            self.openai_cached_tokens = usage.get("cached_tokens")
+            self.openai_model = usage.get("model")
+            self.token_budget_action = usage.get("budget_action")
         
         if self.started_at:
             self.actual_duration = int((self.completed_at - self.started_at).total_seconds())
@@ -167,6 +245,14 @@ class AnalysisTask(Base):
         if self.started_at:
             self.actual_duration = int((self.completed_at - self.started_at).total_seconds())
 
+    def wait_for_retry(self, error_message: str, error_code: str = None) -> None:
+        """一時的なエラーでジョブキューの再試行を待つ（上限に達すると失敗になる）"""
+        self.status = "pending"
+        self.stage = "waiting_for_retry"
+        self.progress = 0
+        self.error_message = error_message
+        self.error_code = error_code
+
     def retry_processing(self) -> None:
         """再試行"""
         if not self.can_retry:
@@ -192,9 +278,15 @@ class AnalysisTask(Base):
             "status": self.status,
             "progress": self.progress,
             "stage": self.stage,
+            "lane": self.lane,
+            "batch_id": self.batch_id,
             "focus_areas": self.focus_areas,
             "custom_prompts": self.custom_prompts,
             "overall_score": self.overall_score,
+            "questioning_score": self.questioning_score,
+            "anxiety_score": self.anxiety_score,
+            "closing_score": self.closing_score,
+            "flow_score": self.flow_score,
             "questioning_result": self.questioning_result,
             "anxiety_handling_result": self.anxiety_handling_result,
             "closing_result": self.closing_result,
@@ -206,7 +298,12 @@ class AnalysisTask(Base):
             "suggestions": self.suggestions,
             "suggestions_generated": self.suggestions_generated,
             "openai_tokens_used": self.openai_tokens_used,
+            "openai_prompt_tokens": self.openai_prompt_tokens,
+            "openai_completion_tokens": self.openai_completion_tokens,
+            "openai_cached_tokens": self.openai_cached_tokens,
             "openai_cost": self.openai_cost,
+            "openai_model": self.openai_model,
+            "token_budget_action": self.token_budget_action,
             "error_message": self.error_message,
             "error_code": self.error_code,
             "retry_count": self.retry_count,
@@ -0,0 +1,59 @@
+"""
+Data export job database models
+"""
+from sqlalchemy import Column, String, Integer, BigInteger, DateTime, Text, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+from datetime import datetime
+import uuid
+
+from app.models.base import Base
+
+
+class ExportJob(Base):
+    """データエクスポートジョブテーブル"""
+    __tablename__ = "export_jobs"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+
+    # 出力設定
+    dataset = Column(String(20), nullable=False)  # sessions, analyses, kpis
+    file_format = Column(String(20), nullable=False)  # csv, jsonl, parquet
+    filters = Column(JSONB, nullable=False)  # 権限適用済みの PerformanceReportFilters
+
+    status = Column(String(20), nullable=False, default="pending", server_default="pending")  # pending, processing, completed, failed
+
+    # 進捗
+    total_rows = Column(Integer, nullable=True)  # 開始時点の件数（進捗の分母）
+    rows_exported = Column(Integer, nullable=False, default=0)
+    bytes_written = Column(BigInteger, nullable=False, default=0)
+    parts_uploaded = Column(Integer, nullable=False, default=0)
+
+    # 出力先
+    file_path = Column(String(500), nullable=True)
+    upload_id = Column(String(255), nullable=True)  # 進行中のマルチパートアップロード（再配信時に中断する）
+
+    error_message = Column(Text, nullable=True)
+
+    # 時間情報
+    started_at = Column(DateTime, nullable=True)
+    completed_at = Column(DateTime, nullable=True)
+    expires_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_export_jobs_user_created", "user_id", "created_at"),
+    )
+
+    @property
+    def progress(self) -> float:
+        """進捗率（0.0-1.0）"""
+        if self.status == "completed":
+            return 1.0
+        if not self.total_rows:
+            return 0.0
+        return min(self.rows_exported / self.total_rows, 1.0)
+
+    def __repr__(self):
+        return f"<ExportJob(id={self.id}, dataset='{self.dataset}', status='{self.status}')>"
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, DateTime, Text, ForeignKey, Boolean
+from sqlalchemy import Column, String, Integer, DateTime, Text, ForeignKey, Boolean, Index, text
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -45,6 +45,16 @@ class Recording(Base):
     session = relationship("Session", back_populates="recording")
     transcription_tasks = relationship("TranscriptionTask", back_populates="recording", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # 一覧のキーセットページング（created_at, id の降順）
+        Index(
+            "ix_recordings_live_created_id",
+            "created_at",
+            "id",
+            postgresql_where=text("is_deleted = false")
+        ),
+    )
+
     def __repr__(self):
         return f"<Recording(id={self.id}, customer_id={self.customer_id}, file_path={self.file_path})>"
 
@@ -0,0 +1,68 @@
+"""
+Dashboard rollup database models
+"""
+from sqlalchemy import Column, Integer, BigInteger, Date, DateTime, Float, ForeignKey, Index, func, text
+from sqlalchemy.dialects.postgresql import UUID
+from datetime import datetime
+import uuid
+
+from app.models.base import Base
+
+# カウンセラー未割当のセッションをユニークキー上で区別するための値
+UNASSIGNED_COUNSELOR_ID = uuid.UUID(int=0)
+UNASSIGNED_COUNSELOR_SQL = f"'{UNASSIGNED_COUNSELOR_ID}'::uuid"
+
+
+class DailySessionRollup(Base):
+    """セッション日次集計テーブル（クリニック × カウンセラー × 日）
+
+    day は settings.ROLLUP_TIME_ZONE の現地日付。行は RollupService が
+    元のセッション・分析タスクから再計算して丸ごと置き換える。
+    """
+    __tablename__ = "daily_session_rollups"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    day = Column(Date, nullable=False)
+    clinic_id = Column(UUID(as_uuid=True), ForeignKey("clinics.id", ondelete="CASCADE"), nullable=False)
+    counselor_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=True)
+
+    # セッション件数
+    session_count = Column(Integer, nullable=False, default=0)
+    completed_count = Column(Integer, nullable=False, default=0)
+    scored_count = Column(Integer, nullable=False, default=0)  # overall_score のあるセッション
+    high_score_count = Column(Integer, nullable=False, default=0)  # overall_score >= 8.0
+    satisfied_count = Column(Integer, nullable=False, default=0)  # overall_score >= 7.0
+    score_sum = Column(Float, nullable=False, default=0.0)
+
+    # カテゴリ別スコア（合計と件数）
+    questioning_score_sum = Column(Float, nullable=False, default=0.0)
+    questioning_count = Column(Integer, nullable=False, default=0)
+    anxiety_score_sum = Column(Float, nullable=False, default=0.0)
+    anxiety_count = Column(Integer, nullable=False, default=0)
+    closing_score_sum = Column(Float, nullable=False, default=0.0)
+    closing_count = Column(Integer, nullable=False, default=0)
+    flow_score_sum = Column(Float, nullable=False, default=0.0)
+    flow_count = Column(Integer, nullable=False, default=0)
+
+    # AI分析の処理量（完了済みタスク）
+    analysis_count = Column(Integer, nullable=False, default=0)
+    tokens_used = Column(BigInteger, nullable=False, default=0)
+    cost = Column(Float, nullable=False, default=0.0)
+    analysis_duration_sum = Column(Integer, nullable=False, default=0)  # 秒
+
+    refreshed_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index(
+            "uq_daily_session_rollups_key",
+            "day",
+            "clinic_id",
+            func.coalesce(counselor_id, text(UNASSIGNED_COUNSELOR_SQL)),
+            unique=True
+        ),
+        Index("ix_daily_session_rollups_clinic_day", "clinic_id", "day"),
+        Index("ix_daily_session_rollups_counselor_day", "counselor_id", "day"),
+    )
+
+    def __repr__(self):
+        return f"<DailySessionRollup(day={self.day}, clinic_id={self.clinic_id}, counselor_id={self.counselor_id})>"
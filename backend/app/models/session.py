@@ -1,9 +1,9 @@
 """
 Session model
 """
-from sqlalchemy import Column, String, Text, Integer, DateTime, ForeignKey, Enum as SQLEnum
+from sqlalchemy import Column, String, Text, Integer, DateTime, ForeignKey, Boolean, Float, Enum as SQLEnum, Index, text
 from sqlalchemy.dialects.postgresql import UUID, JSONB
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, validates
 import enum
 from datetime import datetime
 
@@ -34,10 +34,15 @@ class Session(BaseModel):
     audio_file_path = Column(String(500), nullable=True)
     transcription_text = Column(Text, nullable=True)
     analysis_result = Column(JSONB, nullable=True)
+    overall_score = Column(Float, nullable=True)  # Denormalized from analysis_result
     
     # Additional metadata
     notes = Column(Text, nullable=True)
     
+    # Soft delete
+    is_deleted = Column(Boolean, nullable=False, default=False, server_default="false")
+    deleted_at = Column(DateTime, nullable=True)
+    
     # Foreign keys
     customer_id = Column(
         UUID(as_uuid=True),
@@ -60,6 +65,29 @@ class Session(BaseModel):
     transcription_tasks = relationship("TranscriptionTask", back_populates="session", cascade="all, delete-orphan")
     analysis_tasks = relationship("AnalysisTask", back_populates="session", cascade="all, delete-orphan")
     
+    __table_args__ = (
+        # Dashboard date-range scans over live sessions
+        Index(
+            "ix_sessions_live_session_date_score",
+            "session_date",
+            "overall_score",
+            postgresql_where=text("is_deleted = false")
+        ),
+        Index(
+            "ix_sessions_live_counselor_date_score",
+            "counselor_id",
+            "session_date",
+            "overall_score",
+            postgresql_where=text("is_deleted = false")
+        ),
+        # Keyset pagination of the session list (created_at, id descending)
+        Index(
+            "ix_sessions_created_id",
+            "created_at",
+            "id"
+        ),
+    )
+    
     def __repr__(self):
         return f"<Session(id={self.id}, customer_id={self.customer_id}, status='{self.status}')>"
     
@@ -78,12 +106,14 @@ class Session(BaseModel):
         """Check if session has analysis"""
         return self.analysis_result is not None
     
-    @property
-    def overall_score(self) -> float:
-        """Get overall analysis score"""
-        if self.analysis_result and isinstance(self.analysis_result, dict):
-            return self.analysis_result.get("overall_score", 0.0)
-        return 0.0
+    @validates("analysis_result")
+    def _sync_overall_score(self, key, value):
+        """Keep the denormalized overall_score in step with analysis_result"""
+        score = value.get("overall_score") if isinstance(value, dict) else None
+        if isinstance(score, bool) or not isinstance(score, (int, float)):
+            score = None
+        self.overall_score = float(score) if score is not None else None
+        return value
     
     def update_status(self, new_status: SessionStatus) -> None:
         """Update session status with validation"""
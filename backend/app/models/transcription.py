@@ -1,7 +1,7 @@
 """
 Transcription database models
 """
-from sqlalchemy import Column, String, Integer, DateTime, Text, ForeignKey, Boolean, Float
+from sqlalchemy import Column, String, Integer, DateTime, Text, ForeignKey, Boolean, Float, Index, text
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -64,6 +64,16 @@ class TranscriptionTask(Base):
     session = relationship("Session", back_populates="transcription_tasks")
     analysis_tasks = relationship("AnalysisTask", back_populates="transcription_task", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # 一覧のキーセットページング（created_at, id の降順）
+        Index(
+            "ix_transcription_tasks_live_created_id",
+            "created_at",
+            "id",
+            postgresql_where=text("is_deleted = false")
+        ),
+    )
+
     def __repr__(self):
         return f"<TranscriptionTask(id={self.id}, task_id='{self.task_id}', status='{self.status}')>"
 
@@ -115,6 +125,21 @@ class TranscriptionTask(Base):
         if self.started_at:
             self.actual_duration = int((self.completed_at - self.started_at).total_seconds())
 
+    def update_partial_result(
+        self,
+        transcription_text: str,
+        transcription_result: dict,
+        confidence: float,
+        detected_language: str,
+        duration: float
+    ) -> None:
+        """途中経過を保存（ストリーミング文字起こし）"""
+        self.transcription_text = transcription_text
+        self.transcription_result = transcription_result
+        self.confidence = confidence
+        self.detected_language = detected_language
+        self.duration = duration
+
     def fail_processing(self, error_message: str, error_code: str = None) -> None:
         """処理失敗"""
         self.status = "failed"
@@ -125,6 +150,13 @@ class TranscriptionTask(Base):
         if self.started_at:
             self.actual_duration = int((self.completed_at - self.started_at).total_seconds())
 
+    def wait_for_retry(self, error_message: str, error_code: str = None) -> None:
+        """一時的なエラーでジョブキューの再試行を待つ（上限に達すると失敗になる）"""
+        self.status = "retrying"
+        self.progress = 0
+        self.error_message = error_message
+        self.error_code = error_code
+
     def retry_processing(self) -> None:
         """再試行"""
         if not self.can_retry:
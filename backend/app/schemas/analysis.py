@@ -12,6 +12,7 @@ class AnalysisType(str, Enum):
     FULL = "full"
     QUICK = "quick"
     SPECIFIC = "specific"
+    COMBINED = "combined"  # 4項目＋要約を1回のリクエストで分析
 
 class AnalysisStatus(str, Enum):
     """分析ステータス"""
@@ -164,6 +165,7 @@ class AnalysisRequest(BaseModel):
     analysis_type: AnalysisType = Field(default=AnalysisType.FULL, description="分析タイプ")
     focus_areas: Optional[List[str]] = Field(None, description="重点分析項目")
     custom_prompts: Optional[Dict[str, str]] = Field(None, description="カスタムプロンプト")
+    bypass_cache: bool = Field(default=False, description="LLMキャッシュを使わずに再分析")
 
     class Config:
         from_attributes = True
@@ -208,6 +210,7 @@ class BatchAnalysisRequest(BaseModel):
     transcription_ids: List[str] = Field(..., description="文字起こしIDリスト")
     analysis_type: AnalysisType = Field(default=AnalysisType.FULL, description="分析タイプ")
     priority: str = Field(default="normal", description="優先度")
+    bypass_cache: bool = Field(default=False, description="LLMキャッシュを使わずに再分析")
 
     class Config:
         from_attributes = True
@@ -218,16 +221,29 @@ class BatchAnalysisResponse(BaseModel):
     task_ids: List[str] = Field(..., description="タスクIDリスト")
     total_count: int = Field(..., description="総件数")
     estimated_total_duration: int = Field(..., description="推定総処理時間（秒）")
+    queue_depth: int = Field(..., description="投入時点のバッチ順番待ち件数（このバッチを含む）")
+    estimated_completion: datetime = Field(..., description="バッチ全体の推定完了日時")
 
     class Config:
         from_attributes = True
 
+class BatchQueueStatus(BaseModel):
+    """バッチ分析キューの状況"""
+    queued: int = Field(..., description="順番待ち件数")
+    in_flight: int = Field(..., description="実行中件数")
+    max_in_flight: int = Field(..., description="同時実行数の上限")
+    average_duration: float = Field(..., description="1分析の平均所要時間（秒）")
+    throughput_per_minute: float = Field(..., description="1分あたりの処理件数")
+    estimated_drain_seconds: int = Field(..., description="順番待ちが空になるまでの推定秒数")
+
 class AnalysisList(BaseModel):
     """分析一覧"""
     analyses: List[AnalysisStatusResponse] = Field(..., description="分析一覧")
-    total: int = Field(..., description="総数")
-    page: int = Field(..., description="ページ番号")
+    total: Optional[int] = Field(None, description="総数（カーソル指定時は include_total=true の場合のみ）")
+    total_is_estimate: bool = Field(default=False, description="総数が実行計画からの推定値か")
+    page: Optional[int] = Field(None, description="ページ番号（カーソル指定時は None）")
     per_page: int = Field(..., description="ページサイズ")
+    next_cursor: Optional[str] = Field(None, description="次ページのカーソル（最終ページは None）")
 
     class Config:
         from_attributes = True
@@ -242,6 +258,7 @@ class AnalysisStats(BaseModel):
     average_processing_time: float = Field(..., description="平均処理時間（秒）")
     average_overall_score: float = Field(..., description="平均総合スコア")
     success_rate: float = Field(..., ge=0.0, le=1.0, description="成功率")
+    llm_cache: Optional[Dict[str, Any]] = Field(None, description="LLMレスポンスキャッシュのヒット・ミス・節約量（管理者のみ）")
 
     class Config:
         from_attributes = True
\ No newline at end of file
@@ -1,10 +1,11 @@
 """
 Dashboard and analytics schemas
 """
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, validator
 from typing import List, Dict, Optional, Union
 from datetime import datetime
 from enum import Enum
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 class HealthStatus(str, Enum):
     """システム健全性ステータス"""
@@ -28,6 +29,16 @@ class DashboardFilters(BaseModel):
     counselor_id: Optional[str] = None
     customer_type: Optional[str] = None
     session_status: Optional[str] = None
+    granularity: str = Field(default="daily", pattern="^(hourly|daily|weekly|monthly)$")
+    time_zone: str = Field(default="Asia/Tokyo", description="集計バケットのタイムゾーン（IANA名）")
+    
+    @validator("time_zone")
+    def validate_time_zone(cls, v):
+        try:
+            ZoneInfo(v)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f"Unknown time zone: {v}")
+        return v
 
 class KPIMetrics(BaseModel):
     """KPI メトリクス"""
@@ -118,6 +129,18 @@ class CounselorDashboard(BaseModel):
     generated_at: datetime = Field(default_factory=datetime.utcnow)
     next_review_date: Optional[datetime] = None
 
+class TeamMemberDashboard(BaseModel):
+    """チームダッシュボードのカウンセラー別データ"""
+    counselor_id: str
+    counselor_name: str
+    dashboard: CounselorDashboard
+
+class TeamDashboard(BaseModel):
+    """チームダッシュボード（クリニック内の全カウンセラー）"""
+    clinic_id: str
+    counselors: List[TeamMemberDashboard]
+    generated_at: datetime = Field(default_factory=datetime.utcnow)
+
 class RealTimeMetrics(BaseModel):
     """リアルタイムメトリクス"""
     active_sessions: int = Field(..., ge=0)
@@ -229,8 +252,8 @@ class DashboardAlert(BaseModel):
 # Export schemas
 class ExportRequest(BaseModel):
     """エクスポートリクエスト"""
-    export_type: str = Field(..., pattern="^(csv|pdf|excel|json)$")
-    data_source: str = Field(..., pattern="^(dashboard|report|analysis)$")
+    export_type: str = Field(..., pattern="^(csv|jsonl|parquet)$")
+    data_source: str = Field(..., pattern="^(sessions|analyses|kpis)$", description="セッション・完了済み分析・日次KPI")
     filters: PerformanceReportFilters
     include_charts: bool = Field(default=True)
     email_recipients: Optional[List[str]] = None
@@ -240,6 +263,10 @@ class ExportResponse(BaseModel):
     export_id: str
     file_url: Optional[str] = None
     file_size_mb: Optional[float] = None
-    status: str = Field(..., pattern="^(pending|completed|failed)$")
+    status: str = Field(..., pattern="^(pending|processing|completed|failed)$")
+    progress: float = Field(default=0.0, ge=0.0, le=1.0)
+    rows_exported: int = 0
+    total_rows: Optional[int] = None
+    error_message: Optional[str] = None
     generated_at: datetime = Field(default_factory=datetime.utcnow)
     expires_at: Optional[datetime] = None
\ No newline at end of file
@@ -108,6 +108,12 @@ class PerformanceTrend(BaseModel):
     key_improvements: List[str] = Field(default_factory=list)
     areas_needing_attention: List[str] = Field(default_factory=list)
     confidence_level: float = Field(default=0.8, ge=0.0, le=1.0)
+    session_count: int = Field(default=0, ge=0)
+    score_slope: Optional[float] = Field(None, description="Overall score change per week (least squares)")
+    moving_average: Optional[float] = Field(None, ge=0.0, le=10.0, description="Average of the latest 5 scored sessions")
+    percentile_rank: Optional[float] = Field(None, ge=0.0, le=100.0, description="Rank of current_average within the clinic")
+    category_averages: Dict[str, float] = Field(default_factory=dict)
+    category_changes: Dict[str, float] = Field(default_factory=dict)
 
 # Request/Response schemas
 class SuggestionRequest(BaseModel):
@@ -188,6 +194,20 @@ class PerformanceTrendResponse(BaseModel):
     next_review_date: Optional[datetime] = None
     generated_at: datetime = Field(default_factory=datetime.utcnow)
 
+class CounselorPerformanceTrend(BaseModel):
+    """カウンセラー別パフォーマンストレンド"""
+    counselor_id: str
+    counselor_name: Optional[str] = None
+    trend_data: PerformanceTrend
+
+class TeamPerformanceTrendResponse(BaseModel):
+    """クリニック全体のパフォーマンストレンドレスポンス"""
+    clinic_id: str
+    days: int
+    counselors: List[CounselorPerformanceTrend] = Field(default_factory=list)
+    score_percentiles: Dict[str, float] = Field(default_factory=dict)
+    generated_at: datetime = Field(default_factory=datetime.utcnow)
+
 # Summary schemas
 class ImprovementSummary(BaseModel):
     """改善サマリー"""
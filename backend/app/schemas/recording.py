@@ -75,9 +75,11 @@ class RecordingMetadata(BaseModel):
 class RecordingList(BaseModel):
     """録音一覧"""
     recordings: list[RecordingInfo] = Field(..., description="録音一覧")
-    total: int = Field(..., description="総数")
-    page: int = Field(..., description="ページ番号")
+    total: Optional[int] = Field(None, description="総数（カーソル指定時は include_total=true の場合のみ）")
+    total_is_estimate: bool = Field(default=False, description="総数が実行計画からの推定値か")
+    page: Optional[int] = Field(None, description="ページ番号（カーソル指定時は None）")
     per_page: int = Field(..., description="ページサイズ")
+    next_cursor: Optional[str] = Field(None, description="次ページのカーソル（最終ページは None）")
 
     class Config:
         from_attributes = True
@@ -0,0 +1,105 @@
+"""
+Clinic access scope resolution
+"""
+import uuid
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+from app.models.analysis import AnalysisTask
+from app.models.customer import Customer
+from app.models.recording import Recording
+from app.models.session import Session as SessionModel
+from app.models.transcription import TranscriptionTask
+from app.models.user import User
+
+# 自分のクリニックのリソースのみ参照できるロール（既定）
+RESTRICTED_ROLES = ("counselor",)
+
+
+def _as_uuid(value) -> uuid.UUID:
+    return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+
+
+class ClinicScope:
+    """リソースが属するクリニックの解決とアクセス判定
+
+    セッション→顧客→クリニックを1件ずつ辿る代わりに、ID の集合を1回の JOIN クエリで
+    クリニックIDへ解決する。結果はインスタンス内にキャッシュされ、get_clinic_scope
+    依存関係を使えば1リクエストで1インスタンスを共有する（件数に関係なくクエリ数は一定）。
+    """
+
+    def __init__(self, db: Session, user: User):
+        self.db = db
+        self.user = user
+        self._clinics: Dict[Tuple[str, uuid.UUID], Optional[uuid.UUID]] = {}
+
+    def _query(self, kind: str, ids: Sequence[uuid.UUID]):
+        """(リソースID, クリニックID) を返すクエリ"""
+        if kind == "customer":
+            return self.db.query(Customer.id, Customer.clinic_id).filter(Customer.id.in_(ids))
+
+        if kind == "recording":
+            return self.db.query(Recording.id, Customer.clinic_id).join(
+                Customer, Recording.customer_id == Customer.id
+            ).filter(Recording.id.in_(ids))
+
+        if kind == "session":
+            return self.db.query(SessionModel.id, Customer.clinic_id).join(
+                Customer, SessionModel.customer_id == Customer.id
+            ).filter(SessionModel.id.in_(ids))
+
+        if kind == "transcription":
+            return self.db.query(TranscriptionTask.id, Customer.clinic_id).join(
+                Recording, TranscriptionTask.recording_id == Recording.id
+            ).join(
+                Customer, Recording.customer_id == Customer.id
+            ).filter(TranscriptionTask.id.in_(ids))
+
+        if kind == "analysis":
+            # セッションのない分析はクリニックなし（NULL）として扱う
+            return self.db.query(AnalysisTask.id, Customer.clinic_id).outerjoin(
+                SessionModel, AnalysisTask.session_id == SessionModel.id
+            ).outerjoin(
+                Customer, SessionModel.customer_id == Customer.id
+            ).filter(AnalysisTask.id.in_(ids))
+
+        raise ValueError(f"Unknown resource kind: {kind}")
+
+    def resolve(self, kind: str, ids: Iterable) -> Dict[uuid.UUID, Optional[uuid.UUID]]:
+        """リソースID → クリニックID（未キャッシュ分だけを1クエリで取得）"""
+        keys = [_as_uuid(resource_id) for resource_id in ids]
+        missing = {key for key in keys if (kind, key) not in self._clinics}
+        if missing:
+            found = dict(self._query(kind, list(missing)).all())
+            for key in missing:
+                self._clinics[(kind, key)] = found.get(key)
+        return {key: self._clinics[(kind, key)] for key in keys}
+
+    def clinic_of(self, kind: str, resource_id) -> Optional[uuid.UUID]:
+        """1件のリソースのクリニックID"""
+        return self.resolve(kind, [resource_id])[_as_uuid(resource_id)]
+
+    def can_access(self, clinic_id: Optional[uuid.UUID], roles: Sequence[str] = RESTRICTED_ROLES) -> bool:
+        """roles に含まれるユーザーは自分のクリニックのみ（クリニックなしのリソースは許可）"""
+        if self.user.role not in roles or clinic_id is None:
+            return True
+        return clinic_id == self.user.clinic_id
+
+    def require(
+        self,
+        kind: str,
+        ids: Iterable,
+        roles: Sequence[str] = RESTRICTED_ROLES,
+        detail: str = "Access denied"
+    ) -> Dict[uuid.UUID, Optional[uuid.UUID]]:
+        """すべてのリソースにアクセスできなければ 403、できればクリニックIDの対応を返す"""
+        clinics = self.resolve(kind, ids)
+        if not all(self.can_access(clinic_id, roles) for clinic_id in clinics.values()):
+            raise HTTPException(status_code=403, detail=detail)
+        return clinics
+
+    def require_one(self, kind: str, resource_id, roles: Sequence[str] = RESTRICTED_ROLES) -> Optional[uuid.UUID]:
+        """1件のリソースへのアクセスを確認し、そのクリニックIDを返す"""
+        return self.require(kind, [resource_id], roles)[_as_uuid(resource_id)]
@@ -1,7 +1,6 @@
 """
 AI Analysis service using OpenAI GPT-4
 """
-import openai
 from typing import Dict, List, Optional, Tuple
 import json
 import asyncio
@@ -10,7 +9,15 @@ import re
 from datetime import datetime
 
 from app.core.config import settings
-from app.services.prompt_service import PromptService
+from app.services.chunked_analysis import (
+    CATEGORY_REDUCERS, TranscriptChunk, TranscriptChunker, merge_unique, reduce_summaries
+)
+from app.services.llm_cache import build_cache_key, get_llm_cache
+from app.services.llm_gateway import get_llm_gateway
+from app.services.prompt_service import TRANSCRIPT_REFERENCE, PromptService
+from app.services.token_budget import (
+    AnalysisTokenBudget, BudgetPlan, TokenBudgetExceededError, check_request_fits, estimate_cost
+)
 from app.schemas.analysis import (
     AnalysisResult, AnalysisType, QuestioningAnalysis, 
     AnxietyHandlingAnalysis, ClosingAnalysis, FlowAnalysis
@@ -21,9 +28,29 @@ logger = logging.getLogger(__name__)
 class AnalysisService:
     """AI分析サービス"""
     
-    def __init__(self):
-        self.openai_client = openai.OpenAI(api_key=settings.OPENAI_API_KEY)
+    # 総合スコアの重み
+    CATEGORY_WEIGHTS = {
+        "questioning": 0.25,
+        "anxiety_handling": 0.25,
+        "closing": 0.30,
+        "flow": 0.20,
+    }
+    
+    # 統合分析のセクションと検証モデル
+    SECTION_MODELS = {
+        "questioning": QuestioningAnalysis,
+        "anxiety_handling": AnxietyHandlingAnalysis,
+        "closing": ClosingAnalysis,
+        "flow": FlowAnalysis,
+    }
+    
+    def __init__(self, use_cache: bool = True):
+        self.llm_gateway = get_llm_gateway()
+        self.llm_cache = get_llm_cache()
+        self.use_cache = use_cache
+        self.chunker = TranscriptChunker()
         self.prompt_service = PromptService()
+        self.token_budget = AnalysisTokenBudget(self.prompt_service, self.chunker)
         
         # 環境に応じてモデルを選択（本番環境では高性能、開発環境では低コスト）
         if settings.ENVIRONMENT == "prod":
@@ -33,10 +60,15 @@ class AnalysisService:
             
         self.max_tokens = 4000
         self.temperature = 0.1
+        self.prompt_layout = settings.PROMPT_LAYOUT
         
         # トークン使用量とコスト追跡
         self.total_tokens_used = 0
+        self.total_prompt_tokens = 0
+        self.total_completion_tokens = 0
+        self.total_cached_tokens = 0
         self.total_cost = 0.0
+        self.budget_plan: Optional[BudgetPlan] = None
         
         logger.info(f"AnalysisService initialized with model: {self.model}")
 
@@ -45,10 +77,14 @@ class AnalysisService:
         transcription_text: str,
         analysis_type: AnalysisType = AnalysisType.FULL,
         focus_areas: List[str] = None,
-        custom_prompts: Dict[str, str] = None
+        custom_prompts: Dict[str, str] = None,
+        segments: Optional[List[dict]] = None
     ) -> Tuple[AnalysisResult, int, float]:
         """カウンセリング内容の包括分析
         
+        Args:
+            segments: 文字起こしセグメント（長文の分割にタイムスタンプ境界を使用）
+        
         Returns:
             Tuple[AnalysisResult, tokens_used, cost]
         """
@@ -58,14 +94,45 @@ class AnalysisService:
             # 前処理: テキストクリーニング
             cleaned_text = await self._preprocess_text(transcription_text)
             
+            # 送信前にトークン数を見積もり、予算超過ならモデル切り替え・切り詰め
+            self.budget_plan = self.token_budget.plan(
+                cleaned_text, analysis_type.value, self.model, focus_areas
+            )
+            if self.budget_plan.model != self.model:
+                logger.info(f"Analysis model downgraded to fit the budget: {self.model} -> {self.budget_plan.model}")
+                self.model = self.budget_plan.model
+            if "truncated" in self.budget_plan.actions:
+                # 切り詰めた本文とタイムスタンプは対応しないため文の境界で分割する
+                cleaned_text = self.budget_plan.text
+                segments = None
+            
+            # 長文はチャンクに分割して並列分析
+            chunks = self.chunker.split(cleaned_text, self._preprocess_segments(segments))
+            if len(chunks) > 1:
+                logger.info(f"Long transcript split into {len(chunks)} chunks ({len(cleaned_text)} chars)")
+            
             tokens_used = 0
             cost = 0.0
             
             # 分析実行
             if analysis_type == AnalysisType.FULL:
-                result, tokens, analysis_cost = await self._full_analysis(cleaned_text, custom_prompts)
+                if len(chunks) > 1:
+                    result, tokens, analysis_cost = await self._chunked_analysis(
+                        chunks, list(self.CATEGORY_WEIGHTS), custom_prompts, include_summary=True
+                    )
+                else:
+                    result, tokens, analysis_cost = await self._full_analysis(cleaned_text, custom_prompts)
+            elif analysis_type == AnalysisType.COMBINED:
+                if len(chunks) > 1:
+                    result, tokens, analysis_cost = await self._chunked_combined_analysis(chunks, custom_prompts)
+                else:
+                    result, tokens, analysis_cost = await self._combined_analysis(cleaned_text, custom_prompts)
             elif analysis_type == AnalysisType.QUICK:
                 result, tokens, analysis_cost = await self._quick_analysis(cleaned_text)
+            elif len(chunks) > 1:
+                result, tokens, analysis_cost = await self._chunked_analysis(
+                    chunks, focus_areas or [], custom_prompts, include_summary=False
+                )
             else:
                 result, tokens, analysis_cost = await self._specific_analysis(cleaned_text, focus_areas, custom_prompts)
             
@@ -75,6 +142,8 @@ class AnalysisService:
             logger.info(f"Analysis completed: tokens={tokens_used}, cost=${cost:.4f}")
             return result, tokens_used, cost
             
+        except TokenBudgetExceededError:
+            raise
         except Exception as e:
             logger.error(f"Analysis failed: {e}")
             raise Exception(f"分析処理エラー: {e}")
@@ -89,32 +158,14 @@ class AnalysisService:
             total_tokens = 0
             total_cost = 0.0
             
-            # 並列分析実行
-            tasks = []
-            
             # 各分析項目のタスクを作成
-            if custom_prompts and "questioning" in custom_prompts:
-                tasks.append(self._analyze_with_custom_prompt("questioning", text, custom_prompts["questioning"]))
-            else:
-                tasks.append(self._analyze_questioning(text))
-            
-            if custom_prompts and "anxiety_handling" in custom_prompts:
-                tasks.append(self._analyze_with_custom_prompt("anxiety_handling", text, custom_prompts["anxiety_handling"]))
-            else:
-                tasks.append(self._analyze_anxiety_handling(text))
-            
-            if custom_prompts and "closing" in custom_prompts:
-                tasks.append(self._analyze_with_custom_prompt("closing", text, custom_prompts["closing"]))
-            else:
-                tasks.append(self._analyze_closing(text))
-            
-            if custom_prompts and "flow" in custom_prompts:
-                tasks.append(self._analyze_with_custom_prompt("flow", text, custom_prompts["flow"]))
-            else:
-                tasks.append(self._analyze_flow(text))
+            tasks = [
+                self._analyze_category(category, text, custom_prompts)
+                for category in self.CATEGORY_WEIGHTS
+            ]
             
-            # 並列実行
-            results = await asyncio.gather(*tasks)
+            # 並列実行（prefix レイアウトでは先にプレフィックスをキャッシュさせてから）
+            results, total_tokens, total_cost = await self._gather_sharing_prefix([(text, tasks)])
             
             questioning = results[0][0]
             anxiety = results[1][0]
@@ -127,12 +178,7 @@ class AnalysisService:
                 total_cost += result[2]
             
             # 全体スコア計算
-            overall_score = (
-                questioning.score * 0.25 +
-                anxiety.score * 0.25 +
-                closing.score * 0.30 +
-                flow.score * 0.20
-            )
+            overall_score = self._calculate_overall_score(questioning, anxiety, closing, flow)
             
             # 包括的な要約と改善提案生成
             summary_tokens, summary_cost, session_summary, key_strengths, critical_improvements = await self._generate_comprehensive_analysis(
@@ -156,10 +202,397 @@ class AnalysisService:
             
             return result, total_tokens, total_cost
             
+        except TokenBudgetExceededError:
+            raise
         except Exception as e:
             logger.error(f"Full analysis failed: {e}")
             raise Exception(f"包括分析エラー: {e}")
 
+    async def _combined_analysis(
+        self,
+        text: str,
+        custom_prompts: Dict[str, str] = None
+    ) -> Tuple[AnalysisResult, int, float]:
+        """統合分析（4項目＋要約を1回のJSONスキーマ指定リクエストで取得）
+        
+        検証に失敗したセクションのみ項目別プロンプトで再問い合わせする。
+        """
+        try:
+            total_tokens = 0
+            total_cost = 0.0
+            sections = {}
+            
+            # カスタムプロンプト指定の項目は統合リクエストと並列に個別分析
+            custom_categories = [
+                category for category in self.SECTION_MODELS
+                if custom_prompts and category in custom_prompts
+            ]
+            prompt = self.prompt_service.get_combined_analysis_prompt(self._prompt_text(text))
+            outputs = await asyncio.gather(
+                self._call_openai_api(
+                    prompt,
+                    template_name="combined_analysis",
+                    response_format=self._combined_response_format(),
+                    transcript=text
+                ),
+                *[self._analyze_category(category, text, custom_prompts) for category in custom_categories]
+            )
+            
+            response, tokens, cost = outputs[0]
+            total_tokens += tokens
+            total_cost += cost
+            for category, (analysis, tokens, cost) in zip(custom_categories, outputs[1:]):
+                sections[category] = analysis
+                total_tokens += tokens
+                total_cost += cost
+            
+            # セクションごとに検証
+            result_data = self._parse_json_response(response)
+            failed = []
+            for category, model in self.SECTION_MODELS.items():
+                if category in sections:
+                    continue
+                try:
+                    sections[category] = model(**result_data[category])
+                except Exception as e:
+                    logger.warning(f"Combined analysis section '{category}' failed validation: {e}")
+                    failed.append(category)
+            
+            # 失敗したセクションのみ再問い合わせ
+            if failed:
+                requeries = await asyncio.gather(*[self._analyze_category(category, text) for category in failed])
+                for category, (analysis, tokens, cost) in zip(failed, requeries):
+                    sections[category] = analysis
+                    total_tokens += tokens
+                    total_cost += cost
+            
+            questioning = sections["questioning"]
+            anxiety = sections["anxiety_handling"]
+            closing = sections["closing"]
+            flow = sections["flow"]
+            
+            session_summary = result_data.get("session_summary")
+            key_strengths = result_data.get("key_strengths")
+            critical_improvements = result_data.get("critical_improvements")
+            if not isinstance(session_summary, str) or not session_summary \
+                    or not isinstance(key_strengths, list) or not isinstance(critical_improvements, list):
+                logger.warning("Combined analysis summary failed validation, re-querying")
+                summary_tokens, summary_cost, session_summary, key_strengths, critical_improvements = await self._generate_comprehensive_analysis(
+                    text, questioning, anxiety, closing, flow
+                )
+                total_tokens += summary_tokens
+                total_cost += summary_cost
+            
+            result = AnalysisResult(
+                overall_score=round(self._calculate_overall_score(questioning, anxiety, closing, flow), 2),
+                questioning=questioning,
+                anxiety_handling=anxiety,
+                closing=closing,
+                flow=flow,
+                session_summary=session_summary,
+                key_strengths=key_strengths,
+                critical_improvements=critical_improvements,
+                analyzed_at=datetime.utcnow()
+            )
+            
+            return result, total_tokens, total_cost
+            
+        except TokenBudgetExceededError:
+            raise
+        except Exception as e:
+            logger.error(f"Combined analysis failed: {e}")
+            raise Exception(f"統合分析エラー: {e}")
+
+    async def _chunked_combined_analysis(
+        self,
+        chunks: List[TranscriptChunk],
+        custom_prompts: Dict[str, str] = None
+    ) -> Tuple[AnalysisResult, int, float]:
+        """長文の統合分析（チャンクごとに統合分析してから統合）"""
+        try:
+            outputs = await asyncio.gather(*[
+                self._combined_analysis(chunk.text, custom_prompts) for chunk in chunks
+            ])
+            results = [output[0] for output in outputs]
+            
+            reduced = {
+                category: CATEGORY_REDUCERS[category]([getattr(r, category) for r in results], chunks)
+                for category in self.SECTION_MODELS
+            }
+            
+            result = AnalysisResult(
+                overall_score=round(self._calculate_overall_score(
+                    reduced["questioning"], reduced["anxiety_handling"], reduced["closing"], reduced["flow"]
+                ), 2),
+                questioning=reduced["questioning"],
+                anxiety_handling=reduced["anxiety_handling"],
+                closing=reduced["closing"],
+                flow=reduced["flow"],
+                session_summary=reduce_summaries([r.session_summary for r in results]),
+                key_strengths=merge_unique([r.key_strengths for r in results]),
+                critical_improvements=merge_unique([r.critical_improvements for r in results]),
+                analyzed_at=datetime.utcnow()
+            )
+            
+            return result, sum(output[1] for output in outputs), sum(output[2] for output in outputs)
+            
+        except TokenBudgetExceededError:
+            raise
+        except Exception as e:
+            logger.error(f"Chunked combined analysis failed: {e}")
+            raise Exception(f"分割統合分析エラー: {e}")
+
+    def _combined_response_format(self) -> dict:
+        """統合分析のJSONスキーマ（Structured Outputs）"""
+        string_list = {"type": "array", "items": {"type": "string"}}
+        properties = {
+            category: model.model_json_schema()
+            for category, model in self.SECTION_MODELS.items()
+        }
+        properties.update({
+            "session_summary": {"type": "string"},
+            "key_strengths": string_list,
+            "critical_improvements": string_list,
+        })
+        return {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "counseling_analysis",
+                "schema": {
+                    "type": "object",
+                    "properties": properties,
+                    "required": list(properties)
+                }
+            }
+        }
+
+    async def _chunked_analysis(
+        self,
+        chunks: List[TranscriptChunk],
+        categories: List[str],
+        custom_prompts: Dict[str, str] = None,
+        include_summary: bool = True
+    ) -> Tuple[AnalysisResult, int, float]:
+        """長文のチャンク分割分析（map-reduce）
+        
+        全チャンクの全項目を同時に投入するため、処理時間は最も遅いチャンクで決まる。
+        チャンク単位のプロンプトはLLMキャッシュに載るため、変更のないチャンクは再計算されない。
+        """
+        try:
+            total_tokens = 0
+            total_cost = 0.0
+            
+            # map: チャンク × 分析項目（＋要約）をすべて並列実行
+            groups = []
+            for chunk in chunks:
+                calls = [self._analyze_category(category, chunk.text, custom_prompts) for category in categories]
+                if include_summary:
+                    calls.append(self._generate_chunk_summary(chunk))
+                groups.append((chunk.text, calls))
+            
+            outputs, total_tokens, total_cost = await self._gather_sharing_prefix(groups)
+            
+            per_chunk = len(categories) + (1 if include_summary else 0)
+            category_results = {category: [] for category in categories}
+            summaries, strengths, improvements = [], [], []
+            
+            for chunk_index in range(len(chunks)):
+                row = outputs[chunk_index * per_chunk:(chunk_index + 1) * per_chunk]
+                for category, (analysis, tokens, cost) in zip(categories, row):
+                    category_results[category].append(analysis)
+                    total_tokens += tokens
+                    total_cost += cost
+                if include_summary:
+                    tokens, cost, summary, key_strengths, critical_improvements = row[-1]
+                    summaries.append(summary)
+                    strengths.append(key_strengths)
+                    improvements.append(critical_improvements)
+                    total_tokens += tokens
+                    total_cost += cost
+            
+            # reduce: 項目ごとにチャンク結果を統合
+            reduced = self._default_category_results()
+            for category in categories:
+                reduced[category] = CATEGORY_REDUCERS[category](category_results[category], chunks)
+            
+            if include_summary:
+                overall_score = self._calculate_overall_score(
+                    reduced["questioning"], reduced["anxiety_handling"], reduced["closing"], reduced["flow"]
+                )
+                session_summary = reduce_summaries(summaries)
+                key_strengths = merge_unique(strengths)
+                critical_improvements = merge_unique(improvements)
+            else:
+                scores = [reduced[category].score for category in categories]
+                overall_score = sum(scores) / len(scores) if scores else 5.0
+                session_summary = f"特定項目分析: {', '.join(categories)}"
+                key_strengths = [f"{area}の分析完了" for area in categories]
+                critical_improvements = ["特定項目分析のため包括的な改善提案は省略"]
+            
+            result = AnalysisResult(
+                overall_score=round(overall_score, 2),
+                questioning=reduced["questioning"],
+                anxiety_handling=reduced["anxiety_handling"],
+                closing=reduced["closing"],
+                flow=reduced["flow"],
+                session_summary=session_summary,
+                key_strengths=key_strengths,
+                critical_improvements=critical_improvements,
+                analyzed_at=datetime.utcnow()
+            )
+            
+            return result, total_tokens, total_cost
+            
+        except TokenBudgetExceededError:
+            raise
+        except Exception as e:
+            logger.error(f"Chunked analysis failed: {e}")
+            raise Exception(f"分割分析エラー: {e}")
+
+    async def _generate_chunk_summary(self, chunk: TranscriptChunk) -> Tuple[int, float, str, List[str], List[str]]:
+        """チャンク単位の要約・強み・改善点"""
+        prompt = self.prompt_service.get_comprehensive_analysis_prompt(self._prompt_text(chunk.text))
+        response, tokens, cost = await self._call_openai_api(prompt, transcript=chunk.text)
+        try:
+            result_data = self._parse_json_response(response)
+            
+            return (
+                tokens,
+                cost,
+                result_data.get("session_summary", ""),
+                result_data.get("key_strengths", []),
+                result_data.get("critical_improvements", [])
+            )
+            
+        except (ValueError, AttributeError) as e:
+            logger.error(f"Chunk summary failed for chunk {chunk.index}: {e}")
+            return tokens, cost, "", [], []
+
+    def _analyze_category(self, category: str, text: str, custom_prompts: Dict[str, str] = None):
+        """分析項目ごとの分析コルーチン"""
+        if custom_prompts and category in custom_prompts:
+            return self._analyze_with_custom_prompt(category, text, custom_prompts[category])
+        if category == "questioning":
+            return self._analyze_questioning(text)
+        if category == "anxiety_handling":
+            return self._analyze_anxiety_handling(text)
+        if category == "closing":
+            return self._analyze_closing(text)
+        if category == "flow":
+            return self._analyze_flow(text)
+        raise ValueError(f"Unknown analysis type: {category}")
+
+    def _prompt_text(self, text: str) -> str:
+        """プロンプトの指示部分に埋め込む文字起こし（prefix レイアウトでは参照文のみ）"""
+        return TRANSCRIPT_REFERENCE if self.prompt_layout == "prefix" else text
+
+    async def _gather_sharing_prefix(self, groups: List[Tuple[str, list]]) -> Tuple[list, int, float]:
+        """同じ文字起こしに対する呼び出しのグループを並列実行（結果はグループ順に平坦化）
+        
+        同時に送ると、どの呼び出しもプロバイダー側のキャッシュ作成前に処理されて入力が割引されない。
+        キャッシュ対象になる長さのグループは先に1トークンだけ生成する呼び出しでプレフィックスを
+        キャッシュさせてから本番の呼び出しを並列実行する。
+        
+        Returns:
+            Tuple[results, プライマーのtokens, プライマーのcost]
+        """
+        texts = [text for text, calls in groups if len(calls) > 1 and self._should_warm_prompt_cache(text)]
+        try:
+            primed = await asyncio.gather(*[self._prime_prompt_cache(text) for text in texts])
+        except Exception:
+            for _, calls in groups:
+                for call in calls:
+                    call.close()
+            raise
+        
+        results = await asyncio.gather(*[call for _, calls in groups for call in calls])
+        return list(results), sum(tokens for tokens, _ in primed), sum(cost for _, cost in primed)
+
+    async def _prime_prompt_cache(self, text: str) -> Tuple[int, float]:
+        """文字起こしのプレフィックスをプロバイダー側にキャッシュさせる（失敗しても分析は続行）"""
+        try:
+            response = await self.llm_gateway.chat_completion(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": self.prompt_service.get_transcript_system_prompt(text)},
+                    {"role": "user", "content": "準備ができたら OK とだけ返してください。"}
+                ],
+                max_tokens=1,
+                temperature=self.temperature
+            )
+        except Exception as e:
+            logger.warning(f"Prompt cache warm-up failed: {e}")
+            return 0, 0.0
+        
+        cost = self._calculate_cost(response.prompt_tokens, response.completion_tokens, response.cached_tokens)
+        self._record_usage(response, cost)
+        return response.total_tokens, cost
+
+    def _record_usage(self, response, cost: float) -> None:
+        self.total_tokens_used += response.total_tokens
+        self.total_prompt_tokens += response.prompt_tokens
+        self.total_completion_tokens += response.completion_tokens
+        self.total_cached_tokens += response.cached_tokens
+        self.total_cost += cost
+
+    @property
+    def usage(self) -> dict:
+        """このインスタンスでのAPI使用量（AnalysisTask に記録）"""
+        return {
+            "prompt_tokens": self.total_prompt_tokens,
+            "completion_tokens": self.total_completion_tokens,
+            "cached_tokens": self.total_cached_tokens,
+            "model": self.model,
+            "budget_action": self.budget_plan.action if self.budget_plan else None,
+        }
+
+    def _should_warm_prompt_cache(self, text: str) -> bool:
+        """プレフィックスがプロバイダーのキャッシュ対象（約1024トークン以上）になるか"""
+        return (
+            settings.PROMPT_CACHE_WARMUP
+            and self.prompt_layout == "prefix"
+            and self.llm_gateway.enabled
+            and len(self.prompt_service.get_transcript_system_prompt(text)) >= 1024
+        )
+
+    def _calculate_overall_score(
+        self,
+        questioning: QuestioningAnalysis,
+        anxiety: AnxietyHandlingAnalysis,
+        closing: ClosingAnalysis,
+        flow: FlowAnalysis
+    ) -> float:
+        """重み付き総合スコア"""
+        return (
+            questioning.score * self.CATEGORY_WEIGHTS["questioning"] +
+            anxiety.score * self.CATEGORY_WEIGHTS["anxiety_handling"] +
+            closing.score * self.CATEGORY_WEIGHTS["closing"] +
+            flow.score * self.CATEGORY_WEIGHTS["flow"]
+        )
+
+    def _default_category_results(self) -> dict:
+        """未分析項目のデフォルト値"""
+        return {
+            "questioning": QuestioningAnalysis(
+                score=5.0, open_question_ratio=0.5, customer_talk_time_ratio=0.5,
+                question_diversity=5, effective_questions=[], improvements=[]
+            ),
+            "anxiety_handling": AnxietyHandlingAnalysis(
+                score=5.0, anxiety_points_identified=[], empathy_expressions=0,
+                solution_specificity=0.5, anxiety_resolution_confirmed=False, improvements=[]
+            ),
+            "closing": ClosingAnalysis(
+                score=5.0, timing_appropriateness=0.5, urgency_creation=0.5,
+                limitation_usage=0.5, price_presentation_method="標準", objection_handling=[],
+                contract_probability=0.5, improvements=[]
+            ),
+            "flow": FlowAnalysis(
+                score=5.0, logical_structure=0.5, smooth_transitions=0.5,
+                customer_pace_consideration=0.5, key_point_emphasis=0.5,
+                session_satisfaction_prediction=0.5, improvements=[]
+            ),
+        }
+
     async def _quick_analysis(self, text: str) -> Tuple[AnalysisResult, int, float]:
         """クイック分析（簡易版）"""
         try:
@@ -241,6 +674,8 @@ class AnalysisService:
             
             return result, tokens, cost
             
+        except TokenBudgetExceededError:
+            raise
         except Exception as e:
             logger.error(f"Quick analysis failed: {e}")
             raise Exception(f"クイック分析エラー: {e}")
@@ -336,80 +771,84 @@ class AnalysisService:
             
             return result, total_tokens, total_cost
             
+        except TokenBudgetExceededError:
+            raise
         except Exception as e:
             logger.error(f"Specific analysis failed: {e}")
             raise Exception(f"特定項目分析エラー: {e}")
 
     async def _analyze_questioning(self, text: str) -> Tuple[QuestioningAnalysis, int, float]:
         """質問技法分析"""
+        prompt = self.prompt_service.get_questioning_prompt(self._prompt_text(text))
+        response, tokens, cost = await self._call_openai_api(prompt, template_name="questioning_analysis", transcript=text)
+        # API呼び出しの失敗（一時障害・予算超過）はジョブの再試行・失敗判定に委ね、
+        # フォールバックはJSON解析・検証の失敗に限る
         try:
-            prompt = self.prompt_service.get_questioning_prompt(text)
-            response, tokens, cost = await self._call_openai_api(prompt)
             result_data = self._parse_json_response(response)
             
             return QuestioningAnalysis(**result_data), tokens, cost
             
-        except Exception as e:
+        except (ValueError, TypeError) as e:
             logger.error(f"Questioning analysis failed: {e}")
             # フォールバック結果
             return QuestioningAnalysis(
                 score=5.0, open_question_ratio=0.5, customer_talk_time_ratio=0.5,
                 question_diversity=5, effective_questions=[], 
                 improvements=[f"分析エラー: {str(e)[:100]}"]
-            ), 0, 0.0
+            ), tokens, cost
 
     async def _analyze_anxiety_handling(self, text: str) -> Tuple[AnxietyHandlingAnalysis, int, float]:
         """不安対応分析"""
+        prompt = self.prompt_service.get_anxiety_prompt(self._prompt_text(text))
+        response, tokens, cost = await self._call_openai_api(prompt, template_name="anxiety_analysis", transcript=text)
         try:
-            prompt = self.prompt_service.get_anxiety_prompt(text)
-            response, tokens, cost = await self._call_openai_api(prompt)
             result_data = self._parse_json_response(response)
             
             return AnxietyHandlingAnalysis(**result_data), tokens, cost
             
-        except Exception as e:
+        except (ValueError, TypeError) as e:
             logger.error(f"Anxiety handling analysis failed: {e}")
             return AnxietyHandlingAnalysis(
                 score=5.0, anxiety_points_identified=[], empathy_expressions=0,
                 solution_specificity=0.5, anxiety_resolution_confirmed=False,
                 improvements=[f"分析エラー: {str(e)[:100]}"]
-            ), 0, 0.0
+            ), tokens, cost
 
     async def _analyze_closing(self, text: str) -> Tuple[ClosingAnalysis, int, float]:
         """クロージング分析"""
+        prompt = self.prompt_service.get_closing_prompt(self._prompt_text(text))
+        response, tokens, cost = await self._call_openai_api(prompt, template_name="closing_analysis", transcript=text)
         try:
-            prompt = self.prompt_service.get_closing_prompt(text)
-            response, tokens, cost = await self._call_openai_api(prompt)
             result_data = self._parse_json_response(response)
             
             return ClosingAnalysis(**result_data), tokens, cost
             
-        except Exception as e:
+        except (ValueError, TypeError) as e:
             logger.error(f"Closing analysis failed: {e}")
             return ClosingAnalysis(
                 score=5.0, timing_appropriateness=0.5, urgency_creation=0.5,
                 limitation_usage=0.5, price_presentation_method="標準",
                 objection_handling=[], contract_probability=0.5,
                 improvements=[f"分析エラー: {str(e)[:100]}"]
-            ), 0, 0.0
+            ), tokens, cost
 
     async def _analyze_flow(self, text: str) -> Tuple[FlowAnalysis, int, float]:
         """トーク流れ分析"""
+        prompt = self.prompt_service.get_flow_prompt(self._prompt_text(text))
+        response, tokens, cost = await self._call_openai_api(prompt, template_name="flow_analysis", transcript=text)
         try:
-            prompt = self.prompt_service.get_flow_prompt(text)
-            response, tokens, cost = await self._call_openai_api(prompt)
             result_data = self._parse_json_response(response)
             
             return FlowAnalysis(**result_data), tokens, cost
             
-        except Exception as e:
+        except (ValueError, TypeError) as e:
             logger.error(f"Flow analysis failed: {e}")
             return FlowAnalysis(
                 score=5.0, logical_structure=0.5, smooth_transitions=0.5,
                 customer_pace_consideration=0.5, key_point_emphasis=0.5,
                 session_satisfaction_prediction=0.5,
                 improvements=[f"分析エラー: {str(e)[:100]}"]
-            ), 0, 0.0
+            ), tokens, cost
 
     async def _analyze_with_custom_prompt(
         self, 
@@ -419,8 +858,11 @@ class AnalysisService:
     ) -> Tuple[any, int, float]:
         """カスタムプロンプトによる分析"""
         try:
-            full_prompt = f"{custom_prompt}\n\n【文字起こし】\n{text}"
-            response, tokens, cost = await self._call_openai_api(full_prompt)
+            if self.prompt_layout == "prefix":
+                full_prompt = custom_prompt
+            else:
+                full_prompt = f"{custom_prompt}\n\n【文字起こし】\n{text}"
+            response, tokens, cost = await self._call_openai_api(full_prompt, transcript=text)
             result_data = self._parse_json_response(response)
             
             # 分析タイプに応じて適切なクラスを返す
@@ -448,9 +890,9 @@ class AnalysisService:
         flow: FlowAnalysis
     ) -> Tuple[int, float, str, List[str], List[str]]:
         """包括的な要約と改善提案生成"""
+        prompt = self.prompt_service.get_comprehensive_analysis_prompt(self._prompt_text(text))
+        response, tokens, cost = await self._call_openai_api(prompt, transcript=text)
         try:
-            prompt = self.prompt_service.get_comprehensive_analysis_prompt(text)
-            response, tokens, cost = await self._call_openai_api(prompt)
             result_data = self._parse_json_response(response)
             
             session_summary = result_data.get("session_summary", "要約生成に失敗しました")
@@ -459,92 +901,111 @@ class AnalysisService:
             
             return tokens, cost, session_summary, key_strengths, critical_improvements
             
-        except Exception as e:
+        except (ValueError, AttributeError) as e:
             logger.error(f"Comprehensive analysis generation failed: {e}")
-            return 0, 0.0, "要約生成エラー", ["分析完了"], ["詳細分析が必要"]
+            return tokens, cost, "要約生成エラー", ["分析完了"], ["詳細分析が必要"]
 
-    async def _call_openai_api(self, prompt: str) -> Tuple[str, int, float]:
-        """OpenAI API呼び出し"""
+    async def _call_openai_api(
+        self,
+        prompt: str,
+        template_name: Optional[str] = None,
+        response_format: Optional[dict] = None,
+        transcript: Optional[str] = None
+    ) -> Tuple[str, int, float]:
+        """OpenAI API呼び出し
+        
+        Args:
+            prompt: レンダリング済みプロンプト
+            template_name: 使用テンプレート名（キャッシュキーにバージョンを含める）
+            response_format: レスポンス形式（デフォルトはJSONオブジェクト）
+            transcript: 分析対象の文字起こし（prefix レイアウトではシステムメッセージの末尾に置く）
+        """
         try:
-            if not settings.OPENAI_API_KEY:
+            if not self.llm_gateway.enabled:
                 # 開発環境用のダミーレスポンス
                 logger.warning("OpenAI API key not provided, using dummy response")
-                return self._create_dummy_response(prompt), 0, 0.0
+                return self._create_dummy_response(prompt, response_format), 0, 0.0
+            
+            if transcript is not None and self.prompt_layout == "prefix":
+                # 不変部分（システム＋文字起こし）を先頭に、項目ごとの指示を最後に置く
+                system_prompt = self.prompt_service.get_transcript_system_prompt(transcript)
+            else:
+                system_prompt = self.prompt_service.get_system_prompt()
+            
+            # キャッシュ確認（ヒット時はAPIを呼ばないためトークン・コストは0）
+            cache_key = build_cache_key(
+                self.model,
+                system_prompt,
+                prompt,
+                self.temperature,
+                self.prompt_service.get_template_version(template_name) if template_name else None
+            )
+            if self.use_cache:
+                cached = await self.llm_cache.get(cache_key)
+                if cached:
+                    return cached["content"], 0, 0.0
+            else:
+                await self.llm_cache.record_bypass()
             
             messages = [
-                {"role": "system", "content": self.prompt_service.get_system_prompt()},
+                {"role": "system", "content": system_prompt},
                 {"role": "user", "content": prompt}
             ]
             
-            response = self.openai_client.chat.completions.create(
+            # コンテキスト長を超えるリクエストは送らない
+            prompt_tokens = check_request_fits(messages, self.model, self.max_tokens)
+            
+            response = await self.llm_gateway.chat_completion(
                 model=self.model,
                 messages=messages,
                 max_tokens=self.max_tokens,
                 temperature=self.temperature,
-                response_format={"type": "json_object"}
+                response_format=response_format or {"type": "json_object"},
+                estimated_prompt_tokens=prompt_tokens
             )
             
-            content = response.choices[0].message.content
-            tokens_used = response.usage.total_tokens
+            content = response.content
+            tokens_used = response.total_tokens
             
-            # コスト計算（概算）
-            cost = self._calculate_cost(tokens_used)
+            # コスト計算（キャッシュ済み入力は割引単価）
+            cost = self._calculate_cost(response.prompt_tokens, response.completion_tokens, response.cached_tokens)
             
-            self.total_tokens_used += tokens_used
-            self.total_cost += cost
+            self._record_usage(response, cost)
+            
+            await self.llm_cache.set(cache_key, content, tokens_used, cost, self.model)
             
             return content, tokens_used, cost
             
+        except TokenBudgetExceededError:
+            raise
         except Exception as e:
             logger.error(f"OpenAI API call failed: {e}")
             raise Exception(f"OpenAI API呼び出しエラー: {e}")
 
-    def _calculate_cost(self, tokens_used: int) -> float:
-        """コスト計算（2025年最新料金）"""
-        
-        # モデル別料金設定（2025年4月時点）
-        if "gpt-4.1-mini" in self.model:
-            # GPT-4.1 Mini料金
-            input_cost_per_1k = 0.0004   # $0.40 per 1M tokens = $0.0004 per 1K
-            output_cost_per_1k = 0.0016  # $1.60 per 1M tokens = $0.0016 per 1K
-        elif "gpt-4.1" in self.model:
-            # GPT-4.1料金
-            input_cost_per_1k = 0.002    # $2.00 per 1M tokens = $0.002 per 1K
-            output_cost_per_1k = 0.008   # $8.00 per 1M tokens = $0.008 per 1K
-        elif "gpt-4o" in self.model:
-            # GPT-4o料金（マルチモーダル）
-            input_cost_per_1k = 0.005    # $5.00 per 1M tokens = $0.005 per 1K
-            output_cost_per_1k = 0.015   # $15.00 per 1M tokens = $0.015 per 1K
-        else:
-            # デフォルト（GPT-4.1 Mini相当）
-            input_cost_per_1k = 0.0004
-            output_cost_per_1k = 0.0016
-        
-        # 簡易計算（入力と出力を半々と仮定）
-        return (tokens_used / 1000) * ((input_cost_per_1k + output_cost_per_1k) / 2)
+    def _calculate_cost(self, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+        """コスト計算（入力・キャッシュ済み入力・出力を分けてモデル別の単価で計算）"""
+        return estimate_cost(self.model, prompt_tokens, completion_tokens, cached_tokens)
 
-    def _create_dummy_response(self, prompt: str) -> str:
+    def _create_dummy_response(self, prompt: str, response_format: Optional[dict] = None) -> str:
         """開発用のダミーレスポンス"""
-        if "questioning" in prompt.lower():
-            return json.dumps({
+        sections = {
+            "questioning": {
                 "score": 7.5,
                 "open_question_ratio": 0.6,
                 "customer_talk_time_ratio": 0.7,
                 "question_diversity": 8,
                 "effective_questions": ["どのような点がご不安ですか？", "他にご質問はございますか？"],
                 "improvements": ["より具体的な質問を増やす", "顧客の感情に寄り添う質問を追加"]
-            })
-        elif "anxiety" in prompt.lower():
-            return json.dumps({
+            },
+            "anxiety_handling": {
                 "score": 8.2,
                 "anxiety_points_identified": ["痛みへの不安", "料金への心配"],
                 "empathy_expressions": 5,
                 "solution_specificity": 0.8,
                 "anxiety_resolution_confirmed": True,
                 "improvements": ["具体的な事例を使った説明を増やす"]
-            })
-        elif "closing" in prompt.lower():
-            return json.dumps({
+            },
+            "closing": {
                 "score": 6.8,
                 "timing_appropriateness": 0.7,
                 "urgency_creation": 0.5,
@@ -553,9 +1014,8 @@ class AnalysisService:
                 "objection_handling": ["料金に関する懸念への対応"],
                 "contract_probability": 0.75,
                 "improvements": ["限定性をより効果的に活用", "価格提示のタイミング調整"]
-            })
-        elif "flow" in prompt.lower():
-            return json.dumps({
+            },
+            "flow": {
                 "score": 7.9,
                 "logical_structure": 0.8,
                 "smooth_transitions": 0.7,
@@ -563,36 +1023,58 @@ class AnalysisService:
                 "key_point_emphasis": 0.6,
                 "session_satisfaction_prediction": 0.85,
                 "improvements": ["重要ポイントの強調を改善"]
-            })
-        else:
-            return json.dumps({
-                "session_summary": "開発環境用のダミー分析結果です。顧客のニーズを適切に把握し、不安に対して丁寧に対応されていました。",
-                "key_strengths": ["丁寧な説明", "顧客ペースに配慮", "専門知識の活用"],
-                "critical_improvements": ["クロージングの強化", "限定性の活用", "価格提示の改善"],
-                "overall_score": 7.2
-            })
+            },
+        }
+        summary = {
+            "session_summary": "開発環境用のダミー分析結果です。顧客のニーズを適切に把握し、不安に対して丁寧に対応されていました。",
+            "key_strengths": ["丁寧な説明", "顧客ペースに配慮", "専門知識の活用"],
+            "critical_improvements": ["クロージングの強化", "限定性の活用", "価格提示の改善"],
+        }
+        
+        # 統合分析（JSONスキーマ指定）
+        if response_format and response_format.get("type") == "json_schema":
+            return json.dumps({**sections, **summary})
+        
+        # 項目別プロンプトはテンプレート内のJSONキーで判定
+        markers = {
+            "questioning": "open_question_ratio",
+            "anxiety_handling": "anxiety_points_identified",
+            "closing": "timing_appropriateness",
+            "flow": "logical_structure",
+        }
+        lowered = prompt.lower()
+        for category, marker in markers.items():
+            if marker in prompt or category.split("_")[0] in lowered:
+                return json.dumps(sections[category])
+        
+        return json.dumps({**summary, "overall_score": 7.2})
 
     async def _preprocess_text(self, text: str) -> str:
-        """テキスト前処理"""
+        """テキスト前処理（長文は切り詰めずにチャンク分割で扱う）"""
         if not text:
             return ""
         
         # 基本的なクリーニング
         cleaned = text.strip()
         
-        # 個人情報のマスキング（簡易版）
+        return self._mask_personal_info(cleaned)
+
+    def _preprocess_segments(self, segments: Optional[List[dict]]) -> Optional[List[dict]]:
+        """セグメントのテキストにも同じマスキングを適用"""
+        if not segments:
+            return None
+        return [
+            {**segment, "text": self._mask_personal_info(segment.get("text") or "")}
+            for segment in segments
+        ]
+
+    def _mask_personal_info(self, text: str) -> str:
+        """個人情報のマスキング（簡易版）"""
         # 電話番号のマスキング
-        cleaned = re.sub(r'\d{2,4}-\d{2,4}-\d{4}', '[電話番号]', cleaned)
+        text = re.sub(r'\d{2,4}-\d{2,4}-\d{4}', '[電話番号]', text)
         # メールアドレスのマスキング
-        cleaned = re.sub(r'\S+@\S+\.\S+', '[メールアドレス]', cleaned)
-        
-        # 過度に長いテキストの制限（GPT-4のコンテキスト制限を考慮）
-        max_length = 8000  # 約8000文字まで
-        if len(cleaned) > max_length:
-            cleaned = cleaned[:max_length] + "...[テキストが制限により切り詰められました]"
-            logger.warning(f"Text truncated from {len(text)} to {max_length} characters")
-        
-        return cleaned
+        text = re.sub(r'\S+@\S+\.\S+', '[メールアドレス]', text)
+        return text
 
     def _parse_json_response(self, response: str) -> dict:
         """JSONレスポンスのパース"""
@@ -629,11 +1111,17 @@ class AnalysisService:
         
         return response
 
-    def get_analysis_statistics(self) -> dict:
+    async def get_analysis_statistics(self) -> dict:
         """分析統計情報の取得"""
         return {
             "total_tokens_used": self.total_tokens_used,
+            "total_prompt_tokens": self.total_prompt_tokens,
+            "total_completion_tokens": self.total_completion_tokens,
+            "total_cached_tokens": self.total_cached_tokens,
+            "prompt_layout": self.prompt_layout,
             "total_cost": round(self.total_cost, 4),
             "model": self.model,
-            "service_status": "active" if settings.OPENAI_API_KEY else "development_mode"
+            "service_status": "active" if self.llm_gateway.enabled else "development_mode",
+            "gateway": self.llm_gateway.get_statistics(),
+            "cache": await self.llm_cache.get_statistics()
         }
\ No newline at end of file
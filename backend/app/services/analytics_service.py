@@ -3,24 +3,46 @@ Analytics service for dashboard data processing and aggregation
 """
 from typing import Dict, List, Optional, Union, Tuple
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc, and_, or_, case
+from sqlalchemy import func, desc, and_, or_, case, cast, select, literal_column, DateTime, Float
 import json
 
 from app.models.session import Session as SessionModel, SessionStatus
-from app.models.analysis import AnalysisTask
+from app.models.analysis import AnalysisTask, CATEGORY_SCORE_COLUMNS
 from app.models.customer import Customer
 from app.models.user import User
 from app.models.clinic import Clinic
+from app.models.rollup import DailySessionRollup
+from app.core.config import settings
+from app.services.rollup_service import to_rollup_day
 from app.schemas.dashboard import (
     ExecutiveDashboard, CounselorDashboard, OperationDashboard,
     KPIMetrics, TrendData, PerformanceData, HealthStatus,
-    VolumeData, QualityMetrics, DashboardFilters
+    VolumeData, QualityMetrics, DashboardFilters, TrendDirection,
+    TeamDashboard, TeamMemberDashboard
 )
 
 logger = logging.getLogger(__name__)
 
+# granularity → date_trunc の単位
+TREND_BUCKET_UNITS = {
+    "hourly": "hour",
+    "daily": "day",
+    "weekly": "week",
+    "monthly": "month",
+}
+# これ未満の変化は横ばいとみなす
+TREND_STABLE_THRESHOLD = 1e-6
+# スキルカテゴリの表示名
+SKILL_NAMES = {
+    "questioning": "質問技法",
+    "anxiety_handling": "不安対応",
+    "closing": "クロージング",
+    "flow": "トーク流れ"
+}
+
 class AnalyticsService:
     """分析・統計サービス"""
     
@@ -64,29 +86,79 @@ class AnalyticsService:
     ) -> CounselorDashboard:
         """カウンセラーダッシュボードデータ取得"""
         try:
-            # 基本統計
-            counselor_stats = await self._calculate_counselor_stats(counselor_id, filters)
-            
-            # スキル分析
-            skill_breakdown = await self._calculate_skill_breakdown(counselor_id, filters)
-            
-            # 最近のパフォーマンス
-            recent_performance = await self._get_recent_performance(counselor_id, filters)
+            dashboards = await self._build_counselor_dashboards([counselor_id], filters)
+            return dashboards[str(counselor_id)]
             
-            # 個別推奨事項
-            recommendations = await self._generate_personalized_recommendations(counselor_id, filters)
+        except Exception as e:
+            logger.error(f"Failed to get counselor dashboard: {e}")
+            raise Exception(f"カウンセラーダッシュボード取得エラー: {e}")
+    
+    async def get_team_dashboard(
+        self,
+        clinic_id: str,
+        filters: DashboardFilters
+    ) -> TeamDashboard:
+        """チームダッシュボード（クリニック内の全カウンセラーをまとめて集計）"""
+        try:
+            counselors = self.db.query(User.id, User.name).filter(
+                User.clinic_id == clinic_id,
+                User.role == "counselor",
+                User.is_active == True
+            ).order_by(User.name).all()
+            
+            dashboards = await self._build_counselor_dashboards(
+                [str(counselor.id) for counselor in counselors], filters
+            )
             
-            return CounselorDashboard(
-                counselor_stats=counselor_stats,
-                skill_breakdown=skill_breakdown,
-                recent_performance=recent_performance,
-                personalized_recommendations=recommendations,
+            return TeamDashboard(
+                clinic_id=str(clinic_id),
+                counselors=[
+                    TeamMemberDashboard(
+                        counselor_id=str(counselor.id),
+                        counselor_name=counselor.name,
+                        dashboard=dashboards[str(counselor.id)]
+                    )
+                    for counselor in counselors
+                ],
                 generated_at=datetime.utcnow()
             )
             
         except Exception as e:
-            logger.error(f"Failed to get counselor dashboard: {e}")
-            raise Exception(f"カウンセラーダッシュボード取得エラー: {e}")
+            logger.error(f"Failed to get team dashboard: {e}")
+            raise Exception(f"チームダッシュボード取得エラー: {e}")
+    
+    async def _build_counselor_dashboards(
+        self,
+        counselor_ids: List[str],
+        filters: DashboardFilters
+    ) -> Dict[str, CounselorDashboard]:
+        """複数カウンセラーのダッシュボード（各集計はカウンセラー数に関係なく1クエリ）"""
+        counselor_ids = [str(counselor_id) for counselor_id in counselor_ids]
+        if not counselor_ids:
+            return {}
+        
+        # 基本統計
+        counselor_stats = await self._batch_counselor_stats(counselor_ids, filters)
+        
+        # スキル分析（推奨事項でも再利用）
+        skill_breakdowns = await self._batch_skill_breakdowns(counselor_ids, filters)
+        
+        # 最近のパフォーマンス
+        recent_performance = await self._batch_recent_performance(counselor_ids, filters)
+        
+        generated_at = datetime.utcnow()
+        return {
+            counselor_id: CounselorDashboard(
+                counselor_stats=counselor_stats[counselor_id],
+                skill_breakdown=skill_breakdowns[counselor_id],
+                recent_performance=recent_performance.get(counselor_id, []),
+                personalized_recommendations=self._build_recommendations(
+                    skill_breakdowns[counselor_id], counselor_stats[counselor_id]
+                ),
+                generated_at=generated_at
+            )
+            for counselor_id in counselor_ids
+        }
     
     async def get_operation_dashboard(self) -> OperationDashboard:
         """オペレーションダッシュボードデータ取得"""
@@ -111,27 +183,85 @@ class AnalyticsService:
             logger.error(f"Failed to get operation dashboard: {e}")
             raise Exception(f"オペレーションダッシュボード取得エラー: {e}")
     
+    def _scoped_session_query(self, query, filters: DashboardFilters):
+        """期間・クリニック・カウンセラーの共通フィルター"""
+        query = query.filter(
+            SessionModel.session_date >= filters.start_date,
+            SessionModel.session_date <= filters.end_date,
+            SessionModel.is_deleted == False
+        )
+        
+        # クリニックフィルター
+        if filters.clinic_id:
+            query = query.join(Customer, SessionModel.customer_id == Customer.id).filter(
+                Customer.clinic_id == filters.clinic_id
+            )
+        
+        # カウンセラーフィルター
+        if filters.counselor_id:
+            query = query.filter(SessionModel.counselor_id == filters.counselor_id)
+        
+        return query
+    
+    def _use_rollups(self, filters: DashboardFilters, bucketed: bool = False) -> bool:
+        """日次ロールアップで集計できるか
+        
+        ロールアップは ROLLUP_TIME_ZONE の日単位なので、期間は現地日付に丸められる。
+        バケット集計は日以上の粒度かつ同じタイムゾーンの場合のみ。
+        """
+        if not settings.DASHBOARD_USE_ROLLUPS:
+            return False
+        if bucketed:
+            return filters.granularity != "hourly" and filters.time_zone == settings.ROLLUP_TIME_ZONE
+        return True
+    
+    def _scoped_rollup_query(self, query, filters: DashboardFilters, start_date: Optional[datetime] = None):
+        """ロールアップ用の期間・クリニック・カウンセラーフィルター"""
+        rollup = DailySessionRollup
+        query = query.filter(
+            rollup.day >= to_rollup_day(start_date or filters.start_date),
+            rollup.day <= to_rollup_day(filters.end_date)
+        )
+        
+        if filters.clinic_id:
+            query = query.filter(rollup.clinic_id == filters.clinic_id)
+        
+        if filters.counselor_id:
+            query = query.filter(rollup.counselor_id == filters.counselor_id)
+        
+        return query
+    
+    @staticmethod
+    def _rollup_average(sum_column, count_column):
+        """ロールアップの合計・件数から平均を計算する式"""
+        return func.sum(sum_column) / func.nullif(func.sum(count_column), 0)
+    
     async def _calculate_kpis(self, filters: DashboardFilters) -> KPIMetrics:
-        """KPI計算"""
+        """KPI計算（1回の集計クエリでスカラーのみ取得）"""
         try:
-            # 基本クエリ
-            query = self.db.query(SessionModel).filter(
-                SessionModel.session_date >= filters.start_date,
-                SessionModel.session_date <= filters.end_date,
-                SessionModel.is_deleted == False
-            )
-            
-            # クリニックフィルター
-            if filters.clinic_id:
-                query = query.join(Customer).filter(Customer.clinic_id == filters.clinic_id)
-            
-            # カウンセラーフィルター
-            if filters.counselor_id:
-                query = query.filter(SessionModel.counselor_id == filters.counselor_id)
-            
-            sessions = query.all()
+            if self._use_rollups(filters):
+                rollup = DailySessionRollup
+                query = self.db.query(
+                    func.sum(rollup.session_count).label("total_sessions"),
+                    func.sum(rollup.completed_count).label("completed_sessions"),
+                    func.sum(rollup.high_score_count).label("high_score_sessions"),
+                    func.sum(rollup.satisfied_count).label("satisfied_sessions"),
+                    self._rollup_average(rollup.score_sum, rollup.scored_count).label("average_score")
+                )
+                row = self._scoped_rollup_query(query, filters).one()
+            else:
+                score = SessionModel.overall_score
+                query = self.db.query(
+                    func.count(SessionModel.id).label("total_sessions"),
+                    func.count(case((SessionModel.status == SessionStatus.COMPLETED, 1))).label("completed_sessions"),
+                    func.count(case((score >= 8.0, 1))).label("high_score_sessions"),
+                    func.count(case((score >= 7.0, 1))).label("satisfied_sessions"),
+                    func.avg(score).label("average_score")
+                )
+                row = self._scoped_session_query(query, filters).one()
+            total_sessions = row.total_sessions or 0
             
-            if not sessions:
+            if not total_sessions:
                 return KPIMetrics(
                     conversion_rate=0.0,
                     average_session_score=0.0,
@@ -141,24 +271,17 @@ class AnalyticsService:
                     completed_sessions=0
                 )
             
-            # KPI計算
-            total_sessions = len(sessions)
-            completed_sessions = len([s for s in sessions if s.status == SessionStatus.COMPLETED])
-            high_score_sessions = len([s for s in sessions if s.overall_score and s.overall_score >= 8.0])
-            
             # 成約率（仮：高スコア = 成約と仮定）
-            conversion_rate = high_score_sessions / total_sessions if total_sessions > 0 else 0.0
+            conversion_rate = row.high_score_sessions / total_sessions
             
-            # 平均セッションスコア
-            scores = [s.overall_score for s in sessions if s.overall_score is not None]
-            average_session_score = sum(scores) / len(scores) if scores else 0.0
+            # 平均セッションスコア（未分析のセッションは除外）
+            average_session_score = float(row.average_score or 0.0)
             
             # 月間売上（仮の計算）
-            monthly_revenue = high_score_sessions * 150000  # 仮：成約1件15万円
+            monthly_revenue = row.high_score_sessions * 150000  # 仮：成約1件15万円
             
             # 顧客満足度（分析スコアから推定）
-            satisfaction_scores = [s.overall_score for s in sessions if s.overall_score and s.overall_score >= 7.0]
-            customer_satisfaction = (len(satisfaction_scores) / total_sessions * 10) if total_sessions > 0 else 0.0
+            customer_satisfaction = row.satisfied_sessions / total_sessions * 10
             
             return KPIMetrics(
                 conversion_rate=round(conversion_rate, 3),
@@ -166,7 +289,7 @@ class AnalyticsService:
                 monthly_revenue=monthly_revenue,
                 customer_satisfaction=round(customer_satisfaction, 2),
                 total_sessions=total_sessions,
-                completed_sessions=completed_sessions
+                completed_sessions=row.completed_sessions or 0
             )
             
         except Exception as e:
@@ -181,67 +304,97 @@ class AnalyticsService:
             )
     
     async def _calculate_trends(self, filters: DashboardFilters) -> Dict[str, List[TrendData]]:
-        """トレンド分析"""
+        """トレンド分析（1回の GROUP BY date_trunc クエリで全系列を取得）
+        
+        バケットは filters.time_zone の現地時刻で区切り、セッションのない
+        バケットも generate_series で0として埋める。前バケットとの差分は
+        LAG ウィンドウ関数で計算する。
+        """
         try:
-            trends = {}
-            
-            # 日別データを取得
-            start_date = filters.start_date
-            end_date = filters.end_date
-            current_date = start_date
-            
-            conversion_trend = []
-            score_trend = []
-            revenue_trend = []
-            
-            while current_date <= end_date:
-                next_date = current_date + timedelta(days=1)
-                
-                # その日のセッションを取得
-                daily_query = self.db.query(SessionModel).filter(
-                    SessionModel.session_date >= current_date,
-                    SessionModel.session_date < next_date,
-                    SessionModel.is_deleted == False
-                )
-                
-                if filters.clinic_id:
-                    daily_query = daily_query.join(Customer).filter(Customer.clinic_id == filters.clinic_id)
-                
-                daily_sessions = daily_query.all()
-                
-                if daily_sessions:
-                    # 日別メトリクス計算
-                    total = len(daily_sessions)
-                    high_score = len([s for s in daily_sessions if s.overall_score and s.overall_score >= 8.0])
-                    scores = [s.overall_score for s in daily_sessions if s.overall_score is not None]
-                    
-                    daily_conversion = high_score / total if total > 0 else 0.0
-                    daily_avg_score = sum(scores) / len(scores) if scores else 0.0
-                    daily_revenue = high_score * 150000
-                    
-                    conversion_trend.append(TrendData(
-                        date=current_date,
-                        value=daily_conversion,
-                        change_from_previous=0.0  # 簡略化
-                    ))
-                    
-                    score_trend.append(TrendData(
-                        date=current_date,
-                        value=daily_avg_score,
-                        change_from_previous=0.0
+            unit = TREND_BUCKET_UNITS[filters.granularity]
+            zone = ZoneInfo(filters.time_zone)
+            
+            # session_date はUTCのnaive timestampなので、現地時刻に変換してから切り捨てる
+            def to_local(value):
+                return func.timezone(filters.time_zone, func.timezone("UTC", value))
+            
+            def utc_naive(value: datetime) -> datetime:
+                if value.tzinfo is not None:
+                    value = value.astimezone(timezone.utc).replace(tzinfo=None)
+                return value
+            
+            if self._use_rollups(filters, bucketed=True):
+                rollup = DailySessionRollup
+                bucket = func.date_trunc(unit, cast(rollup.day, DateTime))
+                aggregated = self._scoped_rollup_query(
+                    self.db.query(
+                        bucket.label("bucket"),
+                        func.sum(rollup.session_count).label("total_sessions"),
+                        func.sum(rollup.high_score_count).label("high_score_sessions"),
+                        self._rollup_average(rollup.score_sum, rollup.scored_count).label("average_score")
+                    ),
+                    filters
+                ).group_by(bucket).subquery("aggregated")
+            else:
+                bucket = func.date_trunc(unit, to_local(SessionModel.session_date))
+                score = SessionModel.overall_score
+                aggregated = self._scoped_session_query(
+                    self.db.query(
+                        bucket.label("bucket"),
+                        func.count(SessionModel.id).label("total_sessions"),
+                        func.count(case((score >= 8.0, 1))).label("high_score_sessions"),
+                        func.avg(score).label("average_score")
+                    ),
+                    filters
+                ).group_by(bucket).subquery("aggregated")
+            
+            # 期間内のすべてのバケット（ギャップ埋め）
+            first_bucket = func.date_trunc(unit, to_local(cast(utc_naive(filters.start_date), DateTime)))
+            last_bucket = func.date_trunc(unit, to_local(cast(utc_naive(filters.end_date), DateTime)))
+            buckets = select(
+                func.generate_series(
+                    first_bucket, last_bucket, literal_column(f"interval '1 {unit}'")
+                ).label("bucket")
+            ).subquery("buckets")
+            
+            total = func.coalesce(aggregated.c.total_sessions, 0)
+            high_score = func.coalesce(aggregated.c.high_score_sessions, 0)
+            conversion = func.coalesce(cast(high_score, Float) / func.nullif(total, 0), 0.0)
+            average_score = func.coalesce(cast(aggregated.c.average_score, Float), 0.0)
+            revenue = cast(high_score * 150000, Float)  # 仮：成約1件15万円
+            
+            window = {"order_by": buckets.c.bucket}
+            
+            def with_change(value, name: str):
+                previous = func.lag(value).over(**window)
+                return [value.label(name), (value - func.coalesce(previous, value)).label(f"{name}_change")]
+            
+            rows = self.db.execute(
+                select(
+                    buckets.c.bucket,
+                    *with_change(conversion, "conversion"),
+                    *with_change(average_score, "score"),
+                    *with_change(revenue, "revenue")
+                ).select_from(
+                    buckets.outerjoin(aggregated, aggregated.c.bucket == buckets.c.bucket)
+                ).order_by(buckets.c.bucket)
+            ).all()
+            
+            trends = {"conversion_trend": [], "score_trend": [], "revenue_trend": []}
+            for row in rows:
+                bucket_start = row.bucket.replace(tzinfo=zone)
+                for key, name, digits in (
+                    ("conversion_trend", "conversion", 3),
+                    ("score_trend", "score", 2),
+                    ("revenue_trend", "revenue", 0)
+                ):
+                    change = float(getattr(row, f"{name}_change") or 0.0)
+                    trends[key].append(TrendData(
+                        date=bucket_start,
+                        value=round(float(getattr(row, name) or 0.0), digits),
+                        change_from_previous=round(change, digits),
+                        trend_direction=self._trend_direction(change)
                     ))
-                    
-                    revenue_trend.append(TrendData(
-                        date=current_date,
-                        value=daily_revenue,
-                        change_from_previous=0.0
-                    ))
-                
-                current_date = next_date
-            
-            trends["conversion_trend"] = conversion_trend
-            trends["score_trend"] = score_trend
-            trends["revenue_trend"] = revenue_trend
             
             return trends
             
@@ -249,9 +402,19 @@ class AnalyticsService:
             logger.error(f"Failed to calculate trends: {e}")
             return {}
     
+    @staticmethod
+    def _trend_direction(change: float) -> TrendDirection:
+        """前バケットとの差分からトレンド方向を判定"""
+        if abs(change) < TREND_STABLE_THRESHOLD:
+            return TrendDirection.STABLE
+        return TrendDirection.UP if change > 0 else TrendDirection.DOWN
+    
     async def _get_top_performers(self, filters: DashboardFilters) -> List[Dict[str, Union[str, float]]]:
         """トップパフォーマー取得"""
         try:
+            if self._use_rollups(filters):
+                return self._top_performers_from_rollups(filters)
+            
             # カウンセラー別パフォーマンス計算
             query = self.db.query(
                 User.id,
@@ -274,29 +437,55 @@ class AnalyticsService:
                 func.count(SessionModel.id) >= 5  # 最低5セッション
             ).order_by(desc('avg_score')).limit(10).all()
             
-            top_performers = []
-            for result in results:
-                top_performers.append({
-                    "counselor_id": str(result.id),
-                    "name": result.name,
-                    "session_count": result.session_count,
-                    "average_score": round(float(result.avg_score), 2),
-                    "rank": len(top_performers) + 1
-                })
-            
-            return top_performers
+            return self._format_top_performers(results)
             
         except Exception as e:
             logger.error(f"Failed to get top performers: {e}")
             return []
     
+    def _top_performers_from_rollups(self, filters: DashboardFilters) -> List[Dict[str, Union[str, float]]]:
+        """トップパフォーマー取得（日次ロールアップから）"""
+        rollup = DailySessionRollup
+        session_count = func.sum(rollup.scored_count)
+        query = self.db.query(
+            User.id,
+            User.name,
+            session_count.label('session_count'),
+            self._rollup_average(rollup.score_sum, rollup.scored_count).label('avg_score')
+        ).join(
+            rollup, User.id == rollup.counselor_id
+        )
+        
+        results = self._scoped_rollup_query(query, filters).group_by(User.id, User.name).having(
+            session_count >= 5  # 最低5セッション
+        ).order_by(desc('avg_score')).limit(10).all()
+        
+        return self._format_top_performers(results)
+    
+    @staticmethod
+    def _format_top_performers(results) -> List[Dict[str, Union[str, float]]]:
+        top_performers = []
+        for result in results:
+            top_performers.append({
+                "counselor_id": str(result.id),
+                "name": result.name,
+                "session_count": int(result.session_count),
+                "average_score": round(float(result.avg_score), 2),
+                "rank": len(top_performers) + 1
+            })
+        
+        return top_performers
+    
     async def _identify_opportunities(self, filters: DashboardFilters) -> List[Dict[str, Union[str, float]]]:
         """改善機会の特定"""
         try:
             opportunities = []
             
-            # 低スコア分析タスクを特定
-            low_score_analyses = self.db.query(AnalysisTask).join(
+            # 低スコア分析タスクのカテゴリ別の問題件数を集計
+            query = self.db.query(*[
+                func.count(case((getattr(AnalysisTask, column) < 6.0, 1))).label(category)
+                for category, column in CATEGORY_SCORE_COLUMNS.items()
+            ]).join(
                 SessionModel, AnalysisTask.session_id == SessionModel.id
             ).filter(
                 SessionModel.session_date >= filters.start_date,
@@ -306,28 +495,12 @@ class AnalyticsService:
             )
             
             if filters.clinic_id:
-                low_score_analyses = low_score_analyses.join(Customer).filter(
+                query = query.join(Customer, SessionModel.customer_id == Customer.id).filter(
                     Customer.clinic_id == filters.clinic_id
                 )
             
-            analyses = low_score_analyses.all()
-            
-            # カテゴリ別の問題を集計
-            category_issues = {
-                "questioning": 0,
-                "anxiety_handling": 0,
-                "closing": 0,
-                "flow": 0
-            }
-            
-            for analysis in analyses:
-                if analysis.full_analysis_result:
-                    result = analysis.full_analysis_result
-                    for category in category_issues.keys():
-                        if isinstance(result, dict) and category in result:
-                            category_data = result[category]
-                            if isinstance(category_data, dict) and category_data.get('score', 0) < 6.0:
-                                category_issues[category] += 1
+            row = query.one()
+            category_issues = {category: getattr(row, category) for category in CATEGORY_SCORE_COLUMNS}
             
             # 改善機会として上位3つを返す
             sorted_issues = sorted(category_issues.items(), key=lambda x: x[1], reverse=True)
@@ -354,127 +527,231 @@ class AnalyticsService:
             logger.error(f"Failed to identify opportunities: {e}")
             return []
     
-    async def _calculate_counselor_stats(self, counselor_id: str, filters: DashboardFilters) -> Dict[str, Union[int, float]]:
-        """カウンセラー統計計算"""
+    @staticmethod
+    def _empty_counselor_stats() -> Dict[str, Union[int, float]]:
+        return {
+            "total_sessions": 0,
+            "average_score": 0.0,
+            "conversion_rate": 0.0,
+            "improvement_rate": 0.0
+        }
+    
+    async def _batch_counselor_stats(
+        self,
+        counselor_ids: List[str],
+        filters: DashboardFilters
+    ) -> Dict[str, Dict[str, Union[int, float]]]:
+        """カウンセラー統計計算（全員の今期・前期を1回の集計クエリで取得）"""
         try:
-            query = self.db.query(SessionModel).filter(
-                SessionModel.counselor_id == counselor_id,
-                SessionModel.session_date >= filters.start_date,
-                SessionModel.session_date <= filters.end_date,
-                SessionModel.is_deleted == False
-            )
-            
-            sessions = query.all()
-            
-            if not sessions:
-                return {
-                    "total_sessions": 0,
-                    "average_score": 0.0,
-                    "conversion_rate": 0.0,
-                    "improvement_rate": 0.0
-                }
-            
-            total_sessions = len(sessions)
-            scores = [s.overall_score for s in sessions if s.overall_score is not None]
-            average_score = sum(scores) / len(scores) if scores else 0.0
-            
-            high_score_sessions = len([s for s in sessions if s.overall_score and s.overall_score >= 8.0])
-            conversion_rate = high_score_sessions / total_sessions if total_sessions > 0 else 0.0
-            
-            # 改善率（前期間との比較）
             prev_start = filters.start_date - (filters.end_date - filters.start_date)
-            prev_query = self.db.query(SessionModel).filter(
-                SessionModel.counselor_id == counselor_id,
-                SessionModel.session_date >= prev_start,
-                SessionModel.session_date < filters.start_date,
-                SessionModel.is_deleted == False
-            )
             
-            prev_sessions = prev_query.all()
-            prev_scores = [s.overall_score for s in prev_sessions if s.overall_score is not None]
-            prev_average = sum(prev_scores) / len(prev_scores) if prev_scores else 0.0
+            if self._use_rollups(filters):
+                rollup = DailySessionRollup
+                period = case(
+                    (rollup.day >= to_rollup_day(filters.start_date), "current"),
+                    else_="previous"
+                )
+                query = self.db.query(
+                    rollup.counselor_id.label("counselor_id"),
+                    period.label("period"),
+                    func.sum(rollup.session_count).label("total_sessions"),
+                    func.sum(rollup.high_score_count).label("high_score_sessions"),
+                    self._rollup_average(rollup.score_sum, rollup.scored_count).label("average_score")
+                ).filter(rollup.counselor_id.in_(counselor_ids))
+                rows = self._scoped_rollup_query(query, filters, start_date=prev_start).group_by(
+                    rollup.counselor_id, period
+                ).all()
+            else:
+                score = SessionModel.overall_score
+                period = case(
+                    (SessionModel.session_date >= filters.start_date, "current"),
+                    else_="previous"
+                )
+                rows = self.db.query(
+                    SessionModel.counselor_id.label("counselor_id"),
+                    period.label("period"),
+                    func.count(SessionModel.id).label("total_sessions"),
+                    func.count(case((score >= 8.0, 1))).label("high_score_sessions"),
+                    func.avg(score).label("average_score")
+                ).filter(
+                    SessionModel.counselor_id.in_(counselor_ids),
+                    SessionModel.session_date >= prev_start,
+                    SessionModel.session_date <= filters.end_date,
+                    SessionModel.is_deleted == False
+                ).group_by(SessionModel.counselor_id, period).all()
             
-            improvement_rate = ((average_score - prev_average) / prev_average * 100) if prev_average > 0 else 0.0
+            periods = {counselor_id: {} for counselor_id in counselor_ids}
+            for row in rows:
+                periods.setdefault(str(row.counselor_id), {})[row.period] = row
             
             return {
-                "total_sessions": total_sessions,
-                "average_score": round(average_score, 2),
-                "conversion_rate": round(conversion_rate, 3),
-                "improvement_rate": round(improvement_rate, 2)
+                counselor_id: self._counselor_stats_from_periods(periods[counselor_id])
+                for counselor_id in counselor_ids
             }
             
         except Exception as e:
             logger.error(f"Failed to calculate counselor stats: {e}")
-            return {
-                "total_sessions": 0,
-                "average_score": 0.0,
-                "conversion_rate": 0.0,
-                "improvement_rate": 0.0
-            }
+            return {counselor_id: self._empty_counselor_stats() for counselor_id in counselor_ids}
     
-    async def _calculate_skill_breakdown(self, counselor_id: str, filters: DashboardFilters) -> Dict[str, Dict[str, float]]:
-        """スキル分析"""
+    def _counselor_stats_from_periods(self, periods: Dict[str, object]) -> Dict[str, Union[int, float]]:
+        """今期・前期の集計行から統計を計算"""
+        current = periods.get("current")
+        
+        if not current or not current.total_sessions:
+            return self._empty_counselor_stats()
+        
+        total_sessions = int(current.total_sessions)
+        average_score = float(current.average_score or 0.0)
+        conversion_rate = current.high_score_sessions / total_sessions
+        
+        # 改善率（前期間との比較）
+        previous = periods.get("previous")
+        prev_average = float(previous.average_score or 0.0) if previous else 0.0
+        
+        improvement_rate = ((average_score - prev_average) / prev_average * 100) if prev_average > 0 else 0.0
+        
+        return {
+            "total_sessions": total_sessions,
+            "average_score": round(average_score, 2),
+            "conversion_rate": round(conversion_rate, 3),
+            "improvement_rate": round(improvement_rate, 2)
+        }
+    
+    @staticmethod
+    def _empty_skill_breakdown() -> Dict[str, Dict[str, float]]:
+        return {skill: {"score": 0.0, "sessions_analyzed": 0} for skill in CATEGORY_SCORE_COLUMNS}
+    
+    async def _batch_skill_breakdowns(
+        self,
+        counselor_ids: List[str],
+        filters: DashboardFilters
+    ) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """スキル分析（カウンセラー別に1回の集計クエリ）"""
         try:
-            # 分析タスクから詳細スコアを取得
-            query = self.db.query(AnalysisTask).join(
-                SessionModel, AnalysisTask.session_id == SessionModel.id
-            ).filter(
-                SessionModel.counselor_id == counselor_id,
+            if self._use_rollups(filters):
+                return self._skill_breakdowns_from_rollups(counselor_ids, filters)
+            
+            scope = [
+                SessionModel.counselor_id.in_(counselor_ids),
                 SessionModel.session_date >= filters.start_date,
                 SessionModel.session_date <= filters.end_date,
-                AnalysisTask.is_deleted == False,
-                AnalysisTask.full_analysis_result.isnot(None)
-            )
-            
-            analyses = query.all()
-            
-            skill_data = {
-                "questioning": {"score": 0.0, "count": 0},
-                "anxiety_handling": {"score": 0.0, "count": 0},
-                "closing": {"score": 0.0, "count": 0},
-                "flow": {"score": 0.0, "count": 0}
-            }
+                SessionModel.is_deleted == False
+            ]
             
-            for analysis in analyses:
-                if analysis.full_analysis_result:
-                    result = analysis.full_analysis_result
-                    for skill in skill_data.keys():
-                        if isinstance(result, dict) and skill in result:
-                            skill_info = result[skill]
-                            if isinstance(skill_info, dict) and 'score' in skill_info:
-                                skill_data[skill]["score"] += skill_info["score"]
-                                skill_data[skill]["count"] += 1
-            
-            # 平均スコア計算
-            breakdown = {}
-            for skill, data in skill_data.items():
-                average_score = data["score"] / data["count"] if data["count"] > 0 else 0.0
-                breakdown[skill] = {
-                    "score": round(average_score, 2),
-                    "sessions_analyzed": data["count"]
-                }
+            # 再分析されたセッションも1件として数えるよう、セッションごとに最新の完了済み分析のみ
+            # （ロールアップと同じ集計単位）
+            latest = self.db.query(
+                AnalysisTask.session_id,
+                *[getattr(AnalysisTask, column) for column in CATEGORY_SCORE_COLUMNS.values()]
+            ).filter(
+                AnalysisTask.session_id.in_(select(SessionModel.id).where(*scope)),
+                AnalysisTask.status == "completed",
+                AnalysisTask.is_deleted == False
+            ).distinct(AnalysisTask.session_id).order_by(
+                AnalysisTask.session_id, AnalysisTask.completed_at.desc().nullslast()
+            ).subquery("latest")
+            
+            # 分析タスクのカテゴリスコアを集計
+            selected = []
+            for skill, column in CATEGORY_SCORE_COLUMNS.items():
+                score = latest.c[column]
+                selected.append(func.avg(score).label(f"{skill}_avg"))
+                selected.append(func.count(score).label(f"{skill}_count"))
+            
+            rows = self.db.query(SessionModel.counselor_id.label("counselor_id"), *selected).join(
+                latest, latest.c.session_id == SessionModel.id
+            ).filter(*scope).group_by(SessionModel.counselor_id).all()
+            
+            # 平均スコア
+            breakdowns = {counselor_id: self._empty_skill_breakdown() for counselor_id in counselor_ids}
+            for row in rows:
+                breakdown = breakdowns.setdefault(str(row.counselor_id), {})
+                for skill in CATEGORY_SCORE_COLUMNS:
+                    average_score = getattr(row, f"{skill}_avg")
+                    breakdown[skill] = {
+                        "score": round(float(average_score), 2) if average_score is not None else 0.0,
+                        "sessions_analyzed": getattr(row, f"{skill}_count")
+                    }
             
-            return breakdown
+            return breakdowns
             
         except Exception as e:
             logger.error(f"Failed to calculate skill breakdown: {e}")
-            return {}
+            return {counselor_id: {} for counselor_id in counselor_ids}
     
-    async def _get_recent_performance(self, counselor_id: str, filters: DashboardFilters) -> List[PerformanceData]:
-        """最近のパフォーマンス取得"""
+    def _skill_breakdowns_from_rollups(
+        self,
+        counselor_ids: List[str],
+        filters: DashboardFilters
+    ) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """スキル分析（日次ロールアップから）"""
+        rollup = DailySessionRollup
+        columns = {
+            "questioning": (rollup.questioning_score_sum, rollup.questioning_count),
+            "anxiety_handling": (rollup.anxiety_score_sum, rollup.anxiety_count),
+            "closing": (rollup.closing_score_sum, rollup.closing_count),
+            "flow": (rollup.flow_score_sum, rollup.flow_count)
+        }
+        
+        selected = []
+        for skill, (score_sum, count) in columns.items():
+            selected.append(func.coalesce(func.sum(score_sum), 0.0).label(f"{skill}_sum"))
+            selected.append(func.coalesce(func.sum(count), 0).label(f"{skill}_count"))
+        
+        rows = self._scoped_rollup_query(
+            self.db.query(rollup.counselor_id.label("counselor_id"), *selected).filter(
+                rollup.counselor_id.in_(counselor_ids)
+            ),
+            filters
+        ).group_by(rollup.counselor_id).all()
+        
+        breakdowns = {counselor_id: self._empty_skill_breakdown() for counselor_id in counselor_ids}
+        for row in rows:
+            breakdown = breakdowns.setdefault(str(row.counselor_id), {})
+            for skill in columns:
+                count = int(getattr(row, f"{skill}_count"))
+                score_sum = float(getattr(row, f"{skill}_sum"))
+                breakdown[skill] = {
+                    "score": round(score_sum / count, 2) if count > 0 else 0.0,
+                    "sessions_analyzed": count
+                }
+        
+        return breakdowns
+    
+    async def _batch_recent_performance(
+        self,
+        counselor_ids: List[str],
+        filters: DashboardFilters
+    ) -> Dict[str, List[PerformanceData]]:
+        """最近のパフォーマンス取得（カウンセラーごとに直近20件、ウィンドウ関数で1クエリ）"""
         try:
             # 直近30日のセッションを取得
-            recent_sessions = self.db.query(SessionModel).filter(
-                SessionModel.counselor_id == counselor_id,
+            position = func.row_number().over(
+                partition_by=SessionModel.counselor_id,
+                order_by=SessionModel.session_date.desc()
+            )
+            ranked = self.db.query(
+                SessionModel.id,
+                SessionModel.counselor_id,
+                SessionModel.session_date,
+                SessionModel.overall_score,
+                SessionModel.duration_minutes,
+                position.label("position")
+            ).filter(
+                SessionModel.counselor_id.in_(counselor_ids),
                 SessionModel.session_date >= filters.end_date - timedelta(days=30),
                 SessionModel.session_date <= filters.end_date,
                 SessionModel.is_deleted == False,
                 SessionModel.overall_score.isnot(None)
-            ).order_by(SessionModel.session_date.desc()).limit(20).all()
+            ).subquery("ranked")
+            
+            rows = self.db.query(ranked).filter(ranked.c.position <= 20).order_by(
+                ranked.c.counselor_id, ranked.c.position
+            ).all()
             
-            performance_data = []
-            for session in recent_sessions:
-                performance_data.append(PerformanceData(
+            performance_data = {}
+            for session in rows:
+                performance_data.setdefault(str(session.counselor_id), []).append(PerformanceData(
                     date=session.session_date,
                     score=session.overall_score,
                     session_id=str(session.id),
@@ -486,49 +763,33 @@ class AnalyticsService:
             
         except Exception as e:
             logger.error(f"Failed to get recent performance: {e}")
-            return []
+            return {}
     
-    async def _generate_personalized_recommendations(self, counselor_id: str, filters: DashboardFilters) -> List[str]:
-        """個別推奨事項生成"""
-        try:
-            recommendations = []
-            
-            # スキル分析結果に基づく推奨事項
-            skill_breakdown = await self._calculate_skill_breakdown(counselor_id, filters)
-            
-            for skill, data in skill_breakdown.items():
-                score = data.get("score", 0)
-                if score < 6.0:
-                    skill_names = {
-                        "questioning": "質問技法",
-                        "anxiety_handling": "不安対応",
-                        "closing": "クロージング",
-                        "flow": "トーク流れ"
-                    }
-                    recommendations.append(f"{skill_names[skill]}の向上に重点的に取り組むことを推奨")
-                elif score >= 8.0:
-                    skill_names = {
-                        "questioning": "質問技法",
-                        "anxiety_handling": "不安対応", 
-                        "closing": "クロージング",
-                        "flow": "トーク流れ"
-                    }
-                    recommendations.append(f"{skill_names[skill]}は優秀です。この水準を維持してください")
-            
-            # 全体的な推奨事項
-            counselor_stats = await self._calculate_counselor_stats(counselor_id, filters)
-            avg_score = counselor_stats.get("average_score", 0)
-            
-            if avg_score < 6.0:
-                recommendations.append("基本スキルの見直しと集中的なトレーニングを推奨")
-            elif avg_score >= 8.0:
-                recommendations.append("優秀なパフォーマンスです。メンタリングの役割も検討してください")
-            
-            return recommendations[:5]  # 上位5件
-            
-        except Exception as e:
-            logger.error(f"Failed to generate recommendations: {e}")
-            return []
+    @staticmethod
+    def _build_recommendations(
+        skill_breakdown: Dict[str, Dict[str, float]],
+        counselor_stats: Dict[str, Union[int, float]]
+    ) -> List[str]:
+        """個別推奨事項生成（集計済みのスキル分析・統計から）"""
+        recommendations = []
+        
+        # スキル分析結果に基づく推奨事項
+        for skill, data in skill_breakdown.items():
+            score = data.get("score", 0)
+            if score < 6.0:
+                recommendations.append(f"{SKILL_NAMES[skill]}の向上に重点的に取り組むことを推奨")
+            elif score >= 8.0:
+                recommendations.append(f"{SKILL_NAMES[skill]}は優秀です。この水準を維持してください")
+        
+        # 全体的な推奨事項
+        avg_score = counselor_stats.get("average_score", 0)
+        
+        if avg_score < 6.0:
+            recommendations.append("基本スキルの見直しと集中的なトレーニングを推奨")
+        elif avg_score >= 8.0:
+            recommendations.append("優秀なパフォーマンスです。メンタリングの役割も検討してください")
+        
+        return recommendations[:5]  # 上位5件
     
     async def _get_real_time_metrics(self) -> Dict[str, Union[int, str]]:
         """リアルタイムメトリクス取得"""
@@ -6,6 +6,7 @@ from typing import Optional
 import logging
 
 from app.core.config import settings
+from app.services.storage_service import get_s3_client
 
 
 logger = logging.getLogger(__name__)
@@ -15,12 +16,7 @@ class AudioService:
     """Service for handling audio operations"""
     
     def __init__(self):
-        self.s3_client = boto3.client(
-            's3',
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-            region_name=settings.AWS_REGION
-        )
+        self.s3_client = get_s3_client()
         self.transcribe_client = boto3.client(
             'transcribe',
             aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
@@ -0,0 +1,162 @@
+"""
+ffmpeg helpers for decoding and slicing audio
+"""
+import asyncio
+import logging
+import re
+import wave
+from typing import List, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Whisperの内部サンプリングレートに合わせる（16kHz・モノラル・16bit PCM）
+SAMPLE_RATE = 16000
+CHANNELS = 1
+SAMPLE_WIDTH = 2
+
+# 分割ピースのエンコード設定（16kHzモノラルMP3）
+PIECE_BITRATE = 64000
+PIECE_BYTES_PER_SECOND = PIECE_BITRATE / 8
+
+_SILENCE_START = re.compile(r"silence_start: (-?\d+(?:\.\d+)?)")
+_SILENCE_END = re.compile(r"silence_end: (-?\d+(?:\.\d+)?)")
+_DURATION = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+_PROGRESS_TIME = re.compile(r"time=(\d+):(\d+):(\d+(?:\.\d+)?)")
+
+
+async def run_ffmpeg(*args: str) -> str:
+    """ffmpegを実行して標準エラー出力（ログ）を返す"""
+    process = await asyncio.create_subprocess_exec(
+        settings.FFMPEG_PATH, "-hide_banner", "-nostdin", *args,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE
+    )
+    _, stderr = await process.communicate()
+    output = stderr.decode("utf-8", errors="replace")
+    if process.returncode != 0:
+        raise Exception(f"ffmpeg実行エラー (code={process.returncode}): {output[-500:]}")
+    return output
+
+
+async def convert_to_wav(source_path: str, dest_path: str, start: float = 0.0) -> float:
+    """音声を16kHzモノラルWAVに変換し、変換後の長さ（秒）を返す
+
+    録音中のファイル（末尾が書きかけのWebM等）も読める範囲まで変換する。
+    """
+    args = []
+    if start > 0:
+        args += ["-ss", f"{start:.3f}"]
+    args += [
+        "-i", source_path,
+        "-vn",
+        "-ac", str(CHANNELS),
+        "-ar", str(SAMPLE_RATE),
+        "-acodec", "pcm_s16le",
+        "-y", dest_path
+    ]
+    await run_ffmpeg(*args)
+    return wav_duration(dest_path)
+
+
+def wav_duration(path: str) -> float:
+    """WAVファイルの長さ（秒）"""
+    with wave.open(path, "rb") as wav:
+        return wav.getnframes() / float(wav.getframerate())
+
+
+def slice_wav(source_path: str, dest_path: str, start: float, end: float) -> float:
+    """WAVファイルの [start, end) 秒を切り出し、切り出した長さ（秒）を返す"""
+    with wave.open(source_path, "rb") as source:
+        rate = source.getframerate()
+        total = source.getnframes()
+        first = max(0, min(int(start * rate), total))
+        last = max(first, min(int(end * rate), total))
+        source.setpos(first)
+        frames = source.readframes(last - first)
+
+        with wave.open(dest_path, "wb") as dest:
+            dest.setnchannels(source.getnchannels())
+            dest.setsampwidth(source.getsampwidth())
+            dest.setframerate(rate)
+            dest.writeframes(frames)
+
+    return (last - first) / float(rate)
+
+
+def _to_seconds(hours: str, minutes: str, seconds: str) -> float:
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+async def detect_silences(
+    source_path: str,
+    noise_db: float,
+    min_duration: float
+) -> Tuple[float, List[Tuple[float, float]]]:
+    """無音区間の検出（ffmpeg silencedetect）
+
+    Returns:
+        (音声の長さ（秒）, [(無音開始, 無音終了), ...])
+    """
+    output = await run_ffmpeg(
+        "-i", source_path,
+        "-vn",
+        "-af", f"silencedetect=noise={noise_db}dB:d={min_duration}",
+        "-f", "null", "-"
+    )
+
+    # MediaRecorderのWebMはヘッダーに長さがないため、デコード進捗の最終時刻を使う
+    times = [_to_seconds(*match) for match in _PROGRESS_TIME.findall(output)]
+    header = _DURATION.search(output)
+    duration = max(times) if times else (_to_seconds(*header.groups()) if header else 0.0)
+
+    silences = []
+    starts = [float(value) for value in _SILENCE_START.findall(output)]
+    ends = [float(value) for value in _SILENCE_END.findall(output)]
+    for index, start in enumerate(starts):
+        # 末尾まで無音が続く場合は silence_end が出力されない
+        end = ends[index] if index < len(ends) else duration
+        silences.append((max(0.0, start), end))
+
+    return duration, silences
+
+
+def plan_split_points(
+    duration: float,
+    silences: List[Tuple[float, float]],
+    max_piece_seconds: float,
+    min_piece_seconds: float = None
+) -> List[Tuple[float, float]]:
+    """max_piece_seconds 以下のピースに分割する区間を決める
+
+    各ピースの上限に最も近い無音区間の中央で切り、無音がなければ上限で切る。
+    """
+    if min_piece_seconds is None:
+        min_piece_seconds = max_piece_seconds / 2
+    midpoints = sorted((start + end) / 2 for start, end in silences)
+
+    pieces = []
+    start = 0.0
+    while duration - start > max_piece_seconds:
+        limit = start + max_piece_seconds
+        candidates = [point for point in midpoints if start + min_piece_seconds <= point <= limit]
+        cut = candidates[-1] if candidates else limit
+        pieces.append((start, cut))
+        start = cut
+    pieces.append((start, duration))
+    return pieces
+
+
+async def extract_piece(source_path: str, dest_path: str, start: float, end: float) -> None:
+    """[start, end) 秒を16kHzモノラルMP3として切り出す"""
+    await run_ffmpeg(
+        "-ss", f"{start:.3f}",
+        "-i", source_path,
+        "-t", f"{end - start:.3f}",
+        "-vn",
+        "-ac", str(CHANNELS),
+        "-ar", str(SAMPLE_RATE),
+        "-b:a", str(PIECE_BITRATE),
+        "-y", dest_path
+    )
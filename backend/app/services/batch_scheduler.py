@@ -0,0 +1,265 @@
+"""
+Batch analysis scheduler
+"""
+import asyncio
+import logging
+import math
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import get_background_session
+from app.core.job_queue import JobQueue, LANE_BATCH
+from app.models.analysis import AnalysisTask
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ["pending", "preprocessing", "analyzing", "generating_suggestions"]
+
+# 複数ワーカーのうち1つだけが投入するためのアドバイザリーロックのキー
+DISPATCH_LOCK_KEY = 7305118021
+
+
+class BatchQueueFullError(Exception):
+    """バッチ分析の順番待ちが上限に達している"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def analysis_model() -> str:
+    """分析に使うモデル（AnalysisService と同じ選択）"""
+    if settings.ENVIRONMENT == "prod":
+        return settings.OPENAI_MODEL_PRODUCTION or "gpt-4.1"
+    return settings.OPENAI_MODEL or "gpt-4.1-mini"
+
+
+class BatchScheduler:
+    """バッチ分析のスケジューラ
+
+    バッチの分析タスクはすぐにはジョブキューへ入れず、dispatched_at が NULL のまま
+    順番待ちさせる。BatchDispatcher が同時実行数の上限（LLMのレート制限から算出）まで、
+    クリニックごとに古い順のラウンドロビンで取り出して batch レーンへ投入する。
+    ワーカーは interactive レーンを先に処理するため、単発の分析はバッチに待たされない。
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def _queued(self):
+        return and_(
+            AnalysisTask.lane == LANE_BATCH,
+            AnalysisTask.dispatched_at.is_(None),
+            AnalysisTask.status == "pending",
+            AnalysisTask.is_deleted == False
+        )
+
+    def _in_flight(self):
+        return and_(
+            AnalysisTask.lane == LANE_BATCH,
+            AnalysisTask.dispatched_at.isnot(None),
+            AnalysisTask.status.in_(ACTIVE_STATUSES),
+            AnalysisTask.is_deleted == False
+        )
+
+    def average_duration(self) -> float:
+        """直近24時間に完了した分析の平均所要時間（秒）"""
+        value = self.db.query(func.avg(AnalysisTask.actual_duration)).filter(
+            AnalysisTask.status == "completed",
+            AnalysisTask.completed_at >= datetime.utcnow() - timedelta(days=1),
+            AnalysisTask.actual_duration > 0
+        ).scalar()
+        return float(value) if value else float(settings.BATCH_DEFAULT_ANALYSIS_SECONDS)
+
+    def average_tokens(self) -> float:
+        """直近24時間に完了した分析の1件あたりの平均トークン数（入力＋出力の実測値）"""
+        value = self.db.query(
+            func.avg(AnalysisTask.openai_prompt_tokens + AnalysisTask.openai_completion_tokens)
+        ).filter(
+            AnalysisTask.status == "completed",
+            AnalysisTask.completed_at >= datetime.utcnow() - timedelta(days=1),
+            AnalysisTask.openai_prompt_tokens > 0
+        ).scalar()
+        return float(value) if value else float(settings.BATCH_TOKENS_PER_ANALYSIS)
+
+    def max_in_flight(self, average_duration: float, average_tokens: Optional[float] = None) -> int:
+        """バッチの同時実行数の上限
+
+        レート制限（rpm/tpm）から1分あたりに処理できる分析数を求め、その BATCH_RATE_LIMIT_SHARE 分を
+        平均所要時間だけ保持できる数（リトルの法則: 同時実行数 = 処理速度 × 所要時間）。
+        """
+        limits = settings.LLM_RATE_LIMITS.get(analysis_model(), {})
+        rpm = limits.get("rpm", settings.LLM_DEFAULT_RPM)
+        tpm = limits.get("tpm", settings.LLM_DEFAULT_TPM)
+
+        per_minute = rpm / settings.BATCH_REQUESTS_PER_ANALYSIS
+        if tpm:
+            per_minute = min(per_minute, tpm / (average_tokens or settings.BATCH_TOKENS_PER_ANALYSIS))
+        in_flight = per_minute * settings.BATCH_RATE_LIMIT_SHARE * average_duration / 60
+        return max(1, min(settings.BATCH_MAX_IN_FLIGHT, int(in_flight)))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """順番待ち・実行中の件数と処理速度"""
+        rows = self.db.execute(
+            select(
+                AnalysisTask.clinic_id,
+                func.count(AnalysisTask.id).filter(AnalysisTask.dispatched_at.is_(None)).label("queued"),
+                func.count(AnalysisTask.id).filter(AnalysisTask.dispatched_at.isnot(None)).label("in_flight")
+            ).where(
+                AnalysisTask.lane == LANE_BATCH,
+                AnalysisTask.status.in_(ACTIVE_STATUSES),
+                AnalysisTask.is_deleted == False
+            ).group_by(AnalysisTask.clinic_id)
+        ).all()
+
+        average_duration = self.average_duration()
+        max_in_flight = self.max_in_flight(average_duration, self.average_tokens())
+        queued_by_clinic = {row.clinic_id: row.queued for row in rows if row.queued}
+        return {
+            "queued": sum(queued_by_clinic.values()),
+            "queued_by_clinic": queued_by_clinic,
+            "in_flight": sum(row.in_flight for row in rows),
+            "max_in_flight": max_in_flight,
+            "average_duration": average_duration,
+            "throughput_per_second": max_in_flight / average_duration,
+        }
+
+    @staticmethod
+    def queue_position(snapshot: Dict[str, Any], clinic_id, count: int) -> int:
+        """クリニックの順番待ちの末尾に count 件追加したときの最後の1件の全体での順番
+
+        ラウンドロビンなので、他のクリニックは自分の件数までしか先に処理されない。
+        """
+        queued_by_clinic = snapshot["queued_by_clinic"]
+        own = queued_by_clinic.get(clinic_id, 0) + count
+        return own + sum(min(queued, own) for key, queued in queued_by_clinic.items() if key != clinic_id)
+
+    @staticmethod
+    def estimate_seconds(snapshot: Dict[str, Any], position: int) -> int:
+        """順番 position の分析が完了するまでの推定秒数"""
+        return int(math.ceil(position / snapshot["throughput_per_second"] + snapshot["average_duration"]))
+
+    def admit(self, counts: Dict[Any, int]) -> Dict[str, Any]:
+        """クリニックごとの追加件数を受け付けられるか確認（溢れる場合は BatchQueueFullError）"""
+        snapshot = self.snapshot()
+        throughput = snapshot["throughput_per_second"]
+
+        overflow = snapshot["queued"] + sum(counts.values()) - settings.BATCH_QUEUE_MAX_PENDING
+        if overflow > 0:
+            raise BatchQueueFullError(
+                f"Batch analysis queue is full ({snapshot['queued']} queued)",
+                retry_after=int(math.ceil(overflow / throughput))
+            )
+
+        # クリニックの順番待ちは全体の処理速度をクリニック数で分け合って減る
+        active_clinics = max(len(snapshot["queued_by_clinic"]), 1)
+        for clinic_id, count in counts.items():
+            queued = snapshot["queued_by_clinic"].get(clinic_id, 0)
+            overflow = queued + count - settings.BATCH_QUEUE_MAX_PER_CLINIC
+            if overflow > 0:
+                raise BatchQueueFullError(
+                    f"Batch analysis queue for clinic {clinic_id} is full ({queued} queued)",
+                    retry_after=int(math.ceil(overflow * active_clinics / throughput))
+                )
+        return snapshot
+
+    async def dispatch(self, queue: JobQueue) -> int:
+        """空いている枠の分だけ順番待ちの分析をジョブキューへ投入し、投入数を返す"""
+        # 同時実行数の上限を超えないよう、数えてから投入するまでを1プロセスに限定する
+        locked = self.db.execute(select(func.pg_try_advisory_xact_lock(DISPATCH_LOCK_KEY))).scalar()
+        if not locked:
+            self.db.rollback()
+            return 0
+
+        average_duration = self.average_duration()
+        in_flight = self.db.query(func.count(AnalysisTask.id)).filter(self._in_flight()).scalar()
+        slots = self.max_in_flight(average_duration, self.average_tokens()) - in_flight
+        if slots <= 0:
+            self.db.rollback()
+            return 0
+
+        # クリニックごとに古い順の番号を振り、番号順に取り出す（クリニック間のラウンドロビン）
+        ranked = select(
+            AnalysisTask.id,
+            AnalysisTask.created_at,
+            func.row_number().over(
+                partition_by=AnalysisTask.clinic_id,
+                order_by=(AnalysisTask.created_at, AnalysisTask.id)
+            ).label("turn")
+        ).where(self._queued()).subquery()
+        task_ids = self.db.execute(
+            select(ranked.c.id).order_by(ranked.c.turn, ranked.c.created_at).limit(slots)
+        ).scalars().all()
+        if not task_ids:
+            self.db.rollback()
+            return 0
+
+        tasks = self.db.query(AnalysisTask).filter(AnalysisTask.id.in_(task_ids)).all()
+        now = datetime.utcnow()
+        for task in tasks:
+            task.dispatched_at = now
+            task.estimated_completion = now + timedelta(seconds=average_duration)
+        self.db.commit()
+
+        # コミット後にジョブキューに投入（ワーカーが未コミットのタスクを参照しないように）
+        failed = []
+        for task in tasks:
+            try:
+                await queue.enqueue(
+                    "analysis",
+                    lane=LANE_BATCH,
+                    task_id=task.task_id,
+                    transcription_task_id=str(task.transcription_task_id),
+                    analysis_type=task.analysis_type,
+                    focus_areas=task.focus_areas,
+                    custom_prompts=task.custom_prompts,
+                    bypass_cache=task.bypass_cache
+                )
+            except Exception as e:
+                logger.error(f"Failed to dispatch batch analysis {task.task_id}: {e}")
+                failed.append(task)
+
+        # 投入できなかったタスクは順番待ちに戻す
+        if failed:
+            for task in failed:
+                task.dispatched_at = None
+            self.db.commit()
+
+        return len(tasks) - len(failed)
+
+
+class BatchDispatcher:
+    """順番待ちのバッチ分析を一定間隔でジョブキューへ流す"""
+
+    def __init__(self, queue: JobQueue, interval: Optional[float] = None):
+        self.queue = queue
+        self.interval = interval or settings.BATCH_DISPATCH_INTERVAL
+        self._stopping = asyncio.Event()
+
+    async def run(self) -> None:
+        """stop() が呼ばれるまで実行"""
+        logger.info(f"Batch dispatcher started: interval={self.interval}s")
+        while not self._stopping.is_set():
+            db = get_background_session()
+            try:
+                dispatched = await BatchScheduler(db).dispatch(self.queue)
+                if dispatched:
+                    logger.info(f"Dispatched {dispatched} batch analyses")
+            except Exception as e:
+                logger.error(f"Batch dispatch failed: {e}")
+                db.rollback()
+            finally:
+                db.close()
+
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+        logger.info("Batch dispatcher stopped")
+
+    def stop(self) -> None:
+        self._stopping.set()
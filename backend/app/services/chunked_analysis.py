@@ -0,0 +1,210 @@
+"""
+Chunking and result merging for long counseling transcripts
+"""
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence
+
+from app.core.config import settings
+from app.services.token_budget import count_tokens
+from app.schemas.analysis import (
+    QuestioningAnalysis, AnxietyHandlingAnalysis, ClosingAnalysis, FlowAnalysis
+)
+
+# 文の区切り（句点・感嘆符・疑問符・改行）
+_SENTENCE_PATTERN = re.compile(r"[^。！？!?\n]*[。！？!?\n]|[^。！？!?\n]+$")
+
+
+@dataclass
+class TranscriptChunk:
+    """文字起こしの分割単位"""
+    index: int
+    text: str
+    start: Optional[float] = None  # 秒（セグメント分割時のみ）
+    end: Optional[float] = None
+    position: float = 0.0  # セッション内の相対位置（0=冒頭, 1=末尾）
+
+    @property
+    def weight(self) -> int:
+        return max(len(self.text), 1)
+
+
+class TranscriptChunker:
+    """文字起こしを予算内のチャンクに分割
+
+    セグメント（タイムスタンプ）がある場合はセグメント境界で、
+    ない場合は文の境界で分割する。境界の文脈を保つため前のチャンクの
+    末尾を overlap 分だけ重ねる。
+    """
+
+    def __init__(self, max_tokens: int = None, overlap_tokens: int = None):
+        self.max_tokens = max_tokens or settings.ANALYSIS_CHUNK_MAX_TOKENS
+        self.overlap_tokens = overlap_tokens if overlap_tokens is not None else settings.ANALYSIS_CHUNK_OVERLAP_TOKENS
+
+    def measure(self, text: str) -> int:
+        """テキストの大きさ（予算の単位、トークン数）"""
+        return count_tokens(text)
+
+    def split(self, text: str, segments: Optional[Sequence[Dict[str, Any]]] = None) -> List[TranscriptChunk]:
+        if self.measure(text) <= self.max_tokens:
+            return [TranscriptChunk(index=0, text=text, position=1.0)]
+
+        units = self._units_from_segments(segments) if segments else self._units_from_text(text)
+        return self._pack(units)
+
+    def _units_from_segments(self, segments: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [
+            {"text": (s.get("text") or "").strip(), "start": s.get("start"), "end": s.get("end")}
+            for s in segments
+            if (s.get("text") or "").strip()
+        ]
+
+    def _units_from_text(self, text: str) -> List[Dict[str, Any]]:
+        units = []
+        for sentence in _SENTENCE_PATTERN.findall(text):
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+            # 句点のない長文は予算で強制分割
+            while self.measure(sentence) > self.max_tokens:
+                head = self._head_within_budget(sentence)
+                units.append({"text": head, "start": None, "end": None})
+                sentence = sentence[len(head):]
+            units.append({"text": sentence, "start": None, "end": None})
+        return units
+
+    def _head_within_budget(self, text: str) -> str:
+        """予算に収まる先頭部分（1文字1トークン以下を前提に始め、超える分だけ縮める）"""
+        head = text[:self.max_tokens]
+        while len(head) > 1 and self.measure(head) > self.max_tokens:
+            head = head[:int(len(head) * 0.9)]
+        return head
+
+    def _pack(self, units: List[Dict[str, Any]]) -> List[TranscriptChunk]:
+        groups: List[List[Dict[str, Any]]] = []
+        current: List[Dict[str, Any]] = []
+        size = 0
+        for unit in units:
+            unit_size = self.measure(unit["text"])
+            if current and size + unit_size > self.max_tokens:
+                groups.append(current)
+                current = self._overlap_tail(current)
+                size = sum(self.measure(u["text"]) for u in current)
+            current.append(unit)
+            size += unit_size
+        if current:
+            groups.append(current)
+
+        chunks = []
+        total = len(groups)
+        for index, group in enumerate(groups):
+            chunks.append(TranscriptChunk(
+                index=index,
+                text="\n".join(u["text"] for u in group),
+                start=group[0]["start"],
+                end=group[-1]["end"],
+                position=(index + 1) / total
+            ))
+        return chunks
+
+    def _overlap_tail(self, units: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """前のチャンク末尾の重なり部分"""
+        tail = []
+        size = 0
+        for unit in reversed(units):
+            unit_size = self.measure(unit["text"])
+            if size + unit_size > self.overlap_tokens:
+                break
+            tail.insert(0, unit)
+            size += unit_size
+        return tail
+
+
+def _weighted_average(values: List[float], weights: List[float]) -> float:
+    total = sum(weights)
+    if total <= 0:
+        return sum(values) / len(values)
+    return sum(v * w for v, w in zip(values, weights)) / total
+
+
+def merge_unique(lists: List[List[str]], limit: int = 5) -> List[str]:
+    """出現順を保って重複を除いた和集合"""
+    merged = []
+    for items in lists:
+        for item in items or []:
+            if item and item not in merged:
+                merged.append(item)
+    return merged[:limit]
+
+
+def reduce_questioning(results: List[QuestioningAnalysis], chunks: List[TranscriptChunk]) -> QuestioningAnalysis:
+    weights = [c.weight for c in chunks]
+    return QuestioningAnalysis(
+        score=round(_weighted_average([r.score for r in results], weights), 2),
+        open_question_ratio=_weighted_average([r.open_question_ratio for r in results], weights),
+        customer_talk_time_ratio=_weighted_average([r.customer_talk_time_ratio for r in results], weights),
+        question_diversity=max(r.question_diversity for r in results),
+        effective_questions=merge_unique([r.effective_questions for r in results]),
+        improvements=merge_unique([r.improvements for r in results])
+    )
+
+
+def reduce_anxiety_handling(results: List[AnxietyHandlingAnalysis], chunks: List[TranscriptChunk]) -> AnxietyHandlingAnalysis:
+    weights = [c.weight for c in chunks]
+    return AnxietyHandlingAnalysis(
+        score=round(_weighted_average([r.score for r in results], weights), 2),
+        anxiety_points_identified=merge_unique([r.anxiety_points_identified for r in results], limit=10),
+        empathy_expressions=sum(r.empathy_expressions for r in results),
+        solution_specificity=_weighted_average([r.solution_specificity for r in results], weights),
+        # 不安解消の確認はセッション終盤の状態で判断
+        anxiety_resolution_confirmed=results[-1].anxiety_resolution_confirmed,
+        improvements=merge_unique([r.improvements for r in results])
+    )
+
+
+def reduce_closing(results: List[ClosingAnalysis], chunks: List[TranscriptChunk]) -> ClosingAnalysis:
+    # クロージングはセッション後半に行われるため後半のチャンクほど重みを大きくする
+    weights = [c.weight * (1.0 + 3.0 * c.position) for c in chunks]
+    last = results[-1]
+    return ClosingAnalysis(
+        score=round(_weighted_average([r.score for r in results], weights), 2),
+        timing_appropriateness=_weighted_average([r.timing_appropriateness for r in results], weights),
+        urgency_creation=_weighted_average([r.urgency_creation for r in results], weights),
+        limitation_usage=_weighted_average([r.limitation_usage for r in results], weights),
+        price_presentation_method=last.price_presentation_method,
+        objection_handling=merge_unique([r.objection_handling for r in results]),
+        contract_probability=last.contract_probability,
+        improvements=merge_unique([r.improvements for r in results])
+    )
+
+
+def reduce_flow(results: List[FlowAnalysis], chunks: List[TranscriptChunk]) -> FlowAnalysis:
+    weights = [c.weight for c in chunks]
+    return FlowAnalysis(
+        score=round(_weighted_average([r.score for r in results], weights), 2),
+        logical_structure=_weighted_average([r.logical_structure for r in results], weights),
+        smooth_transitions=_weighted_average([r.smooth_transitions for r in results], weights),
+        customer_pace_consideration=_weighted_average([r.customer_pace_consideration for r in results], weights),
+        key_point_emphasis=_weighted_average([r.key_point_emphasis for r in results], weights),
+        session_satisfaction_prediction=results[-1].session_satisfaction_prediction,
+        improvements=merge_unique([r.improvements for r in results])
+    )
+
+
+CATEGORY_REDUCERS = {
+    "questioning": reduce_questioning,
+    "anxiety_handling": reduce_anxiety_handling,
+    "closing": reduce_closing,
+    "flow": reduce_flow,
+}
+
+
+def reduce_summaries(summaries: List[str], max_length: int = 400) -> str:
+    """チャンクごとの要約を時系列に連結"""
+    parts = [s.strip() for s in summaries if s and s.strip()]
+    if not parts:
+        return "要約生成エラー"
+    summary = " / ".join(parts)
+    if len(summary) > max_length:
+        summary = summary[:max_length - 1] + "…"
+    return summary
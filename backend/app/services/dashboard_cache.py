@@ -0,0 +1,364 @@
+"""
+Read-through cache for dashboard responses
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from itertools import chain
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set, Type, TypeVar
+
+from pydantic import BaseModel
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.analysis import AnalysisTask
+from app.models.customer import Customer
+from app.models.session import Session as SessionModel
+
+logger = logging.getLogger(__name__)
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+# クリニックを指定しない集計（全クリニック・オペレーション）の世代スコープ
+GLOBAL_SCOPE = "all"
+
+# ダッシュボードの値が変わる属性（これらが変わったらキャッシュを無効化）
+TRACKED_ATTRIBUTES = {
+    SessionModel: ("status", "overall_score", "session_date", "counselor_id", "customer_id", "is_deleted"),
+    AnalysisTask: ("status", "is_deleted"),
+}
+
+_PENDING_KEY = "dashboard_cache_pending"
+
+
+def build_cache_key(endpoint: str, role: Any, clinic_id: Optional[Any], params: Dict[str, Any]) -> str:
+    """エンドポイント・ロール・クリニック・フィルターのハッシュからキーを生成"""
+    digest = hashlib.sha256(
+        json.dumps(params, sort_keys=True, default=str, separators=(",", ":")).encode("utf-8")
+    ).hexdigest()
+    role = getattr(role, "value", role)
+    return f"{endpoint}:{role}:{_normalize_id(clinic_id) or '-'}:{digest}"
+
+
+def scope_for(clinic_id: Optional[Any]) -> str:
+    """エントリが依存する世代スコープ（クリニック単位、未指定なら全体）"""
+    return f"clinic:{_normalize_id(clinic_id)}" if clinic_id else GLOBAL_SCOPE
+
+
+def _normalize_id(value: Optional[Any]) -> Optional[str]:
+    if not value:
+        return None
+    try:
+        return str(uuid.UUID(str(value)))
+    except ValueError:
+        return str(value)
+
+
+class MemoryDashboardBackend:
+    """共有層なし・世代カウンターもプロセス内（開発・テスト用）"""
+
+    def __init__(self):
+        self._generations: Dict[str, int] = {}
+
+    async def get(self, key: str) -> Optional[str]:
+        return None
+
+    async def set(self, key: str, value: str) -> None:
+        pass
+
+    async def generation(self, scope: str) -> int:
+        return self._generations.get(scope, 0)
+
+    def bump(self, scopes: Iterable[str]) -> None:
+        for scope in scopes:
+            self._generations[scope] = self._generations.get(scope, 0) + 1
+
+    async def close(self) -> None:
+        pass
+
+
+class RedisDashboardBackend:
+    """Redisの共有キャッシュ層と世代カウンター
+
+    Keys (prefix = DASHBOARD_CACHE_PREFIX):
+        {prefix}:entry:{key}        STRING  レスポンス（EX=STALE_TTL）
+        {prefix}:generation:{scope} STRING  無効化のたびにINCR
+    """
+
+    def __init__(self, stale_ttl: int, redis_url: str = None, prefix: str = None):
+        import redis
+        import redis.asyncio as aioredis
+
+        url = redis_url or settings.REDIS_URL
+        self.redis = aioredis.from_url(url, decode_responses=True)
+        # 無効化はDBのcommitフック（同期）から呼ばれるため同期クライアントを使う
+        self.sync_redis = redis.Redis.from_url(url, decode_responses=True)
+        self.stale_ttl = stale_ttl
+        self.prefix = prefix or settings.DASHBOARD_CACHE_PREFIX
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self.redis.get(f"{self.prefix}:entry:{key}")
+
+    async def set(self, key: str, value: str) -> None:
+        await self.redis.set(f"{self.prefix}:entry:{key}", value, ex=self.stale_ttl)
+
+    async def generation(self, scope: str) -> int:
+        return int(await self.redis.get(f"{self.prefix}:generation:{scope}") or 0)
+
+    def bump(self, scopes: Iterable[str]) -> None:
+        pipeline = self.sync_redis.pipeline(transaction=False)
+        for scope in scopes:
+            pipeline.incr(f"{self.prefix}:generation:{scope}")
+        pipeline.execute()
+
+    async def close(self) -> None:
+        await self.redis.close()
+        self.sync_redis.close()
+
+
+class DashboardResponseCache:
+    """ダッシュボードレスポンスのリードスルーキャッシュ
+
+    プロセス内LRU → バックエンド（Redis）の順に参照し、どちらにもなければ計算して両方に書く。
+    エントリは計算時のスコープ世代を持ち、セッション・分析タスクの状態が変わると
+    該当クリニックと全体の世代が進んで古いエントリは stale 扱いになる。
+    stale なエントリは STALE_TTL の間はそのまま返し、裏で1回だけ再計算する。
+    """
+
+    def __init__(self, backend=None, enabled: bool = None, max_entries: int = None, ttl: int = None, stale_ttl: int = None):
+        self.enabled = settings.DASHBOARD_CACHE_ENABLED if enabled is None else enabled
+        self.max_entries = max_entries or settings.DASHBOARD_CACHE_MAX_ENTRIES
+        self.ttl = ttl or settings.DASHBOARD_CACHE_TTL
+        self.stale_ttl = max(stale_ttl or settings.DASHBOARD_CACHE_STALE_TTL, self.ttl)
+        self.backend = backend or self._create_backend()
+
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _create_backend(self):
+        if settings.DASHBOARD_CACHE_BACKEND == "redis":
+            return RedisDashboardBackend(settings.DASHBOARD_CACHE_STALE_TTL)
+        return MemoryDashboardBackend()
+
+    def _count(self, endpoint: str, name: str) -> None:
+        counters = self._stats.setdefault(endpoint, {
+            "hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "errors": 0
+        })
+        counters[name] += 1
+
+    async def get_or_compute(
+        self,
+        endpoint: str,
+        role: Any,
+        clinic_id: Optional[Any],
+        params: Dict[str, Any],
+        compute: Callable[[], Awaitable[ModelT]],
+        model: Type[ModelT]
+    ) -> ModelT:
+        """キャッシュ済みのレスポンスを返し、なければ compute() で計算して保存
+
+        compute はバックグラウンドの再計算でも呼ばれるため、リクエストのDBセッションに
+        依存せず自前のセッションを開くこと。
+        """
+        if not self.enabled:
+            return await compute()
+
+        key = build_cache_key(endpoint, role, clinic_id, params)
+        scope = scope_for(clinic_id)
+        try:
+            generation = await self.backend.generation(scope)
+            entry = await self._lookup(key, generation)
+        except Exception as e:
+            # キャッシュ障害でダッシュボードを止めない
+            logger.warning(f"Dashboard cache read failed: {e}")
+            self._count(endpoint, "errors")
+            return await compute()
+
+        if entry is not None:
+            if self._is_fresh(entry, generation):
+                self._count(endpoint, "hits")
+                return model.model_validate_json(entry["payload"])
+            if time.time() - entry["cached_at"] < self.stale_ttl:
+                self._count(endpoint, "stale_hits")
+                self._schedule_refresh(endpoint, key, scope, compute)
+                return model.model_validate_json(entry["payload"])
+
+        # 同じキーの同時ミスは1回の計算にまとめる
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                entry = self._entries.get(key)
+                if entry is not None and self._is_fresh(entry, generation):
+                    self._count(endpoint, "hits")
+                    return model.model_validate_json(entry["payload"])
+
+                self._count(endpoint, "misses")
+                result = await compute()
+                await self._store(key, generation, result)
+                return result
+        finally:
+            if not lock.locked():
+                self._locks.pop(key, None)
+
+    def _is_fresh(self, entry: Dict[str, Any], generation: int) -> bool:
+        return entry["generation"] == generation and time.time() - entry["cached_at"] < self.ttl
+
+    async def _lookup(self, key: str, generation: int) -> Optional[Dict[str, Any]]:
+        """プロセス内LRUが新鮮ならそれを、そうでなければ共有層の新しい方を返す"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            if self._is_fresh(entry, generation):
+                return entry
+
+        raw = await self.backend.get(key)
+        if raw is not None:
+            shared = json.loads(raw)
+            if entry is None or shared["cached_at"] > entry["cached_at"]:
+                self._remember(key, shared)
+                entry = shared
+        return entry
+
+    def _remember(self, key: str, entry: Dict[str, Any]) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _store(self, key: str, generation: int, result: BaseModel) -> None:
+        entry = {
+            "payload": result.model_dump_json(),
+            "generation": generation,
+            "cached_at": time.time()
+        }
+        self._remember(key, entry)
+        try:
+            await self.backend.set(key, json.dumps(entry))
+        except Exception as e:
+            logger.warning(f"Dashboard cache write failed: {e}")
+
+    def _schedule_refresh(self, endpoint: str, key: str, scope: str, compute: Callable[[], Awaitable[BaseModel]]) -> None:
+        if key in self._refreshing:
+            return
+        task = asyncio.create_task(self._refresh(endpoint, key, scope, compute))
+        self._refreshing[key] = task
+        task.add_done_callback(lambda _: self._refreshing.pop(key, None))
+
+    async def _refresh(self, endpoint: str, key: str, scope: str, compute: Callable[[], Awaitable[BaseModel]]) -> None:
+        try:
+            # 計算前の世代で保存し、計算中に無効化されたら次回も stale になるようにする
+            generation = await self.backend.generation(scope)
+            result = await compute()
+            await self._store(key, generation, result)
+            self._count(endpoint, "refreshes")
+        except Exception as e:
+            logger.warning(f"Dashboard cache refresh failed for {endpoint}: {e}")
+            self._count(endpoint, "errors")
+
+    def invalidate(self, clinic_ids: Iterable[Any] = ()) -> None:
+        """クリニック（と全体）の世代を進めて既存エントリを stale にする"""
+        scopes = {scope_for(clinic_id) for clinic_id in clinic_ids if clinic_id}
+        scopes.add(GLOBAL_SCOPE)
+        try:
+            self.backend.bump(scopes)
+        except Exception as e:
+            logger.warning(f"Dashboard cache invalidation failed for {sorted(scopes)}: {e}")
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """エンドポイント別のヒット率"""
+        endpoints = {}
+        for endpoint, counters in self._stats.items():
+            served = counters["hits"] + counters["stale_hits"]
+            lookups = served + counters["misses"]
+            endpoints[endpoint] = {
+                **counters,
+                "hit_rate": round(served / lookups, 4) if lookups else 0.0,
+            }
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "refreshing": len(self._refreshing),
+            "endpoints": endpoints,
+        }
+
+    async def close(self) -> None:
+        for task in list(self._refreshing.values()):
+            task.cancel()
+        await self.backend.close()
+
+
+_cache: Optional[DashboardResponseCache] = None
+
+
+def get_dashboard_cache() -> DashboardResponseCache:
+    """プロセス共有のダッシュボードキャッシュ"""
+    global _cache
+    if _cache is None:
+        _cache = DashboardResponseCache()
+    return _cache
+
+
+def _collect_changes(session: Session, flush_context) -> None:
+    """フラッシュされたセッション・分析タスクの変更から無効化対象のクリニックを集める"""
+    session_ids: Set[Any] = set()
+    changed = False
+    for obj in chain(session.new, session.dirty, session.deleted):
+        attributes = TRACKED_ATTRIBUTES.get(type(obj))
+        if attributes is None:
+            continue
+        state = inspect(obj)
+        if not (obj in session.new or obj in session.deleted or any(
+            state.attrs[name].history.has_changes() for name in attributes
+        )):
+            continue
+        changed = True
+        session_id = obj.id if isinstance(obj, SessionModel) else obj.session_id
+        if session_id is not None:
+            session_ids.add(session_id)
+
+    if not changed:
+        return
+
+    clinic_ids: Set[Any] = session.info.setdefault(_PENDING_KEY, set())
+    if session_ids:
+        # フラッシュ中のため autoflush しない Core で引く
+        rows = session.connection().execute(
+            select(Customer.clinic_id)
+            .join(SessionModel.__table__, SessionModel.customer_id == Customer.id)
+            .where(SessionModel.id.in_(session_ids))
+            .distinct()
+        )
+        clinic_ids.update(row.clinic_id for row in rows)
+
+
+def _invalidate_committed(session: Session) -> None:
+    clinic_ids = session.info.pop(_PENDING_KEY, None)
+    if clinic_ids is not None:
+        get_dashboard_cache().invalidate(clinic_ids)
+
+
+def _discard_pending(session: Session, transaction) -> None:
+    # ロールバックされた変更は無効化しない（SAVEPOINTの終了では捨てない）
+    if transaction.parent is None:
+        session.info.pop(_PENDING_KEY, None)
+
+
+_hooks_installed = False
+
+
+def install_invalidation_hooks() -> None:
+    """全てのDBセッションのcommitでダッシュボードキャッシュを無効化する"""
+    global _hooks_installed
+    if _hooks_installed:
+        return
+    event.listen(Session, "after_flush", _collect_changes)
+    event.listen(Session, "after_commit", _invalidate_committed)
+    event.listen(Session, "after_transaction_end", _discard_pending)
+    _hooks_installed = True
@@ -0,0 +1,345 @@
+"""
+Streaming data export to storage
+"""
+import csv
+import enum
+import io
+import json
+import logging
+import uuid
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Any, Dict, List, Sequence
+
+from sqlalchemy import Float, cast, func, select
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import sqltypes
+
+from app.core.config import settings
+from app.models.analysis import AnalysisTask
+from app.models.customer import Customer
+from app.models.export import ExportJob
+from app.models.rollup import DailySessionRollup
+from app.models.session import Session as SessionModel
+from app.schemas.dashboard import PerformanceReportFilters
+from app.services.rollup_service import to_rollup_day
+from app.services.storage_service import get_storage_service
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DATASETS = ("sessions", "analyses", "kpis")
+
+# 出力形式 → (拡張子, Content-Type)
+EXPORT_FORMATS = {
+    "csv": ("csv", "text/csv"),
+    "jsonl": ("jsonl", "application/x-ndjson"),
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+
+
+def _plain(value: Any) -> Any:
+    """CSV/JSONに書ける値へ変換"""
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+class MultipartWriter:
+    """書き込まれたバイト列をパートサイズごとにマルチパートアップロードする
+
+    バッファはパートサイズ + 1バッチ分しか持たないため、出力全体の大きさに関係なく
+    メモリ使用量は一定になる。write() は同期（pyarrow のシンクとしても使う）で、
+    アップロードは upload_parts() で行う。
+    """
+
+    def __init__(self, storage, file_path: str, upload_id: str, part_size: int = None):
+        self.storage = storage
+        self.file_path = file_path
+        self.upload_id = upload_id
+        self.part_size = part_size or settings.EXPORT_PART_SIZE
+        self.parts: List[Dict[str, Any]] = []
+        self.bytes_written = 0
+        self.closed = False
+        self._buffer = bytearray()
+
+    def write(self, data) -> int:
+        self._buffer += data
+        self.bytes_written += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.bytes_written
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    async def upload_parts(self, final: bool = False) -> None:
+        """溜まったパートをアップロード（final=True なら残りも最後のパートとして送る）"""
+        while len(self._buffer) >= self.part_size:
+            await self._upload(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+        if final and (self._buffer or not self.parts):
+            await self._upload(bytes(self._buffer))
+            self._buffer.clear()
+
+    async def _upload(self, data: bytes) -> None:
+        part = await self.storage.upload_part(self.file_path, self.upload_id, len(self.parts) + 1, data)
+        self.parts.append(part)
+
+
+class CsvEncoder:
+    """ヘッダー付きCSV（Excelで開けるようBOM付きUTF-8）"""
+
+    def __init__(self, columns, sink: MultipartWriter):
+        self.sink = sink
+        self._write([[column.name for column in columns]], prefix="\ufeff")
+
+    def _write(self, rows: Sequence[Sequence[Any]], prefix: str = "") -> None:
+        text = io.StringIO()
+        text.write(prefix)
+        csv.writer(text).writerows(rows)
+        self.sink.write(text.getvalue().encode("utf-8"))
+
+    def write_rows(self, rows: Sequence[Sequence[Any]]) -> None:
+        self._write([[_plain(value) for value in row] for row in rows])
+
+    def close(self) -> None:
+        pass
+
+
+class JsonLinesEncoder:
+    """1行1レコードのJSON"""
+
+    def __init__(self, columns, sink: MultipartWriter):
+        self.sink = sink
+        self.names = [column.name for column in columns]
+
+    def write_rows(self, rows: Sequence[Sequence[Any]]) -> None:
+        lines = [
+            json.dumps({name: _plain(value) for name, value in zip(self.names, row)}, ensure_ascii=False)
+            for row in rows
+        ]
+        self.sink.write(("\n".join(lines) + "\n").encode("utf-8"))
+
+    def close(self) -> None:
+        pass
+
+
+class ParquetEncoder:
+    """バッチごとに1つの row group を書く Parquet（pyarrow が必要）"""
+
+    def __init__(self, columns, sink: MultipartWriter):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.schema = pa.schema([(column.name, self._arrow_type(column.type)) for column in columns])
+        self.writer = pq.ParquetWriter(sink, self.schema, compression="snappy")
+
+    def _arrow_type(self, column_type):
+        pa = self.pa
+        if isinstance(column_type, sqltypes.DateTime):
+            return pa.timestamp("us")
+        if isinstance(column_type, sqltypes.Date):
+            return pa.date32()
+        if isinstance(column_type, sqltypes.Boolean):
+            return pa.bool_()
+        if isinstance(column_type, sqltypes.Integer):
+            return pa.int64()
+        if isinstance(column_type, sqltypes.Numeric):
+            return pa.float64()
+        return pa.string()
+
+    def write_rows(self, rows: Sequence[Sequence[Any]]) -> None:
+        arrays = []
+        for index, field in enumerate(self.schema):
+            values = [row[index] for row in rows]
+            if self.pa.types.is_string(field.type):
+                values = [None if value is None else str(_plain(value)) for value in values]
+            arrays.append(self.pa.array(values, type=field.type))
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+ENCODERS = {
+    "csv": CsvEncoder,
+    "jsonl": JsonLinesEncoder,
+    "parquet": ParquetEncoder,
+}
+
+
+class ExportService:
+    """セッション・分析・KPIのエクスポート
+
+    行はサーバーサイドカーソル（yield_per）でバッチごとに読み、エンコードして
+    パートサイズに達するたびにストレージへマルチパートアップロードする。
+    進捗は export_jobs にバッチごとに記録する。
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.storage = get_storage_service()
+
+    def build_query(self, dataset: str, filters: PerformanceReportFilters):
+        """データセットの SELECT（列ラベルがそのまま出力の列名になる）"""
+        if dataset == "sessions":
+            query = select(
+                SessionModel.id.label("session_id"),
+                SessionModel.session_date,
+                Customer.clinic_id,
+                SessionModel.customer_id,
+                SessionModel.counselor_id,
+                SessionModel.status,
+                SessionModel.duration_minutes,
+                SessionModel.overall_score,
+                SessionModel.created_at,
+            ).join(Customer, SessionModel.customer_id == Customer.id).where(
+                SessionModel.is_deleted == False,
+                SessionModel.session_date >= filters.start_date,
+                SessionModel.session_date <= filters.end_date
+            )
+            order_by = (SessionModel.session_date, SessionModel.id)
+
+        elif dataset == "analyses":
+            query = select(
+                AnalysisTask.id.label("analysis_id"),
+                AnalysisTask.session_id,
+                Customer.clinic_id,
+                SessionModel.counselor_id,
+                AnalysisTask.analysis_type,
+                AnalysisTask.overall_score,
+                AnalysisTask.questioning_score,
+                AnalysisTask.anxiety_score,
+                AnalysisTask.closing_score,
+                AnalysisTask.flow_score,
+                AnalysisTask.openai_tokens_used,
+                AnalysisTask.openai_prompt_tokens,
+                AnalysisTask.openai_completion_tokens,
+                AnalysisTask.openai_cached_tokens,
+                AnalysisTask.openai_cost,
+                AnalysisTask.openai_model,
+                AnalysisTask.actual_duration,
+                AnalysisTask.created_at,
+                AnalysisTask.completed_at,
+            ).join(SessionModel, AnalysisTask.session_id == SessionModel.id).join(
+                Customer, SessionModel.customer_id == Customer.id
+            ).where(
+                AnalysisTask.status == "completed",
+                AnalysisTask.is_deleted == False,
+                AnalysisTask.created_at >= filters.start_date,
+                AnalysisTask.created_at <= filters.end_date
+            )
+            order_by = (AnalysisTask.created_at, AnalysisTask.id)
+
+        elif dataset == "kpis":
+            rollup = DailySessionRollup
+            query = select(
+                rollup.day,
+                rollup.clinic_id,
+                rollup.counselor_id,
+                rollup.session_count,
+                rollup.completed_count,
+                (cast(rollup.completed_count, Float) / func.nullif(rollup.session_count, 0)).label("conversion_rate"),
+                (rollup.score_sum / func.nullif(rollup.scored_count, 0)).label("average_score"),
+                rollup.high_score_count,
+                rollup.satisfied_count,
+                rollup.analysis_count,
+                rollup.tokens_used,
+                rollup.cost,
+            ).where(
+                rollup.day >= to_rollup_day(filters.start_date),
+                rollup.day <= to_rollup_day(filters.end_date)
+            )
+            if filters.clinic_ids:
+                query = query.where(rollup.clinic_id.in_(filters.clinic_ids))
+            if filters.counselor_ids:
+                query = query.where(rollup.counselor_id.in_(filters.counselor_ids))
+            return query.order_by(rollup.day, rollup.clinic_id, rollup.counselor_id)
+
+        else:
+            raise ValueError(f"Unknown export dataset: {dataset}")
+
+        if filters.clinic_ids:
+            query = query.where(Customer.clinic_id.in_(filters.clinic_ids))
+        if filters.counselor_ids:
+            query = query.where(SessionModel.counselor_id.in_(filters.counselor_ids))
+        return query.order_by(*order_by)
+
+    async def run(self, export_job: ExportJob) -> None:
+        """エクスポートを実行して export_job を完了にする（失敗時は例外）"""
+        extension, content_type = EXPORT_FORMATS[export_job.file_format]
+        filters = PerformanceReportFilters(**export_job.filters)
+        query = self.build_query(export_job.dataset, filters)
+
+        # 再配信されたジョブは前回のアップロードを破棄してやり直す
+        if export_job.upload_id:
+            try:
+                await self.storage.abort_multipart_upload(export_job.file_path, export_job.upload_id)
+            except Exception as e:
+                logger.warning(f"Failed to abort previous upload for export {export_job.id}: {e}")
+
+        export_job.status = "processing"
+        export_job.started_at = datetime.utcnow()
+        export_job.rows_exported = 0
+        export_job.bytes_written = 0
+        export_job.parts_uploaded = 0
+        export_job.error_message = None
+        export_job.total_rows = self.db.execute(
+            select(func.count()).select_from(query.order_by(None).subquery())
+        ).scalar()
+        export_job.file_path = f"{settings.EXPORT_STORAGE_PREFIX}/{export_job.user_id}/{export_job.id}.{extension}"
+        export_job.upload_id = await self.storage.create_multipart_upload(export_job.file_path, content_type)
+        self.db.commit()
+
+        writer = MultipartWriter(self.storage, export_job.file_path, export_job.upload_id)
+        try:
+            encoder = ENCODERS[export_job.file_format](query.selected_columns, writer)
+
+            # 進捗のcommitでカーソルが閉じないよう、読み出しは別のコネクションで行う
+            with self.db.get_bind().connect() as connection:
+                result = connection.execution_options(yield_per=settings.EXPORT_BATCH_SIZE).execute(query)
+                for rows in result.partitions():
+                    encoder.write_rows(rows)
+                    await writer.upload_parts()
+
+                    export_job.rows_exported += len(rows)
+                    export_job.bytes_written = writer.bytes_written
+                    export_job.parts_uploaded = len(writer.parts)
+                    self.db.commit()
+
+            encoder.close()
+            await writer.upload_parts(final=True)
+            await self.storage.complete_multipart_upload(export_job.file_path, export_job.upload_id, writer.parts)
+
+        except Exception:
+            try:
+                await self.storage.abort_multipart_upload(export_job.file_path, export_job.upload_id)
+            except Exception as e:
+                logger.warning(f"Failed to abort upload for export {export_job.id}: {e}")
+            export_job.upload_id = None
+            raise
+
+        now = datetime.utcnow()
+        export_job.status = "completed"
+        export_job.upload_id = None
+        export_job.bytes_written = writer.bytes_written
+        export_job.parts_uploaded = len(writer.parts)
+        export_job.completed_at = now
+        export_job.expires_at = now + timedelta(hours=settings.EXPORT_RETENTION_HOURS)
+        self.db.commit()
+
+        logger.info(
+            f"Export {export_job.id} completed: {export_job.rows_exported} rows, "
+            f"{export_job.bytes_written} bytes in {export_job.parts_uploaded} parts"
+        )
@@ -1,20 +1,26 @@
 """
 Improvement suggestion service for analysis results
 """
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional
 import logging
 from datetime import datetime, timedelta
+import numpy as np
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
+from sqlalchemy import func, desc, case
 
-from app.models.analysis import AnalysisTask, SuccessPattern
+from app.models.analysis import AnalysisTask, SuccessPattern, CATEGORY_SCORE_COLUMNS
 from app.models.session import Session as SessionModel, SessionStatus
 from app.models.customer import Customer
+from app.models.user import User, UserRole
 from app.schemas.analysis import AnalysisResult, QuestioningAnalysis, AnxietyHandlingAnalysis, ClosingAnalysis, FlowAnalysis
 from app.schemas.improvement import (
     Suggestion, SuggestionPriority, SuggestionCategory,
     OptimizedScript, ScriptSection, SuccessPatternData,
-    ImprovementRecommendation, PerformanceTrend
+    ImprovementRecommendation, PerformanceTrend,
+    CounselorPerformanceTrend, TeamPerformanceTrendResponse
+)
+from app.services.score_matrix import (
+    TrendTable, compute_trends, load_score_matrix, percentile_ranks, score_percentiles
 )
 
 logger = logging.getLogger(__name__)
@@ -322,7 +328,14 @@ class ImprovementSuggestionService:
         try:
             cutoff_date = datetime.utcnow() - timedelta(days=days)
             
-            query = self.db.query(AnalysisTask).filter(
+            # 高スコア分析の件数とカテゴリ別の高スコア件数を集計
+            query = self.db.query(
+                func.count(AnalysisTask.id).label("total"),
+                *[
+                    func.count(case((getattr(AnalysisTask, column) >= 8.0, 1))).label(category)
+                    for category, column in CATEGORY_SCORE_COLUMNS.items()
+                ]
+            ).filter(
                 AnalysisTask.status == "completed",
                 AnalysisTask.overall_score >= 8.0,
                 AnalysisTask.created_at >= cutoff_date,
@@ -330,14 +343,17 @@ class ImprovementSuggestionService:
             )
             
             if clinic_id:
-                query = query.join(SessionModel).join(Customer).filter(
+                query = query.join(SessionModel, AnalysisTask.session_id == SessionModel.id).join(
+                    Customer, SessionModel.customer_id == Customer.id
+                ).filter(
                     Customer.clinic_id == clinic_id
                 )
             
-            high_score_analyses = query.all()
+            row = query.one()
+            high_score_counts = {category: getattr(row, category) for category in CATEGORY_SCORE_COLUMNS}
             
             # パターン分析
-            patterns = self._analyze_success_patterns(high_score_analyses)
+            patterns = self._analyze_success_patterns(high_score_counts, row.total)
             
             return patterns
             
@@ -345,24 +361,22 @@ class ImprovementSuggestionService:
             logger.error(f"Failed to get success patterns: {e}")
             return []
     
-    def _analyze_success_patterns(self, analyses: List[AnalysisTask]) -> List[SuccessPatternData]:
-        """成功パターンの分析"""
+    def _analyze_success_patterns(self, high_score_counts: Dict[str, int], total_count: int) -> List[SuccessPatternData]:
+        """成功パターンの分析
+        
+        Args:
+            high_score_counts: カテゴリ別のスコア8.0以上の件数
+            total_count: 対象の高スコア分析の件数
+        """
         patterns = []
         
-        if not analyses:
+        if not total_count:
             return patterns
         
         # 高スコア項目の分析
-        high_questioning_count = len([a for a in analyses if a.full_analysis_result and 
-                                     a.full_analysis_result.get('questioning', {}).get('score', 0) >= 8.0])
-        
-        high_anxiety_count = len([a for a in analyses if a.full_analysis_result and 
-                                a.full_analysis_result.get('anxiety_handling', {}).get('score', 0) >= 8.0])
-        
-        high_closing_count = len([a for a in analyses if a.full_analysis_result and 
-                                a.full_analysis_result.get('closing', {}).get('score', 0) >= 8.0])
-        
-        total_count = len(analyses)
+        high_questioning_count = high_score_counts.get("questioning", 0)
+        high_anxiety_count = high_score_counts.get("anxiety_handling", 0)
+        high_closing_count = high_score_counts.get("closing", 0)
         
         if high_questioning_count / total_count >= 0.7:
             patterns.append(SuccessPatternData(
@@ -404,107 +418,116 @@ class ImprovementSuggestionService:
         """パフォーマンストレンドの生成"""
         try:
             cutoff_date = datetime.utcnow() - timedelta(days=days)
-            
-            # セッション履歴の取得
-            sessions = self.db.query(SessionModel).filter(
-                SessionModel.counselor_id == counselor_id,
-                SessionModel.session_date >= cutoff_date,
-                SessionModel.is_deleted == False
-            ).order_by(SessionModel.session_date).all()
-            
-            if not sessions:
-                return PerformanceTrend(
-                    trend_direction="stable",
-                    improvement_rate=0.0,
-                    current_average=0.0,
-                    previous_average=0.0,
-                    key_improvements=[],
-                    areas_needing_attention=[]
-                )
-            
-            # 前半と後半での比較
-            mid_point = len(sessions) // 2
-            early_sessions = sessions[:mid_point] if mid_point > 0 else []
-            recent_sessions = sessions[mid_point:] if mid_point < len(sessions) else sessions
-            
-            early_avg = self._calculate_average_score(early_sessions)
-            recent_avg = self._calculate_average_score(recent_sessions)
-            
-            improvement_rate = ((recent_avg - early_avg) / early_avg * 100) if early_avg > 0 else 0
-            
-            if improvement_rate > 5:
-                trend_direction = "improving"
-            elif improvement_rate < -5:
-                trend_direction = "declining"
-            else:
-                trend_direction = "stable"
-            
-            return PerformanceTrend(
-                trend_direction=trend_direction,
-                improvement_rate=improvement_rate,
-                current_average=recent_avg,
-                previous_average=early_avg,
-                key_improvements=self._identify_improvements(early_sessions, recent_sessions),
-                areas_needing_attention=self._identify_attention_areas(recent_sessions)
-            )
+            table = compute_trends(load_score_matrix(self.db, cutoff_date, counselor_ids=[counselor_id]))
+            if not table.counselor_ids:
+                return self._empty_trend("stable")
+            return self._build_trend(table, 0)
             
         except Exception as e:
             logger.error(f"Failed to generate performance trend: {e}")
-            return PerformanceTrend(
-                trend_direction="unknown",
-                improvement_rate=0.0,
-                current_average=0.0,
-                previous_average=0.0,
-                key_improvements=[],
-                areas_needing_attention=[]
-            )
+            return self._empty_trend("unknown")
     
-    def _calculate_average_score(self, sessions: List[SessionModel]) -> float:
-        """平均スコアの計算"""
-        if not sessions:
-            return 0.0
-        
-        scores = [s.overall_score for s in sessions if s.overall_score is not None]
-        return sum(scores) / len(scores) if scores else 0.0
+    def generate_team_performance_trends(
+        self,
+        clinic_id: str,
+        days: int = 30
+    ) -> TeamPerformanceTrendResponse:
+        """クリニック内の全カウンセラーのパフォーマンストレンド（スコア取得は1クエリ）"""
+        cutoff_date = datetime.utcnow() - timedelta(days=days)
+        members = self.db.query(User.id, User.name, User.role, User.is_active).filter(
+            User.clinic_id == clinic_id
+        ).all()
+        
+        table = compute_trends(load_score_matrix(self.db, cutoff_date, counselor_ids=[m.id for m in members]))
+        ranks = percentile_ranks(table.current[:, 0])
+        
+        trends = {}
+        for index, counselor_id in enumerate(table.counselor_ids):
+            trend = self._build_trend(table, index)
+            trend.percentile_rank = self._optional(ranks[index])
+            trends[counselor_id] = trend
+        
+        counselors = []
+        for member in members:
+            trend = trends.get(member.id)
+            if trend is None:
+                # 期間内にセッションのない在籍カウンセラーも一覧に含める
+                if member.role != UserRole.COUNSELOR or not member.is_active:
+                    continue
+                trend = self._empty_trend("stable")
+            counselors.append(CounselorPerformanceTrend(
+                counselor_id=str(member.id),
+                counselor_name=member.name,
+                trend_data=trend
+            ))
+        counselors.sort(key=lambda c: c.trend_data.current_average, reverse=True)
+        
+        return TeamPerformanceTrendResponse(
+            clinic_id=str(clinic_id),
+            days=days,
+            counselors=counselors,
+            score_percentiles=score_percentiles(table.current[:, 0])
+        )
     
-    def _identify_improvements(self, early_sessions: List[SessionModel], recent_sessions: List[SessionModel]) -> List[str]:
-        """改善点の特定"""
-        improvements = []
-        
-        # 各カテゴリでの改善を確認
-        categories = ['questioning', 'anxiety_handling', 'closing', 'flow']
-        
-        for category in categories:
-            early_avg = self._calculate_category_average(early_sessions, category)
-            recent_avg = self._calculate_category_average(recent_sessions, category)
-            
-            if recent_avg > early_avg + 0.5:  # 0.5ポイント以上の改善
-                improvements.append(f"{category}スキルが向上")
-        
-        return improvements
+    def _build_trend(self, table: TrendTable, index: int) -> PerformanceTrend:
+        """集計結果の index 行目をトレンドに変換（前半にデータがなければ変化率は0）"""
+        previous = np.nan_to_num(table.previous[index])
+        current = np.nan_to_num(table.current[index])
+        early_avg, recent_avg = float(previous[0]), float(current[0])
+        improvement_rate = ((recent_avg - early_avg) / early_avg * 100) if early_avg > 0 else 0.0
+        
+        if improvement_rate > 5:
+            trend_direction = "improving"
+        elif improvement_rate < -5:
+            trend_direction = "declining"
+        else:
+            trend_direction = "stable"
+        
+        categories = list(CATEGORY_SCORE_COLUMNS)
+        deltas = table.deltas[index, 1:]
+        return PerformanceTrend(
+            trend_direction=trend_direction,
+            improvement_rate=improvement_rate,
+            current_average=recent_avg,
+            previous_average=early_avg,
+            key_improvements=self._identify_improvements(deltas),
+            areas_needing_attention=self._identify_attention_areas(table.current[index, 1:]),
+            session_count=int(table.session_counts[index]),
+            score_slope=self._optional(table.slope_per_week[index]),
+            moving_average=self._optional(table.moving_average[index]),
+            category_averages={
+                category: float(value)
+                for category, value in zip(categories, table.current[index, 1:]) if not np.isnan(value)
+            },
+            category_changes={
+                category: float(value)
+                for category, value in zip(categories, deltas) if not np.isnan(value)
+            }
+        )
     
-    def _identify_attention_areas(self, sessions: List[SessionModel]) -> List[str]:
-        """注意が必要な領域の特定"""
-        attention_areas = []
-        
-        categories = ['questioning', 'anxiety_handling', 'closing', 'flow']
-        
-        for category in categories:
-            avg_score = self._calculate_category_average(sessions, category)
-            if avg_score < 6.0:  # 6.0未満は要注意
-                attention_areas.append(f"{category}スキルの改善が必要")
-        
-        return attention_areas
+    @staticmethod
+    def _empty_trend(trend_direction: str) -> PerformanceTrend:
+        return PerformanceTrend(
+            trend_direction=trend_direction,
+            improvement_rate=0.0,
+            current_average=0.0,
+            previous_average=0.0,
+            key_improvements=[],
+            areas_needing_attention=[]
+        )
     
-    def _calculate_category_average(self, sessions: List[SessionModel], category: str) -> float:
-        """カテゴリ別平均スコアの計算"""
-        scores = []
-        for session in sessions:
-            if session.analysis_result and isinstance(session.analysis_result, dict):
-                category_data = session.analysis_result.get(category, {})
-                if isinstance(category_data, dict):
-                    score = category_data.get('score')
-                    if score is not None:
-                        scores.append(float(score))
-        
-        return sum(scores) / len(scores) if scores else 0.0
\ No newline at end of file
+    @staticmethod
+    def _optional(value) -> Optional[float]:
+        return None if np.isnan(value) else float(value)
+    
+    def _identify_improvements(self, deltas: np.ndarray) -> List[str]:
+        """改善点の特定（前半→後半で0.5ポイント以上向上したカテゴリ）"""
+        categories = np.array(list(CATEGORY_SCORE_COLUMNS))
+        improved = np.nan_to_num(deltas, nan=0.0) > 0.5
+        return [f"{category}スキルが向上" for category in categories[improved]]
+    
+    def _identify_attention_areas(self, averages: np.ndarray) -> List[str]:
+        """注意が必要な領域の特定（6.0未満、分析のないカテゴリは対象外）"""
+        categories = np.array(list(CATEGORY_SCORE_COLUMNS))
+        low = np.nan_to_num(averages, nan=10.0) < 6.0
+        return [f"{category}スキルの改善が必要" for category in categories[low]]
@@ -0,0 +1,260 @@
+"""
+Content-addressed cache for LLM responses
+"""
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def build_cache_key(
+    model: str,
+    system_prompt: str,
+    prompt: str,
+    temperature: float,
+    template_version: Optional[str] = None
+) -> str:
+    """モデル・システムプロンプト・プロンプト・温度（・テンプレート版）のハッシュ"""
+    material = json.dumps(
+        [model, system_prompt, prompt, round(float(temperature), 4), template_version],
+        ensure_ascii=False,
+        separators=(",", ":")
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class MemoryCacheBackend:
+    """プロセス内LRUキャッシュ（開発・テスト用）"""
+
+    def __init__(self, max_bytes: int, ttl: int):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.total_bytes = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._stats: Dict[str, float] = {}
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.time():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: str) -> int:
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (value, time.time() + self.ttl)
+        self.total_bytes += len(value.encode("utf-8"))
+
+        evicted = 0
+        while self.total_bytes > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            evicted += 1
+        return evicted
+
+    def _remove(self, key: str) -> None:
+        value, _ = self._entries.pop(key)
+        self.total_bytes -= len(value.encode("utf-8"))
+
+    async def incr_stats(self, amounts: Dict[str, float]) -> None:
+        for field, amount in amounts.items():
+            self._stats[field] = self._stats.get(field, 0) + amount
+
+    async def get_stats(self) -> Dict[str, float]:
+        return dict(self._stats)
+
+    async def close(self) -> None:
+        pass
+
+
+class RedisCacheBackend:
+    """Redisキャッシュ（TTL + 合計サイズ上限でLRU追い出し）
+
+    Keys (prefix = LLM_CACHE_PREFIX):
+        {prefix}:entry:{key}  STRING  キャッシュ本体（EX=TTL）
+        {prefix}:lru          ZSET    key -> 最終アクセス時刻
+        {prefix}:sizes        HASH    key -> バイト数
+        {prefix}:bytes        STRING  合計バイト数
+        {prefix}:stats        HASH    ヒット・ミス・節約量の累計（全プロセス共通）
+    """
+
+    _SET_SCRIPT = """
+local previous = redis.call('HGET', KEYS[3], ARGV[6])
+if previous then
+    redis.call('DECRBY', KEYS[4], previous)
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('ZADD', KEYS[2], ARGV[3], ARGV[6])
+redis.call('HSET', KEYS[3], ARGV[6], ARGV[4])
+local total = redis.call('INCRBY', KEYS[4], ARGV[4])
+local evicted = 0
+while total > tonumber(ARGV[5]) do
+    local oldest = redis.call('ZPOPMIN', KEYS[2])
+    if #oldest == 0 then
+        break
+    end
+    local size = redis.call('HGET', KEYS[3], oldest[1])
+    redis.call('HDEL', KEYS[3], oldest[1])
+    redis.call('DEL', ARGV[7] .. oldest[1])
+    if size then
+        total = redis.call('DECRBY', KEYS[4], size)
+    end
+    evicted = evicted + 1
+end
+return evicted
+"""
+
+    def __init__(self, max_bytes: int, ttl: int, redis_url: str = None, prefix: str = None):
+        import redis.asyncio as aioredis
+
+        self.redis = aioredis.from_url(redis_url or settings.REDIS_URL, decode_responses=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.prefix = prefix or settings.LLM_CACHE_PREFIX
+        self.entry_prefix = f"{self.prefix}:entry:"
+        self.lru_key = f"{self.prefix}:lru"
+        self.sizes_key = f"{self.prefix}:sizes"
+        self.bytes_key = f"{self.prefix}:bytes"
+        self.stats_key = f"{self.prefix}:stats"
+        self._set = self.redis.register_script(self._SET_SCRIPT)
+
+    async def get(self, key: str) -> Optional[str]:
+        value = await self.redis.get(self.entry_prefix + key)
+        if value is not None:
+            await self.redis.zadd(self.lru_key, {key: time.time()}, xx=True)
+        return value
+
+    async def set(self, key: str, value: str) -> int:
+        return int(await self._set(
+            keys=[self.entry_prefix + key, self.lru_key, self.sizes_key, self.bytes_key],
+            args=[value, self.ttl, time.time(), len(value.encode("utf-8")), self.max_bytes, key, self.entry_prefix]
+        ))
+
+    async def incr_stats(self, amounts: Dict[str, float]) -> None:
+        pipeline = self.redis.pipeline(transaction=False)
+        for field, amount in amounts.items():
+            if isinstance(amount, float):
+                pipeline.hincrbyfloat(self.stats_key, field, amount)
+            else:
+                pipeline.hincrby(self.stats_key, field, amount)
+        await pipeline.execute()
+
+    async def get_stats(self) -> Dict[str, float]:
+        return {field: float(value) for field, value in (await self.redis.hgetall(self.stats_key)).items()}
+
+    async def close(self) -> None:
+        await self.redis.close()
+
+
+class LLMResponseCache:
+    """LLMレスポンスキャッシュ
+
+    キーにはテンプレートのバージョンハッシュを含めるため、PromptService.update_template で
+    テンプレートが変わると旧エントリは参照されなくなり、TTLとサイズ上限で追い出される。
+    ヒット・ミス・節約量はバックエンドに累計するため、Redisバックエンドではワーカーで
+    記録した値をAPIプロセスから参照できる。
+    """
+
+    def __init__(self, backend=None, enabled: bool = None):
+        self.enabled = settings.LLM_CACHE_ENABLED if enabled is None else enabled
+        self.backend = backend or self._create_backend()
+
+    def _create_backend(self):
+        if settings.LLM_CACHE_BACKEND == "redis":
+            return RedisCacheBackend(settings.LLM_CACHE_MAX_BYTES, settings.LLM_CACHE_TTL)
+        return MemoryCacheBackend(settings.LLM_CACHE_MAX_BYTES, settings.LLM_CACHE_TTL)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """キャッシュ取得（ヒット時は節約量を記録）"""
+        if not self.enabled:
+            return None
+        try:
+            raw = await self.backend.get(key)
+        except Exception as e:
+            # キャッシュ障害で分析を止めない
+            logger.warning(f"LLM cache read failed: {e}")
+            return None
+
+        if raw is None:
+            await self._record(misses=1)
+            return None
+
+        entry = json.loads(raw)
+        await self._record(
+            hits=1, saved_tokens=entry.get("tokens_used", 0), saved_cost=float(entry.get("cost", 0.0))
+        )
+        return entry
+
+    async def set(self, key: str, content: str, tokens_used: int, cost: float, model: str) -> None:
+        """キャッシュ保存"""
+        if not self.enabled:
+            return
+        entry = json.dumps({
+            "content": content,
+            "tokens_used": tokens_used,
+            "cost": cost,
+            "model": model,
+            "cached_at": time.time()
+        }, ensure_ascii=False)
+        try:
+            evicted = await self.backend.set(key, entry)
+        except Exception as e:
+            logger.warning(f"LLM cache write failed: {e}")
+            return
+        if evicted:
+            await self._record(evictions=evicted)
+
+    async def record_bypass(self) -> None:
+        await self._record(bypassed=1)
+
+    async def _record(self, **amounts) -> None:
+        try:
+            await self.backend.incr_stats(amounts)
+        except Exception as e:
+            logger.warning(f"LLM cache stats update failed: {e}")
+
+    async def get_statistics(self) -> Dict[str, Any]:
+        """ヒット率・節約量"""
+        try:
+            stats = await self.backend.get_stats()
+        except Exception as e:
+            logger.warning(f"LLM cache stats read failed: {e}")
+            stats = {}
+        hits = int(stats.get("hits", 0))
+        misses = int(stats.get("misses", 0))
+        lookups = hits + misses
+        return {
+            "enabled": self.enabled,
+            "hits": hits,
+            "misses": misses,
+            "bypassed": int(stats.get("bypassed", 0)),
+            "evictions": int(stats.get("evictions", 0)),
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "saved_tokens": int(stats.get("saved_tokens", 0)),
+            "saved_cost": round(stats.get("saved_cost", 0.0), 4),
+        }
+
+    async def close(self) -> None:
+        await self.backend.close()
+
+
+_cache: Optional[LLMResponseCache] = None
+
+
+def get_llm_cache() -> LLMResponseCache:
+    """プロセス共有のLLMレスポンスキャッシュ"""
+    global _cache
+    if _cache is None:
+        _cache = LLMResponseCache()
+    return _cache
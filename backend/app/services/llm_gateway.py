@@ -0,0 +1,369 @@
+"""
+Async OpenAI gateway with shared rate limiting
+"""
+import asyncio
+import logging
+import random
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import httpx
+import openai
+
+from app.core.config import settings
+from app.core.instrumentation import record_llm_call, record_llm_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """1分あたりの容量で補充されるトークンバケット"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """amount を消費できるまでの待ち時間（秒）"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount: float) -> None:
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def sync_remaining(self, remaining: float) -> None:
+        """サーバーが返した残量に合わせる（サーバー側の方が少ない場合のみ）"""
+        self._refill()
+        self.tokens = min(self.tokens, float(remaining))
+
+    def drain(self) -> None:
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+
+
+class ModelRateLimiter:
+    """モデル単位のリクエスト数・トークン数リミッター"""
+
+    def __init__(self, model: str, requests_per_minute: int, tokens_per_minute: int):
+        self.model = model
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, estimated_tokens: int) -> None:
+        """予算が確保できるまで待機（ロック保持中に待つため到着順に処理される）"""
+        async with self._lock:
+            while True:
+                wait = max(
+                    self.paused_until - time.monotonic(),
+                    self.requests.wait_time(1),
+                    self.tokens.wait_time(estimated_tokens) if self.tokens else 0.0
+                )
+                if wait <= 0:
+                    self.requests.consume(1)
+                    if self.tokens:
+                        self.tokens.consume(estimated_tokens)
+                    return
+                await asyncio.sleep(wait)
+
+    def settle(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """見積もりと実使用量の差分を精算"""
+        if self.tokens and actual_tokens is not None:
+            self.tokens.refund(estimated_tokens - actual_tokens)
+
+    def pause(self, seconds: float) -> None:
+        """429受信時に全リクエストを一時停止"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.requests.drain()
+        if self.tokens:
+            self.tokens.drain()
+
+    def update_from_headers(self, headers: httpx.Headers) -> None:
+        """x-ratelimit-remaining-* ヘッダーでバケットを補正"""
+        remaining_requests = headers.get("x-ratelimit-remaining-requests")
+        if remaining_requests and remaining_requests.isdigit():
+            self.requests.sync_remaining(int(remaining_requests))
+        remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+        if self.tokens and remaining_tokens and remaining_tokens.isdigit():
+            self.tokens.sync_remaining(int(remaining_tokens))
+
+
+@dataclass
+class LLMResponse:
+    """Chat Completion の結果"""
+    content: str
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+    cached_tokens: int = 0  # プロンプトキャッシュから読まれた入力トークン（prompt_tokens の内数）
+    usage: Dict[str, Any] = field(default_factory=dict)
+
+
+_DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+
+
+def parse_retry_after(headers: Optional[httpx.Headers]) -> Optional[float]:
+    """retry-after / retry-after-ms / x-ratelimit-reset-* から待ち時間（秒）を取得"""
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000.0
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+
+    # "6m0s", "1.5s", "250ms" 形式
+    resets = []
+    for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+        value = headers.get(name)
+        if not value:
+            continue
+        seconds = 0.0
+        for amount, unit in _DURATION_PATTERN.findall(value):
+            seconds += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+        resets.append(seconds)
+    return max(resets) if resets else None
+
+
+class LLMGateway:
+    """プロセス共有のOpenAIクライアント
+
+    - モデルごとのリクエスト数/分・トークン数/分のトークンバケット
+    - 429 と retry-after ヘッダーに応じた一時停止と再試行
+    - 同時実行数の上限
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        max_concurrency: int = None,
+        max_retries: int = None,
+        rate_limits: Dict[str, Dict[str, int]] = None
+    ):
+        self.api_key = api_key if api_key is not None else settings.OPENAI_API_KEY
+        self.base_url = base_url if base_url is not None else settings.OPENAI_BASE_URL
+        self.max_concurrency = max_concurrency or settings.LLM_MAX_CONCURRENCY
+        self.max_retries = max_retries if max_retries is not None else settings.LLM_MAX_RETRIES
+        self.rate_limits = rate_limits if rate_limits is not None else settings.LLM_RATE_LIMITS
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client: Optional[openai.AsyncOpenAI] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._limiters: Dict[str, ModelRateLimiter] = {}
+
+        self.request_count = 0
+        self.rate_limited_count = 0
+        self.retry_count = 0
+
+    @property
+    def enabled(self) -> bool:
+        """APIキー（またはフェイクサーバー）が設定されているか"""
+        return bool(self.api_key or self.base_url)
+
+    def _ensure_loop(self) -> None:
+        """イベントループごとにクライアントと同期プリミティブを用意"""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._client = openai.AsyncOpenAI(
+            api_key=self.api_key or "not-set",
+            base_url=self.base_url or None,
+            max_retries=0,  # 再試行はゲートウェイで制御
+            http_client=httpx.AsyncClient(
+                timeout=settings.LLM_REQUEST_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency
+                )
+            )
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._limiters = {}
+
+    def get_limiter(self, model: str) -> ModelRateLimiter:
+        if model not in self._limiters:
+            limits = self.rate_limits.get(model, {})
+            self._limiters[model] = ModelRateLimiter(
+                model,
+                requests_per_minute=limits.get("rpm", settings.LLM_DEFAULT_RPM),
+                tokens_per_minute=limits.get("tpm", settings.LLM_DEFAULT_TPM)
+            )
+        return self._limiters[model]
+
+    async def chat_completion(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        temperature: float,
+        response_format: Optional[Dict[str, Any]] = None,
+        estimated_prompt_tokens: Optional[int] = None
+    ) -> LLMResponse:
+        """Chat Completion API呼び出し"""
+        self._ensure_loop()
+
+        if estimated_prompt_tokens is None:
+            # 日本語は概ね1文字1トークン以下なので文字数で安全側に見積もる
+            estimated_prompt_tokens = sum(len(m.get("content") or "") for m in messages)
+        estimated_tokens = estimated_prompt_tokens + max_tokens
+
+        params = {
+            "model": model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+        }
+        if response_format:
+            params["response_format"] = response_format
+
+        raw = await self._request(
+            model,
+            estimated_tokens,
+            lambda: self._client.chat.completions.with_raw_response.create(**params)
+        )
+        completion = raw.parse()
+
+        usage = completion.usage.model_dump() if completion.usage else {}
+        prompt_details = usage.get("prompt_tokens_details") or {}
+        response = LLMResponse(
+            content=completion.choices[0].message.content or "",
+            model=completion.model or model,
+            prompt_tokens=usage.get("prompt_tokens", 0),
+            completion_tokens=usage.get("completion_tokens", 0),
+            total_tokens=usage.get("total_tokens", 0),
+            cached_tokens=prompt_details.get("cached_tokens") or 0,
+            usage=usage
+        )
+        self.get_limiter(model).settle(estimated_tokens, response.total_tokens)
+        record_llm_tokens(model, response.total_tokens, response.cached_tokens)
+        return response
+
+    async def transcribe(
+        self,
+        file_path: str,
+        model: str,
+        language: str,
+        temperature: float,
+        response_format: str = "verbose_json",
+        prompt: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Whisper API呼び出し（prompt は直前の文字起こしを文脈として渡す）"""
+        self._ensure_loop()
+
+        params = {
+            "model": model,
+            "language": language,
+            "response_format": response_format,
+            "temperature": temperature,
+        }
+        if prompt:
+            params["prompt"] = prompt
+
+        async def call():
+            with open(file_path, "rb") as audio_file:
+                return await self._client.audio.transcriptions.with_raw_response.create(
+                    file=audio_file,
+                    **params
+                )
+
+        raw = await self._request(model, 0, call)
+        return raw.parse().model_dump()
+
+    async def _request(self, model: str, estimated_tokens: int, call):
+        """レート制限・同時実行数・再試行を適用してリクエストを実行"""
+        limiter = self.get_limiter(model)
+
+        for attempt in range(self.max_retries + 1):
+            await limiter.acquire(estimated_tokens)
+            try:
+                async with self._semaphore:
+                    self.request_count += 1
+                    started = time.perf_counter()
+                    try:
+                        raw = await call()
+                    finally:
+                        record_llm_call(model, time.perf_counter() - started)
+                limiter.update_from_headers(raw.headers)
+                return raw
+
+            except openai.RateLimitError as e:
+                # クォータ不足は待っても回復しない
+                if getattr(e, "code", None) == "insufficient_quota":
+                    raise
+                self.rate_limited_count += 1
+                delay = parse_retry_after(getattr(e, "response", None) and e.response.headers)
+                if delay is None:
+                    delay = self._backoff(attempt)
+                limiter.pause(delay)
+                logger.warning(f"Rate limited on {model}, pausing {delay:.2f}s (attempt {attempt + 1})")
+                if attempt >= self.max_retries:
+                    raise
+
+            except (openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError) as e:
+                limiter.settle(estimated_tokens, 0)
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning(f"OpenAI request failed on {model}: {e}, retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+            self.retry_count += 1
+
+    def _backoff(self, attempt: int) -> float:
+        return min(60.0, (2 ** attempt) + random.uniform(0, 1))
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """ゲートウェイの利用状況"""
+        return {
+            "requests": self.request_count,
+            "rate_limited": self.rate_limited_count,
+            "retries": self.retry_count,
+            "max_concurrency": self.max_concurrency,
+        }
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+            self._loop = None
+
+
+_gateway: Optional[LLMGateway] = None
+
+
+def get_llm_gateway() -> LLMGateway:
+    """プロセス共有のLLMゲートウェイ"""
+    global _gateway
+    if _gateway is None:
+        _gateway = LLMGateway()
+    return _gateway
@@ -1,29 +1,296 @@
 """
 Prompt management service for AI analysis
 """
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import threading
+import time
 import jinja2
 import logging
 
+from app.core.config import settings
+
 logger = logging.getLogger(__name__)
 
-class PromptService:
-    """プロンプトテンプレート管理サービス"""
-    
-    def __init__(self):
-        self.template_dir = Path(__file__).parent.parent / "prompts"
+# 4項目と要約を1回で回答させる統合分析テンプレート
+COMBINED_ANALYSIS_TEMPLATE = """
+以下のカウンセリング文字起こしを分析し、質問技法・不安対応・クロージング・トーク流れの4項目の評価と、
+セッション全体の要約を1つのJSONで回答してください。
+
+【文字起こし】
+{{ transcription }}
+
+【分析観点】
+- questioning: オープン/クローズドクエスチョンの使い分け、顧客の発言時間比率、質問の多様性
+- anxiety_handling: 不安要素の特定、共感表現、解決策の具体性、不安解消の確認
+- closing: タイミング、緊急性・限定性の活用、価格提示方法、異議処理、契約確度
+- flow: 構成の論理性、話題転換、顧客ペースへの配慮、重要ポイントの強調、満足度予測
+- session_summary: セッション全体の要約（200文字以内）
+- key_strengths / critical_improvements: 主な強みと重要な改善点（各3-5項目）
+
+スコアは1-10、比率・スコア類は0-1で回答してください：
+{
+    "questioning": {
+        "score": (1-10), "open_question_ratio": (0-1), "customer_talk_time_ratio": (0-1),
+        "question_diversity": (質問の種類数), "effective_questions": ["効果的だった質問例"], "improvements": ["改善提案"]
+    },
+    "anxiety_handling": {
+        "score": (1-10), "anxiety_points_identified": ["特定された不安要素"], "empathy_expressions": (共感表現の回数),
+        "solution_specificity": (0-1), "anxiety_resolution_confirmed": (true/false), "improvements": ["改善提案"]
+    },
+    "closing": {
+        "score": (1-10), "timing_appropriateness": (0-1), "urgency_creation": (0-1), "limitation_usage": (0-1),
+        "price_presentation_method": "価格提示手法の説明", "objection_handling": ["異議処理の例"],
+        "contract_probability": (0-1), "improvements": ["改善提案"]
+    },
+    "flow": {
+        "score": (1-10), "logical_structure": (0-1), "smooth_transitions": (0-1), "customer_pace_consideration": (0-1),
+        "key_point_emphasis": (0-1), "session_satisfaction_prediction": (0-1), "improvements": ["改善提案"]
+    },
+    "session_summary": "このセッションの要約...",
+    "key_strengths": ["強み1", "強み2", "強み3"],
+    "critical_improvements": ["重要改善点1", "重要改善点2", "重要改善点3"]
+}
+"""
+
+# prefix レイアウトで指示側の {{ transcription }} に入れる参照文（文字起こし本体はシステムメッセージ側）
+TRANSCRIPT_REFERENCE = "（システムメッセージ末尾の文字起こしを参照してください）"
+
+# テンプレートディレクトリに無ければ作成する既定のテンプレート
+DEFAULT_TEMPLATES = {
+    "questioning_analysis.txt": """
+以下のカウンセリング文字起こしの質問技法を分析してください。
+
+【文字起こし】
+{{ transcription }}
+
+【分析観点】
+- オープンクエスチョンとクローズドクエスチョンの効果的な使い分け
+- 顧客の本音を引き出す質問力
+- 質問の多様性と深掘り力
+- 顧客の発言を促す質問技法
+
+JSON形式で回答してください：
+{
+    "score": (1-10のスコア),
+    "open_question_ratio": (0-1の比率),
+    "customer_talk_time_ratio": (0-1の比率),
+    "question_diversity": (質問の種類数),
+    "effective_questions": ["効果的だった質問例"],
+    "improvements": ["改善提案"]
+}
+""",
+    "anxiety_analysis.txt": """
+以下のカウンセリング文字起こしの不安対応を分析してください。
+
+【文字起こし】
+{{ transcription }}
+
+【分析観点】
+- 顧客の不安要素の特定精度
+- 共感的な対応の質と頻度
+- 具体的で分かりやすい解決策提示
+- 不安解消の確認と安心感の醸成
+
+JSON形式で回答してください：
+{
+    "score": (1-10のスコア),
+    "anxiety_points_identified": ["特定された不安要素"],
+    "empathy_expressions": (共感表現の回数),
+    "solution_specificity": (0-1の具体性スコア),
+    "anxiety_resolution_confirmed": (true/false),
+    "improvements": ["改善提案"]
+}
+""",
+    "closing_analysis.txt": """
+以下のカウンセリング文字起こしのクロージング手法を分析してください。
+
+【文字起こし】
+{{ transcription }}
+
+【分析観点】
+- クロージングタイミングの適切さ
+- 緊急性と限定性の効果的活用
+- 価格提示方法の巧妙さ
+- 異議処理の技法
+- 契約への誘導力
+
+JSON形式で回答してください：
+{
+    "score": (1-10のスコア),
+    "timing_appropriateness": (0-1のタイミングスコア),
+    "urgency_creation": (0-1の緊急性スコア),
+    "limitation_usage": (0-1の限定性スコア),
+    "price_presentation_method": "価格提示手法の説明",
+    "objection_handling": ["異議処理の例"],
+    "contract_probability": (0-1の契約確度),
+    "improvements": ["改善提案"]
+}
+""",
+    "flow_analysis.txt": """
+以下のカウンセリング文字起こしのトーク流れを分析してください。
+
+【文字起こし】
+{{ transcription }}
+
+【分析観点】
+- セッション構成の論理性と自然さ
+- 話題転換のスムーズさ
+- 顧客ペースへの配慮
+- 重要ポイントの効果的強調
+- 全体的な満足度予測
+
+JSON形式で回答してください：
+{
+    "score": (1-10のスコア),
+    "logical_structure": (0-1の論理性スコア),
+    "smooth_transitions": (0-1の転換スムーズさ),
+    "customer_pace_consideration": (0-1の配慮スコア),
+    "key_point_emphasis": (0-1の強調効果),
+    "session_satisfaction_prediction": (0-1の満足度予測),
+    "improvements": ["改善提案"]
+}
+""",
+    "combined_analysis.txt": COMBINED_ANALYSIS_TEMPLATE
+}
+
+_combined_fallback = jinja2.Template(COMBINED_ANALYSIS_TEMPLATE)
+
+
+@dataclass(frozen=True)
+class CompiledPrompt:
+    """コンパイル済みのテンプレート"""
+    name: str
+    template: jinja2.Template
+    version: str
+    mtime_ns: int
+
+    def render(self, **kwargs) -> str:
+        return self.template.render(**kwargs)
+
+
+class PromptRegistry:
+    """プロセス共有のプロンプトテンプレート
+
+    ディレクトリの用意と既定テンプレートの作成、全テンプレートの読み込みとコンパイルは
+    プロセスで1回だけ行い、以降はコンパイル済みのものを返す。ファイルの更新時刻は
+    PROMPT_RELOAD_INTERVAL ごとに確認し、変わっていれば読み直す（write では即座に破棄）。
+    version は内容のハッシュで、LLMキャッシュのキーに使う。
+    """
+
+    def __init__(self, template_dir: Path, reload_interval: Optional[float] = None):
+        self.template_dir = template_dir
+        self.reload_interval = settings.PROMPT_RELOAD_INTERVAL if reload_interval is None else reload_interval
         self.template_dir.mkdir(exist_ok=True)
-        
+
+        # include/extends 用のローダー（テンプレート本体は _compile でコンパイル）
         self.env = jinja2.Environment(
             loader=jinja2.FileSystemLoader(self.template_dir),
             autoescape=True
         )
-        
-        # プロンプトテンプレートが存在しない場合は作成
-        self._ensure_prompt_templates()
-        
-        logger.info("PromptService initialized")
+        # テンプレート名 → (コンパイル済みテンプレート or None, 最終確認時刻)
+        self._prompts: Dict[str, Tuple[Optional[CompiledPrompt], float]] = {}
+        self._lock = threading.Lock()
+
+        self._ensure_default_templates()
+        for name in self.names():
+            self.get(name)
+        logger.info(f"PromptRegistry loaded {len(self._prompts)} templates from {self.template_dir}")
+
+    def _ensure_default_templates(self) -> None:
+        for filename, content in DEFAULT_TEMPLATES.items():
+            template_path = self.template_dir / filename
+            if not template_path.exists():
+                try:
+                    template_path.write_text(content.strip(), encoding='utf-8')
+                    logger.info(f"Created template: {filename}")
+                except Exception as e:
+                    logger.error(f"Failed to create template {filename}: {e}")
+
+    def _path(self, name: str) -> Path:
+        return self.template_dir / f"{name}.txt"
+
+    def _compile(self, name: str, previous: Optional[CompiledPrompt]) -> Optional[CompiledPrompt]:
+        path = self._path(name)
+        try:
+            mtime_ns = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if previous is not None and previous.mtime_ns == mtime_ns:
+            return previous
+
+        try:
+            source = path.read_text(encoding='utf-8')
+            template = self.env.from_string(source)
+        except Exception as e:
+            # 壊れた編集では直前のテンプレートを使い続ける
+            logger.error(f"Failed to compile template {name}: {e}")
+            return previous
+
+        version = hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+        if previous is not None:
+            logger.info(f"Reloaded template: {name} ({previous.version} -> {version})")
+        return CompiledPrompt(name=name, template=template, version=version, mtime_ns=mtime_ns)
+
+    def get(self, name: str) -> Optional[CompiledPrompt]:
+        """コンパイル済みテンプレート（存在しなければ None）"""
+        entry = self._prompts.get(name)
+        if entry is not None and time.monotonic() - entry[1] < self.reload_interval:
+            return entry[0]
+
+        with self._lock:
+            previous = entry[0] if entry is not None else None
+            prompt = self._compile(name, previous)
+            self._prompts[name] = (prompt, time.monotonic())
+            return prompt
+
+    def render(self, name: str, **kwargs) -> Optional[str]:
+        prompt = self.get(name)
+        return prompt.render(**kwargs) if prompt is not None else None
+
+    def version(self, name: str) -> Optional[str]:
+        prompt = self.get(name)
+        return prompt.version if prompt is not None else None
+
+    def invalidate(self, name: Optional[str] = None) -> None:
+        """次の get で読み直させる（name 省略時は全テンプレート）"""
+        with self._lock:
+            if name is None:
+                self._prompts.clear()
+            else:
+                self._prompts.pop(name, None)
+
+    def write(self, name: str, content: str) -> None:
+        self._path(name).write_text(content, encoding='utf-8')
+        self.invalidate(name)
+
+    def names(self) -> List[str]:
+        return sorted(f.stem for f in self.template_dir.glob("*.txt") if f.is_file())
+
+
+_prompt_registry: Optional[PromptRegistry] = None
+_prompt_registry_lock = threading.Lock()
+
+
+def get_prompt_registry() -> PromptRegistry:
+    """プロセス共有のプロンプトレジストリ"""
+    global _prompt_registry
+    if _prompt_registry is None:
+        with _prompt_registry_lock:
+            if _prompt_registry is None:
+                _prompt_registry = PromptRegistry(Path(__file__).parent.parent / "prompts")
+    return _prompt_registry
+
+
+class PromptService:
+    """プロンプトテンプレート管理サービス"""
+    
+    def __init__(self, registry: Optional[PromptRegistry] = None):
+        # テンプレートの読み込みとコンパイルはレジストリがプロセスで1回だけ行う
+        self.registry = registry or get_prompt_registry()
+        self.template_dir = self.registry.template_dir
 
     def get_system_prompt(self) -> str:
         """システムプロンプト取得"""
@@ -41,12 +308,18 @@ class PromptService:
 美容医療業界の専門知識を活用し、実用的なアドバイスを提供してください。
 """
 
+    def get_transcript_system_prompt(self, text: str) -> str:
+        """システムプロンプト＋文字起こし（prefix レイアウト）
+
+        同じ文字起こしに対する項目別の呼び出しで先頭が完全に一致するため、
+        プロバイダー側のプロンプトキャッシュが2件目以降の入力に効く。
+        """
+        return f"{self.get_system_prompt()}\n【文字起こし】\n{text}\n"
+
     def get_questioning_prompt(self, text: str) -> str:
         """質問分析プロンプト"""
-        try:
-            template = self.env.get_template("questioning_analysis.txt")
-            return template.render(transcription=text)
-        except jinja2.TemplateNotFound:
+        prompt = self.registry.render("questioning_analysis", transcription=text)
+        if prompt is None:
             # フォールバック用の直接テンプレート
             return f"""
 以下のカウンセリング文字起こしを分析し、質問技法について評価してください。
@@ -71,13 +344,12 @@ class PromptService:
     "improvements": ["改善点1", "改善点2"]
 }}
 """
+        return prompt
 
     def get_anxiety_prompt(self, text: str) -> str:
         """不安対応分析プロンプト"""
-        try:
-            template = self.env.get_template("anxiety_analysis.txt")
-            return template.render(transcription=text)
-        except jinja2.TemplateNotFound:
+        prompt = self.registry.render("anxiety_analysis", transcription=text)
+        if prompt is None:
             return f"""
 以下のカウンセリング文字起こしを分析し、顧客の不安への対応について評価してください。
 
@@ -101,13 +373,12 @@ class PromptService:
     "improvements": ["改善点1", "改善点2"]
 }}
 """
+        return prompt
 
     def get_closing_prompt(self, text: str) -> str:
         """クロージング分析プロンプト"""
-        try:
-            template = self.env.get_template("closing_analysis.txt")
-            return template.render(transcription=text)
-        except jinja2.TemplateNotFound:
+        prompt = self.registry.render("closing_analysis", transcription=text)
+        if prompt is None:
             return f"""
 以下のカウンセリング文字起こしを分析し、クロージング手法について評価してください。
 
@@ -134,13 +405,12 @@ class PromptService:
     "improvements": ["改善点1", "改善点2"]
 }}
 """
+        return prompt
 
     def get_flow_prompt(self, text: str) -> str:
         """フロー分析プロンプト"""
-        try:
-            template = self.env.get_template("flow_analysis.txt")
-            return template.render(transcription=text)
-        except jinja2.TemplateNotFound:
+        prompt = self.registry.render("flow_analysis", transcription=text)
+        if prompt is None:
             return f"""
 以下のカウンセリング文字起こしを分析し、トークの流れについて評価してください。
 
@@ -165,6 +435,7 @@ class PromptService:
     "improvements": ["改善点1", "改善点2"]
 }}
 """
+        return prompt
 
     def get_comprehensive_analysis_prompt(self, text: str) -> str:
         """包括分析プロンプト"""
@@ -189,126 +460,32 @@ class PromptService:
 }}
 """
 
+    def get_combined_analysis_prompt(self, text: str) -> str:
+        """統合分析プロンプト（4項目＋要約）"""
+        prompt = self.registry.render("combined_analysis", transcription=text)
+        if prompt is None:
+            return _combined_fallback.render(transcription=text)
+        return prompt
+
     def get_custom_prompt(self, template_name: str, **kwargs) -> str:
         """カスタムプロンプト取得"""
-        try:
-            template = self.env.get_template(f"{template_name}.txt")
-            return template.render(**kwargs)
-        except jinja2.TemplateNotFound:
+        prompt = self.registry.render(template_name, **kwargs)
+        if prompt is None:
             logger.warning(f"Template not found: {template_name}")
             return ""
+        return prompt
 
-    def _ensure_prompt_templates(self) -> None:
-        """プロンプトテンプレートファイルを確保"""
-        templates = {
-            "questioning_analysis.txt": """
-以下のカウンセリング文字起こしの質問技法を分析してください。
-
-【文字起こし】
-{{ transcription }}
-
-【分析観点】
-- オープンクエスチョンとクローズドクエスチョンの効果的な使い分け
-- 顧客の本音を引き出す質問力
-- 質問の多様性と深掘り力
-- 顧客の発言を促す質問技法
-
-JSON形式で回答してください：
-{
-    "score": (1-10のスコア),
-    "open_question_ratio": (0-1の比率),
-    "customer_talk_time_ratio": (0-1の比率),
-    "question_diversity": (質問の種類数),
-    "effective_questions": ["効果的だった質問例"],
-    "improvements": ["改善提案"]
-}
-""",
-            "anxiety_analysis.txt": """
-以下のカウンセリング文字起こしの不安対応を分析してください。
-
-【文字起こし】
-{{ transcription }}
-
-【分析観点】
-- 顧客の不安要素の特定精度
-- 共感的な対応の質と頻度
-- 具体的で分かりやすい解決策提示
-- 不安解消の確認と安心感の醸成
-
-JSON形式で回答してください：
-{
-    "score": (1-10のスコア),
-    "anxiety_points_identified": ["特定された不安要素"],
-    "empathy_expressions": (共感表現の回数),
-    "solution_specificity": (0-1の具体性スコア),
-    "anxiety_resolution_confirmed": (true/false),
-    "improvements": ["改善提案"]
-}
-""",
-            "closing_analysis.txt": """
-以下のカウンセリング文字起こしのクロージング手法を分析してください。
-
-【文字起こし】
-{{ transcription }}
-
-【分析観点】
-- クロージングタイミングの適切さ
-- 緊急性と限定性の効果的活用
-- 価格提示方法の巧妙さ
-- 異議処理の技法
-- 契約への誘導力
-
-JSON形式で回答してください：
-{
-    "score": (1-10のスコア),
-    "timing_appropriateness": (0-1のタイミングスコア),
-    "urgency_creation": (0-1の緊急性スコア),
-    "limitation_usage": (0-1の限定性スコア),
-    "price_presentation_method": "価格提示手法の説明",
-    "objection_handling": ["異議処理の例"],
-    "contract_probability": (0-1の契約確度),
-    "improvements": ["改善提案"]
-}
-""",
-            "flow_analysis.txt": """
-以下のカウンセリング文字起こしのトーク流れを分析してください。
-
-【文字起こし】
-{{ transcription }}
-
-【分析観点】
-- セッション構成の論理性と自然さ
-- 話題転換のスムーズさ
-- 顧客ペースへの配慮
-- 重要ポイントの効果的強調
-- 全体的な満足度予測
-
-JSON形式で回答してください：
-{
-    "score": (1-10のスコア),
-    "logical_structure": (0-1の論理性スコア),
-    "smooth_transitions": (0-1の転換スムーズさ),
-    "customer_pace_consideration": (0-1の配慮スコア),
-    "key_point_emphasis": (0-1の強調効果),
-    "session_satisfaction_prediction": (0-1の満足度予測),
-    "improvements": ["改善提案"]
-}
-"""
-        }
-        
-        for filename, content in templates.items():
-            template_path = self.template_dir / filename
-            if not template_path.exists():
-                try:
-                    template_path.write_text(content.strip(), encoding='utf-8')
-                    logger.info(f"Created template: {filename}")
-                except Exception as e:
-                    logger.error(f"Failed to create template {filename}: {e}")
+    def get_template_version(self, template_name: str) -> Optional[str]:
+        """テンプレート内容のハッシュ（LLMキャッシュのキーに使用）"""
+        return self.registry.version(template_name)
 
     def validate_template(self, template_name: str) -> bool:
         """テンプレートの妥当性チェック"""
         try:
-            template = self.env.get_template(f"{template_name}.txt")
+            content = self.get_template_content(template_name)
+            if content is None:
+                raise jinja2.TemplateNotFound(template_name)
+            template = self.registry.env.from_string(content)
             # 簡単なレンダリングテスト
             template.render(transcription="test")
             return True
@@ -318,13 +495,7 @@ JSON形式で回答してください：
 
     def list_templates(self) -> list[str]:
         """利用可能なテンプレート一覧"""
-        if not self.template_dir.exists():
-            return []
-        
-        return [
-            f.stem for f in self.template_dir.glob("*.txt")
-            if f.is_file()
-        ]
+        return self.registry.names()
 
     def get_template_content(self, template_name: str) -> Optional[str]:
         """テンプレート内容の取得"""
@@ -338,14 +509,9 @@ JSON形式で回答してください：
 
     def update_template(self, template_name: str, content: str) -> bool:
         """テンプレート内容の更新"""
-        template_path = self.template_dir / f"{template_name}.txt"
         try:
-            template_path.write_text(content, encoding='utf-8')
-            # テンプレート環境をリロード
-            self.env = jinja2.Environment(
-                loader=jinja2.FileSystemLoader(self.template_dir),
-                autoescape=True
-            )
+            # 書き込み後にコンパイル済みテンプレートを破棄（次の利用時に読み直す）
+            self.registry.write(template_name, content)
             logger.info(f"Updated template: {template_name}")
             return True
         except Exception as e:
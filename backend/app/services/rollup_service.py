@@ -0,0 +1,215 @@
+"""
+Daily session rollups for dashboard aggregation
+"""
+import logging
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Iterable, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import Date, Float, case, cast, delete, func, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.analysis import AnalysisTask
+from app.models.customer import Customer
+from app.models.rollup import DailySessionRollup, UNASSIGNED_COUNSELOR_SQL
+from app.models.session import Session as SessionModel, SessionStatus
+
+logger = logging.getLogger(__name__)
+
+# ロールアップのキー: (現地日付, クリニックID, カウンセラーID)
+RollupKey = Tuple[date, object, Optional[object]]
+
+# ロールアップ列名 → analysis_result のカテゴリキー
+CATEGORY_COLUMNS = {
+    "questioning": "questioning",
+    "anxiety": "anxiety_handling",
+    "closing": "closing",
+    "flow": "flow",
+}
+
+
+def to_rollup_day(value: datetime) -> date:
+    """日時（naiveはUTC）をロールアップの現地日付に変換"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(ZoneInfo(settings.ROLLUP_TIME_ZONE)).date()
+
+
+def day_bounds(first_day: date, last_day: date) -> Tuple[datetime, datetime]:
+    """現地日付の範囲 [first_day, last_day] をUTCのnaive日時 [start, end) に変換"""
+    zone = ZoneInfo(settings.ROLLUP_TIME_ZONE)
+    start = datetime.combine(first_day, time.min, tzinfo=zone)
+    end = datetime.combine(last_day + timedelta(days=1), time.min, tzinfo=zone)
+    return (
+        start.astimezone(timezone.utc).replace(tzinfo=None),
+        end.astimezone(timezone.utc).replace(tzinfo=None)
+    )
+
+
+class RollupService:
+    """日次ロールアップの更新・再構築
+
+    行は差分の加算ではなく、対象キーのセッションから毎回再計算して置き換える。
+    ジョブの再配信や同じセッションの再分析でも二重計上されない。
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def _aggregate_select(self, start: datetime, end: datetime, clinic_id=None, counselor_id=None, unassigned: bool = False):
+        """セッション（と完了済み分析タスク）をキーごとに集計するSELECT"""
+        tasks = select(
+            AnalysisTask.session_id.label("session_id"),
+            func.count(AnalysisTask.id).label("analysis_count"),
+            func.coalesce(func.sum(AnalysisTask.openai_tokens_used), 0).label("tokens_used"),
+            func.coalesce(func.sum(AnalysisTask.openai_cost), 0.0).label("cost"),
+            func.coalesce(func.sum(AnalysisTask.actual_duration), 0).label("analysis_duration_sum")
+        ).where(
+            AnalysisTask.status == "completed",
+            AnalysisTask.is_deleted == False,
+            AnalysisTask.session_id.isnot(None)
+        ).group_by(AnalysisTask.session_id).subquery("tasks")
+
+        day = cast(
+            func.timezone(settings.ROLLUP_TIME_ZONE, func.timezone("UTC", SessionModel.session_date)),
+            Date
+        )
+        score = SessionModel.overall_score
+
+        def category_score(key: str):
+            return cast(SessionModel.analysis_result[key]["score"].astext, Float)
+
+        columns = [
+            func.gen_random_uuid().label("id"),
+            day.label("day"),
+            Customer.clinic_id.label("clinic_id"),
+            SessionModel.counselor_id.label("counselor_id"),
+            func.count(SessionModel.id).label("session_count"),
+            func.count(case((SessionModel.status == SessionStatus.COMPLETED, 1))).label("completed_count"),
+            func.count(score).label("scored_count"),
+            func.count(case((score >= 8.0, 1))).label("high_score_count"),
+            func.count(case((score >= 7.0, 1))).label("satisfied_count"),
+            func.coalesce(func.sum(score), 0.0).label("score_sum"),
+        ]
+        for column, key in CATEGORY_COLUMNS.items():
+            columns.append(func.coalesce(func.sum(category_score(key)), 0.0).label(f"{column}_score_sum"))
+            columns.append(func.count(category_score(key)).label(f"{column}_count"))
+        columns += [
+            func.coalesce(func.sum(tasks.c.analysis_count), 0).label("analysis_count"),
+            func.coalesce(func.sum(tasks.c.tokens_used), 0).label("tokens_used"),
+            func.coalesce(func.sum(tasks.c.cost), 0.0).label("cost"),
+            func.coalesce(func.sum(tasks.c.analysis_duration_sum), 0).label("analysis_duration_sum"),
+            func.timezone("UTC", func.now()).label("refreshed_at"),
+        ]
+
+        query = select(*columns).select_from(
+            SessionModel.__table__
+            .join(Customer.__table__, SessionModel.customer_id == Customer.id)
+            .outerjoin(tasks, tasks.c.session_id == SessionModel.id)
+        ).where(
+            SessionModel.session_date >= start,
+            SessionModel.session_date < end,
+            SessionModel.is_deleted == False
+        )
+        if clinic_id is not None:
+            query = query.where(Customer.clinic_id == clinic_id)
+        if counselor_id is not None:
+            query = query.where(SessionModel.counselor_id == counselor_id)
+        elif unassigned:
+            query = query.where(SessionModel.counselor_id.is_(None))
+
+        return query.group_by(day, Customer.clinic_id, SessionModel.counselor_id)
+
+    def _upsert(self, aggregate) -> None:
+        """集計結果をロールアップに書き込む（同時更新はユニークキーで合流）"""
+        names = [column.name for column in aggregate.selected_columns]
+        statement = insert(DailySessionRollup).from_select(names, aggregate)
+        statement = statement.on_conflict_do_update(
+            index_elements=[
+                DailySessionRollup.day,
+                DailySessionRollup.clinic_id,
+                func.coalesce(DailySessionRollup.counselor_id, text(UNASSIGNED_COUNSELOR_SQL)),
+            ],
+            set_={name: statement.excluded[name] for name in names if name not in ("id", "day", "clinic_id", "counselor_id")}
+        )
+        self.db.execute(statement)
+
+    def refresh_keys(self, keys: Iterable[RollupKey]) -> None:
+        """指定したキーの行を再計算"""
+        self.db.flush()
+        for day, clinic_id, counselor_id in set(keys):
+            counselor_match = (
+                DailySessionRollup.counselor_id == counselor_id
+                if counselor_id is not None
+                else DailySessionRollup.counselor_id.is_(None)
+            )
+            # 対象のセッションがなくなった場合に行を残さない
+            self.db.execute(
+                delete(DailySessionRollup).where(
+                    DailySessionRollup.day == day,
+                    DailySessionRollup.clinic_id == clinic_id,
+                    counselor_match
+                )
+            )
+            start, end = day_bounds(day, day)
+            self._upsert(self._aggregate_select(
+                start, end,
+                clinic_id=clinic_id,
+                counselor_id=counselor_id,
+                unassigned=counselor_id is None
+            ))
+
+    def session_key(self, session: SessionModel) -> Optional[RollupKey]:
+        """セッションが属するロールアップのキー"""
+        clinic_id = self.db.query(Customer.clinic_id).filter(Customer.id == session.customer_id).scalar()
+        if clinic_id is None or session.session_date is None:
+            return None
+        return (to_rollup_day(session.session_date), clinic_id, session.counselor_id)
+
+    def refresh_sessions(self, *sessions: SessionModel) -> None:
+        """セッションの変更をロールアップに反映
+
+        失敗しても呼び出し元のトランザクションを巻き込まないよう SAVEPOINT 内で実行し、
+        取りこぼした行は backfill スクリプトで再構築する。
+        """
+        keys: Set[RollupKey] = set()
+        for session in sessions:
+            key = self.session_key(session)
+            if key:
+                keys.add(key)
+        if not keys:
+            return
+
+        try:
+            with self.db.begin_nested():
+                self.refresh_keys(keys)
+        except Exception as e:
+            logger.warning(f"Failed to refresh daily rollups {sorted(str(k) for k in keys)}: {e}")
+
+    def rebuild(self, first_day: Optional[date] = None, last_day: Optional[date] = None) -> int:
+        """期間内のロールアップを作り直し、書き込んだ行数を返す（呼び出し側でcommit）"""
+        if first_day is None or last_day is None:
+            earliest, latest = self.db.query(
+                func.min(SessionModel.session_date),
+                func.max(SessionModel.session_date)
+            ).one()
+            if earliest is None:
+                return 0
+            first_day = first_day or to_rollup_day(earliest)
+            last_day = last_day or to_rollup_day(latest)
+
+        self.db.execute(
+            delete(DailySessionRollup).where(
+                DailySessionRollup.day >= first_day,
+                DailySessionRollup.day <= last_day
+            )
+        )
+        start, end = day_bounds(first_day, last_day)
+        self._upsert(self._aggregate_select(start, end))
+
+        return self.db.query(func.count(DailySessionRollup.id)).filter(
+            DailySessionRollup.day >= first_day,
+            DailySessionRollup.day <= last_day
+        ).scalar()
@@ -0,0 +1,177 @@
+"""
+Columnar score matrix for counselor trend analytics
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.models.analysis import AnalysisTask, CATEGORY_SCORE_COLUMNS
+from app.models.session import Session as SessionModel
+
+# scores の列（0列目が総合スコア、以降がカテゴリ別スコア）
+SCORE_COLUMNS = ["overall"] + list(CATEGORY_SCORE_COLUMNS)
+
+# 直近の移動平均に使うセッション数
+MOVING_AVERAGE_WINDOW = 5
+
+
+@dataclass
+class ScoreMatrix:
+    """セッション × スコアの列指向データ（カウンセラー・セッション日時の順に並ぶ）"""
+    counselor_ids: np.ndarray  # (n,) object
+    days: np.ndarray  # (n,) 期間開始からの経過日数
+    scores: np.ndarray  # (n, len(SCORE_COLUMNS)) 未採点は NaN
+    since: datetime
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def groups(self):
+        """カウンセラーごとの (ID, 開始位置, 件数)"""
+        if not len(self):
+            return [], np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        starts = np.concatenate(([0], np.flatnonzero(self.counselor_ids[1:] != self.counselor_ids[:-1]) + 1))
+        sizes = np.diff(np.append(starts, len(self)))
+        return list(self.counselor_ids[starts]), starts, sizes
+
+
+@dataclass
+class TrendTable:
+    """カウンセラー単位の集計結果（各配列の i 行目が counselor_ids[i]）"""
+    counselor_ids: List
+    session_counts: np.ndarray  # (g,)
+    previous: np.ndarray  # (g, len(SCORE_COLUMNS)) 期間前半の平均
+    current: np.ndarray  # (g, len(SCORE_COLUMNS)) 期間後半の平均
+    slope_per_week: np.ndarray  # (g,) 総合スコアの最小二乗の傾き（1週間あたり）
+    moving_average: np.ndarray  # (g,) 直近 MOVING_AVERAGE_WINDOW 件の総合スコア平均
+
+    @property
+    def deltas(self) -> np.ndarray:
+        """前半→後半の変化量"""
+        return self.current - self.previous
+
+
+def load_score_matrix(
+    db: Session,
+    since: datetime,
+    counselor_ids: Optional[Sequence] = None
+) -> ScoreMatrix:
+    """期間内のセッションの総合スコアと最新の完了済み分析のカテゴリ別スコアを1クエリで取得"""
+    scope = [SessionModel.session_date >= since, SessionModel.is_deleted == False]
+    if counselor_ids is not None:
+        scope.append(SessionModel.counselor_id.in_(list(counselor_ids)))
+
+    latest = db.query(
+        AnalysisTask.session_id,
+        *[getattr(AnalysisTask, column) for column in CATEGORY_SCORE_COLUMNS.values()]
+    ).filter(
+        AnalysisTask.session_id.in_(select(SessionModel.id).where(*scope)),
+        AnalysisTask.status == "completed",
+        AnalysisTask.is_deleted == False
+    ).distinct(AnalysisTask.session_id).order_by(
+        AnalysisTask.session_id, AnalysisTask.completed_at.desc().nullslast()
+    ).subquery("latest")
+
+    rows = db.query(
+        SessionModel.counselor_id,
+        SessionModel.session_date,
+        SessionModel.overall_score,
+        *[latest.c[column] for column in CATEGORY_SCORE_COLUMNS.values()]
+    ).outerjoin(
+        latest, latest.c.session_id == SessionModel.id
+    ).filter(*scope).order_by(
+        SessionModel.counselor_id, SessionModel.session_date
+    ).all()
+
+    dates = np.array([row[1] for row in rows], dtype="datetime64[us]")
+    return ScoreMatrix(
+        counselor_ids=np.array([row[0] for row in rows], dtype=object),
+        days=(dates - np.datetime64(since, "us")) / np.timedelta64(1, "D"),
+        scores=np.array([row[2:] for row in rows], dtype=np.float64).reshape(len(rows), len(SCORE_COLUMNS)),
+        since=since
+    )
+
+
+def _group_sum(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    return np.add.reduceat(values, starts, axis=0)
+
+
+def _group_mean(values: np.ndarray, mask: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """mask 内の NaN 以外の値のグループ平均（値がなければ NaN）"""
+    if values.ndim > mask.ndim:
+        mask = mask[:, None]
+    valid = mask & ~np.isnan(values)
+    sums = _group_sum(np.where(valid, values, 0.0), starts)
+    counts = _group_sum(valid.astype(np.int64), starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts
+
+
+def _group_slope(x: np.ndarray, y: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """グループごとの y = a + bx の最小二乗の傾き b（2点未満・同一時刻のみは NaN）"""
+    valid = ~np.isnan(y)
+    x = np.where(valid, x, 0.0)
+    y = np.where(valid, y, 0.0)
+    n = _group_sum(valid.astype(np.float64), starts)
+    sx, sy = _group_sum(x, starts), _group_sum(y, starts)
+    sxx, sxy = _group_sum(x * x, starts), _group_sum(x * y, starts)
+    denominator = n * sxx - sx * sx
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(denominator > 1e-9, (n * sxy - sx * sy) / denominator, np.nan)
+
+
+def _trailing_mask(values: np.ndarray, starts: np.ndarray, sizes: np.ndarray, window: int) -> np.ndarray:
+    """各グループで NaN 以外の末尾 window 件"""
+    valid = ~np.isnan(values)
+    cumulative = np.cumsum(valid)
+    before_group = cumulative[starts] - valid[starts]
+    seen = cumulative - np.repeat(before_group, sizes)
+    remaining = np.repeat(_group_sum(valid.astype(np.int64), starts), sizes) - seen
+    return valid & (remaining < window)
+
+
+def compute_trends(matrix: ScoreMatrix, window: int = MOVING_AVERAGE_WINDOW) -> TrendTable:
+    """全カウンセラーの前半/後半平均・傾き・移動平均をまとめて計算
+
+    各カウンセラーのセッションを日時順に二分し（奇数件は後半が1件多い）、前半と後半の
+    平均をカテゴリごとに求める。
+    """
+    counselor_ids, starts, sizes = matrix.groups()
+    if not counselor_ids:
+        empty = np.zeros((0, len(SCORE_COLUMNS)))
+        return TrendTable([], sizes, empty, empty, np.zeros(0), np.zeros(0))
+
+    position = np.arange(len(matrix)) - np.repeat(starts, sizes)
+    recent = position >= np.repeat(sizes // 2, sizes)
+    overall = matrix.scores[:, 0]
+
+    return TrendTable(
+        counselor_ids=counselor_ids,
+        session_counts=sizes,
+        previous=_group_mean(matrix.scores, ~recent, starts),
+        current=_group_mean(matrix.scores, recent, starts),
+        slope_per_week=_group_slope(matrix.days, overall, starts) * 7,
+        moving_average=_group_mean(overall, _trailing_mask(overall, starts, sizes, window), starts)
+    )
+
+
+def percentile_ranks(values: np.ndarray) -> np.ndarray:
+    """各値以下の値の割合（0〜100、NaN は NaN のまま）"""
+    valid = ~np.isnan(values)
+    ordered = np.sort(values[valid])
+    if not len(ordered):
+        return np.full(values.shape, np.nan)
+    ranks = np.searchsorted(ordered, values, side="right") / len(ordered) * 100
+    return np.where(valid, ranks, np.nan)
+
+
+def score_percentiles(values: np.ndarray, quantiles: Sequence[int] = (25, 50, 75)) -> Dict[str, float]:
+    """分布のパーセンタイル（例: {"p50": 7.2}）"""
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return {}
+    return {f"p{q}": float(v) for q, v in zip(quantiles, np.percentile(values, quantiles))}
@@ -5,10 +5,11 @@ from typing import List, Dict, Optional, Union
 import logging
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
+from sqlalchemy import func, case
 
 from app.models.session import Session as SessionModel
 from app.models.customer import Customer
-from app.models.analysis import AnalysisTask
+from app.models.analysis import AnalysisTask, CATEGORY_SCORE_COLUMNS
 from app.schemas.improvement import (
     OptimizedScript, ScriptSection, SuccessPatternData,
     ScriptGenerationRequest, ImplementationDifficulty
@@ -147,19 +148,31 @@ class ScriptOptimizationService:
     def _get_relevant_success_patterns(self, request: ScriptGenerationRequest) -> List[SuccessPatternData]:
         """関連する成功パターンの取得"""
         try:
-            # 過去30日間の高スコア分析から成功パターンを抽出
-            high_score_analyses = self.db.query(AnalysisTask).filter(
+            # 過去30日間の高スコア分析（20件）のカテゴリスコア
+            high_score_analyses = self.db.query(
+                *[getattr(AnalysisTask, column) for column in CATEGORY_SCORE_COLUMNS.values()]
+            ).filter(
                 AnalysisTask.overall_score >= 8.0,
                 AnalysisTask.status == "completed",
                 AnalysisTask.created_at >= datetime.utcnow() - timedelta(days=30),
                 AnalysisTask.is_deleted == False
-            ).limit(20).all()
+            ).limit(20).subquery("high_score_analyses")
+            
+            # エリア別の高スコア件数を集計
+            row = self.db.query(
+                func.count().label("total"),
+                *[
+                    func.count(case((high_score_analyses.c[column] >= 8.0, 1))).label(area)
+                    for area, column in CATEGORY_SCORE_COLUMNS.items()
+                ]
+            ).select_from(high_score_analyses).one()
             
             patterns = []
             
             # フォーカスエリアに基づいて関連パターンを抽出
             for focus_area in request.focus_areas:
-                pattern_data = self._extract_pattern_for_area(high_score_analyses, focus_area)
+                high_score_count = getattr(row, focus_area, 0) if focus_area in CATEGORY_SCORE_COLUMNS else 0
+                pattern_data = self._extract_pattern_for_area(high_score_count, row.total, focus_area)
                 if pattern_data:
                     patterns.append(pattern_data)
             
@@ -169,20 +182,16 @@ class ScriptOptimizationService:
             logger.error(f"Failed to get success patterns: {e}")
             return []
     
-    def _extract_pattern_for_area(self, analyses: List[AnalysisTask], area: str) -> Optional[SuccessPatternData]:
-        """特定エリアの成功パターン抽出"""
-        if not analyses:
+    def _extract_pattern_for_area(self, high_score_count: int, total_count: int, area: str) -> Optional[SuccessPatternData]:
+        """特定エリアの成功パターン抽出
+        
+        Args:
+            high_score_count: エリアのスコアが8.0以上の分析件数
+            total_count: 対象の高スコア分析の件数
+        """
+        if not total_count:
             return None
         
-        high_score_count = 0
-        total_count = len(analyses)
-        
-        for analysis in analyses:
-            if analysis.full_analysis_result and isinstance(analysis.full_analysis_result, dict):
-                area_data = analysis.full_analysis_result.get(area, {})
-                if isinstance(area_data, dict) and area_data.get('score', 0) >= 8.0:
-                    high_score_count += 1
-        
         if high_score_count / total_count >= 0.6:  # 60%以上で成功パターンとみなす
             return SuccessPatternData(
                 pattern_type=area,
@@ -1,29 +1,96 @@
+import asyncio
 import boto3
+import contextvars
+from botocore.config import Config
 from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from functools import partial
+import hashlib
+import mimetypes
+import shutil
 import uuid
 import logging
 from typing import Optional, Dict, Any
 import os
 
 from app.core.config import settings
+from app.core.instrumentation import instrument_s3_client
 
 logger = logging.getLogger(__name__)
 
-class S3StorageService:
-    """S3を使用したファイルストレージサービス"""
+_s3_client = None
+_executor: Optional[ThreadPoolExecutor] = None
+_storage_service = None
+
+
+def get_s3_client():
+    """プロセス共有のS3クライアント
     
-    def __init__(self):
-        self.s3_client = boto3.client(
+    boto3のクライアントはスレッドセーフなので1つを共有し、
+    コネクションプールの上限と再試行ポリシーを設定で制御する。
+    """
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = boto3.client(
             's3',
             aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
             aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
             region_name=settings.AWS_REGION,
+            endpoint_url=settings.S3_ENDPOINT_URL,
+            config=Config(
+                max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+                retries={
+                    'max_attempts': settings.S3_MAX_ATTEMPTS,
+                    'mode': settings.S3_RETRY_MODE,
+                },
+            ),
         )
-        self.bucket_name = settings.S3_BUCKET_NAME
-        self.expiration = 3600  # プリサインドURLの有効期限（1時間）
-        
-        logger.info(f"S3StorageService initialized with bucket: {self.bucket_name}")
+        instrument_s3_client(_s3_client)
+    return _s3_client
+
+
+def get_storage_executor() -> ThreadPoolExecutor:
+    """ストレージI/O用のスレッドプール（コネクションプールと同じ上限）"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.S3_MAX_POOL_CONNECTIONS,
+            thread_name_prefix="storage"
+        )
+    return _executor
+
+
+async def run_blocking(func, *args, **kwargs):
+    """ブロッキング呼び出しをストレージ用スレッドプールで実行（計測用にコンテキストを引き継ぐ）"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_storage_executor(), partial(context.run, func, *args, **kwargs))
+
+
+def get_storage_service():
+    """プロセス共有のストレージサービス（STORAGE_BACKEND で切り替え）"""
+    global _storage_service
+    if _storage_service is None:
+        if settings.STORAGE_BACKEND == "local":
+            _storage_service = LocalStorageService()
+        else:
+            _storage_service = S3StorageService()
+    return _storage_service
+
+
+def close_storage() -> None:
+    """スレッドプールの停止"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+class StorageService:
+    """ストレージサービスの共通処理"""
+    
+    expiration = 3600  # プリサインドURLの有効期限（1時間）
 
     def generate_file_path(
         self, 
@@ -47,6 +114,46 @@ class S3StorageService:
         session_id = str(uuid.uuid4())
         return f"{clinic_id}/{customer_id}/{date_str}/{session_id}.{file_extension}"
 
+    def validate_file_type(self, content_type: str) -> bool:
+        """ファイルタイプ検証
+        
+        Args:
+            content_type: ファイルのContent-Type
+            
+        Returns:
+            有効なファイルタイプかどうか
+        """
+        allowed_types = [
+            'audio/webm',
+            'audio/mp4',
+            'audio/mpeg',
+            'audio/wav',
+            'audio/ogg'
+        ]
+        return content_type in allowed_types
+
+    def validate_file_size(self, file_size: int) -> bool:
+        """ファイルサイズ検証
+        
+        Args:
+            file_size: ファイルサイズ（バイト）
+            
+        Returns:
+            有効なファイルサイズかどうか
+        """
+        max_size = 100 * 1024 * 1024  # 100MB
+        return 0 < file_size <= max_size
+
+
+class S3StorageService(StorageService):
+    """S3を使用したファイルストレージサービス"""
+    
+    def __init__(self):
+        self.s3_client = get_s3_client()
+        self.bucket_name = settings.S3_BUCKET_NAME
+        
+        logger.info(f"S3StorageService initialized with bucket: {self.bucket_name}")
+
     async def generate_presigned_upload_url(
         self, 
         file_path: str, 
@@ -133,6 +240,178 @@ class S3StorageService:
             logger.error(f"Failed to generate presigned download URL: {e}")
             raise Exception(f"ダウンロードURL生成エラー: {e}")
 
+    async def upload_file(self, local_path: str, file_path: str, content_type: str) -> int:
+        """ローカルファイルをアップロード
+        
+        Args:
+            local_path: アップロードするローカルファイル
+            file_path: S3内のファイルパス
+            content_type: ファイルのContent-Type
+            
+        Returns:
+            アップロードしたバイト数
+        """
+        try:
+            await run_blocking(
+                self.s3_client.upload_file,
+                local_path,
+                self.bucket_name,
+                file_path,
+                ExtraArgs={
+                    'ContentType': content_type,
+                    'ServerSideEncryption': 'AES256'
+                }
+            )
+            
+            logger.info(f"File uploaded successfully: {file_path}")
+            return os.path.getsize(local_path)
+            
+        except ClientError as e:
+            logger.error(f"Failed to upload file {file_path}: {e}")
+            raise Exception(f"ファイルアップロードエラー: {e}")
+
+    async def download_to_file(self, file_path: str, dest_path: str) -> int:
+        """オブジェクトをローカルファイルへストリーミングダウンロード
+        
+        本文はチャンク単位でファイルに書き込むため、メモリ使用量は
+        S3_DOWNLOAD_CHUNK_SIZE × 同時実行数で頭打ちになる。
+        S3_DOWNLOAD_PART_SIZE を超えるオブジェクトはRange GETで並列に取得する。
+        
+        Args:
+            file_path: S3内のファイルパス
+            dest_path: 書き込み先のローカルファイル
+            
+        Returns:
+            ダウンロードしたバイト数
+        """
+        try:
+            metadata = await self.get_file_metadata(file_path)
+            size = metadata["size"]
+            part_size = settings.S3_DOWNLOAD_PART_SIZE
+            
+            fd = os.open(dest_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            try:
+                os.ftruncate(fd, size)
+                if size <= part_size:
+                    await run_blocking(self._download_range, file_path, fd, 0, size - 1)
+                else:
+                    semaphore = asyncio.Semaphore(settings.S3_DOWNLOAD_CONCURRENCY)
+                    
+                    async def download_part(start: int) -> None:
+                        end = min(start + part_size, size) - 1
+                        async with semaphore:
+                            await run_blocking(self._download_range, file_path, fd, start, end)
+                    
+                    await asyncio.gather(*[download_part(start) for start in range(0, size, part_size)])
+            finally:
+                os.close(fd)
+            
+            logger.info(f"File downloaded: {file_path} ({size} bytes)")
+            return size
+            
+        except ClientError as e:
+            logger.error(f"Failed to download file {file_path}: {e}")
+            raise Exception(f"ファイルダウンロードエラー: {e}")
+
+    def _download_range(self, file_path: str, fd: int, start: int, end: int) -> None:
+        """[start, end] バイトを取得して同じ位置に書き込む（スレッドプールで実行）"""
+        if end < start:
+            return
+        response = self.s3_client.get_object(
+            Bucket=self.bucket_name,
+            Key=file_path,
+            Range=f"bytes={start}-{end}"
+        )
+        offset = start
+        for chunk in response['Body'].iter_chunks(chunk_size=settings.S3_DOWNLOAD_CHUNK_SIZE):
+            os.pwrite(fd, chunk, offset)
+            offset += len(chunk)
+        
+        expected = end + 1
+        if offset != expected:
+            raise Exception(f"Range {start}-{end} truncated at {offset}")
+
+    async def create_multipart_upload(self, file_path: str, content_type: str) -> str:
+        """マルチパートアップロード開始
+        
+        Args:
+            file_path: S3内のファイルパス
+            content_type: ファイルのContent-Type
+            
+        Returns:
+            アップロードID
+        """
+        try:
+            response = await run_blocking(
+                self.s3_client.create_multipart_upload,
+                Bucket=self.bucket_name,
+                Key=file_path,
+                ContentType=content_type,
+                ServerSideEncryption='AES256'
+            )
+            return response['UploadId']
+            
+        except ClientError as e:
+            logger.error(f"Failed to start multipart upload {file_path}: {e}")
+            raise Exception(f"マルチパートアップロード開始エラー: {e}")
+
+    async def upload_part(self, file_path: str, upload_id: str, part_number: int, data: bytes) -> Dict[str, Any]:
+        """パートのアップロード（最後以外は5MB以上）
+        
+        Args:
+            file_path: S3内のファイルパス
+            upload_id: アップロードID
+            part_number: パート番号（1始まり）
+            data: パートの内容
+            
+        Returns:
+            complete_multipart_upload に渡すパート情報
+        """
+        try:
+            response = await run_blocking(
+                self.s3_client.upload_part,
+                Bucket=self.bucket_name,
+                Key=file_path,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=data
+            )
+            return {"PartNumber": part_number, "ETag": response['ETag']}
+            
+        except ClientError as e:
+            logger.error(f"Failed to upload part {part_number} of {file_path}: {e}")
+            raise Exception(f"パートアップロードエラー: {e}")
+
+    async def complete_multipart_upload(self, file_path: str, upload_id: str, parts: list[Dict[str, Any]]) -> None:
+        """マルチパートアップロード完了"""
+        try:
+            await run_blocking(
+                self.s3_client.complete_multipart_upload,
+                Bucket=self.bucket_name,
+                Key=file_path,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts}
+            )
+            logger.info(f"Multipart upload completed: {file_path} ({len(parts)} parts)")
+            
+        except ClientError as e:
+            logger.error(f"Failed to complete multipart upload {file_path}: {e}")
+            raise Exception(f"マルチパートアップロード完了エラー: {e}")
+
+    async def abort_multipart_upload(self, file_path: str, upload_id: str) -> None:
+        """マルチパートアップロード中断（アップロード済みのパートを破棄）"""
+        try:
+            await run_blocking(
+                self.s3_client.abort_multipart_upload,
+                Bucket=self.bucket_name,
+                Key=file_path,
+                UploadId=upload_id
+            )
+            
+        except ClientError as e:
+            logger.error(f"Failed to abort multipart upload {file_path}: {e}")
+            raise Exception(f"マルチパートアップロード中断エラー: {e}")
+
     async def delete_file(self, file_path: str) -> bool:
         """ファイル削除
         
@@ -143,7 +422,8 @@ class S3StorageService:
             削除成功フラグ
         """
         try:
-            self.s3_client.delete_object(
+            await run_blocking(
+                self.s3_client.delete_object,
                 Bucket=self.bucket_name,
                 Key=file_path
             )
@@ -164,7 +444,8 @@ class S3StorageService:
             ファイルメタデータ
         """
         try:
-            response = self.s3_client.head_object(
+            response = await run_blocking(
+                self.s3_client.head_object,
                 Bucket=self.bucket_name,
                 Key=file_path
             )
@@ -192,7 +473,8 @@ class S3StorageService:
             ファイル存在フラグ
         """
         try:
-            self.s3_client.head_object(
+            await run_blocking(
+                self.s3_client.head_object,
                 Bucket=self.bucket_name,
                 Key=file_path
             )
@@ -221,7 +503,8 @@ class S3StorageService:
                 'Key': source_path
             }
             
-            self.s3_client.copy_object(
+            await run_blocking(
+                self.s3_client.copy_object,
                 CopySource=copy_source,
                 Bucket=self.bucket_name,
                 Key=dest_path,
@@ -250,7 +533,8 @@ class S3StorageService:
             ファイル一覧
         """
         try:
-            response = self.s3_client.list_objects_v2(
+            response = await run_blocking(
+                self.s3_client.list_objects_v2,
                 Bucket=self.bucket_name,
                 Prefix=prefix,
                 MaxKeys=max_keys
@@ -272,32 +556,162 @@ class S3StorageService:
             logger.error(f"Failed to list files with prefix {prefix}: {e}")
             raise Exception(f"ファイル一覧取得エラー: {e}")
 
-    def validate_file_type(self, content_type: str) -> bool:
-        """ファイルタイプ検証
+
+class LocalStorageService(StorageService):
+    """ローカルファイルシステムを使用したストレージ（オフライン開発・ベンチマーク用）
+    
+    S3StorageService と同じインターフェースで STORAGE_LOCAL_ROOT 配下に保存する。
+    プリサインドURLは file:// のURLを返す。
+    """
+    
+    def __init__(self, root: str = None):
+        self.root = os.path.abspath(root or settings.STORAGE_LOCAL_ROOT)
+        os.makedirs(self.root, exist_ok=True)
         
-        Args:
-            content_type: ファイルのContent-Type
-            
-        Returns:
-            有効なファイルタイプかどうか
-        """
-        allowed_types = [
-            'audio/webm',
-            'audio/mp4',
-            'audio/mpeg',
-            'audio/wav',
-            'audio/ogg'
-        ]
-        return content_type in allowed_types
+        logger.info(f"LocalStorageService initialized with root: {self.root}")
 
-    def validate_file_size(self, file_size: int) -> bool:
-        """ファイルサイズ検証
+    def _resolve(self, file_path: str) -> str:
+        """ストレージ内の絶対パス（ルート外へのパスは拒否）"""
+        path = os.path.abspath(os.path.join(self.root, file_path.lstrip("/")))
+        if os.path.commonpath([self.root, path]) != self.root:
+            raise Exception(f"不正なファイルパス: {file_path}")
+        return path
+
+    async def generate_presigned_upload_url(
+        self, 
+        file_path: str, 
+        content_type: str,
+        file_size: Optional[int] = None
+    ) -> Dict[str, Any]:
+        expires_at = datetime.utcnow() + timedelta(seconds=self.expiration)
+        return {
+            "upload_url": f"file://{self._resolve(file_path)}",
+            "fields": {"Content-Type": content_type},
+            "file_path": file_path,
+            "expires_at": expires_at.isoformat()
+        }
+
+    async def generate_presigned_download_url(self, file_path: str) -> Dict[str, Any]:
+        expires_at = datetime.utcnow() + timedelta(seconds=self.expiration)
+        return {
+            "download_url": f"file://{self._resolve(file_path)}",
+            "file_path": file_path,
+            "expires_at": expires_at.isoformat()
+        }
+
+    def _copy(self, source: str, dest: str) -> int:
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shutil.copyfile(source, dest)
+        return os.path.getsize(dest)
+
+    async def upload_file(self, local_path: str, file_path: str, content_type: str) -> int:
+        try:
+            return await run_blocking(self._copy, local_path, self._resolve(file_path))
+        except OSError as e:
+            logger.error(f"Failed to upload file {file_path}: {e}")
+            raise Exception(f"ファイルアップロードエラー: {e}")
+
+    async def download_to_file(self, file_path: str, dest_path: str) -> int:
+        try:
+            return await run_blocking(self._copy, self._resolve(file_path), dest_path)
+        except OSError as e:
+            logger.error(f"Failed to download file {file_path}: {e}")
+            raise Exception(f"ファイルダウンロードエラー: {e}")
+
+    def _part_path(self, file_path: str, upload_id: str) -> str:
+        return f"{self._resolve(file_path)}.{upload_id}.part"
+
+    def _append(self, path: str, data: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "ab") as f:
+            f.write(data)
+
+    async def create_multipart_upload(self, file_path: str, content_type: str) -> str:
+        # パートは順番にアップロードされる前提で一時ファイルへ追記する
+        upload_id = uuid.uuid4().hex
+        await run_blocking(self._append, self._part_path(file_path, upload_id), b"")
+        return upload_id
+
+    async def upload_part(self, file_path: str, upload_id: str, part_number: int, data: bytes) -> Dict[str, Any]:
+        try:
+            await run_blocking(self._append, self._part_path(file_path, upload_id), data)
+        except OSError as e:
+            logger.error(f"Failed to upload part {part_number} of {file_path}: {e}")
+            raise Exception(f"パートアップロードエラー: {e}")
+        return {"PartNumber": part_number, "ETag": hashlib.md5(data).hexdigest()}
+
+    async def complete_multipart_upload(self, file_path: str, upload_id: str, parts: list[Dict[str, Any]]) -> None:
+        try:
+            await run_blocking(os.replace, self._part_path(file_path, upload_id), self._resolve(file_path))
+            logger.info(f"Multipart upload completed: {file_path} ({len(parts)} parts)")
+        except OSError as e:
+            logger.error(f"Failed to complete multipart upload {file_path}: {e}")
+            raise Exception(f"マルチパートアップロード完了エラー: {e}")
+
+    async def abort_multipart_upload(self, file_path: str, upload_id: str) -> None:
+        path = self._part_path(file_path, upload_id)
+        if await run_blocking(os.path.exists, path):
+            await run_blocking(os.remove, path)
+
+    async def delete_file(self, file_path: str) -> bool:
+        try:
+            await run_blocking(os.remove, self._resolve(file_path))
+            logger.info(f"File deleted successfully: {file_path}")
+            return True
+        except OSError as e:
+            logger.error(f"Failed to delete file {file_path}: {e}")
+            raise Exception(f"ファイル削除エラー: {e}")
+
+    async def get_file_metadata(self, file_path: str) -> Dict[str, Any]:
+        try:
+            stat = await run_blocking(os.stat, self._resolve(file_path))
+        except OSError as e:
+            logger.error(f"Failed to get file metadata {file_path}: {e}")
+            raise Exception(f"メタデータ取得エラー: {e}")
         
-        Args:
-            file_size: ファイルサイズ（バイト）
-            
-        Returns:
-            有効なファイルサイズかどうか
-        """
-        max_size = 100 * 1024 * 1024  # 100MB
-        return 0 < file_size <= max_size
\ No newline at end of file
+        return {
+            "size": stat.st_size,
+            "last_modified": datetime.utcfromtimestamp(stat.st_mtime).isoformat(),
+            "content_type": mimetypes.guess_type(file_path)[0] or "application/octet-stream",
+            "metadata": {},
+            "etag": hashlib.md5(f"{stat.st_size}-{stat.st_mtime_ns}".encode()).hexdigest(),
+            "encryption": None
+        }
+
+    async def file_exists(self, file_path: str) -> bool:
+        return await run_blocking(os.path.isfile, self._resolve(file_path))
+
+    async def copy_file(self, source_path: str, dest_path: str) -> bool:
+        try:
+            await run_blocking(self._copy, self._resolve(source_path), self._resolve(dest_path))
+            logger.info(f"File copied from {source_path} to {dest_path}")
+            return True
+        except OSError as e:
+            logger.error(f"Failed to copy file from {source_path} to {dest_path}: {e}")
+            raise Exception(f"ファイルコピーエラー: {e}")
+
+    def _list(self, prefix: str, max_keys: int) -> list:
+        files = []
+        for directory, _, names in os.walk(self.root):
+            for name in sorted(names):
+                path = os.path.join(directory, name)
+                key = os.path.relpath(path, self.root).replace(os.sep, "/")
+                if not key.startswith(prefix):
+                    continue
+                stat = os.stat(path)
+                files.append({
+                    "key": key,
+                    "size": stat.st_size,
+                    "last_modified": datetime.utcfromtimestamp(stat.st_mtime).isoformat(),
+                    "etag": hashlib.md5(f"{stat.st_size}-{stat.st_mtime_ns}".encode()).hexdigest()
+                })
+                if len(files) >= max_keys:
+                    return files
+        return files
+
+    async def list_files(
+        self, 
+        prefix: str = "", 
+        max_keys: int = 1000
+    ) -> list[Dict[str, Any]]:
+        return await run_blocking(self._list, prefix, max_keys)
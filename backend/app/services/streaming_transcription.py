@@ -0,0 +1,196 @@
+"""
+Incremental transcription of in-progress recordings
+"""
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+from difflib import SequenceMatcher
+from typing import List, Optional
+
+import aiofiles
+
+from app.core.config import settings
+from app.schemas.transcription import TranscriptionResult, TranscriptionSegment
+from app.services.audio_processing import convert_to_wav, slice_wav
+from app.services.transcribe_service import TranscriptionService
+
+logger = logging.getLogger(__name__)
+
+# これより短い残りはウィンドウとして送らない（秒）
+MIN_WINDOW_SECONDS = 0.5
+# 境界の重複とみなす最短一致文字数
+MIN_OVERLAP_CHARS = 2
+# Whisperに文脈として渡す直前テキストの文字数
+CONTEXT_PROMPT_CHARS = 100
+
+
+class StreamingTranscriber:
+    """録音中の音声を逐次文字起こし
+
+    ブラウザから届く音声チャンクをスプールファイルに追記し、
+    window_seconds ごとに overlap_seconds 重ねたウィンドウを Whisper に送る。
+    重なり区間は中央で前後のウィンドウに割り当て、境界をまたぐセグメントは
+    直前のセグメントと重複する先頭テキストを除去してから確定する。
+    """
+
+    def __init__(
+        self,
+        task_id: str,
+        file_extension: str = ".webm",
+        language: str = "ja",
+        temperature: float = 0.0,
+        window_seconds: float = None,
+        overlap_seconds: float = None
+    ):
+        self.task_id = task_id
+        self.language = language
+        self.temperature = temperature
+        self.window_seconds = window_seconds or settings.STREAMING_WINDOW_SECONDS
+        self.overlap_seconds = overlap_seconds if overlap_seconds is not None else settings.STREAMING_OVERLAP_SECONDS
+        self.transcription_service = TranscriptionService()
+
+        self.spool_dir = tempfile.mkdtemp(prefix=f"stream-{task_id}-", dir=settings.STREAMING_SPOOL_DIR)
+        self.spool_path = os.path.join(self.spool_dir, f"audio{file_extension}")
+        self.bytes_received = 0
+
+        self.window_start = 0.0  # 次のウィンドウの開始位置（秒）
+        self.committed_until = 0.0  # ここより前に始まるセグメントは確定済み
+        self.processed_until = 0.0  # 文字起こし済みの音声の終端
+        self.segments: List[TranscriptionSegment] = []
+        self.detected_language = language
+        self._lock = asyncio.Lock()
+
+    async def append(self, data: bytes) -> None:
+        """音声チャンクをスプールに追記"""
+        async with aiofiles.open(self.spool_path, "ab") as spool:
+            await spool.write(data)
+        self.bytes_received += len(data)
+
+    async def process(self, final: bool = False) -> List[TranscriptionSegment]:
+        """処理可能なウィンドウを文字起こしし、新たに確定したセグメントを返す
+
+        Args:
+            final: 録音終了後の確定処理（残りの音声をすべて処理する）
+        """
+        async with self._lock:
+            if self.bytes_received == 0:
+                return []
+
+            # 次のウィンドウ開始位置以降をデコード（書きかけの末尾は読める範囲まで）
+            tail_path = os.path.join(self.spool_dir, "tail.wav")
+            available = await convert_to_wav(self.spool_path, tail_path, start=self.window_start)
+
+            added = []
+            offset = 0.0
+            while True:
+                remaining = available - offset
+                if remaining < MIN_WINDOW_SECONDS or (not final and remaining < self.window_seconds):
+                    break
+
+                length = min(self.window_seconds, remaining)
+                is_last = final and length >= remaining
+                window_path = os.path.join(self.spool_dir, "window.wav")
+                slice_wav(tail_path, window_path, offset, offset + length)
+
+                response = await self.transcription_service._call_whisper_api(
+                    window_path,
+                    self.language,
+                    self.temperature,
+                    prompt=self._context_prompt()
+                )
+                window_result = self.transcription_service._parse_whisper_response(response)
+                self.detected_language = window_result.language or self.detected_language
+
+                # 重なり区間の中央より後に始まるセグメントは次のウィンドウで確定する
+                window_end = self.window_start + length
+                cut = window_end if is_last else window_end - self.overlap_seconds / 2
+                added.extend(self._stitch(window_result.segments, self.window_start, cut))
+                self.committed_until = cut
+                self.processed_until = window_end
+
+                if is_last:
+                    break
+                step = length - self.overlap_seconds
+                self.window_start += step
+                offset += step
+
+            if added:
+                logger.info(
+                    f"Streaming transcription {self.task_id}: +{len(added)} segments, "
+                    f"committed until {self.committed_until:.1f}s"
+                )
+            return added
+
+    def _stitch(
+        self,
+        window_segments: List[TranscriptionSegment],
+        offset: float,
+        cut: float
+    ) -> List[TranscriptionSegment]:
+        """ウィンドウのセグメントを全体の時間軸に合わせて重複なく追加"""
+        added = []
+        previous_end = self.processed_until
+        for segment in window_segments:
+            start = segment.start + offset
+            end = segment.end + offset
+
+            if start >= cut:
+                continue
+            text = segment.text
+            if start < self.committed_until:
+                # 前のウィンドウで聞き終えている区間は確定済み
+                if end <= previous_end:
+                    continue
+                text = self._trim_overlap(text)
+            elif start < self.committed_until + self.overlap_seconds:
+                text = self._trim_overlap(text)
+            if not text.strip():
+                continue
+
+            merged = TranscriptionSegment(
+                id=len(self.segments),
+                start=round(max(start, self.committed_until), 2),
+                end=round(end, 2),
+                text=text,
+                confidence=segment.confidence
+            )
+            self.segments.append(merged)
+            added.append(merged)
+        return added
+
+    def _trim_overlap(self, text: str) -> str:
+        """直前のセグメント末尾と重複する先頭部分を除去"""
+        if not self.segments:
+            return text
+
+        previous = self.segments[-1].text.strip()
+        candidate = text.strip()
+        for size in range(min(len(previous), len(candidate)), MIN_OVERLAP_CHARS - 1, -1):
+            if previous.endswith(candidate[:size]):
+                return candidate[size:]
+
+        # 句読点の揺れ程度の差しかないセグメントは重複とみなす
+        if SequenceMatcher(None, previous, candidate).ratio() >= 0.8:
+            return ""
+        return text
+
+    def _context_prompt(self) -> Optional[str]:
+        """直前の確定テキスト（Whisperのprompt）"""
+        text = "".join(segment.text for segment in self.segments)
+        return text[-CONTEXT_PROMPT_CHARS:] or None
+
+    def result(self) -> TranscriptionResult:
+        """現時点の文字起こし結果"""
+        return TranscriptionResult(
+            text="".join(segment.text for segment in self.segments),
+            language=self.detected_language,
+            confidence=self.transcription_service._calculate_overall_confidence(self.segments),
+            duration=round(self.processed_until, 2),
+            segments=list(self.segments)
+        )
+
+    def cleanup(self) -> None:
+        """スプールの削除"""
+        shutil.rmtree(self.spool_dir, ignore_errors=True)
@@ -0,0 +1,283 @@
+"""
+Token counting and per-analysis token budgets
+"""
+import logging
+import math
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# チャット形式のメッセージごと・応答開始のオーバーヘッド（OpenAI のカウント方法）
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+# 切り詰めで省いた部分の目印
+TRUNCATION_MARKER = "\n（中略）\n"
+
+_ASCII_RUN = re.compile(r"[\x00-\x7f]+")
+
+
+class TokenBudgetExceededError(Exception):
+    """トークン数が上限を超えるためAPIに送れない"""
+
+    def __init__(self, message: str, tokens: int, limit: int):
+        super().__init__(message)
+        self.tokens = tokens
+        self.limit = limit
+
+
+@dataclass(frozen=True)
+class ModelPricing:
+    """1Kトークンあたりの料金（USD）とコンテキスト長"""
+    input_per_1k: float
+    cached_input_per_1k: float
+    output_per_1k: float
+    context_window: int
+
+
+# モデル名の前方一致（長いものから判定、2025年4月時点の料金）
+MODEL_PRICING: List[Tuple[str, ModelPricing]] = [
+    ("gpt-4.1-nano", ModelPricing(0.0001, 0.000025, 0.0004, 1_047_576)),
+    ("gpt-4.1-mini", ModelPricing(0.0004, 0.0001, 0.0016, 1_047_576)),
+    ("gpt-4.1", ModelPricing(0.002, 0.0005, 0.008, 1_047_576)),
+    ("gpt-4o-mini", ModelPricing(0.00015, 0.000075, 0.0006, 128_000)),
+    ("gpt-4o", ModelPricing(0.0025, 0.00125, 0.01, 128_000)),
+]
+DEFAULT_PRICING = ModelPricing(0.0004, 0.0001, 0.0016, 128_000)  # GPT-4.1 Mini相当
+
+
+def model_pricing(model: str) -> ModelPricing:
+    for prefix, pricing in MODEL_PRICING:
+        if model.startswith(prefix):
+            return pricing
+    return DEFAULT_PRICING
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+    """入力（うちキャッシュ分は割引単価）と出力を分けたコスト（USD）"""
+    pricing = model_pricing(model)
+    cached_tokens = min(cached_tokens, prompt_tokens)
+    return (
+        (prompt_tokens - cached_tokens) / 1000 * pricing.input_per_1k
+        + cached_tokens / 1000 * pricing.cached_input_per_1k
+        + completion_tokens / 1000 * pricing.output_per_1k
+    )
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+    """tiktoken のエンコーディング（未インストール・取得失敗時は None で概算にフォールバック）"""
+    try:
+        import tiktoken
+    except ImportError:
+        logger.warning("tiktoken is not installed; token counts are approximated")
+        return None
+
+    try:
+        if model.startswith(("gpt-4.1", "gpt-4o", "o1", "o3", "o4")):
+            return tiktoken.get_encoding("o200k_base")
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # エンコーディングの初回取得はダウンロードを伴う
+        logger.warning(f"Failed to load tokenizer for {model}, token counts are approximated: {e}")
+        return None
+
+
+def _approximate_tokens(text: str) -> int:
+    """tokenizer なしの概算（日本語は1文字1トークン、英数字は4文字1トークンで安全側）"""
+    ascii_chars = sum(len(run) for run in _ASCII_RUN.findall(text))
+    return (len(text) - ascii_chars) + math.ceil(ascii_chars / 4)
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    if not text:
+        return 0
+    encoding = _encoding(model or settings.OPENAI_MODEL or "gpt-4.1-mini")
+    if encoding is None:
+        return _approximate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages: List[Dict[str, str]], model: Optional[str] = None) -> int:
+    """Chat Completion の入力トークン数"""
+    return sum(
+        TOKENS_PER_MESSAGE + count_tokens(message.get("content") or "", model)
+        for message in messages
+    ) + TOKENS_PER_REPLY
+
+
+def check_request_fits(messages: List[Dict[str, str]], model: str, max_tokens: int) -> int:
+    """入力＋最大出力がコンテキスト長に収まるか確認し、入力トークン数を返す"""
+    prompt_tokens = count_message_tokens(messages, model)
+    limit = model_pricing(model).context_window
+    if prompt_tokens + max_tokens > limit:
+        raise TokenBudgetExceededError(
+            f"Request needs {prompt_tokens} prompt + {max_tokens} completion tokens, "
+            f"exceeding the {limit} token context of {model}",
+            tokens=prompt_tokens + max_tokens,
+            limit=limit
+        )
+    return prompt_tokens
+
+
+def truncate_middle(text: str, keep_chars: int) -> str:
+    """冒頭と末尾を残して中間を省く（導入とクロージングを評価に残す）"""
+    if len(text) <= keep_chars:
+        return text
+    head = keep_chars // 2
+    tail = keep_chars - head
+    return text[:head] + TRUNCATION_MARKER + text[len(text) - tail:]
+
+
+@dataclass
+class BudgetPlan:
+    """1分析の送信計画"""
+    model: str
+    text: str
+    chunks: int
+    requests: int
+    prompt_tokens: int
+    completion_tokens: int
+    cost: float
+    actions: Tuple[str, ...] = ()  # "chunked", "downgraded", "truncated"
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def action(self) -> Optional[str]:
+        return ",".join(self.actions) or None
+
+
+class AnalysisTokenBudget:
+    """分析1件あたりのトークン・コスト予算
+
+    送信前に文字起こしとプロンプトのトークン数をローカルで数え、分析タイプごとの
+    呼び出し数（チャンク数 × 項目数＋要約）から入力・出力トークンとコストを見積もる。
+    予算を超える場合はまず ANALYSIS_FALLBACK_MODEL に切り替え、それでも超えれば
+    文字起こしの中間を切り詰めて収める。1リクエストの上限はチャンク分割で守る。
+    """
+
+    def __init__(self, prompt_service, chunker, output_tokens_per_call: Optional[int] = None):
+        self.prompt_service = prompt_service
+        self.chunker = chunker
+        self.output_tokens_per_call = output_tokens_per_call or settings.ANALYSIS_OUTPUT_TOKENS_PER_CALL
+
+    def _instruction_tokens(self, analysis_type: str, focus_areas: Optional[List[str]], model: str) -> List[int]:
+        """文字起こしを除いた1チャンクあたりの各呼び出しの入力トークン数"""
+        from app.services.prompt_service import TRANSCRIPT_REFERENCE
+
+        system = count_tokens(self.prompt_service.get_system_prompt(), model) + 2 * TOKENS_PER_MESSAGE + TOKENS_PER_REPLY
+        prompts = {
+            "questioning": self.prompt_service.get_questioning_prompt(TRANSCRIPT_REFERENCE),
+            "anxiety_handling": self.prompt_service.get_anxiety_prompt(TRANSCRIPT_REFERENCE),
+            "closing": self.prompt_service.get_closing_prompt(TRANSCRIPT_REFERENCE),
+            "flow": self.prompt_service.get_flow_prompt(TRANSCRIPT_REFERENCE),
+        }
+        summary = self.prompt_service.get_comprehensive_analysis_prompt(TRANSCRIPT_REFERENCE)
+
+        if analysis_type == "combined":
+            calls = [self.prompt_service.get_combined_analysis_prompt(TRANSCRIPT_REFERENCE)]
+        elif analysis_type == "quick":
+            calls = [summary]
+        elif analysis_type == "specific":
+            calls = [prompts[area] for area in focus_areas or [] if area in prompts]
+        else:
+            calls = list(prompts.values()) + [summary]
+        return [system + count_tokens(prompt, model) for prompt in calls]
+
+    def estimate(
+        self,
+        text: str,
+        analysis_type: str,
+        model: str,
+        focus_areas: Optional[List[str]] = None
+    ) -> BudgetPlan:
+        chunks = self.chunker.split(text) if analysis_type != "quick" else []
+        if analysis_type == "quick":
+            chunk_tokens = [count_tokens(text[:2000], model)]
+        else:
+            chunk_tokens = [count_tokens(chunk.text, model) for chunk in chunks]
+
+        per_call = self._instruction_tokens(analysis_type, focus_areas, model)
+        prompt_tokens = sum(fixed + tokens for tokens in chunk_tokens for fixed in per_call)
+        requests = len(per_call) * len(chunk_tokens)
+        completion_tokens = requests * self.output_tokens_per_call
+        return BudgetPlan(
+            model=model,
+            text=text,
+            chunks=len(chunk_tokens),
+            requests=requests,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cost=estimate_cost(model, prompt_tokens, completion_tokens),
+            actions=("chunked",) if len(chunk_tokens) > 1 else ()
+        )
+
+    @staticmethod
+    def _within_cost(plan: BudgetPlan) -> bool:
+        return not settings.ANALYSIS_COST_BUDGET or plan.cost <= settings.ANALYSIS_COST_BUDGET
+
+    @classmethod
+    def _fits(cls, plan: BudgetPlan) -> bool:
+        return plan.total_tokens <= settings.ANALYSIS_TOKEN_BUDGET and cls._within_cost(plan)
+
+    def plan(
+        self,
+        text: str,
+        analysis_type: str,
+        model: str,
+        focus_areas: Optional[List[str]] = None
+    ) -> BudgetPlan:
+        """予算に収まる送信計画（収められなければ TokenBudgetExceededError）"""
+        plan = self.estimate(text, analysis_type, model, focus_areas)
+        if self._fits(plan):
+            return plan
+
+        # コスト超過は安価なモデルで解消を試みる（トークン数は変わらない）
+        actions = []
+        fallback = settings.ANALYSIS_FALLBACK_MODEL
+        if (
+            not self._within_cost(plan)
+            and fallback and fallback != model
+            and model_pricing(fallback).input_per_1k < model_pricing(model).input_per_1k
+        ):
+            plan = self.estimate(text, analysis_type, fallback, focus_areas)
+            actions.append("downgraded")
+            if self._fits(plan):
+                plan.actions = plan.actions + tuple(actions)
+                return plan
+
+        # 予算に収まる最長の文字数を二分探索
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self._fits(self.estimate(truncate_middle(text, middle), analysis_type, plan.model, focus_areas)):
+                low = middle
+            else:
+                high = middle - 1
+
+        if low < settings.ANALYSIS_MIN_TRANSCRIPT_CHARS:
+            raise TokenBudgetExceededError(
+                f"Analysis needs ~{plan.total_tokens} tokens (${plan.cost:.4f}), "
+                f"over the budget of {settings.ANALYSIS_TOKEN_BUDGET} tokens / ${settings.ANALYSIS_COST_BUDGET}",
+                tokens=plan.total_tokens,
+                limit=settings.ANALYSIS_TOKEN_BUDGET
+            )
+
+        truncated = self.estimate(truncate_middle(text, low), analysis_type, plan.model, focus_areas)
+        truncated.actions = truncated.actions + tuple(actions) + ("truncated",)
+        logger.warning(
+            f"Transcript truncated from {len(text)} to {low} chars to fit the analysis budget "
+            f"(~{truncated.total_tokens} tokens, ${truncated.cost:.4f}, model={truncated.model})"
+        )
+        return truncated
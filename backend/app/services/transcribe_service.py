@@ -1,10 +1,11 @@
 """
 Transcription service using OpenAI Whisper API
 """
-import openai
 import tempfile
 import os
 import logging
+import math
+import shutil
 import uuid
 from typing import Optional, Dict, Any, List
 from datetime import datetime, timedelta
@@ -13,7 +14,11 @@ import aiofiles
 import json
 
 from app.core.config import settings
-from app.services.storage_service import S3StorageService
+from app.services.audio_processing import (
+    PIECE_BYTES_PER_SECOND, detect_silences, extract_piece, plan_split_points
+)
+from app.services.llm_gateway import get_llm_gateway
+from app.services.storage_service import get_storage_service
 from app.schemas.transcription import TranscriptionResult, TranscriptionSegment
 
 logger = logging.getLogger(__name__)
@@ -22,8 +27,8 @@ class TranscriptionService:
     """文字起こしサービス"""
     
     def __init__(self):
-        self.openai_client = openai.OpenAI(api_key=settings.OPENAI_API_KEY)
-        self.storage_service = S3StorageService()
+        self.llm_gateway = get_llm_gateway()
+        self.storage_service = get_storage_service()
         self.max_file_size = 25 * 1024 * 1024  # 25MB (Whisper制限)
         self.supported_formats = ['.webm', '.mp4', '.wav', '.mp3', '.m4a']
         
@@ -49,27 +54,25 @@ class TranscriptionService:
         try:
             logger.info(f"Starting transcription for file: {file_path}")
             
-            # S3からファイルダウンロード
-            audio_data = await self._download_from_s3(file_path)
-            
-            # ファイルサイズチェック
-            if len(audio_data) > self.max_file_size:
-                logger.warning(f"File size {len(audio_data)} exceeds limit, attempting compression")
-                audio_data = await self._compress_audio(audio_data)
-            
-            # 一時ファイル作成
+            # S3から一時ファイルへ直接ダウンロード（メモリに全体を載せない）
             file_extension = self._get_file_extension(file_path)
-            temp_file_path = await self._create_temp_file(audio_data, file_extension)
+            temp_file_path = await self._create_temp_file(file_extension)
+            file_size = await self._download_from_s3(file_path, temp_file_path)
             
-            # Whisper API呼び出し
-            response = await self._call_whisper_api(
-                temp_file_path, 
-                language, 
-                temperature
-            )
-            
-            # 結果を構造化
-            result = self._parse_whisper_response(response)
+            # ファイルサイズチェック（制限超過時は無音区間で分割して並列処理）
+            if file_size > self.max_file_size:
+                logger.info(f"File size {file_size} exceeds limit, transcribing in pieces")
+                result = await self._transcribe_in_pieces(temp_file_path, language, temperature)
+            else:
+                # Whisper API呼び出し
+                response = await self._call_whisper_api(
+                    temp_file_path, 
+                    language, 
+                    temperature
+                )
+                
+                # 結果を構造化
+                result = self._parse_whisper_response(response)
             
             logger.info(f"Transcription completed for file: {file_path}")
             return result
@@ -86,28 +89,111 @@ class TranscriptionService:
                 except Exception as e:
                     logger.warning(f"Failed to delete temp file {temp_file_path}: {e}")
 
-    async def _download_from_s3(self, file_path: str) -> bytes:
-        """S3からファイルをダウンロード"""
+    async def _download_from_s3(self, file_path: str, dest_path: str) -> int:
+        """S3からファイルをダウンロード
+        
+        Args:
+            file_path: S3のファイルパス
+            dest_path: 書き込み先の一時ファイル
+            
+        Returns:
+            ファイルサイズ（バイト）
+        """
         try:
-            # プリサインドURLを取得してファイルをダウンロード
-            download_info = await self.storage_service.generate_presigned_download_url(file_path)
+            if settings.STORAGE_BACKEND == "s3" and not settings.S3_BUCKET_NAME:
+                # 開発環境用のダミーデータ
+                logger.warning("S3 bucket not configured, using dummy audio data")
+                async with aiofiles.open(dest_path, "wb") as dummy_file:
+                    await dummy_file.write(b"dummy_audio_data")
+                return len(b"dummy_audio_data")
             
-            # TODO: ここで実際にHTTPリクエストを送ってファイルをダウンロード
-            # 簡易実装として、ダミーデータを返す
-            logger.warning("Using dummy audio data for development")
-            return b"dummy_audio_data"  # 実際の実装では、HTTP GETでファイルを取得
+            return await self.storage_service.download_to_file(file_path, dest_path)
             
         except Exception as e:
             logger.error(f"Failed to download file from S3: {e}")
             raise Exception(f"S3ファイルダウンロードエラー: {e}")
 
-    async def _compress_audio(self, audio_data: bytes) -> bytes:
-        """音声ファイル圧縮
+    async def _transcribe_in_pieces(
+        self,
+        file_path: str,
+        language: str,
+        temperature: float
+    ) -> TranscriptionResult:
+        """無音区間で25MB未満のピースに分割し、並列に文字起こし
         
-        Note: 実際の実装では ffmpeg-python などを使用してファイルを圧縮
+        Args:
+            file_path: ローカルの音声ファイル
         """
-        logger.warning("Audio compression not implemented, returning original data")
-        return audio_data
+        work_dir = tempfile.mkdtemp(prefix="transcribe-")
+        try:
+            duration, silences = await detect_silences(
+                file_path,
+                settings.SILENCE_NOISE_DB,
+                settings.SILENCE_MIN_DURATION
+            )
+            
+            # ピースの長さはエンコード後のサイズがWhisper制限に収まる範囲に抑える
+            max_piece_seconds = min(
+                settings.TRANSCRIPTION_PIECE_SECONDS,
+                self.max_file_size * 0.9 / PIECE_BYTES_PER_SECOND
+            )
+            pieces = plan_split_points(duration, silences, max_piece_seconds)
+            logger.info(
+                f"Split {duration:.1f}s audio into {len(pieces)} pieces "
+                f"({len(silences)} silences detected)"
+            )
+            
+            semaphore = asyncio.Semaphore(settings.TRANSCRIPTION_MAX_PARALLEL)
+            
+            async def transcribe_piece(index: int, start: float, end: float) -> TranscriptionResult:
+                async with semaphore:
+                    piece_path = os.path.join(work_dir, f"piece-{index:03d}.mp3")
+                    await extract_piece(file_path, piece_path, start, end)
+                    response = await self._call_whisper_api(piece_path, language, temperature)
+                    os.unlink(piece_path)
+                    return self._parse_whisper_response(response)
+            
+            results = await asyncio.gather(*[
+                transcribe_piece(index, start, end)
+                for index, (start, end) in enumerate(pieces)
+            ])
+            
+            return self._merge_piece_results(results, pieces, duration)
+            
+        except Exception as e:
+            logger.error(f"Segmented transcription failed: {e}")
+            raise Exception(f"分割文字起こしエラー: {e}")
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _merge_piece_results(
+        self,
+        results: List[TranscriptionResult],
+        pieces: List[tuple],
+        duration: float
+    ) -> TranscriptionResult:
+        """ピースごとの結果を開始位置のオフセットを補正して結合"""
+        segments = []
+        for result, (offset, _) in zip(results, pieces):
+            for segment in result.segments:
+                segments.append(TranscriptionSegment(
+                    id=len(segments),
+                    start=round(segment.start + offset, 2),
+                    end=round(segment.end + offset, 2),
+                    text=segment.text,
+                    confidence=segment.confidence
+                ))
+        
+        language = results[0].language if results else "ja"
+        separator = "" if language in ("ja", "zh") else " "
+        
+        return TranscriptionResult(
+            text=separator.join(result.text.strip() for result in results if result.text.strip()),
+            language=language,
+            confidence=self._calculate_overall_confidence(segments),
+            duration=duration or sum(result.duration for result in results),
+            segments=segments
+        )
 
     def _get_file_extension(self, file_path: str) -> str:
         """ファイル拡張子を取得"""
@@ -116,14 +202,13 @@ class TranscriptionService:
             return extension
         return '.webm'  # デフォルト
 
-    async def _create_temp_file(self, audio_data: bytes, file_extension: str) -> str:
-        """一時ファイル作成"""
+    async def _create_temp_file(self, file_extension: str) -> str:
+        """一時ファイル作成（ダウンロード先）"""
         try:
             with tempfile.NamedTemporaryFile(
                 suffix=file_extension, 
                 delete=False
             ) as temp_file:
-                temp_file.write(audio_data)
                 temp_file_path = temp_file.name
             
             logger.debug(f"Temporary file created: {temp_file_path}")
@@ -137,29 +222,30 @@ class TranscriptionService:
         self, 
         file_path: str, 
         language: str, 
-        temperature: float
+        temperature: float,
+        prompt: Optional[str] = None
     ) -> Dict[str, Any]:
-        """Whisper API呼び出し"""
+        """Whisper API呼び出し
+        
+        Args:
+            prompt: 直前の文字起こし（分割処理時に文脈を引き継ぐ）
+        """
         try:
             logger.info(f"Calling Whisper API for file: {file_path}")
             
-            with open(file_path, "rb") as audio_file:
-                # 実際のWhisper API呼び出し
-                if settings.OPENAI_API_KEY:
-                    response = self.openai_client.audio.transcriptions.create(
-                        model=settings.WHISPER_MODEL,
-                        file=audio_file,
-                        language=language,
-                        response_format="verbose_json",
-                        temperature=temperature
-                    )
-                    
-                    # レスポンスを辞書形式に変換
-                    return response.model_dump()
-                else:
-                    # 開発環境用のダミーレスポンス
-                    logger.warning("OpenAI API key not provided, using dummy response")
-                    return self._create_dummy_response()
+            # 実際のWhisper API呼び出し
+            if self.llm_gateway.enabled:
+                return await self.llm_gateway.transcribe(
+                    file_path=file_path,
+                    model=settings.WHISPER_MODEL,
+                    language=language,
+                    temperature=temperature,
+                    prompt=prompt
+                )
+            else:
+                # 開発環境用のダミーレスポンス
+                logger.warning("OpenAI API key not provided, using dummy response")
+                return self._create_dummy_response()
                 
         except Exception as e:
             logger.error(f"Whisper API call failed: {e}")
@@ -203,7 +289,7 @@ class TranscriptionService:
                         start=float(segment.get('start', 0.0)),
                         end=float(segment.get('end', 0.0)),
                         text=segment.get('text', ''),
-                        confidence=float(segment.get('confidence', 0.0))
+                        confidence=self._segment_confidence(segment)
                     ))
             
             # 全体の信頼度を計算
@@ -221,6 +307,14 @@ class TranscriptionService:
             logger.error(f"Failed to parse Whisper response: {e}")
             raise Exception(f"Whisperレスポンス解析エラー: {e}")
 
+    def _segment_confidence(self, segment: Dict[str, Any]) -> float:
+        """セグメントの信頼度（Whisper APIは avg_logprob のみ返すため確率に換算）"""
+        if segment.get('confidence') is not None:
+            return float(segment['confidence'])
+        if segment.get('avg_logprob') is not None:
+            return max(0.0, min(1.0, math.exp(float(segment['avg_logprob']))))
+        return 0.0
+
     def _calculate_overall_confidence(self, segments: List[TranscriptionSegment]) -> float:
         """全体の信頼度計算"""
         if not segments:
@@ -278,8 +372,8 @@ class TranscriptionService:
             # ファイルメタデータチェック
             metadata = await self.storage_service.get_file_metadata(file_path)
             
-            # ファイルサイズチェック
-            if metadata['size'] > self.max_file_size * 2:  # 圧縮を考慮して2倍まで
+            # ファイルサイズチェック（Whisper制限を超えるファイルは分割して処理）
+            if metadata['size'] > settings.MAX_FILE_SIZE:
                 return False
             
             return True
@@ -0,0 +1,98 @@
+"""
+Background job worker entry point
+
+Usage:
+    python -m app.worker --concurrency 4
+"""
+import argparse
+import asyncio
+import importlib
+import logging
+import signal
+
+from app.core.config import settings
+from app.core.database import dispose_engines, get_pool_metrics
+from app.core.job_queue import JobQueue, Worker, create_broker
+from app.services.batch_scheduler import BatchDispatcher
+from app.services.dashboard_cache import get_dashboard_cache, install_invalidation_hooks
+from app.services.llm_cache import get_llm_cache
+from app.services.llm_gateway import get_llm_gateway
+from app.services.storage_service import close_storage
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Modules that register job handlers with @job_handler
+JOB_MODULES = [
+    "app.api.transcribe",
+    "app.api.ai_analysis",
+    "app.api.dashboard",
+]
+
+
+def load_job_handlers() -> None:
+    """Import modules so their job handlers are registered"""
+    for module in JOB_MODULES:
+        importlib.import_module(module)
+
+
+async def run_worker(concurrency: int, visibility_timeout: int) -> None:
+    load_job_handlers()
+    install_invalidation_hooks()
+
+    broker = create_broker()
+    broker.visibility_timeout = visibility_timeout
+    worker = Worker(broker, concurrency=concurrency)
+    # Feeds queued batch analyses into the batch lane (one dispatcher wins the advisory lock per cycle)
+    dispatcher = BatchDispatcher(JobQueue(broker))
+
+    def stop() -> None:
+        worker.stop()
+        dispatcher.stop()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop)
+
+    dispatcher_task = asyncio.create_task(dispatcher.run())
+    try:
+        await worker.run()
+    finally:
+        dispatcher.stop()
+        await dispatcher_task
+        await broker.close()
+        await get_llm_gateway().close()
+        await get_llm_cache().close()
+        await get_dashboard_cache().close()
+        close_storage()
+        logger.info(f"Database pool at shutdown: {get_pool_metrics()}")
+        dispose_engines()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the background job worker")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=settings.WORKER_CONCURRENCY,
+        help="Number of jobs processed concurrently"
+    )
+    parser.add_argument(
+        "--visibility-timeout",
+        type=int,
+        default=settings.JOB_VISIBILITY_TIMEOUT,
+        help="Seconds before an unacknowledged job is delivered again"
+    )
+    args = parser.parse_args()
+
+    if settings.JOB_QUEUE_BACKEND != "redis":
+        logger.warning(
+            f"JOB_QUEUE_BACKEND={settings.JOB_QUEUE_BACKEND}: a standalone worker only "
+            "sees jobs enqueued by this process; use redis to share the queue"
+        )
+
+    asyncio.run(run_worker(args.concurrency, args.visibility_timeout))
+
+
+if __name__ == "__main__":
+    main()
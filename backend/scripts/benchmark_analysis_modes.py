@@ -0,0 +1,175 @@
+"""
+Compare FULL and COMBINED analysis on the bundled dummy responses
+
+Replaces the LLM gateway with an in-process fake that answers with
+AnalysisService's dummy responses, counts one token per character and
+sleeps a fixed latency plus per-token delays, so request count, token
+usage, cost and wall time can be compared without an API key. The fake
+also mimics the provider's prompt cache: once a request finishes, later
+requests with the same system message (>= 1024 tokens) report it as
+cached tokens and skip its prefill delay, which is what the "prefix"
+prompt layout relies on.
+
+Usage:
+    python scripts/benchmark_analysis_modes.py --runs 5 --latency 0.8
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Add the project root to the Python path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.schemas.analysis import AnalysisType
+from app.services.analysis_service import AnalysisService
+from app.services.llm_gateway import LLMResponse
+
+SAMPLE_DIALOGUE = [
+    "カウンセラー: 本日はご来院ありがとうございます。脱毛について気になっていることを教えていただけますか？",
+    "お客様: 腕と脇を考えているんですが、痛みがどれくらいなのか心配で。",
+    "カウンセラー: 痛みが不安なんですね。多くの方が同じように心配されます。当院では冷却しながら照射するので、輪ゴムで弾かれる程度と言われる方が多いです。",
+    "お客様: それなら大丈夫かもしれません。料金はどのくらいかかりますか？",
+    "カウンセラー: 回数によって変わりますので、まずはご希望の仕上がりを伺ってもよろしいですか？",
+    "お客様: 自己処理をしなくていいくらいにしたいです。",
+    "カウンセラー: それでしたら6回コースがおすすめです。今月中のご契約で初回割引が適用されます。",
+]
+
+
+class FakeGateway:
+    """ダミーレスポンスを返すLLMゲートウェイ"""
+
+    def __init__(self, service: AnalysisService, latency: float, per_token_latency: float, prefill_latency: float):
+        self.service = service
+        self.latency = latency
+        self.per_token_latency = per_token_latency
+        self.prefill_latency = prefill_latency
+        self.reset()
+
+    @property
+    def enabled(self) -> bool:
+        return True
+
+    def reset(self) -> None:
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self.prefix_cache = set()
+
+    async def chat_completion(self, model, messages, max_tokens, temperature, response_format=None, **kwargs):
+        content = self.service._create_dummy_response(messages[-1]["content"], response_format)[:max_tokens]
+        prefix = messages[0]["content"]
+        prompt_tokens = sum(len(m["content"]) for m in messages)
+        cached_tokens = len(prefix) // 128 * 128 if len(prefix) >= 1024 and prefix in self.prefix_cache else 0
+        completion_tokens = len(content)
+        await asyncio.sleep(
+            self.latency
+            + (prompt_tokens - cached_tokens) * self.prefill_latency
+            + completion_tokens * self.per_token_latency
+        )
+        self.prefix_cache.add(prefix)
+
+        self.requests += 1
+        self.prompt_tokens += prompt_tokens
+        self.cached_tokens += cached_tokens
+        self.completion_tokens += completion_tokens
+        return LLMResponse(
+            content=content,
+            model=model,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+            cached_tokens=cached_tokens
+        )
+
+    def get_statistics(self) -> dict:
+        return {"requests": self.requests}
+
+
+async def run_mode(
+    service: AnalysisService,
+    gateway: FakeGateway,
+    analysis_type: AnalysisType,
+    layout: str,
+    text: str,
+    runs: int
+) -> dict:
+    timings = []
+    service.prompt_layout = layout
+    tokens_total = 0
+    cost_total = 0.0
+    for _ in range(runs):
+        gateway.reset()
+        started = time.perf_counter()
+        _, tokens, cost = await service.analyze_counseling(text, analysis_type=analysis_type)
+        timings.append(time.perf_counter() - started)
+        tokens_total += tokens
+        cost_total += cost
+
+    return {
+        "mode": f"{analysis_type.value}/{layout}",
+        "requests": gateway.requests,
+        "prompt_tokens": gateway.prompt_tokens,
+        "cached_tokens": gateway.cached_tokens,
+        "completion_tokens": gateway.completion_tokens,
+        "tokens": tokens_total / runs,
+        "cost": cost_total / runs,
+        "wall_p50": statistics.median(timings),
+        "wall_max": max(timings),
+    }
+
+
+async def main_async(args) -> None:
+    service = AnalysisService(use_cache=False)
+    service.llm_cache.enabled = False
+    gateway = FakeGateway(service, args.latency, args.per_token_latency, args.prefill_latency)
+    service.llm_gateway = gateway
+
+    text = "\n".join(SAMPLE_DIALOGUE * args.repeat)
+    print(f"Transcript: {len(text)} chars, model={service.model}, runs={args.runs}")
+
+    results = [
+        await run_mode(service, gateway, AnalysisType.FULL, "inline", text, args.runs),
+        await run_mode(service, gateway, AnalysisType.FULL, "prefix", text, args.runs),
+        await run_mode(service, gateway, AnalysisType.COMBINED, "prefix", text, args.runs),
+    ]
+
+    header = (
+        f"{'mode':<16}{'requests':>10}{'prompt':>10}{'cached':>10}{'output':>10}"
+        f"{'tokens':>10}{'cost($)':>10}{'p50(s)':>9}{'max(s)':>9}"
+    )
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['mode']:<16}{r['requests']:>10.0f}{r['prompt_tokens']:>10.0f}{r['cached_tokens']:>10.0f}"
+            f"{r['completion_tokens']:>10.0f}{r['tokens']:>10.0f}{r['cost']:>10.4f}"
+            f"{r['wall_p50']:>9.2f}{r['wall_max']:>9.2f}"
+        )
+
+    inline, full, combined = results
+    if inline["cost"]:
+        print(f"\nFULL/prefix costs {full['cost'] / inline['cost']:.0%} of FULL/inline, "
+              f"{full['wall_p50'] / inline['wall_p50']:.0%} of its wall time")
+    if full["tokens"]:
+        print(f"\nCOMBINED uses {combined['tokens'] / full['tokens']:.0%} of FULL tokens, "
+              f"{combined['wall_p50'] / full['wall_p50']:.0%} of FULL wall time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FULL vs COMBINED analysis")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=10, help="Times the sample dialogue is repeated")
+    parser.add_argument("--latency", type=float, default=0.8, help="Seconds of fixed latency per request")
+    parser.add_argument("--per-token-latency", type=float, default=0.002, help="Seconds per output token")
+    parser.add_argument("--prefill-latency", type=float, default=0.0002, help="Seconds per uncached prompt token")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Per-analysis prompt overhead benchmark
+
+Times what one analysis job spends on prompts: building a PromptService,
+rendering the five analysis prompts and looking up their version hashes
+for the LLM cache key. "legacy" repeats the previous behaviour (directory
+check and template file probes on every construction, a fresh
+FileSystemLoader environment, and a file read per version hash);
+"registry" uses the process-wide PromptRegistry.
+
+Usage:
+    python scripts/benchmark_prompts.py --iterations 2000
+"""
+import argparse
+import hashlib
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import jinja2
+
+# Add the project root to the Python path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.services.prompt_service import DEFAULT_TEMPLATES, PromptService, get_prompt_registry
+
+TEMPLATE_NAMES = ["questioning_analysis", "anxiety_analysis", "closing_analysis", "flow_analysis", "combined_analysis"]
+SAMPLE_TEXT = "カウンセラー: 痛みが不安なんですね。\nお客様: はい、腕と脇を考えています。\n" * 20
+
+
+def legacy_analysis(template_dir: Path) -> None:
+    template_dir.mkdir(exist_ok=True)
+    env = jinja2.Environment(loader=jinja2.FileSystemLoader(template_dir), autoescape=True)
+    for filename in DEFAULT_TEMPLATES:
+        (template_dir / filename).exists()
+
+    for name in TEMPLATE_NAMES:
+        env.get_template(f"{name}.txt").render(transcription=SAMPLE_TEXT)
+        content = (template_dir / f"{name}.txt").read_text(encoding="utf-8")
+        hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+
+def registry_analysis(template_dir: Path) -> None:
+    service = PromptService()
+    for name in TEMPLATE_NAMES:
+        service.get_custom_prompt(name, transcription=SAMPLE_TEXT)
+        service.get_template_version(name)
+
+
+def run(name: str, call, template_dir: Path, iterations: int) -> float:
+    call(template_dir)  # warm up
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        call(template_dir)
+        timings.append(time.perf_counter() - started)
+
+    timings.sort()
+    median = statistics.median(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{name:<10} median {median * 1e6:>9.1f}us  p95 {p95 * 1e6:>9.1f}us  per analysis")
+    return median
+
+
+def lookup_only(iterations: int) -> None:
+    """Compiled template lookups alone, without rendering the transcript"""
+    registry = get_prompt_registry()
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        for name in TEMPLATE_NAMES:
+            registry.get(name)
+        timings.append(time.perf_counter() - started)
+    print(f"{'lookup':<10} median {statistics.median(timings) * 1e6:>9.1f}us  (5 compiled template lookups)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-analysis prompt overhead")
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    template_dir = get_prompt_registry().template_dir
+    print(f"Templates: {template_dir}, iterations={args.iterations}, transcript={len(SAMPLE_TEXT)} chars")
+
+    legacy = run("legacy", legacy_analysis, template_dir, args.iterations)
+    registry = run("registry", registry_analysis, template_dir, args.iterations)
+    lookup_only(args.iterations)
+    print(f"Speedup: {legacy / registry:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Storage throughput benchmark
+
+Runs concurrent metadata lookups, uploads and downloads against the shared
+storage service. Works offline with the filesystem backend, or against a
+local S3 stand-in such as moto:
+
+    pip install "moto[server]" && moto_server -p 5000
+    STORAGE_BACKEND=s3 S3_ENDPOINT_URL=http://localhost:5000 S3_BUCKET_NAME=bench \
+        python scripts/benchmark_storage.py --create-bucket
+
+Usage:
+    STORAGE_BACKEND=local python scripts/benchmark_storage.py --objects 50 --size-mb 4 --concurrency 16
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add the project root to the Python path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.core.config import settings
+from app.services.storage_service import close_storage, get_s3_client, get_storage_service
+
+
+async def timed(semaphore: asyncio.Semaphore, latencies: list, call) -> None:
+    async with semaphore:
+        started = time.perf_counter()
+        await call()
+        latencies.append(time.perf_counter() - started)
+
+
+async def run_phase(name: str, calls: list, concurrency: int, total_bytes: int = 0) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    started = time.perf_counter()
+    await asyncio.gather(*[timed(semaphore, latencies, call) for call in calls])
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0.0
+    line = (
+        f"{name:<10} {len(calls):>6} ops  {len(calls) / elapsed:>9.1f} ops/s  "
+        f"p50 {statistics.median(latencies) * 1000:>8.1f}ms  p95 {p95 * 1000:>8.1f}ms"
+    )
+    if total_bytes:
+        line += f"  {total_bytes / elapsed / 1024 / 1024:>8.1f} MB/s"
+    print(line)
+
+
+async def main_async(args) -> None:
+    storage = get_storage_service()
+    print(
+        f"Backend: {type(storage).__name__}, objects={args.objects}, size={args.size_mb}MB, "
+        f"concurrency={args.concurrency}, pool={settings.S3_MAX_POOL_CONNECTIONS}"
+    )
+
+    if args.create_bucket and settings.STORAGE_BACKEND == "s3":
+        get_s3_client().create_bucket(
+            Bucket=settings.S3_BUCKET_NAME,
+            CreateBucketConfiguration={"LocationConstraint": settings.AWS_REGION}
+        )
+
+    work_dir = tempfile.mkdtemp(prefix="storage-bench-")
+    source_path = os.path.join(work_dir, "source.bin")
+    with open(source_path, "wb") as source:
+        for _ in range(args.size_mb):
+            source.write(os.urandom(1024 * 1024))
+
+    size = args.size_mb * 1024 * 1024
+    keys = [f"benchmark/{index:05d}.bin" for index in range(args.objects)]
+
+    try:
+        await run_phase("upload", [
+            (lambda key=key: storage.upload_file(source_path, key, "application/octet-stream"))
+            for key in keys
+        ], args.concurrency, size * len(keys))
+
+        await run_phase("exists", [
+            (lambda key=key: storage.file_exists(key)) for key in keys
+        ], args.concurrency)
+
+        await run_phase("metadata", [
+            (lambda key=key: storage.get_file_metadata(key)) for key in keys
+        ], args.concurrency)
+
+        await run_phase("download", [
+            (lambda index=index, key=key: storage.download_to_file(key, os.path.join(work_dir, f"dl-{index}.bin")))
+            for index, key in enumerate(keys)
+        ], args.concurrency, size * len(keys))
+
+        await run_phase("delete", [
+            (lambda key=key: storage.delete_file(key)) for key in keys
+        ], args.concurrency)
+    finally:
+        for name in os.listdir(work_dir):
+            os.unlink(os.path.join(work_dir, name))
+        os.rmdir(work_dir)
+        close_storage()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the storage service")
+    parser.add_argument("--objects", type=int, default=50)
+    parser.add_argument("--size-mb", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--create-bucket", action="store_true", help="Create S3_BUCKET_NAME first (moto/MinIO)")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
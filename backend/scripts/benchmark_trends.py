@@ -0,0 +1,117 @@
+"""
+Counselor trend computation benchmark
+
+Compares computing performance trends for a whole clinic with the previous
+per-counselor Python loops (split the session list in halves, average each
+half and each category in turn) against the vectorized score matrix
+(compute_trends over one columnar array). Data is synthetic and no database
+is needed; the DB side went from 1 + 2 queries per counselor to one query.
+
+Usage:
+    python scripts/benchmark_trends.py --counselors 50 --sessions 200
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+# Add the project root to the Python path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.services.score_matrix import SCORE_COLUMNS, ScoreMatrix, compute_trends, percentile_ranks
+
+
+def synthetic_rows(counselors: int, sessions: int):
+    rows = []
+    for counselor in range(counselors):
+        base = random.uniform(4, 8)
+        drift = random.uniform(-0.02, 0.02)
+        for day in sorted(random.uniform(0, 90) for _ in range(sessions)):
+            scores = [
+                None if random.random() < 0.1 else min(10.0, max(0.0, base + drift * day + random.gauss(0, 1)))
+                for _ in SCORE_COLUMNS
+            ]
+            rows.append((counselor, day, *scores))
+    return rows
+
+
+def _average(values):
+    values = [v for v in values if v is not None]
+    return sum(values) / len(values) if values else 0.0
+
+
+def legacy(rows) -> None:
+    by_counselor = {}
+    for row in rows:
+        by_counselor.setdefault(row[0], []).append(row)
+
+    averages = []
+    for sessions in by_counselor.values():
+        mid_point = len(sessions) // 2
+        halves = (sessions[:mid_point], sessions[mid_point:])
+        early_avg, recent_avg = (_average([s[2] for s in half]) for half in halves)
+        categories = [
+            [_average([s[3 + i] for s in half]) for i in range(len(SCORE_COLUMNS) - 1)]
+            for half in halves
+        ]
+        [recent > early + 0.5 for early, recent in zip(*categories)]
+        averages.append(recent_avg)
+
+    ordered = sorted(averages)
+    [sum(1 for other in ordered if other <= value) / len(ordered) * 100 for value in averages]
+
+
+def vectorized(matrix: ScoreMatrix) -> None:
+    table = compute_trends(matrix)
+    percentile_ranks(table.current[:, 0])
+    table.deltas[:, 1:] > 0.5
+
+
+def to_matrix(rows) -> ScoreMatrix:
+    return ScoreMatrix(
+        counselor_ids=np.array([row[0] for row in rows], dtype=object),
+        days=np.array([row[1] for row in rows], dtype=np.float64),
+        scores=np.array([row[2:] for row in rows], dtype=np.float64),
+        since=datetime.utcnow()
+    )
+
+
+def timed(call, argument, iterations: int) -> float:
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        call(argument)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark clinic-wide trend computation")
+    parser.add_argument("--counselors", type=int, default=50)
+    parser.add_argument("--sessions", type=int, default=200, help="sessions per counselor")
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    rows = synthetic_rows(args.counselors, args.sessions)
+    print(f"{args.counselors} counselors x {args.sessions} sessions ({len(rows)} rows)")
+
+    legacy_time = timed(legacy, rows, args.iterations)
+    build_time = timed(to_matrix, rows, args.iterations)
+    matrix = to_matrix(rows)
+    vectorized_time = timed(vectorized, matrix, args.iterations)
+
+    print(f"{'legacy':<12} {legacy_time * 1e3:>8.2f}ms")
+    print(f"{'matrix load':<12} {build_time * 1e3:>8.2f}ms  (rows -> arrays)")
+    print(f"{'vectorized':<12} {vectorized_time * 1e3:>8.2f}ms")
+    print(f"Speedup: {legacy_time / vectorized_time:.1f}x compute, "
+          f"{legacy_time / (build_time + vectorized_time):.1f}x including array build")
+
+
+if __name__ == "__main__":
+    main()
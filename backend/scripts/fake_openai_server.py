@@ -0,0 +1,141 @@
+"""
+Local fake OpenAI server for exercising the LLM gateway
+
+Emulates /v1/chat/completions and /v1/audio/transcriptions with a fixed
+requests-per-minute budget and answers 429 with retry-after headers once
+the budget is spent.
+
+Usage:
+    python scripts/fake_openai_server.py --port 8089 --rpm 60 --latency 0.5
+    OPENAI_BASE_URL=http://localhost:8089/v1 python -m app.worker
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+import uuid
+from pathlib import Path
+
+# Add the project root to the Python path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+app = FastAPI(title="Fake OpenAI")
+
+state = {
+    "rpm": 60,
+    "latency": 0.5,
+    "window_start": time.monotonic(),
+    "window_count": 0,
+    "served": 0,
+    "rejected": 0,
+}
+
+
+def _rate_limited() -> JSONResponse:
+    """1分間の窓を超えたリクエストに429を返す"""
+    now = time.monotonic()
+    if now - state["window_start"] >= 60:
+        state["window_start"] = now
+        state["window_count"] = 0
+
+    state["window_count"] += 1
+    if state["window_count"] <= state["rpm"]:
+        return None
+
+    state["rejected"] += 1
+    retry_after = 60 - (now - state["window_start"])
+    return JSONResponse(
+        status_code=429,
+        headers={
+            "retry-after": f"{retry_after:.3f}",
+            "x-ratelimit-remaining-requests": "0",
+        },
+        content={"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}
+    )
+
+
+def _headers() -> dict:
+    return {"x-ratelimit-remaining-requests": str(max(state["rpm"] - state["window_count"], 0))}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    limited = _rate_limited()
+    if limited:
+        return limited
+
+    body = await request.json()
+    await asyncio.sleep(state["latency"])
+    state["served"] += 1
+
+    prompt_tokens = sum(len(m.get("content") or "") for m in body.get("messages", []))
+    content = json.dumps({
+        "score": 7.0,
+        "improvements": ["フェイクサーバーの応答"],
+        "session_summary": "フェイクサーバーの要約",
+        "key_strengths": [],
+        "critical_improvements": []
+    }, ensure_ascii=False)
+
+    return JSONResponse(headers=_headers(), content={
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(content),
+            "total_tokens": prompt_tokens + len(content)
+        }
+    })
+
+
+@app.post("/v1/audio/transcriptions")
+async def audio_transcriptions():
+    limited = _rate_limited()
+    if limited:
+        return limited
+
+    await asyncio.sleep(state["latency"])
+    state["served"] += 1
+
+    return JSONResponse(headers=_headers(), content={
+        "text": "フェイクサーバーの文字起こし結果です。",
+        "language": "ja",
+        "duration": 3.0,
+        "segments": [
+            {"id": 0, "start": 0.0, "end": 3.0, "text": "フェイクサーバーの文字起こし結果です。", "no_speech_prob": 0.01}
+        ]
+    })
+
+
+@app.get("/stats")
+async def stats():
+    return {"served": state["served"], "rejected": state["rejected"], "rpm": state["rpm"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake OpenAI server")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--rpm", type=int, default=60, help="Requests per minute before 429")
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds per response")
+    args = parser.parse_args()
+
+    state["rpm"] = args.rpm
+    state["latency"] = args.latency
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Rebuild the daily session rollups used by the dashboards
+
+Recomputes daily_session_rollups from the raw sessions and analysis
+tasks. Run it after bulk imports, direct SQL edits or a change of
+ROLLUP_TIME_ZONE. Without --start/--end every day that has sessions is
+rebuilt.
+
+Usage:
+    python scripts/rebuild_rollups.py --start 2025-01-01 --end 2025-03-31
+"""
+import argparse
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+# Add the project root to the Python path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.services.rollup_service import RollupService
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild daily session rollups")
+    parser.add_argument("--start", type=date.fromisoformat, help="First local day (YYYY-MM-DD)")
+    parser.add_argument("--end", type=date.fromisoformat, help="Last local day (YYYY-MM-DD)")
+    parser.add_argument("--batch-days", type=int, default=31, help="Days rebuilt per transaction")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        service = RollupService(db)
+        if args.start is None or args.end is None:
+            # Full rebuild in one transaction
+            started = time.perf_counter()
+            rows = service.rebuild(args.start, args.end)
+            db.commit()
+            print(f"Rebuilt {rows} rollup rows ({settings.ROLLUP_TIME_ZONE}) in {time.perf_counter() - started:.1f}s")
+            return
+
+        total = 0
+        first_day = args.start
+        while first_day <= args.end:
+            last_day = min(args.end, first_day + timedelta(days=args.batch_days - 1))
+            started = time.perf_counter()
+            rows = service.rebuild(first_day, last_day)
+            db.commit()
+            total += rows
+            print(f"{first_day} - {last_day}: {rows} rows in {time.perf_counter() - started:.1f}s")
+            first_day = last_day + timedelta(days=1)
+        print(f"Rebuilt {total} rollup rows ({settings.ROLLUP_TIME_ZONE})")
+
+    except Exception as e:
+        db.rollback()
+        print(f"Error during rollup rebuild: {e}")
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
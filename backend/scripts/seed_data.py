@@ -16,6 +16,7 @@ from app.models.clinic import Clinic
 from app.models.user import User, UserRole
 from app.models.customer import Customer
 from app.models.session import Session as SessionModel, SessionStatus
+from app.services.rollup_service import RollupService
 from datetime import datetime, timedelta
 import uuid
 
@@ -242,6 +243,9 @@ def main():
         print("Seeding sessions...")
         seed_sessions(db, customers, users)
         
+        print("Building dashboard rollups...")
+        RollupService(db).rebuild()
+        
         db.commit()
         print("Data seeding completed successfully!")
         
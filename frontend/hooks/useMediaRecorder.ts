@@ -23,7 +23,15 @@ const DEFAULT_CONFIG: RecordingConfig = {
   channelCount: 1,
 };
 
-export const useMediaRecorder = (config: Partial<RecordingConfig> = {}) => {
+export interface RecordingOptions {
+  // 録音中のチャンクを受け取る（ストリーミング文字起こし用）
+  onDataAvailable?: (chunk: Blob) => void;
+}
+
+export const useMediaRecorder = (
+  config: Partial<RecordingConfig> = {},
+  options: RecordingOptions = {}
+) => {
   const [state, setState] = useState<RecordingState>({
     isRecording: false,
     isPaused: false,
@@ -38,6 +46,8 @@ export const useMediaRecorder = (config: Partial<RecordingConfig> = {}) => {
   const chunksRef = useRef<Blob[]>([]);
   const timerRef = useRef<NodeJS.Timeout | null>(null);
   const startTimeRef = useRef<number>(0);
+  const onDataAvailableRef = useRef(options.onDataAvailable);
+  onDataAvailableRef.current = options.onDataAvailable;
 
   const recordingConfig = { ...DEFAULT_CONFIG, ...config };
 
@@ -95,6 +105,7 @@ export const useMediaRecorder = (config: Partial<RecordingConfig> = {}) => {
       mediaRecorder.ondataavailable = (event) => {
         if (event.data.size > 0) {
           chunksRef.current.push(event.data);
+          onDataAvailableRef.current?.(event.data);
         }
       };
 
@@ -0,0 +1,120 @@
+import { useState, useRef, useCallback, useEffect } from 'react';
+
+export interface StreamingSegment {
+  id: number;
+  start: number;
+  end: number;
+  text: string;
+  confidence: number;
+}
+
+export interface StreamingTranscriptionState {
+  taskId: string | null;
+  status: 'idle' | 'connecting' | 'streaming' | 'finalizing' | 'completed' | 'error';
+  segments: StreamingSegment[];
+  text: string;
+  error: string | null;
+}
+
+const buildStreamUrl = (recordingId: string, token: string, language: string) => {
+  const base = process.env.NEXT_PUBLIC_API_URL || window.location.origin;
+  const url = new URL(`/api/v1/transcription/stream/${recordingId}`, base);
+  url.protocol = url.protocol === 'https:' ? 'wss:' : 'ws:';
+  url.searchParams.set('token', token);
+  url.searchParams.set('language', language);
+  return url.toString();
+};
+
+export const useStreamingTranscription = () => {
+  const [state, setState] = useState<StreamingTranscriptionState>({
+    taskId: null,
+    status: 'idle',
+    segments: [],
+    text: '',
+    error: null,
+  });
+
+  const socketRef = useRef<WebSocket | null>(null);
+  // 接続確立前のチャンク（先頭チャンクにWebMヘッダーが含まれるため破棄できない）
+  const queueRef = useRef<Blob[]>([]);
+
+  const connect = useCallback((recordingId: string, language: string = 'ja') => {
+    const token = localStorage.getItem('access_token');
+    if (!token) {
+      setState(prev => ({ ...prev, status: 'error', error: 'Not authenticated' }));
+      return;
+    }
+
+    setState({ taskId: null, status: 'connecting', segments: [], text: '', error: null });
+    queueRef.current = [];
+
+    const socket = new WebSocket(buildStreamUrl(recordingId, token, language));
+    socket.binaryType = 'arraybuffer';
+    socketRef.current = socket;
+
+    socket.onopen = () => {
+      queueRef.current.forEach(chunk => socket.send(chunk));
+      queueRef.current = [];
+    };
+
+    socket.onmessage = (event) => {
+      const message = JSON.parse(event.data);
+      switch (message.type) {
+        case 'started':
+          setState(prev => ({ ...prev, taskId: message.task_id, status: 'streaming' }));
+          break;
+        case 'partial':
+          setState(prev => {
+            const segments = [...prev.segments, ...message.segments];
+            return { ...prev, segments, text: segments.map(s => s.text).join('') };
+          });
+          break;
+        case 'completed':
+          setState(prev => ({ ...prev, status: 'completed', text: message.text }));
+          break;
+        case 'error':
+          setState(prev => ({ ...prev, status: 'error', error: message.detail }));
+          break;
+      }
+    };
+
+    socket.onerror = () => {
+      setState(prev => ({ ...prev, status: 'error', error: 'Streaming connection error' }));
+    };
+
+    socket.onclose = () => {
+      socketRef.current = null;
+    };
+  }, []);
+
+  // 録音チャンクをそのまま送信（録音順に届く必要がある）
+  const sendChunk = useCallback((chunk: Blob) => {
+    const socket = socketRef.current;
+    if (socket && socket.readyState === WebSocket.OPEN) {
+      socket.send(chunk);
+    } else if (socket && socket.readyState === WebSocket.CONNECTING) {
+      queueRef.current.push(chunk);
+    }
+  }, []);
+
+  const stop = useCallback(() => {
+    const socket = socketRef.current;
+    if (socket && socket.readyState === WebSocket.OPEN) {
+      socket.send(JSON.stringify({ type: 'stop' }));
+      setState(prev => ({ ...prev, status: 'finalizing' }));
+    }
+  }, []);
+
+  useEffect(() => {
+    return () => {
+      socketRef.current?.close();
+    };
+  }, []);
+
+  return {
+    state,
+    connect,
+    sendChunk,
+    stop,
+  };
+};